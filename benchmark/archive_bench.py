@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Remote CI 归档微基准：打包、解压、转码、下载各路径的吞吐量和峰值内存
+
+测量的路径：
+  client_pack:      客户端打包代码（RemoteCIClient._create_archive）
+  server_pack:      服务端打包产物（ArtifactHandler.pack_artifacts）
+  server_extract:   服务端解压代码包（extract_tar_stream，上传模式和流式上传共用）
+  server_transcode: 服务端把zstd产物转码为gzip（iter_transcode_to_gzip，旧客户端下载）
+  client_download:  客户端下载并解压产物（RemoteCIClient._download_artifacts，本地HTTP服务）
+
+每次测量在fork出的子进程中执行，通过wait4获取该次测量的CPU时间和峰值RSS；
+吞吐量按原始（未压缩）数据量计算
+
+用法:
+  python benchmark/archive_bench.py
+  python benchmark/archive_bench.py --shapes many_tiny,few_huge --paths server_pack --scale 0.25
+  python benchmark/archive_bench.py --output baseline.json
+  python benchmark/archive_bench.py --compare baseline.json
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / 'client'))
+
+# 目录形状: [(文件数, 单个文件大小, 内容类型), ...]
+# 内容类型 text 为可压缩的源码类文本，binary 为不可压缩的随机数据
+SHAPES = {
+    'many_tiny': [(20000, 512, 'text')],
+    'source_like': [(2000, 16 * 1024, 'text')],
+    'mixed': [(1000, 8 * 1024, 'text'), (16, 1024 * 1024, 'binary')],
+    'few_huge': [(2, 32 * 1024 * 1024, 'text'), (1, 32 * 1024 * 1024, 'binary')],
+}
+
+PATHS = ('client_pack', 'server_pack', 'server_extract', 'server_transcode', 'client_download')
+
+# 服务端产物打包的压缩选项（格式:级别），gzip:9 和 zstd:3 为当前默认值
+DEFAULT_SERVER_OPTIONS = 'gzip:6,gzip:9,zstd:1,zstd:3,zstd:9'
+
+# 文本内容的词表大小
+VOCABULARY_SIZE = 4096
+
+# 同组文件共享的内容池大小下限（避免小文件内容重复导致压缩率失真）
+MIN_POOL_BYTES = 8 * 1024 * 1024
+
+
+def _text_block(rng, size):
+    """生成可压缩的文本（约3-5倍压缩率，接近源码）"""
+    words = [f"ident{rng.randrange(VOCABULARY_SIZE)}" for _ in range(min(size, MIN_POOL_BYTES) // 8 + 1)]
+    block = (' '.join(words) + '\n').encode()
+    return (block * (size // len(block) + 1))[:size]
+
+
+def make_tree(root, shape, scale, seed):
+    """
+    生成指定形状的目录
+
+    Args:
+        root: 目标目录
+        shape: SHAPES中的名称
+        scale: 缩放比例（文件数>=10的项缩放文件数，其余缩放文件大小）
+        seed: 随机种子
+
+    Returns:
+        (文件数, 总字节数)
+    """
+    rng = random.Random(seed)
+    file_count = 0
+    total = 0
+    for group, (count, size, kind) in enumerate(SHAPES[shape]):
+        if count >= 10:
+            count = max(1, int(count * scale))
+        else:
+            size = max(1, int(size * scale))
+        # 同组文件共享一块内容的不同切片，避免生成数据本身成为瓶颈
+        pool_size = max(size * 2, MIN_POOL_BYTES)
+        pool = _text_block(rng, pool_size) if kind == 'text' else os.urandom(pool_size)
+        for i in range(count):
+            path = Path(root) / f"g{group}/d{i % 64}/f{i}.{'txt' if kind == 'text' else 'bin'}"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            offset = rng.randrange(pool_size - size + 1)
+            path.write_bytes(pool[offset:offset + size])
+            file_count += 1
+            total += size
+    return file_count, total
+
+
+def measure(fn):
+    """
+    在fork出的子进程中执行fn，测量耗时、CPU时间和峰值RSS
+
+    Returns:
+        {'seconds', 'cpu_seconds', 'peak_rss_mb', 'result'}
+    """
+    import time
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        # 屏蔽被测代码的输出
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        try:
+            start = time.perf_counter()
+            result = fn()
+            payload = {'seconds': time.perf_counter() - start, 'result': result}
+        except BaseException as e:
+            payload = {'error': f"{type(e).__name__}: {e}"}
+        with os.fdopen(write_fd, 'w') as f:
+            json.dump(payload, f)
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'r') as f:
+        payload = json.loads(f.read() or '{"error": "子进程异常退出"}')
+    _, _, usage = os.wait4(pid, 0)
+
+    if 'error' in payload:
+        raise RuntimeError(payload['error'])
+    payload['cpu_seconds'] = usage.ru_utime + usage.ru_stime
+    payload['peak_rss_mb'] = usage.ru_maxrss / 1024
+    return payload
+
+
+class _ArtifactServer(BaseHTTPRequestHandler):
+    """模拟产物下载接口：返回预先生成的归档"""
+
+    archive_path = None
+    content_type = None
+
+    def do_GET(self):
+        with open(self.archive_path, 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', self.content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ArchiveBenchmark:
+    """对每个 (路径, 目录形状, 压缩选项) 组合执行测量"""
+
+    def __init__(self, args, base_dir):
+        self.args = args
+        self.base_dir = base_dir
+        self.results = []
+
+    def run(self):
+        from server import compression
+
+        formats = compression.available_formats()
+        server_options = [
+            (fmt, int(level)) for fmt, _, level in (o.partition(':') for o in self.args.server_options.split(','))
+            if fmt in formats
+        ]
+
+        for shape in self.args.shapes:
+            tree = os.path.join(self.base_dir, shape, 'out')
+            files, total = make_tree(tree, shape, self.args.scale, self.args.seed)
+            print(f"\n>>> {shape}: {files} 个文件, {total / 1048576:.1f} MB")
+
+            # 子进程继承当前进程的内存，峰值RSS减去空操作子进程的RSS得到被测代码的增量
+            baseline_rss = min(measure(lambda: None)['peak_rss_mb'] for _ in range(3))
+
+            # 各格式的参考归档（解压、转码、下载的输入）
+            archives = {}
+            for fmt in formats:
+                archives[fmt] = os.path.join(self.base_dir, shape, 'ref' + compression.FORMATS[fmt]['suffix'])
+                with compression.open_tar_writer(archives[fmt], fmt) as tar:
+                    tar.add(tree, arcname='out')
+
+            cases = []
+            if 'client_pack' in self.args.paths:
+                cases += [('client_pack', fmt, self._client_pack(shape, fmt)) for fmt in formats]
+            if 'server_pack' in self.args.paths:
+                cases += [('server_pack', f'{fmt}:{level}', self._server_pack(shape, fmt, level))
+                          for fmt, level in server_options]
+            if 'server_extract' in self.args.paths:
+                cases += [('server_extract', fmt, self._server_extract(shape, archives[fmt])) for fmt in formats]
+            if 'server_transcode' in self.args.paths and 'zstd' in archives:
+                cases.append(('server_transcode', 'zstd->gzip', self._server_transcode(archives['zstd'])))
+            if 'client_download' in self.args.paths:
+                cases += [('client_download', fmt, self._client_download(shape, archives[fmt])) for fmt in formats]
+
+            for path, option, (fn, cleanup) in cases:
+                runs = []
+                for _ in range(self.args.repeat):
+                    cleanup()
+                    runs.append(measure(fn))
+                cleanup()
+                self._record(path, shape, option, files, total, runs, baseline_rss)
+
+            shutil.rmtree(os.path.join(self.base_dir, shape), ignore_errors=True)
+
+        return {
+            'version': self._git_version(),
+            'label': self.args.label,
+            'created_at': datetime.now(timezone.utc).replace(tzinfo=None).isoformat() + 'Z',
+            'machine': {
+                'cpus': os.cpu_count(),
+                'python': sys.version.split()[0],
+                'formats': formats,
+                'zstandard': getattr(compression.zstandard, '__version__', None),
+            },
+            'config': {
+                'shapes': self.args.shapes,
+                'scale': self.args.scale,
+                'artifact_patterns': self.args.artifact_patterns,
+                'repeat': self.args.repeat,
+                'seed': self.args.seed,
+            },
+            'results': self.results,
+        }
+
+    def _record(self, path, shape, option, files, total, runs, baseline_rss):
+        """汇总一个组合的多次测量"""
+        seconds = sorted(r['seconds'] for r in runs)
+        median = seconds[len(seconds) // 2]
+        peak = max(r['peak_rss_mb'] for r in runs)
+        archive_bytes = runs[-1]['result']
+        entry = {
+            'path': path,
+            'shape': shape,
+            'option': option,
+            'files': files,
+            'bytes': total,
+            'archive_bytes': archive_bytes,
+            'ratio': round(total / archive_bytes, 2) if archive_bytes else None,
+            'seconds_median': round(median, 4),
+            'seconds_min': round(seconds[0], 4),
+            'mb_per_s': round(total / 1048576 / median, 1) if median else None,
+            'files_per_s': round(files / median, 1) if median else None,
+            'cpu_seconds': round(sorted(r['cpu_seconds'] for r in runs)[len(runs) // 2], 4),
+            'peak_rss_mb': round(peak, 1),
+            'peak_rss_delta_mb': round(peak - baseline_rss, 1),
+            'baseline_rss_mb': round(baseline_rss, 1),
+        }
+        self.results.append(entry)
+        print(f"  {path:<17}{option:<12}{entry['mb_per_s']:>9} MB/s {entry['files_per_s']:>10} 文件/s "
+              f"{entry['seconds_median']:>9.3f} s  CPU {entry['cpu_seconds']:>7.3f} s  "
+              f"RSS +{entry['peak_rss_delta_mb']:.1f} MB  压缩率 {entry['ratio']}")
+
+    # ===== 各路径的测量函数：返回 (fn, cleanup)，fn的返回值为归档字节数 =====
+
+    def _client_pack(self, shape, fmt):
+        from submit import RemoteCIClient
+
+        client = RemoteCIClient('http://127.0.0.1:1', 'bench')
+        shape_dir = os.path.join(self.base_dir, shape)
+        output = os.path.join(self.base_dir, f'client-pack.{fmt}')
+
+        def fn():
+            os.chdir(shape_dir)
+            client._create_archive('out', output, archive_format=fmt)
+            return os.path.getsize(output)
+
+        return fn, lambda: Path(output).unlink(missing_ok=True)
+
+    def _server_pack(self, shape, fmt, level):
+        from server.artifact_handler import ArtifactHandler
+
+        artifacts_dir = os.path.join(self.base_dir, 'artifacts')
+        handler = ArtifactHandler(artifacts_dir, fmt, level)
+
+        def fn():
+            return os.path.getsize(handler.pack_artifacts(os.path.join(self.base_dir, shape),
+                                                          self.args.artifact_patterns, 'bench'))
+
+        return fn, lambda: shutil.rmtree(artifacts_dir, ignore_errors=True) or os.makedirs(artifacts_dir)
+
+    def _server_extract(self, shape, archive):
+        from server.tar_stream import extract_tar_stream
+
+        dest = os.path.join(self.base_dir, 'extract')
+
+        def fn():
+            with open(archive, 'rb') as f:
+                extract_tar_stream(f, dest)
+            return os.path.getsize(archive)
+
+        return fn, lambda: shutil.rmtree(dest, ignore_errors=True)
+
+    def _server_transcode(self, archive):
+        from server.compression import iter_transcode_to_gzip
+
+        def fn():
+            return sum(len(chunk) for chunk in iter_transcode_to_gzip(archive))
+
+        return fn, lambda: None
+
+    def _client_download(self, shape, archive):
+        from submit import RemoteCIClient
+        from server.compression import FORMATS, format_of_path
+
+        handler = type('Handler', (_ArtifactServer,), {
+            'archive_path': archive,
+            'content_type': FORMATS[format_of_path(archive)]['mimetype'],
+        })
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = RemoteCIClient(f'http://127.0.0.1:{server.server_port}', 'bench')
+        dest = os.path.join(self.base_dir, 'download')
+
+        def fn():
+            os.makedirs(dest, exist_ok=True)
+            os.chdir(dest)
+            if not client._download_artifacts('bench'):
+                raise RuntimeError('下载产物失败')
+            return os.path.getsize(archive)
+
+        return fn, lambda: shutil.rmtree(dest, ignore_errors=True)
+
+    @staticmethod
+    def _git_version():
+        """当前代码的git版本"""
+        try:
+            return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=str(REPO_ROOT),
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+
+def print_comparison(result, baseline):
+    """与基线结果对比吞吐量和峰值内存"""
+    print(f"\n对比基线: {baseline.get('version')} ({baseline.get('label') or '无标签'})")
+    before = {(r['path'], r['shape'], r['option']): r for r in baseline['results']}
+    for entry in result['results']:
+        old = before.get((entry['path'], entry['shape'], entry['option']))
+        if not old or not old['mb_per_s']:
+            continue
+        change = (entry['mb_per_s'] - old['mb_per_s']) / old['mb_per_s'] * 100
+        print(f"  {entry['path']:<17}{entry['shape']:<12}{entry['option']:<12}"
+              f"{old['mb_per_s']:>8} -> {entry['mb_per_s']:>8} MB/s ({change:+.1f}%)  "
+              f"RSS +{old['peak_rss_delta_mb']} -> +{entry['peak_rss_delta_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Remote CI 归档微基准',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split('用法:')[1]
+    )
+    parser.add_argument('--shapes', type=lambda s: s.split(','), default=list(SHAPES),
+                        help=f"目录形状（逗号分隔）: {', '.join(SHAPES)}")
+    parser.add_argument('--paths', type=lambda s: s.split(','), default=list(PATHS),
+                        help=f"测量的路径（逗号分隔）: {', '.join(PATHS)}")
+    parser.add_argument('--server-options', default=DEFAULT_SERVER_OPTIONS,
+                        help='服务端打包产物的压缩选项（格式:级别，逗号分隔）')
+    parser.add_argument('--artifact-patterns', type=lambda s: s.split(','), default=['out/'],
+                        help='服务端打包产物的产物模式（逗号分隔，如 out/,out/**/*）')
+    parser.add_argument('--scale', type=float, default=1.0, help='数据量缩放比例')
+    parser.add_argument('--repeat', type=int, default=3, help='每个组合的测量次数（取中位数）')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--label', help='结果标签（如分支名）')
+    parser.add_argument('--output', help='结果JSON文件')
+    parser.add_argument('--compare', help='对比的基线结果JSON文件')
+    args = parser.parse_args()
+
+    for name in args.shapes:
+        if name not in SHAPES:
+            parser.error(f"未知的目录形状: {name}")
+    for name in args.paths:
+        if name not in PATHS:
+            parser.error(f"未知的路径: {name}")
+
+    base_dir = tempfile.mkdtemp(prefix='remote-ci-archive-bench-')
+    cwd = os.getcwd()
+    try:
+        result = ArchiveBenchmark(args, base_dir).run()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\n✓ 结果已保存: {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(result, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
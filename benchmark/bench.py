@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+Remote CI 压测工具：提交 -> 构建 -> 结果 全流程吞吐量与延迟
+
+在本机启动API服务，按配置的比例提交 upload / rsync / git 任务（轻量或重量级脚本），
+统计吞吐量（任务/分钟）以及提交、排队、开始、完成各环节的延迟分位数，结果写入JSON，
+可与其他版本的结果对比
+
+执行方式：
+  eager: Celery eager模式，构建在API请求线程中同步执行（无需Redis，测量单条流水线的开销）
+  redis: 连接本地Redis，启动独立的Celery worker进程（测量真实并发下的吞吐量）
+
+用法:
+  python benchmark/bench.py --jobs 50 --mix upload=2,rsync=1,git=1 --scripts trivial=3,heavy=1
+  python benchmark/bench.py --executor redis --workers 4 --concurrency 8 --output results.json
+  python benchmark/bench.py --jobs 50 --compare baseline.json
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import random
+import tarfile
+import tempfile
+import argparse
+import threading
+import subprocess
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# 压测使用的Token和项目名
+BENCH_TOKEN = 'bench-token'
+BENCH_PROJECT = 'bench'
+
+# 默认脚本
+TRIVIAL_SCRIPT = 'true'
+HEAVY_SCRIPT = ('python3 -c "import hashlib; h = hashlib.sha256(); '
+                '[h.update(bytes(65536)) for _ in range(20000)]"')
+
+# 统计的延迟指标
+LATENCY_METRICS = ('submit', 'queue_wait', 'start', 'finish', 'run')
+
+# 对比结果时展示的统计量
+COMPARE_FIELDS = ('p50', 'p95')
+
+
+def parse_weights(spec, allowed):
+    """
+    解析比例配置
+
+    Args:
+        spec: 如 "upload=2,rsync=1"
+        allowed: 允许的名称
+
+    Returns:
+        {名称: 权重}
+    """
+    weights = {}
+    for item in spec.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in allowed:
+            raise argparse.ArgumentTypeError(f"未知的类型: {name}（可选: {', '.join(allowed)}）")
+        weights[name] = float(weight or 1)
+    if not any(weights.values()):
+        raise argparse.ArgumentTypeError(f"比例不能全为0: {spec}")
+    return weights
+
+
+def utc_timestamp(value):
+    """数据库中的UTC ISO时间 -> Unix时间戳"""
+    return datetime.fromisoformat(value.rstrip('Z')).replace(tzinfo=timezone.utc).timestamp()
+
+
+def make_project(path, file_count, file_size, seed):
+    """生成压测用的项目目录"""
+    rng = random.Random(seed)
+    for i in range(file_count):
+        file_path = Path(path) / f"src/mod{i % 16}/file{i}.txt"
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # 可压缩的文本内容，接近真实源码
+        words = [f"token{rng.randrange(5000)}" for _ in range(file_size // 10)]
+        file_path.write_text(' '.join(words)[:file_size] + '\n')
+
+
+def make_archive(path):
+    """把项目打包为tar.gz（内存中）"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        tar.add(path, arcname='.')
+    return buffer.getvalue()
+
+
+def make_git_repo(src, dest):
+    """用项目目录创建本地git仓库，返回分支名"""
+    shutil.copytree(src, dest)
+    env = {**os.environ, 'GIT_AUTHOR_NAME': 'bench', 'GIT_AUTHOR_EMAIL': 'bench@localhost',
+           'GIT_COMMITTER_NAME': 'bench', 'GIT_COMMITTER_EMAIL': 'bench@localhost'}
+    for command in (['git', 'init', '-q', '-b', 'main'], ['git', 'add', '-A'], ['git', 'commit', '-q', '-m', 'bench']):
+        subprocess.run(command, cwd=dest, env=env, check=True)
+    return 'main'
+
+
+def summarize_values(values):
+    """延迟分布的统计量（秒）"""
+    from server.stage_timer import percentile, PERCENTILES
+
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return {'count': 0}
+    summary = {'count': len(values), 'avg': round(sum(values) / len(values), 4), 'min': round(values[0], 4)}
+    for q in PERCENTILES:
+        summary[f'p{q}'] = round(percentile(values, q), 4)
+    summary['max'] = round(values[-1], 4)
+    return summary
+
+
+class Benchmark:
+    """启动API服务、提交任务并收集各任务的时间点"""
+
+    def __init__(self, args, base_dir):
+        self.args = args
+        self.base_dir = base_dir
+        self.results = []
+        self.results_lock = threading.Lock()
+        self.worker_process = None
+
+    def setup_environment(self):
+        """配置服务端环境变量（必须在导入server模块之前）"""
+        args = self.args
+        os.environ.update(
+            CI_DATA_DIR=f'{self.base_dir}/data',
+            CI_WORK_DIR=f'{self.base_dir}/work',
+            CI_WORKSPACE_DIR=f'{self.base_dir}/workspace',
+            CI_API_TOKEN=BENCH_TOKEN,
+            CI_MAX_CONCURRENT=str(args.workers),
+        )
+        if args.executor == 'redis':
+            os.environ.update(CI_BROKER_URL=args.broker, CI_RESULT_BACKEND=args.broker)
+        # cgroup需要root权限，压测默认不启用（可通过环境变量覆盖）
+        os.environ.setdefault('CI_CGROUP', 'false')
+        sys.path.insert(0, str(REPO_ROOT))
+
+    def prepare_sources(self):
+        """生成项目、代码包、rsync workspace和git仓库"""
+        project_dir = f'{self.base_dir}/project'
+        make_project(project_dir, self.args.files, self.args.file_size, self.args.seed)
+        self.archive = make_archive(project_dir)
+
+        self.workspace = f'{self.base_dir}/workspace/{BENCH_PROJECT}'
+        shutil.copytree(project_dir, self.workspace)
+
+        self.git_repo = f'{self.base_dir}/git-src'
+        self.git_branch = make_git_repo(project_dir, self.git_repo)
+
+    def start_server(self):
+        """在后台线程中启动API服务，redis模式下同时启动worker进程"""
+        from server.celery_app import celery_app
+        if self.args.executor == 'eager':
+            celery_app.conf.task_always_eager = True
+            celery_app.conf.result_backend = 'cache+memory://'
+            celery_app.conf.task_store_eager_result = True
+        else:
+            self.worker_process = subprocess.Popen(
+                [sys.executable, '-m', 'celery', '-A', 'server.celery_app', 'worker',
+                 f'--concurrency={self.args.workers}', '--loglevel=warning'],
+                cwd=str(REPO_ROOT), env=os.environ.copy(),
+                stdout=open(f'{self.base_dir}/worker.log', 'w'), stderr=subprocess.STDOUT
+            )
+
+        from werkzeug.serving import make_server
+        from server import app as app_module
+        self.app_module = app_module
+        self.server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+        if self.worker_process:
+            # 等待worker就绪
+            deadline = time.time() + 60
+            while not celery_app.control.inspect(timeout=1).ping():
+                if time.time() > deadline or self.worker_process.poll() is not None:
+                    raise RuntimeError(f"Celery worker启动失败，见 {self.base_dir}/worker.log")
+            app_module.scheduler.start_background(1)
+
+    def stop(self):
+        """停止API服务和worker进程"""
+        if getattr(self, 'server', None):
+            self.server.shutdown()
+        if self.worker_process:
+            self.worker_process.terminate()
+            try:
+                self.worker_process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.worker_process.kill()
+
+    def submit(self, session, mode, script):
+        """提交一个任务，返回job_id"""
+        headers = {'Authorization': f'Bearer {BENCH_TOKEN}'}
+        if mode == 'upload':
+            response = session.post(f'{self.url}/api/jobs/upload', headers=headers, files={
+                'code': ('code.tar.gz', self.archive, 'application/gzip')
+            }, data={'script': script, 'project_name': BENCH_PROJECT, 'user_id': 'bench', 'no_cache': 'true'})
+        elif mode == 'rsync':
+            response = session.post(f'{self.url}/api/jobs/rsync', headers=headers, json={
+                'workspace': self.workspace, 'script': script, 'user_id': 'bench', 'no_cache': True
+            })
+        else:
+            response = session.post(f'{self.url}/api/jobs/git', headers=headers, json={
+                'repo': self.git_repo, 'branch': self.git_branch, 'script': script,
+                'user_id': 'bench', 'no_cache': True
+            })
+        response.raise_for_status()
+        return response.json()['job_id']
+
+    def run_job(self, index, mode, script_kind, scheduled_at):
+        """按计划时间提交任务并等待结束"""
+        import requests
+        from server.log_reader import FINISHED_STATUSES
+
+        delay = scheduled_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        script = self.args.heavy_script if script_kind == 'heavy' else TRIVIAL_SCRIPT
+        record = {'index': index, 'mode': mode, 'script': script_kind}
+        session = requests.Session()
+
+        submitted = time.time()
+        try:
+            job_id = self.submit(session, mode, script)
+        except Exception as e:
+            record.update(status='submit_error', error=str(e))
+            with self.results_lock:
+                self.results.append(record)
+            return
+        record.update(job_id=job_id, submitted_at=submitted, submit=time.time() - submitted)
+
+        deadline = time.time() + self.args.job_timeout
+        job = None
+        while time.time() < deadline:
+            job = self.app_module.job_db.get_job(job_id)
+            if job and job['status'] in FINISHED_STATUSES:
+                break
+            time.sleep(self.args.poll_interval)
+
+        record['status'] = job['status'] if job else 'missing'
+        if job and job.get('started_at'):
+            started = utc_timestamp(job['started_at'])
+            record['queue_wait'] = started - utc_timestamp(job['created_at'])
+            record['start'] = started - submitted
+            if job.get('finished_at'):
+                finished = utc_timestamp(job['finished_at'])
+                record['finish'] = finished - submitted
+                record['run'] = finished - started
+                record['finished_at'] = finished
+
+        with self.results_lock:
+            self.results.append(record)
+
+    def plan(self):
+        """按比例生成任务列表 [(序号, 模式, 脚本类型, 计划提交时间), ...]"""
+        rng = random.Random(self.args.seed)
+        modes, mode_weights = zip(*self.args.mix.items())
+        kinds, kind_weights = zip(*self.args.scripts.items())
+        start = time.time()
+        return [
+            (i, rng.choices(modes, mode_weights)[0], rng.choices(kinds, kind_weights)[0],
+             start + i / self.args.rate if self.args.rate else start)
+            for i in range(self.args.jobs)
+        ]
+
+    def run(self):
+        """执行压测，返回结果"""
+        self.setup_environment()
+        self.prepare_sources()
+        self.start_server()
+
+        # 预热：首个任务会初始化git镜像、数据库连接等，不计入结果
+        for _ in range(self.args.warmup):
+            for mode in self.args.mix:
+                self.run_job(-1, mode, 'trivial', time.time())
+        self.results.clear()
+
+        plan = self.plan()
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            for job in plan:
+                pool.submit(self.run_job, *job)
+        wall = time.time() - started
+
+        return self.report(wall)
+
+    def report(self, wall):
+        """汇总结果"""
+        from server.stage_timer import summarize
+
+        finished = [r for r in self.results if r.get('finished_at')]
+        if finished:
+            first_submit = min(r['submitted_at'] for r in self.results if 'submitted_at' in r)
+            span = max(r['finished_at'] for r in finished) - first_submit
+        else:
+            span = wall
+
+        statuses = {}
+        for r in self.results:
+            statuses[r['status']] = statuses.get(r['status'], 0) + 1
+
+        by_group = {}
+        for r in self.results:
+            by_group.setdefault(f"{r['mode']}/{r['script']}", []).append(r)
+
+        return {
+            'version': self.git_version(),
+            'label': self.args.label,
+            'created_at': datetime.now(timezone.utc).replace(tzinfo=None).isoformat() + 'Z',
+            'config': {
+                'executor': self.args.executor,
+                'jobs': self.args.jobs,
+                'concurrency': self.args.concurrency,
+                'workers': self.args.workers,
+                'rate': self.args.rate,
+                'mix': self.args.mix,
+                'scripts': self.args.scripts,
+                'heavy_script': self.args.heavy_script,
+                'files': self.args.files,
+                'file_size': self.args.file_size,
+                'archive_bytes': len(self.archive),
+            },
+            'wall_seconds': round(wall, 3),
+            'throughput_jobs_per_min': round(len(finished) / span * 60, 2) if span > 0 else 0,
+            'statuses': statuses,
+            'latency': {m: summarize_values(r.get(m) for r in self.results) for m in LATENCY_METRICS},
+            'by_group': {
+                group: {m: summarize_values(r.get(m) for r in records) for m in ('finish', 'run')}
+                for group, records in sorted(by_group.items())
+            },
+            'stages': summarize(self.app_module.job_db.get_stage_durations(days=1)),
+            'jobs': sorted(self.results, key=lambda r: r['index']),
+        }
+
+    @staticmethod
+    def git_version():
+        """当前代码的git版本"""
+        try:
+            return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=str(REPO_ROOT),
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+
+def print_report(result):
+    """输出结果摘要"""
+    print("=" * 70)
+    print(f"版本: {result['version']}  执行方式: {result['config']['executor']}  "
+          f"任务数: {result['config']['jobs']}  并发: {result['config']['concurrency']}")
+    print(f"状态: {result['statuses']}")
+    print(f"吞吐量: {result['throughput_jobs_per_min']} 任务/分钟（总耗时 {result['wall_seconds']} 秒）")
+    print("-" * 70)
+    print(f"{'延迟(秒)':<12}{'p50':>10}{'p90':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for metric, summary in result['latency'].items():
+        if summary['count']:
+            print(f"{metric:<12}" + ''.join(f"{summary[k]:>10.3f}" for k in ('p50', 'p90', 'p95', 'p99', 'max')))
+    print("=" * 70)
+
+
+def print_comparison(result, baseline):
+    """与基线结果对比"""
+    print(f"\n对比基线: {baseline.get('version')} ({baseline.get('label') or '无标签'})")
+    old, new = baseline['throughput_jobs_per_min'], result['throughput_jobs_per_min']
+    change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+    print(f"吞吐量: {old} -> {new} 任务/分钟 ({change})")
+    for metric in LATENCY_METRICS:
+        before = baseline['latency'].get(metric, {})
+        after = result['latency'].get(metric, {})
+        for field in COMPARE_FIELDS:
+            if field in before and field in after:
+                delta = f"{(after[field] - before[field]) / before[field] * 100:+.1f}%" if before[field] else 'n/a'
+                print(f"  {metric:<12}{field:<5}{before[field]:>10.3f} -> {after[field]:>10.3f}  ({delta})")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Remote CI 压测：提交到结果的吞吐量和延迟',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split('用法:')[1]
+    )
+    parser.add_argument('--executor', choices=['eager', 'redis'], default='eager',
+                        help='eager: 构建在API进程中同步执行；redis: 使用本地Redis和独立worker进程')
+    parser.add_argument('--broker', default='redis://localhost:6379/15', help='redis模式的broker地址')
+    parser.add_argument('--workers', type=int, default=2, help='redis模式的worker并发数（同时作为调度槽位数）')
+    parser.add_argument('--jobs', type=int, default=20, help='提交的任务数')
+    parser.add_argument('--concurrency', type=int, default=4, help='同时提交/等待的客户端数')
+    parser.add_argument('--rate', type=float, default=0, help='提交速率（任务/秒），0表示客户端空闲即提交')
+    parser.add_argument('--mix', type=lambda s: parse_weights(s, ('upload', 'rsync', 'git')),
+                        default={'upload': 1, 'rsync': 1, 'git': 1}, help='模式比例，如 upload=2,rsync=1,git=1')
+    parser.add_argument('--scripts', type=lambda s: parse_weights(s, ('trivial', 'heavy')),
+                        default={'trivial': 1}, help='脚本比例，如 trivial=3,heavy=1')
+    parser.add_argument('--heavy-script', default=HEAVY_SCRIPT, help='重量级脚本')
+    parser.add_argument('--files', type=int, default=200, help='项目文件数')
+    parser.add_argument('--file-size', type=int, default=4096, help='单个文件大小（字节）')
+    parser.add_argument('--warmup', type=int, default=1, help='每种模式的预热任务数（不计入结果）')
+    parser.add_argument('--poll-interval', type=float, default=0.1, help='查询任务状态的间隔（秒）')
+    parser.add_argument('--job-timeout', type=float, default=600, help='单个任务的最长等待时间（秒）')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子（任务顺序和项目内容）')
+    parser.add_argument('--label', help='结果标签（如分支名）')
+    parser.add_argument('--output', help='结果JSON文件')
+    parser.add_argument('--compare', help='对比的基线结果JSON文件')
+    parser.add_argument('--keep', action='store_true', help='保留临时目录（数据库、日志）')
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp(prefix='remote-ci-bench-')
+    bench = Benchmark(args, base_dir)
+    try:
+        result = bench.run()
+    finally:
+        bench.stop()
+        if args.keep:
+            print(f"临时目录: {base_dir}")
+        else:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"✓ 结果已保存: {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(result, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
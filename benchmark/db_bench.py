@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+Remote CI 数据库规模基准：百万级任务历史下 JobDatabase 各公开查询的耗时和查询计划
+
+生成覆盖多用户、多项目、一年时间跨度的合成任务历史（ci_jobs，以及最近任务的 job_stages），
+逐个调用 JobDatabase 的公开方法计时，同时记录每条语句的 EXPLAIN QUERY PLAN；
+出现未登记的全表扫描（大表上不使用索引的 SCAN）时以非零状态退出，
+作为索引和表结构改动的回归检查
+
+用法:
+  python benchmark/db_bench.py
+  python benchmark/db_bench.py --rows 200000 --repeat 3
+  python benchmark/db_bench.py --db /tmp/jobs-1m.db --output baseline.json
+  python benchmark/db_bench.py --db /tmp/jobs-1m.db --compare baseline.json
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import hashlib
+import argparse
+import sqlite3
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+UTC = timezone.utc
+
+# 历史中的用户数和项目数（按Zipf分布提交，少数用户/项目占大部分任务）
+USER_COUNT = 300
+PROJECT_COUNT = 800
+
+MODES = (('upload', 45), ('git', 35), ('rsync', 20))
+STATUSES = (('success', 80), ('failed', 15), ('timeout', 2), ('error', 2), ('cancelled', 1))
+
+# 超过该天数的任务大部分已被配额清理标记为过期
+EXPIRE_AFTER_DAYS = 30
+
+# 表行数较少、允许全表扫描的表
+SMALL_TABLES = {'special_users', 'scheduler_queues'}
+
+# 已知且可接受的全表扫描（用例名: 原因），新出现的全表扫描会使检查失败
+KNOWN_FULL_SCANS = {
+    'count_jobs': 'COUNT(*) 需要遍历整个索引',
+    'count_jobs[user_id]': "user_id 为大小写不敏感的子串匹配（LIKE '%x%'），无法使用索引",
+    'count_jobs[project_name]': "project_name 为大小写不敏感的子串匹配（LIKE '%x%'），无法使用索引",
+    'get_stats[7]': '按模式分组时遍历 idx_jobs_mode，而不是按 created_at 范围查找（待优化）',
+    'get_stats[90]': '按模式分组时遍历 idx_jobs_mode，而不是按 created_at 范围查找（待优化）',
+    'get_stage_durations[7]': '按阶段排序时遍历 idx_job_stages_stage，而不是先按 created_at 筛选任务（待优化）',
+    'cleanup_old_jobs': '删除孤立的阶段记录需要遍历 job_stages（只在定期清理时执行）',
+}
+
+# EXPLAIN QUERY PLAN 中的扫描："SCAN 表名" 为全表扫描，"SCAN 表名 USING [COVERING] INDEX" 为遍历整个索引
+_SCAN_RE = re.compile(r'^SCAN (\w+)(?: USING (?:COVERING )?INDEX \w+)?$')
+
+# 带LIMIT的语句按索引顺序扫描时提前结束，不算全表扫描
+_LIMIT_RE = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+
+
+def _iso(dt):
+    return dt.isoformat() + 'Z'
+
+
+def _zipf_weights(n, s=1.1):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def populate(db_path, rows, days, stage_days, seed):
+    """
+    生成合成任务历史
+
+    Args:
+        db_path: 数据库路径（表结构由 JobDatabase 创建）
+        rows: 任务数
+        days: 历史跨度（天）
+        stage_days: 为最近几天的任务生成阶段耗时
+        seed: 随机种子
+    """
+    from server.database import JobDatabase
+    from server.stage_timer import STAGES
+
+    with redirect_stdout(io.StringIO()):
+        JobDatabase(db_path)
+    rng = random.Random(seed)
+    users = [f"dev{i:03d}" for i in range(USER_COUNT)]
+    user_weights = _zipf_weights(USER_COUNT)
+    projects = [f"service-{i:03d}" for i in range(PROJECT_COUNT)]
+    project_weights = _zipf_weights(PROJECT_COUNT)
+    modes, mode_weights = zip(*MODES)
+    statuses, status_weights = zip(*STATUSES)
+
+    now = datetime.now(UTC).replace(tzinfo=None)
+    start = now - timedelta(days=days)
+    step = (now - start) / rows
+    stage_cutoff = now - timedelta(days=stage_days)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA journal_mode = MEMORY')
+
+    columns = ('job_id', 'mode', 'status', 'script', 'user_id', 'project_name', 'created_at', 'started_at',
+               'finished_at', 'duration', 'exit_code', 'error_message', 'workspace', 'repo_url', 'branch',
+               'commit_hash', 'log_file', 'log_size', 'artifacts_path', 'artifacts_size', 'code_archive_path',
+               'code_archive_size', 'is_expired', 'metadata', 'build_key', 'cached_from', 'coalesced_into',
+               'dispatched_at', 'priority', 'cpu_user_seconds', 'cpu_system_seconds', 'max_rss_kb',
+               'build_seconds', 'heartbeat_at')
+    insert_job = f"INSERT INTO ci_jobs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    insert_stage = 'INSERT INTO job_stages (job_id, stage, seq, started_at, duration) VALUES (?, ?, ?, ?, ?)'
+
+    # 最近成功构建的构建键（用于生成缓存命中和跟随任务）
+    recent_builds = []
+    batch, stage_batch = [], []
+    started = time.perf_counter()
+
+    for i in range(rows):
+        job_id = uuid.UUID(int=rng.getrandbits(128), version=4).hex
+        user = rng.choices(users, user_weights)[0]
+        project = rng.choices(projects, project_weights)[0]
+        mode = rng.choices(modes, mode_weights)[0]
+        created = start + step * i
+        age_days = (now - created).days
+        # 最后一小时内的任务有一部分仍在排队或运行
+        if now - created < timedelta(hours=1) and rng.random() < 0.3:
+            status = rng.choice(('queued', 'running'))
+        else:
+            status = rng.choices(statuses, status_weights)[0]
+
+        queue_wait = rng.expovariate(1 / 20)
+        duration = rng.lognormvariate(4.5, 1.0) if status not in ('queued', 'running') else None
+        started_at = created + timedelta(seconds=queue_wait) if status != 'queued' else None
+        finished_at = started_at + timedelta(seconds=duration) if duration is not None else None
+        commit = hashlib.sha1(f"{project}-{rng.randrange(200)}".encode()).hexdigest()
+        build_key = hashlib.sha256(f"{project}:{commit}".encode()).hexdigest()
+
+        cached_from = coalesced_into = None
+        if recent_builds and status == 'success' and rng.random() < 0.08:
+            cached_from, build_key = rng.choice(recent_builds)
+            duration = 0.0
+        elif recent_builds and rng.random() < 0.03:
+            coalesced_into, build_key = rng.choice(recent_builds)
+        elif status == 'success':
+            recent_builds.append((job_id, build_key))
+            if len(recent_builds) > 500:
+                recent_builds.pop(0)
+
+        owns_files = cached_from is None and coalesced_into is None
+        log_size = int(rng.lognormvariate(10.5, 1.2)) if owns_files else 0
+        artifacts_size = int(rng.lognormvariate(15, 1.5)) if owns_files and rng.random() < 0.6 else 0
+        code_archive_size = int(rng.lognormvariate(14, 1)) if owns_files and mode == 'upload' else 0
+        expired = 1 if age_days > EXPIRE_AFTER_DAYS and rng.random() < 0.9 else 0
+        repo_url = f"https://git.example.com/{project}.git" if mode == 'git' else None
+        script = rng.choice(('make -j8', 'npm ci && npm test', 'pytest -q', './gradlew build', 'cargo build'))
+        metadata = json.dumps({'mode': mode, 'script': script, 'user_id': user, 'project_name': project,
+                               'artifacts': ['dist/'] if artifacts_size else [], 'timeout': 3600})
+        build_seconds = duration * 0.9 if duration else None
+
+        batch.append((
+            job_id, mode, status, script, user, project, _iso(created),
+            _iso(started_at) if started_at else None, _iso(finished_at) if finished_at else None,
+            duration, (0 if status == 'success' else 1) if duration is not None else None,
+            'Build failed' if status in ('failed', 'error') else None,
+            f"/data/workspace/{project}" if mode == 'rsync' else None, repo_url,
+            'main' if mode == 'git' else None, commit if mode == 'git' else None,
+            f"/data/logs/{job_id}.log", log_size,
+            f"/data/artifacts/{job_id}.tar.gz" if artifacts_size else None, artifacts_size,
+            f"/data/uploads/{job_id}.tar.gz" if code_archive_size else None, code_archive_size,
+            expired, metadata, build_key, cached_from, coalesced_into,
+            _iso(created + timedelta(seconds=0.5)) if owns_files else None,
+            rng.choices((0, 1, 2), (10, 85, 5))[0],
+            build_seconds * rng.uniform(0.5, 4) if build_seconds else None,
+            build_seconds * rng.uniform(0.05, 0.3) if build_seconds else None,
+            int(rng.lognormvariate(13, 1)) if build_seconds else None,
+            build_seconds,
+            _iso(now - timedelta(seconds=rng.uniform(0, 30))) if status == 'running' else None,
+        ))
+
+        if created >= stage_cutoff and owns_files and duration:
+            offset = 0.0
+            for seq, stage in enumerate(STAGES):
+                if stage == 'preempted':
+                    continue
+                spent = queue_wait if stage == 'queue_wait' else duration * rng.uniform(0.01, 0.2)
+                stage_batch.append((job_id, stage, seq, _iso(created + timedelta(seconds=offset)), spent))
+                offset += spent
+
+        if len(batch) >= 20000:
+            conn.executemany(insert_job, batch)
+            conn.executemany(insert_stage, stage_batch)
+            conn.commit()
+            batch, stage_batch = [], []
+            print(f"\r  已生成 {i + 1}/{rows} 条任务 ({time.perf_counter() - started:.0f} 秒)", end='', flush=True)
+
+    conn.executemany(insert_job, batch)
+    conn.executemany(insert_stage, stage_batch)
+    conn.execute(
+        'INSERT INTO special_users (user_id, quota_bytes, created_at, updated_at, weight) VALUES (?, ?, ?, ?, ?)',
+        (users[0], 50 * 1024 ** 3, _iso(now), _iso(now), 2.0))
+    # 不执行ANALYZE：服务端从不收集统计信息，查询计划应与线上一致
+    conn.commit()
+    conn.close()
+    print(f"\r  已生成 {rows}/{rows} 条任务 ({time.perf_counter() - started:.0f} 秒)")
+
+
+class QueryPlanRecorder:
+    """记录连接上执行的语句（参数已展开），用于生成查询计划"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, sql):
+        statement = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+        if statement in ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH') and sql not in self.statements:
+            self.statements.append(sql)
+
+    def plans(self, conn):
+        """
+        Returns:
+            [{'sql', 'plan': [计划行], 'full_scans': [表名]}]
+        """
+        result = []
+        for sql in self.statements:
+            details = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+            scans = []
+            for detail in details:
+                match = _SCAN_RE.match(detail)
+                if not match or match.group(1) in SMALL_TABLES:
+                    continue
+                if ' USING ' in detail and _LIMIT_RE.search(sql):
+                    continue
+                scans.append(match.group(1))
+            result.append({'sql': ' '.join(sql.split()), 'plan': details, 'full_scans': scans})
+        return result
+
+
+class DatabaseBenchmark:
+    """对每个公开查询执行计时并检查查询计划"""
+
+    def __init__(self, args, db_path):
+        from server.database import JobDatabase
+
+        self.args = args
+        with redirect_stdout(io.StringIO()):
+            self.db = JobDatabase(db_path)
+        self.conn = self.db._get_conn()
+        self.results = []
+
+    def sample(self):
+        """从数据库中选取查询参数（排队/运行中的任务、常见用户和项目等）"""
+        conn = self.conn
+        row = conn.execute('''
+            SELECT job_id, user_id, project_name, build_key FROM ci_jobs
+            WHERE status = 'success' AND cached_from IS NULL AND coalesced_into IS NULL
+            ORDER BY created_at DESC LIMIT 1
+        ''').fetchone()
+        running = conn.execute("SELECT job_id FROM ci_jobs WHERE status = 'running' LIMIT 1").fetchone()
+        git = conn.execute("SELECT repo_url FROM ci_jobs WHERE repo_url IS NOT NULL LIMIT 1").fetchone()
+        return {
+            'job_id': row['job_id'],
+            'user_id': row['user_id'],
+            'project_name': row['project_name'],
+            'build_key': row['build_key'],
+            'running_id': running['job_id'] if running else row['job_id'],
+            'repo_url': git['repo_url'] if git else None,
+            'since': _iso(datetime.now(UTC).replace(tzinfo=None) - timedelta(days=1)),
+            'alive_since': _iso(datetime.now(UTC).replace(tzinfo=None) - timedelta(minutes=2)),
+            'now': _iso(datetime.now(UTC).replace(tzinfo=None)),
+        }
+
+    def cases(self, s):
+        """(用例名, 调用) 列表；写操作只作用于本次基准新建的任务，不改变历史数据"""
+        db = self.db
+        job_id = f"bench{uuid.uuid4().hex[:27]}"
+        job_data = {'mode': 'upload', 'script': 'make', 'user_id': s['user_id'],
+                    'project_name': s['project_name'], 'build_key': s['build_key']}
+        stages = [{'stage': 'build', 'started_at': s['since'], 'duration': 1.0}]
+        source = db.get_job(s['job_id'])
+        counter = iter(range(10 ** 9))
+
+        return [
+            ('get_job', lambda: db.get_job(s['job_id'])),
+            ('get_jobs', lambda: db.get_jobs()),
+            ('get_jobs[offset=10000]', lambda: db.get_jobs(offset=10000)),
+            ('get_jobs[status]', lambda: db.get_jobs(filters={'status': 'failed'})),
+            ('get_jobs[mode]', lambda: db.get_jobs(filters={'mode': 'rsync'})),
+            ('get_jobs[user_id]', lambda: db.get_jobs(filters={'user_id': s['user_id']})),
+            ('get_jobs[project_name]', lambda: db.get_jobs(filters={'project_name': s['project_name']})),
+            ('count_jobs', lambda: db.count_jobs()),
+            ('count_jobs[status]', lambda: db.count_jobs({'status': 'failed'})),
+            ('count_jobs[mode]', lambda: db.count_jobs({'mode': 'rsync'})),
+            ('count_jobs[user_id]', lambda: db.count_jobs({'user_id': s['user_id']})),
+            ('count_jobs[project_name]', lambda: db.count_jobs({'project_name': s['project_name']})),
+            ('get_active_job_counts', lambda: db.get_active_job_counts()),
+            ('get_stats[7]', lambda: db.get_stats(7)),
+            ('get_stats[90]', lambda: db.get_stats(90)),
+            ('calculate_disk_usage', lambda: db.calculate_disk_usage()),
+            ('calculate_disk_usage[user]', lambda: db.calculate_disk_usage(s['user_id'])),
+            ('get_oldest_jobs', lambda: db.get_oldest_jobs()),
+            ('get_oldest_jobs[user]', lambda: db.get_oldest_jobs(s['user_id'])),
+            ('find_inflight_job', lambda: db.find_inflight_job(s['build_key'])),
+            ('find_cached_build', lambda: db.find_cached_build(s['build_key'], 24 * 7)),
+            ('get_pending_jobs', lambda: db.get_pending_jobs()),
+            ('get_dispatched_jobs', lambda: db.get_dispatched_jobs(s['since'], s['alive_since'])),
+            ('get_finished_jobs', lambda: db.get_finished_jobs(s['since'], '', s['now'])),
+            ('get_recent_resource_usage[project]', lambda: db.get_recent_resource_usage(s['project_name'])),
+            ('get_recent_resource_usage[repo]', lambda: db.get_recent_resource_usage(repo_url=s['repo_url'])),
+            ('find_preemptible_job', lambda: db.find_preemptible_job(2, 3, s['alive_since'])),
+            ('get_preempting_job', lambda: db.get_preempting_job(s['running_id'])),
+            ('get_job_stages', lambda: db.get_job_stages(s['job_id'])),
+            ('get_stage_durations[7]', lambda: db.get_stage_durations(7)),
+            ('get_stage_durations[project]', lambda: db.get_stage_durations(7, {'project_name': s['project_name']})),
+            ('get_scheduler_queues', lambda: db.get_scheduler_queues()),
+            ('get_special_user', lambda: db.get_special_user(s['user_id'])),
+            ('get_all_special_users', lambda: db.get_all_special_users()),
+            ('get_user_weights', lambda: db.get_user_weights()),
+            ('create_job', lambda: db.create_job(f"{job_id}-{next(counter)}", job_data)),
+            ('create_cached_job', lambda: db.create_cached_job(f"{job_id}-{next(counter)}", job_data, source)),
+            ('create_follower_job', lambda: db.create_follower_job(
+                f"{job_id}-{next(counter)}", job_data, {**source, 'job_id': job_id, 'status': 'queued'})),
+            ('update_job_build_key', lambda: db.update_job_build_key(job_id, s['build_key'])),
+            ('set_job_dispatched', lambda: db.set_job_dispatched(job_id)),
+            ('raise_job_priority', lambda: db.raise_job_priority(job_id, 2)),
+            ('update_job_started', lambda: db.update_job_started(job_id)),
+            ('request_preemption', lambda: db.request_preemption(job_id, f"{job_id}-0")),
+            ('finish_preemption', lambda: db.finish_preemption(job_id, 1.0)),
+            ('release_preemption', lambda: db.release_preemption(job_id)),
+            ('update_job_resource_usage', lambda: db.update_job_resource_usage(job_id, build_seconds=1.0)),
+            ('update_job_finished', lambda: db.update_job_finished(job_id, 'success', {'duration': 1.0})),
+            ('update_job_file_sizes', lambda: db.update_job_file_sizes(job_id, log_size=1, artifacts_path='x')),
+            ('save_job_stages', lambda: db.save_job_stages(job_id, stages)),
+            ('mark_job_expired', lambda: db.mark_job_expired(job_id)),
+            ('save_scheduler_queue', lambda: db.save_scheduler_queue(s['user_id'], 1.0, 1.0)),
+            # 保留天数超过历史跨度，不会删除任何任务
+            ('cleanup_old_jobs', lambda: db.cleanup_old_jobs(days=self.args.days + 30)),
+        ], job_id
+
+    def run(self):
+        s = self.sample()
+        cases, job_id = self.cases(s)
+        # create_job 先执行一次，后续写操作作用于这个任务
+        self.db.create_job(job_id, {'mode': 'upload', 'script': 'make', 'user_id': s['user_id']})
+
+        rows = self.conn.execute('SELECT COUNT(*) FROM ci_jobs').fetchone()[0]
+        print(f"\n>>> {rows} 条任务，每个查询执行 {self.args.repeat} 次\n")
+        print(f"  {'查询':<38}{'中位数':>10}{'最大':>10}  全表扫描")
+
+        for name, fn in cases:
+            if self.args.only and not any(key in name for key in self.args.only):
+                continue
+            recorder = QueryPlanRecorder()
+            output = io.StringIO()
+            timings = []
+            # 屏蔽成功提示，只输出失败信息
+            with redirect_stdout(output):
+                self.conn.set_trace_callback(recorder)
+                try:
+                    fn()
+                finally:
+                    self.conn.set_trace_callback(None)
+
+                for _ in range(self.args.repeat):
+                    start = time.perf_counter()
+                    fn()
+                    timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            for line in output.getvalue().splitlines():
+                if line.startswith('✗'):
+                    print(f"  {name}: {line}")
+
+            plans = recorder.plans(self.conn)
+            scans = sorted({table for plan in plans for table in plan['full_scans']})
+            entry = {
+                'name': name,
+                'median_ms': round(timings[len(timings) // 2], 3),
+                'max_ms': round(timings[-1], 3),
+                'full_scans': scans,
+                'known': name in KNOWN_FULL_SCANS,
+                'plans': plans,
+            }
+            self.results.append(entry)
+            flag = (f"{', '.join(scans)}{'（已知）' if entry['known'] else ''}") if scans else '-'
+            print(f"  {name:<40}{entry['median_ms']:>9.2f}ms{entry['max_ms']:>9.2f}ms  {flag}")
+            if self.args.verbose or (scans and not entry['known']):
+                for plan in plans:
+                    print(f"      {plan['sql'][:150]}")
+                    for detail in plan['plan']:
+                        print(f"        {detail}")
+
+        # 删除基准新建的任务
+        self.conn.execute('DELETE FROM ci_jobs WHERE job_id LIKE ?', (f"{job_id}%",))
+        self.conn.execute('DELETE FROM job_stages WHERE job_id = ?', (job_id,))
+        self.conn.commit()
+
+        return {
+            'version': self._git_version(),
+            'label': self.args.label,
+            'created_at': _iso(datetime.now(UTC).replace(tzinfo=None)),
+            'machine': {
+                'cpus': os.cpu_count(),
+                'python': sys.version.split()[0],
+                'sqlite': sqlite3.sqlite_version,
+            },
+            'config': {
+                'rows': rows,
+                'days': self.args.days,
+                'repeat': self.args.repeat,
+                'seed': self.args.seed,
+            },
+            'results': self.results,
+        }
+
+    @staticmethod
+    def _git_version():
+        """当前代码的git版本"""
+        try:
+            return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=str(REPO_ROOT),
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+
+def print_comparison(result, baseline):
+    """与基线结果对比各查询的中位数耗时和全表扫描"""
+    print(f"\n对比基线: {baseline.get('version')} ({baseline.get('label') or '无标签'})")
+    before = {r['name']: r for r in baseline['results']}
+    for entry in result['results']:
+        old = before.get(entry['name'])
+        if not old:
+            continue
+        change = (entry['median_ms'] - old['median_ms']) / old['median_ms'] * 100 if old['median_ms'] else 0
+        scans = '' if old['full_scans'] == entry['full_scans'] else \
+            f"  全表扫描 {old['full_scans'] or '-'} -> {entry['full_scans'] or '-'}"
+        print(f"  {entry['name']:<40}{old['median_ms']:>9.2f} -> {entry['median_ms']:>9.2f} ms ({change:+.1f}%){scans}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Remote CI 数据库规模基准',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split('用法:')[1]
+    )
+    parser.add_argument('--rows', type=int, default=1000000, help='生成的任务数')
+    parser.add_argument('--days', type=int, default=365, help='任务历史跨度（天）')
+    parser.add_argument('--stage-days', type=int, default=14, help='为最近几天的任务生成阶段耗时')
+    parser.add_argument('--db', help='数据库路径（已存在时直接复用，不重新生成）')
+    parser.add_argument('--repeat', type=int, default=5, help='每个查询的执行次数（取中位数）')
+    parser.add_argument('--only', type=lambda s: s.split(','), help='只执行名称包含指定关键字的查询（逗号分隔）')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--verbose', action='store_true', help='输出所有查询的执行计划')
+    parser.add_argument('--no-check', action='store_true', help='出现未登记的全表扫描时不以失败状态退出')
+    parser.add_argument('--label', help='结果标签（如分支名）')
+    parser.add_argument('--output', help='结果JSON文件')
+    parser.add_argument('--compare', help='对比的基线结果JSON文件')
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp(prefix='remote-ci-db-bench-')
+    # 导入server模块前设置数据目录，避免在默认位置创建文件
+    os.environ.update(CI_DATA_DIR=f'{base_dir}/data', CI_WORK_DIR=f'{base_dir}/work',
+                      CI_WORKSPACE_DIR=f'{base_dir}/workspace')
+    db_path = args.db or os.path.join(base_dir, 'jobs.db')
+    try:
+        if os.path.exists(db_path):
+            print(f"复用已有数据库: {db_path}")
+        else:
+            print(f"生成 {args.rows} 条任务历史: {db_path}")
+            populate(db_path, args.rows, args.days, args.stage_days, args.seed)
+        result = DatabaseBenchmark(args, db_path).run()
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\n✓ 结果已保存: {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(result, json.load(f))
+
+    regressions = [r for r in result['results'] if r['full_scans'] and not r['known']]
+    if regressions:
+        print(f"\n✗ {len(regressions)} 个查询出现全表扫描: {', '.join(r['name'] for r in regressions)}")
+        if not args.no_check:
+            sys.exit(1)
+    else:
+        print("\n✓ 没有新的全表扫描")
+
+
+if __name__ == '__main__':
+    main()
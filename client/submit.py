@@ -26,9 +26,28 @@ import argparse
 import requests
 import subprocess
 import fnmatch
+import hashlib
 from pathlib import Path
 import yaml
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 归档格式：文件后缀、MIME类型
+ARCHIVE_FORMATS = {
+    'gzip': {'suffix': '.tar.gz', 'mimetype': 'application/gzip'},
+    'zstd': {'suffix': '.tar.zst', 'mimetype': 'application/zstd'},
+}
+
+# 日志长轮询单次等待时间（秒）
+LOG_FOLLOW_WAIT = 25
+
+# zstd压缩级别和线程数（-1表示使用全部CPU核心）
+ZSTD_LEVEL = int(os.environ.get('REMOTE_CI_ZSTD_LEVEL', '3'))
+ZSTD_THREADS = int(os.environ.get('REMOTE_CI_ZSTD_THREADS', '-1'))
+
 
 # ============ 辅助函数 ============
 
@@ -144,9 +163,32 @@ class RemoteCIClient:
         self.headers = {
             'Authorization': f'Bearer {api_token}'
         }
+        self._archive_format = None
 
     # ========== 通用方法 ==========
 
+    def _negotiate_archive_format(self):
+        """
+        选择代码包格式：双方都支持zstd时使用zstd，否则使用gzip
+
+        Returns:
+            'zstd' 或 'gzip'
+        """
+        if self._archive_format:
+            return self._archive_format
+
+        self._archive_format = 'gzip'
+        if zstandard is not None:
+            try:
+                response = requests.get(f'{self.api_url}/api/capabilities', timeout=10)
+                if response.status_code == 200 and 'zstd' in response.json().get('archive_formats', []):
+                    self._archive_format = 'zstd'
+            except (requests.exceptions.RequestException, ValueError):
+                # 旧版服务端没有该接口
+                pass
+
+        return self._archive_format
+
     def _build_web_url(self, user_id=None):
         """构建Web查看链接（带筛选参数）"""
         if user_id:
@@ -156,11 +198,138 @@ class RemoteCIClient:
         return self.api_url
 
     def wait_for_result(self, job_id, max_wait=1500, interval=10, user_id=None, has_artifacts=False):
-        """等待任务结果"""
+        """
+        等待任务结果
+
+        优先通过日志长轮询接口实时输出构建日志，任务结束立即返回；
+        服务端不支持时回退为按interval轮询任务状态
+        """
         print(">>> 等待构建结果")
         print()
 
+        try:
+            status = self._follow_logs(job_id, max_wait)
+        except requests.exceptions.RequestException as e:
+            print(f"\n⚠ 实时日志中断: {e}，改为轮询任务状态")
+            status = None
+
+        logs_shown = status is not None
+        if status is None:
+            status = self._poll_status(job_id, max_wait, interval)
+            if status is None:
+                return 1
+
+        if status == 'success':
+            print("\n")
+            print("=" * 42)
+            print("✓ 构建成功")
+            print("=" * 42)
+            if not logs_shown:
+                self._show_logs(job_id)
+                print()
+
+            # 下载产物
+            if has_artifacts:
+                download_success = self._download_artifacts(job_id)
+                if not download_success:
+                    print("⚠ 产物下载失败，可通过Web界面手动下载")
+                print()
+
+            web_url = self._build_web_url(user_id)
+            print(f"Web查看: {web_url}")
+            print("=" * 42)
+            return 0
+
+        elif status in ['failed', 'error', 'timeout']:
+            print("\n")
+            print("=" * 42)
+            print("✗ 构建失败")
+            print("=" * 42)
+            if not logs_shown:
+                self._show_logs(job_id)
+                print()
+            web_url = self._build_web_url(user_id)
+            print(f"Web查看: {web_url}")
+            print("=" * 42)
+            return 1
+
+        elif status not in ['queued', 'running']:
+            print(f"\n✗ 未知状态: {status}")
+            return 1
+
+        # 超时处理
+        print("\n")
+        print("=" * 42)
+        print("⚠ 等待超时")
+        print("=" * 42)
+        print("任务仍在远程CI执行中...")
+        web_url = self._build_web_url(user_id)
+        print(f"查看任务: {web_url}")
+        print()
+        print("远程CI将继续执行，结果可通过Web界面查看")
+        print("=" * 42)
+
+        # 不返回失败状态，避免CI报错
+        return 0
+
+    def _follow_logs(self, job_id, max_wait):
+        """
+        长轮询跟随任务日志，边接收边输出，任务结束立即返回
+
+        Args:
+            job_id: 任务ID
+            max_wait: 最长等待时间（秒）
+
+        Returns:
+            任务状态（等待超时时为 queued/running）；服务端不支持增量日志返回None
+        """
+        offset = 0
+        status = None
+        header_printed = False
+        deadline = time.monotonic() + max_wait
+
+        while time.monotonic() < deadline:
+            wait = max(1, min(LOG_FOLLOW_WAIT, int(deadline - time.monotonic())))
+            response = requests.get(
+                f'{self.api_url}/api/jobs/{job_id}/logs',
+                headers=self.headers,
+                params={'offset': offset, 'follow': 1, 'wait': wait},
+                timeout=wait + 30
+            )
+            response.raise_for_status()
+
+            # 旧版服务端忽略offset参数，返回完整日志且没有偏移头
+            next_offset = response.headers.get('X-Next-Offset')
+            if next_offset is None:
+                return None
+
+            if response.content:
+                if not header_printed:
+                    print("构建日志:")
+                    print("-" * 42)
+                    header_printed = True
+                sys.stdout.write(response.content.decode('utf-8', errors='replace'))
+                sys.stdout.flush()
+
+            offset = int(next_offset)
+            status = response.headers.get('X-Job-Status', 'unknown')
+
+            # 任务结束且已读完当前日志
+            if status in ['success', 'failed', 'error', 'timeout'] and not response.content:
+                return status
+
+        # 等待超时（任务记录尚未写入数据库时状态为unknown，按排队处理）
+        return status if status in ['queued', 'running'] else 'queued'
+
+    def _poll_status(self, job_id, max_wait, interval):
+        """
+        按固定间隔轮询任务状态（兼容不支持增量日志的旧版服务端）
+
+        Returns:
+            任务状态（等待超时时为 queued/running），请求失败返回None
+        """
         elapsed = 0
+        status = 'queued'
 
         while elapsed < max_wait:
             try:
@@ -176,64 +345,17 @@ class RemoteCIClient:
                 # 显示进度
                 print(f"\r[{elapsed:03d}s] 状态: {status:<10}", end='', flush=True)
 
-                if status == 'success':
-                    print("\n")
-                    print("=" * 42)
-                    print("✓ 构建成功")
-                    print("=" * 42)
-                    self._show_logs(job_id)
-                    print()
-
-                    # 下载产物
-                    if has_artifacts:
-                        download_success = self._download_artifacts(job_id)
-                        if not download_success:
-                            print("⚠ 产物下载失败，可通过Web界面手动下载")
-                        print()
-
-                    web_url = self._build_web_url(user_id)
-                    print(f"Web查看: {web_url}")
-                    print("=" * 42)
-                    return 0
-
-                elif status in ['failed', 'error', 'timeout']:
-                    print("\n")
-                    print("=" * 42)
-                    print("✗ 构建失败")
-                    print("=" * 42)
-                    self._show_logs(job_id)
-                    print()
-                    web_url = self._build_web_url(user_id)
-                    print(f"Web查看: {web_url}")
-                    print("=" * 42)
-                    return 1
-
-                elif status in ['queued', 'running']:
-                    time.sleep(interval)
-                    elapsed += interval
+                if status not in ['queued', 'running']:
+                    return status
 
-                else:
-                    print(f"\n✗ 未知状态: {status}")
-                    return 1
+                time.sleep(interval)
+                elapsed += interval
 
             except requests.exceptions.RequestException as e:
                 print(f"\n✗ 请求失败: {e}")
-                return 1
-
-        # 超时处理
-        print("\n")
-        print("=" * 42)
-        print("⚠ 等待超时")
-        print("=" * 42)
-        print("任务仍在远程CI执行中...")
-        web_url = self._build_web_url(user_id)
-        print(f"查看任务: {web_url}")
-        print()
-        print("远程CI将继续执行，结果可通过Web界面查看")
-        print("=" * 42)
+                return None
 
-        # 不返回失败状态，避免CI报错
-        return 0
+        return status
 
     def _show_logs(self, job_id):
         """显示任务日志"""
@@ -265,10 +387,14 @@ class RemoteCIClient:
         """
         print(">>> 下载构建产物")
 
+        # 声明接受zstd，服务端会直接返回zstd产物，否则转码为gzip
+        accept = 'application/zstd, application/gzip;q=0.9' if zstandard is not None else 'application/gzip'
+
         try:
             # 下载产物
             response = requests.get(
                 f'{self.api_url}/api/jobs/{job_id}/artifacts',
+                headers={'Accept': accept},
                 stream=True
             )
 
@@ -281,9 +407,12 @@ class RemoteCIClient:
 
             response.raise_for_status()
 
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+            archive_format = 'zstd' if content_type in ('application/zstd', 'application/x-zstd') else 'gzip'
+
             # 保存到临时文件
             import tempfile
-            with tempfile.NamedTemporaryFile(suffix='.tar.gz', delete=False) as tmp:
+            with tempfile.NamedTemporaryFile(suffix=ARCHIVE_FORMATS[archive_format]['suffix'], delete=False) as tmp:
                 tmp_path = tmp.name
                 for chunk in response.iter_content(chunk_size=8192):
                     tmp.write(chunk)
@@ -294,11 +423,20 @@ class RemoteCIClient:
 
             # 解压到当前目录
             print(">>> 解压产物到当前目录")
-            import tarfile
-            with tarfile.open(tmp_path, 'r:gz') as tar:
-                tar.extractall(path='.')
-                members = tar.getmembers()
-                print(f"✓ 已解压 {len(members)} 个文件")
+            if archive_format == 'zstd':
+                with open(tmp_path, 'rb') as f:
+                    reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+                    with tarfile.open(fileobj=reader, mode='r|') as tar:
+                        count = 0
+                        for member in tar:
+                            tar.extract(member, path='.')
+                            count += 1
+                print(f"✓ 已解压 {count} 个文件")
+            else:
+                with tarfile.open(tmp_path, 'r:gz') as tar:
+                    tar.extractall(path='.')
+                    members = tar.getmembers()
+                    print(f"✓ 已解压 {len(members)} 个文件")
 
             # 清理临时文件
             os.unlink(tmp_path)
@@ -345,9 +483,11 @@ class RemoteCIClient:
     # ========== Upload 模式 ==========
 
     def upload_mode(self, script, upload_path='.', project_name=None, user_id=None,
-                    exclude_patterns=None, config=None):
-        """上传模式：打包代码并上传"""
+                    exclude_patterns=None, config=None, incremental=True, no_cache=False, priority=None):
+        """上传模式：打包代码并上传（默认增量上传，服务端不支持时回退为完整上传）"""
         artifact_patterns = []
+        cache = (config or {}).get('cache')
+        resources = (config or {}).get('resources')
 
         # 从配置文件读取默认值（如果有）
         if config and 'upload' in config:
@@ -378,6 +518,10 @@ class RemoteCIClient:
                     else:
                         exclude_patterns = config_exclude_str
 
+            # incremental: 是否启用增量上传
+            if upload_config.get('incremental') is False:
+                incremental = False
+
             # artifacts: 读取产物配置
             if 'artifacts' in upload_config:
                 artifacts = upload_config['artifacts']
@@ -395,21 +539,43 @@ class RemoteCIClient:
         print(f"上传内容: {upload_path}")
         if artifact_patterns:
             print(f"产物配置: {artifact_patterns}")
+        if cache:
+            print(f"依赖缓存: {cache}")
+        if resources:
+            print(f"资源需求: {resources}")
+        if priority:
+            print(f"优先级: {priority}")
         if user_id:
             print(f"用户ID: {user_id}")
         print("=" * 42)
         print()
 
-        # 创建临时压缩包
-        with tempfile.NamedTemporaryFile(suffix='.tar.gz', delete=False) as tmp:
+        # 增量上传：只上传服务端缺失的文件内容
+        if incremental:
+            supported, job_id = self._submit_incremental_job(
+                upload_path, script, project_name, user_id, artifact_patterns, exclude_patterns, cache, no_cache,
+                priority, resources
+            )
+            if supported:
+                if not job_id:
+                    return 1
+                return self.wait_for_result(job_id, user_id=user_id, has_artifacts=bool(artifact_patterns))
+
+            print("⚠ 服务端不支持增量上传，改用完整上传")
+            print()
+
+        # 创建临时压缩包（服务端支持时使用zstd）
+        archive_format = self._negotiate_archive_format()
+        with tempfile.NamedTemporaryFile(suffix=ARCHIVE_FORMATS[archive_format]['suffix'], delete=False) as tmp:
             archive_path = tmp.name
 
         try:
             # 打包代码
-            self._create_archive(upload_path, archive_path, exclude_patterns)
+            self._create_archive(upload_path, archive_path, exclude_patterns, archive_format)
 
             # 提交任务
-            job_id = self._submit_upload_job(archive_path, script, project_name, user_id, artifact_patterns)
+            job_id = self._submit_upload_job(archive_path, script, project_name, user_id, artifact_patterns,
+                                             archive_format, cache, no_cache, priority, resources)
             if not job_id:
                 return 1
 
@@ -421,10 +587,8 @@ class RemoteCIClient:
             if os.path.exists(archive_path):
                 os.unlink(archive_path)
 
-    def _create_archive(self, upload_path, archive_path, custom_excludes=None):
-        """创建代码压缩包"""
-        print(">>> 步骤 1/3: 打包代码")
-
+    def _collect_excludes(self, custom_excludes=None):
+        """合并默认排除规则和自定义排除规则"""
         # 默认排除规则
         default_excludes = [
             '.git', 'node_modules', '__pycache__', '*.pyc',
@@ -440,6 +604,27 @@ class RemoteCIClient:
             for exclude in excludes:
                 print(f"  排除: {exclude}")
 
+        return all_excludes
+
+    def _open_archive_writer(self, archive_path, archive_format):
+        """
+        打开压缩包写入器
+
+        Returns:
+            (tarfile对象, 需要在tar关闭后关闭的对象列表)
+        """
+        if archive_format == 'zstd':
+            f = open(archive_path, 'wb')
+            writer = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=ZSTD_THREADS).stream_writer(f)
+            return tarfile.open(fileobj=writer, mode='w|'), [writer, f]
+        return tarfile.open(archive_path, 'w:gz'), []
+
+    def _create_archive(self, upload_path, archive_path, custom_excludes=None, archive_format='gzip'):
+        """创建代码压缩包"""
+        print(">>> 步骤 1/3: 打包代码")
+
+        all_excludes = self._collect_excludes(custom_excludes)
+
         # 解析上传路径
         paths = upload_path.strip().split() if ' ' in upload_path else [upload_path]
 
@@ -450,8 +635,9 @@ class RemoteCIClient:
         else:
             print(f"打包指定路径: {upload_path}")
 
-        # 创建tar.gz文件
-        with tarfile.open(archive_path, 'w:gz') as tar:
+        # 创建压缩包（tar.gz 或 tar.zst）
+        tar, closers = self._open_archive_writer(archive_path, archive_format)
+        try:
             for path in paths:
                 path = path.strip()
                 if not path:
@@ -476,6 +662,10 @@ class RemoteCIClient:
                             tar.add(path, arcname=normalized_path)
                 else:
                     print(f"⚠ 警告: 路径不存在: {path}")
+        finally:
+            tar.close()
+            for closer in closers:
+                closer.close()
 
         # 获取文件大小
         size_bytes = os.path.getsize(archive_path)
@@ -485,7 +675,7 @@ class RemoteCIClient:
         else:
             size_str = f"{size_mb:.1f}M"
 
-        print(f"✓ 代码打包完成 (大小: {size_str})")
+        print(f"✓ 代码打包完成 (格式: {archive_format}, 大小: {size_str})")
         print()
 
     def _should_exclude(self, path, excludes):
@@ -504,7 +694,8 @@ class RemoteCIClient:
             return None
         return tarinfo
 
-    def _submit_upload_job(self, archive_path, script, project_name=None, user_id=None, artifact_patterns=None):
+    def _submit_upload_job(self, archive_path, script, project_name=None, user_id=None, artifact_patterns=None,
+                           archive_format='gzip', cache=None, no_cache=False, priority=None, resources=None):
         """提交上传任务"""
         print(">>> 步骤 2/3: 上传代码并提交任务")
 
@@ -512,7 +703,8 @@ class RemoteCIClient:
             project_name = self._detect_project_name()
 
         with open(archive_path, 'rb') as f:
-            files = {'code': ('code.tar.gz', f, 'application/gzip')}
+            fmt = ARCHIVE_FORMATS[archive_format]
+            files = {'code': (f"code{fmt['suffix']}", f, fmt['mimetype'])}
             data = {
                 'script': script,
                 'project_name': project_name
@@ -523,6 +715,16 @@ class RemoteCIClient:
                 # 将列表转换为JSON字符串
                 import json
                 data['artifact_patterns'] = json.dumps(artifact_patterns)
+            if cache:
+                import json
+                data['cache'] = json.dumps(cache)
+            if no_cache:
+                data['no_cache'] = 'true'
+            if priority:
+                data['priority'] = priority
+            if resources:
+                import json
+                data['resources'] = json.dumps(resources)
 
             try:
                 response = requests.post(
@@ -542,6 +744,10 @@ class RemoteCIClient:
 
                 print("✓ 任务已提交")
                 print(f"任务ID: {job_id}")
+                if result.get('cached_from'):
+                    print(f"✓ 命中构建缓存，复用任务 {result['cached_from']} 的结果")
+                if result.get('coalesced_into'):
+                    print(f"✓ 已与进行中的相同任务 {result['coalesced_into']} 合并，共享其日志和结果")
                 web_url = self._build_web_url(user_id)
                 print(f"Web查看: {web_url}")
                 print()
@@ -552,9 +758,215 @@ class RemoteCIClient:
                 print(f"✗ 请求失败: {e}")
                 return None
 
+    # ========== 增量上传 ==========
+
+    # 单次上传的块批量上限（字节数 / 文件数）
+    BLOB_BATCH_BYTES = 64 * 1024 * 1024
+    BLOB_BATCH_FILES = 256
+
+    def _build_manifest(self, upload_path, custom_excludes=None):
+        """
+        扫描上传路径，生成内容清单（与_create_archive使用相同的路径和排除规则）
+
+        Returns:
+            (manifest, sources): 清单和 {sha256: 本地文件路径}
+        """
+        all_excludes = self._collect_excludes(custom_excludes)
+        paths = upload_path.strip().split() if ' ' in upload_path else [upload_path]
+
+        manifest = {'files': [], 'dirs': []}
+        sources = {}
+
+        for path in paths:
+            path = path.strip()
+            if not path:
+                continue
+
+            if not os.path.exists(path) and not os.path.islink(path):
+                print(f"⚠ 警告: 路径不存在: {path}")
+                continue
+
+            arcname = path.rstrip('/') or path
+            if self._should_exclude(arcname, all_excludes):
+                continue
+
+            if os.path.isdir(path) and not os.path.islink(path):
+                self._scan_manifest_dir(path, arcname, all_excludes, manifest, sources)
+            else:
+                self._add_manifest_entry(path, arcname, manifest, sources)
+
+        return manifest, sources
+
+    def _scan_manifest_dir(self, dir_path, arcname, excludes, manifest, sources):
+        """递归扫描目录，空目录单独记录"""
+        entries = sorted(os.scandir(dir_path), key=lambda e: e.name)
+        added = False
+
+        for entry in entries:
+            name = os.path.join(arcname, entry.name)
+            if self._should_exclude(name, excludes):
+                continue
+
+            if entry.is_dir(follow_symlinks=False):
+                self._scan_manifest_dir(entry.path, name, excludes, manifest, sources)
+            else:
+                self._add_manifest_entry(entry.path, name, manifest, sources)
+            added = True
+
+        if not added and os.path.normpath(arcname) != '.':
+            manifest['dirs'].append(os.path.normpath(arcname))
+
+    def _add_manifest_entry(self, path, arcname, manifest, sources):
+        """添加单个文件或符号链接到清单"""
+        rel_path = os.path.normpath(arcname)
+
+        if os.path.islink(path):
+            manifest['files'].append({'path': rel_path, 'symlink': os.readlink(path)})
+            return
+
+        if not os.path.isfile(path):
+            return
+
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+
+        manifest['files'].append({
+            'path': rel_path,
+            'sha256': digest,
+            'mode': os.stat(path).st_mode & 0o777
+        })
+        sources[digest] = path
+
+    def _upload_blobs(self, digests, sources):
+        """分批上传缺失的块，返回上传字节数"""
+        uploaded_bytes = 0
+        batch = []
+        batch_bytes = 0
+
+        def flush():
+            handles = {digest: open(sources[digest], 'rb') for digest in batch}
+            try:
+                files = {
+                    digest: (digest, handle, 'application/octet-stream')
+                    for digest, handle in handles.items()
+                }
+                response = requests.post(
+                    f'{self.api_url}/api/blobs',
+                    headers=self.headers,
+                    files=files
+                )
+                response.raise_for_status()
+            finally:
+                for handle in handles.values():
+                    handle.close()
+
+        for digest in digests:
+            size = os.path.getsize(sources[digest])
+            if batch and (batch_bytes + size > self.BLOB_BATCH_BYTES or len(batch) >= self.BLOB_BATCH_FILES):
+                flush()
+                batch = []
+                batch_bytes = 0
+            batch.append(digest)
+            batch_bytes += size
+            uploaded_bytes += size
+
+        if batch:
+            flush()
+
+        return uploaded_bytes
+
+    def _submit_incremental_job(self, upload_path, script, project_name=None, user_id=None,
+                                artifact_patterns=None, custom_excludes=None, cache=None, no_cache=False,
+                                priority=None, resources=None):
+        """
+        增量上传并提交任务
+
+        Returns:
+            (supported, job_id): 服务端不支持增量上传时supported为False
+        """
+        print(">>> 步骤 1/3: 扫描代码（增量上传）")
+
+        manifest, sources = self._build_manifest(upload_path, custom_excludes)
+        total_bytes = sum(os.path.getsize(p) for p in sources.values())
+        print(f"✓ 扫描完成: {len(manifest['files'])} 个文件, {len(sources)} 个不同内容 "
+              f"({total_bytes / 1024:.1f}K)")
+        print()
+
+        print(">>> 步骤 2/3: 上传变更内容并提交任务")
+
+        if project_name is None:
+            project_name = self._detect_project_name()
+
+        try:
+            response = requests.post(
+                f'{self.api_url}/api/blobs/missing',
+                headers={**self.headers, 'Content-Type': 'application/json'},
+                json={'digests': list(sources)}
+            )
+            if response.status_code in (404, 405):
+                return False, None
+            response.raise_for_status()
+            missing = response.json().get('missing', [])
+
+            uploaded_bytes = self._upload_blobs(missing, sources)
+            print(f"✓ 已上传 {len(missing)} 个文件内容 ({uploaded_bytes / 1024:.1f}K)，"
+                  f"复用 {len(sources) - len(missing)} 个")
+
+            payload = {
+                'manifest': manifest,
+                'script': script,
+                'project_name': project_name
+            }
+            if user_id:
+                payload['user_id'] = user_id
+            if artifact_patterns:
+                payload['artifact_patterns'] = artifact_patterns
+            if cache:
+                payload['cache'] = cache
+            if no_cache:
+                payload['no_cache'] = True
+            if priority:
+                payload['priority'] = priority
+            if resources:
+                payload['resources'] = resources
+
+            response = requests.post(
+                f'{self.api_url}/api/jobs/manifest',
+                headers={**self.headers, 'Content-Type': 'application/json'},
+                json=payload
+            )
+            response.raise_for_status()
+            result = response.json()
+
+            job_id = result.get('job_id')
+            if not job_id:
+                print("✗ 任务提交失败")
+                print(f"响应: {result}")
+                return True, None
+
+            print("✓ 任务已提交")
+            print(f"任务ID: {job_id}")
+            if result.get('cached_from'):
+                print(f"✓ 命中构建缓存，复用任务 {result['cached_from']} 的结果")
+            if result.get('coalesced_into'):
+                print(f"✓ 已与进行中的相同任务 {result['coalesced_into']} 合并，共享其日志和结果")
+            web_url = self._build_web_url(user_id)
+            print(f"Web查看: {web_url}")
+            print()
+
+            return True, job_id
+
+        except requests.exceptions.RequestException as e:
+            print(f"✗ 请求失败: {e}")
+            return True, None
+
     # ========== Rsync 模式 ==========
 
-    def rsync_mode(self, project_name, script, remote_host, workspace_base, user_id=None):
+    def rsync_mode(self, project_name, script, remote_host, workspace_base, user_id=None, cache=None,
+                   priority=None, resources=None):
         """rsync模式：同步代码并提交任务"""
         workspace_path = f"{workspace_base}/{project_name}"
 
@@ -564,6 +976,8 @@ class RemoteCIClient:
         print(f"项目名称: {project_name}")
         print(f"构建脚本: {script}")
         print(f"远程路径: {workspace_path}")
+        if priority:
+            print(f"优先级: {priority}")
         if user_id:
             print(f"用户ID: {user_id}")
         print("=" * 42)
@@ -575,7 +989,7 @@ class RemoteCIClient:
             return 1
 
         # 提交任务
-        job_id = self._submit_rsync_job(workspace_path, script, user_id)
+        job_id = self._submit_rsync_job(workspace_path, script, user_id, cache, priority, resources)
         if not job_id:
             return 1
 
@@ -634,7 +1048,7 @@ class RemoteCIClient:
             print("✗ rsync命令未找到，请确保已安装rsync")
             return None
 
-    def _submit_rsync_job(self, workspace_path, script, user_id=None):
+    def _submit_rsync_job(self, workspace_path, script, user_id=None, cache=None, priority=None, resources=None):
         """提交rsync任务"""
         print(">>> 步骤 2/3: 提交构建任务")
 
@@ -644,6 +1058,12 @@ class RemoteCIClient:
         }
         if user_id:
             payload['user_id'] = user_id
+        if cache:
+            payload['cache'] = cache
+        if priority:
+            payload['priority'] = priority
+        if resources:
+            payload['resources'] = resources
 
         try:
             response = requests.post(
@@ -662,6 +1082,8 @@ class RemoteCIClient:
 
             print("✓ 任务已提交")
             print(f"任务ID: {job_id}")
+            if result.get('coalesced_into'):
+                print(f"✓ 已与排队中的相同任务 {result['coalesced_into']} 合并，共享其日志和结果")
             web_url = self._build_web_url(user_id)
             print(f"Web查看: {web_url}")
             print()
@@ -674,7 +1096,8 @@ class RemoteCIClient:
 
     # ========== Git 模式 ==========
 
-    def git_mode(self, repo, branch, script, commit=None, user_id=None):
+    def git_mode(self, repo, branch, script, commit=None, user_id=None, cache=None, no_cache=False,
+                 priority=None, resources=None):
         """git模式：远程克隆并构建"""
         print("=" * 42)
         print("Remote CI - Git模式")
@@ -684,20 +1107,23 @@ class RemoteCIClient:
         if commit:
             print(f"提交: {commit}")
         print(f"构建脚本: {script}")
+        if priority:
+            print(f"优先级: {priority}")
         if user_id:
             print(f"用户ID: {user_id}")
         print("=" * 42)
         print()
 
         # 提交任务
-        job_id = self._submit_git_job(repo, branch, script, commit, user_id)
+        job_id = self._submit_git_job(repo, branch, script, commit, user_id, cache, no_cache, priority, resources)
         if not job_id:
             return 1
 
         # 等待结果
         return self.wait_for_result(job_id, user_id=user_id)
 
-    def _submit_git_job(self, repo, branch, script, commit=None, user_id=None):
+    def _submit_git_job(self, repo, branch, script, commit=None, user_id=None, cache=None, no_cache=False,
+                        priority=None, resources=None):
         """提交git任务"""
         print(">>> 提交构建任务")
 
@@ -710,6 +1136,14 @@ class RemoteCIClient:
             payload['commit'] = commit
         if user_id:
             payload['user_id'] = user_id
+        if cache:
+            payload['cache'] = cache
+        if no_cache:
+            payload['no_cache'] = True
+        if priority:
+            payload['priority'] = priority
+        if resources:
+            payload['resources'] = resources
 
         try:
             response = requests.post(
@@ -728,6 +1162,10 @@ class RemoteCIClient:
 
             print("✓ 任务已提交")
             print(f"任务ID: {job_id}")
+            if result.get('cached_from'):
+                print(f"✓ 命中构建缓存，复用任务 {result['cached_from']} 的结果")
+            if result.get('coalesced_into'):
+                print(f"✓ 已与进行中的相同任务 {result['coalesced_into']} 合并，共享其日志和结果")
             web_url = self._build_web_url(user_id)
             print(f"Web查看: {web_url}")
             print()
@@ -762,6 +1200,10 @@ def main():
       - "*.log"
       - "*.tmp"
       - cache/
+    incremental: true   # 增量上传（只上传服务端缺失的文件内容，默认开启）
+  resources:            # 资源需求（可选，未声明时服务端按项目历史用量估算）
+    cpus: 4
+    memory: 8G
 
 示例:
   # Upload模式 - 使用默认配置文件
@@ -774,6 +1216,15 @@ def main():
   python submit.py upload "npm test" --project myapp --user-id 12345
   python submit.py upload "npm test" --path "src/ tests/" --exclude "*.log,*.tmp"
 
+  # Upload模式 - 禁用增量上传
+  python submit.py upload "npm test" --full-upload
+
+  # Upload模式 - 不复用构建缓存，强制重新构建
+  python submit.py upload "npm test" --no-build-cache
+
+  # 紧急任务 - 槽位已满时暂停低优先级构建，优先执行
+  python submit.py --priority high upload "make release"
+
   # Rsync模式（推荐：自动用户隔离）
   python submit.py rsync myproject "npm test"
   # → workspace: myproject-alice（自动检测用户，复用缓存）
@@ -799,6 +1250,8 @@ def main():
     # 全局参数
     parser.add_argument('--user-id', help='用户ID（可选，用于标识提交者）')
     parser.add_argument('--config', '-c', help='配置文件路径（默认: .remoteCI.yml）')
+    parser.add_argument('--priority', choices=['low', 'normal', 'high'],
+                        help='任务优先级（默认: normal；high可暂停运行中的低优先级构建）')
 
     # 子命令
     subparsers = parser.add_subparsers(dest='mode', help='执行模式')
@@ -809,6 +1262,10 @@ def main():
     upload_parser.add_argument('--project', '-p', dest='project_name', help='项目名称（留空自动检测）')
     upload_parser.add_argument('--path', default='.', help='上传路径（默认: .，可在配置文件指定）')
     upload_parser.add_argument('--exclude', help='自定义排除模式（逗号分隔，追加到配置文件规则）')
+    upload_parser.add_argument('--full-upload', action='store_true',
+                               help='禁用增量上传，每次打包上传完整代码')
+    upload_parser.add_argument('--no-build-cache', action='store_true',
+                               help='不复用相同代码和脚本的构建结果、不与进行中的相同任务合并，强制重新构建')
 
     # Rsync 子命令
     rsync_parser = subparsers.add_parser('rsync', help='rsync模式')
@@ -825,6 +1282,8 @@ def main():
     git_parser.add_argument('branch', help='分支名')
     git_parser.add_argument('script', help='构建脚本')
     git_parser.add_argument('--commit', help='指定commit hash（可选）')
+    git_parser.add_argument('--no-build-cache', action='store_true',
+                            help='不复用相同commit和脚本的构建结果、不与进行中的相同任务合并，强制重新构建')
 
     args = parser.parse_args()
 
@@ -853,7 +1312,10 @@ def main():
             project_name=args.project_name,
             user_id=user_id,
             exclude_patterns=args.exclude,
-            config=config
+            config=config,
+            incremental=not args.full_upload,
+            no_cache=args.no_build_cache,
+            priority=args.priority
         )
 
     elif args.mode == 'rsync':
@@ -898,7 +1360,10 @@ def main():
             script=args.script,
             remote_host=remote_host,
             workspace_base=workspace_base,
-            user_id=user_id
+            user_id=user_id,
+            cache=config.get('cache'),
+            priority=args.priority,
+            resources=config.get('resources')
         )
 
     elif args.mode == 'git':
@@ -907,7 +1372,11 @@ def main():
             branch=args.branch,
             script=args.script,
             commit=args.commit,
-            user_id=user_id
+            user_id=user_id,
+            cache=config.get('cache'),
+            no_cache=args.no_build_cache,
+            priority=args.priority,
+            resources=config.get('resources')
         )
 
     return 1
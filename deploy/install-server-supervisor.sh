@@ -149,7 +149,7 @@ EOF
 # Celery Worker服务配置
 cat > /etc/supervisor/conf.d/remote-ci-worker.conf <<EOF
 [program:remote-ci-worker]
-command=$INSTALL_DIR/venv/bin/celery -A server.celery_app worker --loglevel=info --concurrency=2
+command=$INSTALL_DIR/venv/bin/celery -A server.celery_app worker --loglevel=info
 directory=$INSTALL_DIR
 user=ci-user
 environment=PATH="$INSTALL_DIR/venv/bin"
@@ -142,7 +142,7 @@ Type=simple
 User=ci-user
 WorkingDirectory=$INSTALL_DIR
 Environment="PATH=$INSTALL_DIR/venv/bin"
-ExecStart=$INSTALL_DIR/venv/bin/celery -A server.celery_app worker --loglevel=info --concurrency=2
+ExecStart=$INSTALL_DIR/venv/bin/celery -A server.celery_app worker --loglevel=info
 Restart=always
 RestartSec=10
 StandardOutput=append:/var/log/remote-ci/worker.log
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+资源准入控制
+任务声明需要的CPU和内存（未声明时按同一项目最近构建的实际用量估算），
+只有节点剩余容量足够时才开始执行；并发数由资源决定而不是固定槽位：
+多个轻量任务可以同时运行，重量级任务独占整台机器
+
+需求超过节点容量的任务按节点容量计，只在没有其他任务运行时开始
+"""
+
+import os
+import re
+import math
+from typing import Any, Dict, Iterable, Optional
+
+from server.database import JobDatabase
+
+# 估算时参考的最近构建数
+HISTORY_SAMPLES = 10
+
+# 按历史用量估算内存时预留的余量
+MEMORY_HEADROOM = 1.2
+
+# 内存大小写法: 512、512M、8G、1.5GiB
+_MEMORY_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(?:i?b)?\s*$', re.IGNORECASE)
+_MEMORY_UNITS = {'k': 1 / 1024, '': 1, 'm': 1, 'g': 1024, 't': 1024 * 1024}
+
+
+def node_cpus() -> int:
+    """当前进程可用的CPU核数"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def node_memory_mb() -> int:
+    """物理内存大小（MB）"""
+    try:
+        return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024 * 1024))
+    except (ValueError, OSError, AttributeError):
+        return 4096
+
+
+def parse_memory_mb(value: Any) -> int:
+    """
+    解析内存大小
+
+    Args:
+        value: 数值（MB）或带单位的字符串（512M、8G）
+
+    Raises:
+        ValueError: 格式错误
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"无效的内存大小: {value!r}")
+    if isinstance(value, (int, float)):
+        mb = float(value)
+    else:
+        match = _MEMORY_RE.match(str(value))
+        if not match:
+            raise ValueError(f"无效的内存大小: {value!r}")
+        mb = float(match.group(1)) * _MEMORY_UNITS[match.group(2).lower()]
+    if mb <= 0:
+        raise ValueError(f"内存大小必须大于0: {value!r}")
+    return max(int(math.ceil(mb)), 1)
+
+
+def parse_resources(spec: Any) -> Optional[Dict[str, Any]]:
+    """
+    校验任务的资源声明
+
+    支持写法：
+      {"cpus": 4, "memory": "8G"}
+      {"cpu": 0.5, "memory_mb": 512}
+
+    Returns:
+        {'cpus': float, 'memory_mb': int}（未声明的项为None），未声明返回None
+
+    Raises:
+        ValueError: 格式错误
+    """
+    if not spec:
+        return None
+    if not isinstance(spec, dict):
+        raise ValueError("resources必须是包含cpus/memory的对象")
+
+    cpus = spec.get('cpus', spec.get('cpu'))
+    memory = spec.get('memory_mb', spec.get('memory'))
+
+    if cpus is not None:
+        if isinstance(cpus, bool):
+            raise ValueError(f"无效的CPU数: {cpus!r}")
+        try:
+            cpus = float(cpus)
+        except (TypeError, ValueError):
+            raise ValueError(f"无效的CPU数: {cpus!r}")
+        if cpus <= 0:
+            raise ValueError(f"CPU数必须大于0: {cpus!r}")
+
+    if memory is not None:
+        memory = parse_memory_mb(memory)
+
+    if cpus is None and memory is None:
+        return None
+    return {'cpus': cpus, 'memory_mb': memory}
+
+
+class AdmissionController:
+    """按节点CPU和内存容量决定任务能否开始执行"""
+
+    def __init__(self, db: JobDatabase, cpus: float, memory_mb: int,
+                 default_cpus: float, default_memory_mb: int):
+        """
+        初始化准入控制器
+
+        Args:
+            db: 任务数据库（查询历史用量）
+            cpus: 节点可分配给构建的CPU核数
+            memory_mb: 节点可分配给构建的内存（MB）
+            default_cpus: 没有声明和历史记录时任务的CPU需求
+            default_memory_mb: 没有声明和历史记录时任务的内存需求（MB）
+        """
+        self.db = db
+        self.cpus = cpus
+        self.memory_mb = memory_mb
+        self.default_cpus = default_cpus
+        self.default_memory_mb = default_memory_mb
+
+    def resolve(self, declared: Optional[Dict[str, Any]], project_name: Optional[str] = None,
+                repo_url: Optional[str] = None) -> Dict[str, Any]:
+        """
+        确定任务的资源需求：声明值 > 同一项目最近构建的实际用量 > 默认值
+
+        Args:
+            declared: parse_resources 的结果
+            project_name: 项目名（查询历史用量）
+            repo_url: git仓库URL（没有项目名时查询历史用量）
+
+        Returns:
+            {'cpus': float, 'memory_mb': int, 'source': 'declared' | 'history' | 'default'}
+        """
+        declared = declared or {}
+        cpus = declared.get('cpus')
+        memory_mb = declared.get('memory_mb')
+        source = 'declared'
+
+        if cpus is None or memory_mb is None:
+            history = None
+            if project_name or repo_url:
+                history = self.db.get_recent_resource_usage(project_name, repo_url, HISTORY_SAMPLES)
+
+            if history:
+                if cpus is None:
+                    cpus = round(max(history['cpus'], 0.1), 2)
+                if memory_mb is None:
+                    memory_mb = int(math.ceil(history['memory_mb'] * MEMORY_HEADROOM))
+                source = 'history' if not declared else source
+            else:
+                if cpus is None:
+                    cpus = self.default_cpus
+                if memory_mb is None:
+                    memory_mb = self.default_memory_mb
+                source = 'default' if not declared else source
+
+        # 需求超过节点容量时按容量计，空闲时仍可独占运行
+        return {
+            'cpus': min(float(cpus), float(self.cpus)),
+            'memory_mb': min(int(memory_mb), int(self.memory_mb)),
+            'source': source,
+        }
+
+    @staticmethod
+    def usage(jobs: Iterable[Dict[str, Any]]) -> Dict[str, float]:
+        """已准入任务占用的资源合计"""
+        cpus = 0.0
+        memory_mb = 0
+        for job in jobs:
+            cpus += job.get('cpu_request') or 0
+            memory_mb += job.get('memory_request_mb') or 0
+        return {'cpus': cpus, 'memory_mb': memory_mb}
+
+    def fits(self, used: Dict[str, float], job: Dict[str, Any]) -> bool:
+        """
+        节点剩余容量是否足够开始该任务
+
+        Args:
+            used: 已准入任务占用的资源（usage的结果）
+            job: 待调度任务（cpu_request, memory_request_mb）
+        """
+        if not used['cpus'] and not used['memory_mb']:
+            return True
+        return (used['cpus'] + (job.get('cpu_request') or 0) <= self.cpus + 1e-9 and
+                used['memory_mb'] + (job.get('memory_request_mb') or 0) <= self.memory_mb)
+
+    def get_state(self, used: Dict[str, float]) -> Dict[str, Any]:
+        """节点容量和占用（供管理接口展示）"""
+        return {
+            'cpus': self.cpus,
+            'memory_mb': self.memory_mb,
+            'used_cpus': round(used['cpus'], 2),
+            'used_memory_mb': used['memory_mb'],
+        }
+
+
+# 测试代码
+if __name__ == '__main__':
+    import tempfile
+
+    for raw, expected in [('512', 512), ('8G', 8192), ('1.5GiB', 1536), (256, 256), ('2048MB', 2048)]:
+        assert parse_memory_mb(raw) == expected, raw
+    print(f"资源声明: {parse_resources({'cpu': 2, 'memory': '4G'})}")
+
+    for bad in [{'cpus': 0}, {'memory': 'lots'}, {'cpus': True}, ['cpus']]:
+        try:
+            parse_resources(bad)
+            raise AssertionError(f"应拒绝: {bad}")
+        except ValueError as e:
+            print(f"✓ 已拒绝 {bad}: {e}")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = JobDatabase(os.path.join(temp_dir, 'jobs.db'))
+        controller = AdmissionController(db, cpus=8, memory_mb=16384, default_cpus=1, default_memory_mb=1024)
+
+        # 没有历史记录时使用默认值，声明值优先，超过容量时按容量计
+        assert controller.resolve(None, 'lint')['source'] == 'default'
+        assert controller.resolve({'cpus': 32, 'memory_mb': None}, 'cpp') == \
+            {'cpus': 8.0, 'memory_mb': 1024, 'source': 'declared'}
+
+        # 有历史记录后按实际用量估算
+        db.create_job('cpp-1', {'mode': 'upload', 'script': 'make -j8', 'project_name': 'cpp'})
+        db.update_job_resource_usage('cpp-1', cpu_user_seconds=700, cpu_system_seconds=100,
+                                     max_rss_kb=6 * 1024 * 1024, build_seconds=100)
+        db.update_job_finished('cpp-1', 'success')
+        estimate = controller.resolve(None, 'cpp')
+        print(f"历史估算: {estimate}")
+        assert estimate['source'] == 'history' and estimate['cpus'] == 8.0
+
+        lint = {'cpu_request': 0.5, 'memory_request_mb': 256}
+        heavy = {'cpu_request': 8, 'memory_request_mb': 8192}
+        running = [lint] * 4
+        assert controller.fits(controller.usage(running), lint)
+        assert not controller.fits(controller.usage(running), heavy)
+        assert controller.fits(controller.usage([]), heavy)
+        print(f"占用: {controller.get_state(controller.usage(running))}")
+
+    print("\n✓ 所有测试通过")
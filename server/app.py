@@ -6,21 +6,51 @@ Remote CI Flask API服务
 
 import os
 import json
+import time
+import uuid
 from datetime import datetime
 from pathlib import Path
 from functools import wraps
-from flask import Flask, request, jsonify, send_file, render_template_string, render_template
+from flask import Flask, Response, g, request, jsonify, send_file, render_template_string, render_template
 from werkzeug.utils import secure_filename
 from celery.result import AsyncResult
 
 from server.config import (
     API_HOST, API_PORT, API_TOKEN, DATA_DIR,
-    WORKSPACE_DIR, MAX_UPLOAD_SIZE
+    WORKSPACE_DIR, MAX_UPLOAD_SIZE, STAGING_DIR, MAX_EXTRACT_SIZE,
+    DEP_CACHE_DIR, DEP_CACHE_MAX_BYTES, BUILD_CACHE_ENABLED, BUILD_CACHE_TTL_HOURS,
+    COALESCE_JOBS, SCHEDULER_SLOTS, SCHEDULER_KEY, SCHEDULER_INTERVAL,
+    PREEMPTION_ENABLED, MAX_PREEMPTIONS, TASK_TIME_LIMIT, HEARTBEAT_TIMEOUT,
+    ADMISSION_ENABLED, NODE_CPUS, NODE_MEMORY_MB, DEFAULT_JOB_CPUS, DEFAULT_JOB_MEMORY_MB,
+    LOG_SEARCH_ENABLED, LOG_SEARCH_DAYS, LOG_SEARCH_RATE, LOG_SEARCH_INTERVAL
 )
 from server.celery_app import celery_app
 from server.tasks import execute_build
-from server.database import JobDatabase
+from server.database import JobDatabase, RESOURCE_USAGE_FIELDS
 from server.quota_manager import QuotaManager
+from server.admission import AdmissionController, parse_resources, node_cpus, node_memory_mb
+from server.scheduler import FairShareScheduler, parse_priority
+from server.stage_timer import summarize
+from server.metrics import (
+    REQUEST_LATENCY, UPLOAD_BYTES, ARTIFACT_BYTES, JobStateCollector, render_metrics, cleanup_dead_processes
+)
+from server.blob_store import BlobStore
+from server.dep_cache import DependencyCache, parse_cache_spec
+from server.build_cache import (
+    compute_build_key, manifest_source_key, archive_source_key, git_source_key,
+    git_branch_source_key, workspace_source_key, file_sha256
+)
+from server.tar_stream import extract_tar_stream, ArchiveTooLarge, UnsafeArchiveMember
+from server.git_cache import validate_ref, validate_repo_url
+from server.log_reader import (
+    read_from_offset, read_lines, read_last_lines, wait_for_log, is_log_complete, log_size,
+    DEFAULT_READ_BYTES, MAX_READ_LINES, FINISHED_STATUSES
+)
+from server.compression import (
+    FORMATS, available_formats, format_of_path, negotiate_format, iter_transcode_to_gzip, accepts_encoding
+)
+from server.log_archive import CONTENT_ENCODINGS, find_log, open_log, log_exists, remove_log
+from server.log_search import LogSearchIndex, LogSearchIndexer
 
 # 配置静态文件目录和模板目录
 app = Flask(__name__,
@@ -33,7 +63,59 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
 job_db = JobDatabase(f"{DATA_DIR}/jobs.db")
 
 # 初始化配额管理器
-quota_manager = QuotaManager(job_db)
+quota_manager = QuotaManager(job_db, dep_cache=DependencyCache(DEP_CACHE_DIR, DEP_CACHE_MAX_BYTES))
+
+# 初始化源码块存储（增量上传）
+blob_store = BlobStore(f"{DATA_DIR}/blobs")
+
+# 初始化资源准入控制（按节点CPU和内存容量决定任务能否开始）
+admission = AdmissionController(
+    job_db,
+    cpus=NODE_CPUS or node_cpus(),
+    memory_mb=NODE_MEMORY_MB or node_memory_mb(),
+    default_cpus=DEFAULT_JOB_CPUS,
+    default_memory_mb=DEFAULT_JOB_MEMORY_MB
+)
+
+# 初始化公平调度器（任务按用户轮流提交给Celery）
+scheduler = FairShareScheduler(
+    job_db,
+    send=lambda job_id, job_data: execute_build.apply_async(args=[job_data], task_id=job_id),
+    slots=SCHEDULER_SLOTS,
+    key_by=SCHEDULER_KEY,
+    lock_path=f"{DATA_DIR}/scheduler.lock",
+    stale_seconds=TASK_TIME_LIMIT + 600,
+    heartbeat_timeout=HEARTBEAT_TIMEOUT,
+    preemption=PREEMPTION_ENABLED,
+    max_preemptions=MAX_PREEMPTIONS,
+    admission=admission if ADMISSION_ENABLED else None
+)
+
+# 初始化日志全文索引（后台线程增量索引已结束任务的日志）
+log_search = LogSearchIndex(f"{DATA_DIR}/log_search.db") if LOG_SEARCH_ENABLED else None
+log_indexer = LogSearchIndexer(
+    job_db, log_search,
+    lock_path=f"{DATA_DIR}/log_search.lock",
+    days=LOG_SEARCH_DAYS,
+    rate_bytes=int(LOG_SEARCH_RATE)
+) if LOG_SEARCH_ENABLED else None
+
+
+# ============ 请求指标 ============
+@app.before_request
+def start_request_timer():
+    """记录请求开始时间"""
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request_latency(response):
+    """按路由记录请求延迟（流式响应只计到返回响应头为止）"""
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_LATENCY.labels(request.method, route, str(response.status_code)).observe(time.perf_counter() - start)
+    return response
 
 
 # ============ 认证装饰器 ============
@@ -69,11 +151,27 @@ def get_job_info(task_id):
             'finished_at': db_job['finished_at'],
             'duration': db_job['duration'],
             'exit_code': db_job['exit_code'],
+            'priority': db_job.get('priority'),
         }
 
-        # 2. 如果任务未完成，从Celery获取实时状态
+        if db_job.get('cpu_request') is not None:
+            job_info['resources'] = {'cpus': db_job['cpu_request'], 'memory_mb': db_job['memory_request_mb']}
+        if db_job.get('build_seconds'):
+            job_info['resource_usage'] = {
+                field: db_job[field] for field in RESOURCE_USAGE_FIELDS if db_job.get(field) is not None
+            }
+        if db_job.get('paused_seconds'):
+            job_info['paused_seconds'] = db_job['paused_seconds']
+        if db_job.get('preempted_by'):
+            job_info['preempted_by'] = db_job['preempted_by']
+        if db_job.get('cached_from'):
+            job_info['cached_from'] = db_job['cached_from']
+        if db_job.get('coalesced_into'):
+            job_info['coalesced_into'] = db_job['coalesced_into']
+
+        # 2. 如果任务未完成，从Celery获取实时状态（跟随任务查询主任务）
         if db_job['status'] in ['queued', 'running']:
-            result = AsyncResult(task_id, app=celery_app)
+            result = AsyncResult(db_job.get('coalesced_into') or task_id, app=celery_app)
 
             if result.state == 'STARTED' or result.state == 'PROGRESS':
                 job_info['status'] = 'running'
@@ -113,6 +211,104 @@ def get_job_info(task_id):
     return job_info
 
 
+def _parse_cache_param(raw):
+    """
+    解析请求中的依赖缓存声明（JSON字符串或已解析的对象）
+
+    Returns:
+        {'paths': [...], 'key_files': [...]}，未声明返回None
+
+    Raises:
+        ValueError: 格式错误
+    """
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError:
+            raise ValueError('not valid JSON')
+    return parse_cache_spec(raw)
+
+
+def _parse_resources_param(raw):
+    """
+    解析请求中的资源声明（JSON字符串或已解析的对象）
+
+    Returns:
+        {'cpus': float, 'memory_mb': int}，未声明返回None
+
+    Raises:
+        ValueError: 格式错误
+    """
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError:
+            raise ValueError('not valid JSON')
+    return parse_resources(raw)
+
+
+def _is_true(value):
+    """解析布尔参数（JSON布尔值或 true/1/yes 字符串）"""
+    return str(value).lower() in ['true', '1', 'yes']
+
+
+def _reuse_existing_build(source_key, job_data, no_cache=False, mutable=False, **extra):
+    """
+    计算构建键，复用相同的构建：先查构建缓存，再查排队中/运行中的相同任务
+
+    Args:
+        source_key: 源码标识（见 server.build_cache）
+        job_data: 任务数据（使用script和artifact_patterns）
+        no_cache: 任务要求重新构建（仍返回构建键，本次结果可供后续任务复用）
+        mutable: 源码内容可变（rsync workspace、git分支），只与尚未开始的任务合并
+        extra: 附加到响应中的字段
+
+    Returns:
+        (构建键, 响应)，没有可复用的构建时响应为None，调用方正常提交任务
+    """
+    build_key = compute_build_key(source_key, job_data['script'], job_data.get('artifact_patterns'))
+    if no_cache:
+        return build_key, None
+
+    # 构建缓存：最近一次成功构建
+    if BUILD_CACHE_ENABLED and not mutable:
+        cached = job_db.find_cached_build(build_key, BUILD_CACHE_TTL_HOURS)
+        # 文件已被手动删除时不复用
+        if cached and log_exists(cached.get('log_file') or '') and \
+                (not cached.get('artifacts_path') or os.path.exists(cached['artifacts_path'])):
+            job_id = str(uuid.uuid4())
+            job_db.create_cached_job(job_id, job_data, cached)
+            print(f"✓ 任务 {job_id} 命中构建缓存，复用任务 {cached['job_id']}")
+            return build_key, (jsonify({
+                'job_id': job_id,
+                'status': 'success',
+                'mode': job_data['mode'],
+                'cached_from': cached['job_id'],
+                **extra
+            }), 201)
+
+    # 合并重复提交：跟随排队中/运行中的相同任务，不再入队
+    if COALESCE_JOBS:
+        leader = job_db.find_inflight_job(build_key, ('queued',) if mutable else ('queued', 'running'))
+        if leader:
+            job_id = str(uuid.uuid4())
+            job_db.create_follower_job(job_id, job_data, leader)
+            # 跟随者优先级更高时提高主任务的优先级，避免高优先级提交被低优先级排队拖住
+            if leader['status'] == 'queued' and job_data.get('priority', 0) > (leader.get('priority') or 0):
+                job_db.raise_job_priority(leader['job_id'], job_data['priority'])
+                scheduler.dispatch()
+            print(f"✓ 任务 {job_id} 与进行中的任务 {leader['job_id']} 合并")
+            return build_key, (jsonify({
+                'job_id': job_id,
+                'status': leader['status'],
+                'mode': job_data['mode'],
+                'coalesced_into': leader['job_id'],
+                **extra
+            }), 201)
+
+    return build_key, None
+
+
 # ============ API路由 ============
 
 @app.route('/api/jobs/rsync', methods=['POST'])
@@ -123,7 +319,11 @@ def create_rsync_job():
     请求体: {
         "workspace": "/var/ci-workspace/project-name",
         "script": "npm install && npm test",
-        "user_id": "optional-user-id"
+        "user_id": "optional-user-id",
+        "cache": {"paths": ["node_modules"], "key_files": ["package-lock.json"]},  // 可选
+        "priority": "normal",  // 可选，low | normal | high
+        "resources": {"cpus": 2, "memory": "4G"},  // 可选，未声明时按项目历史用量估算
+        "no_cache": false  // 可选，为true时不与排队中的相同任务合并
     }
     """
     data = request.json
@@ -145,25 +345,50 @@ def create_rsync_job():
     if not workspace_abs.startswith(workspace_base):
         return jsonify({'error': f'Workspace must be under {WORKSPACE_DIR}'}), 403
 
+    try:
+        cache = _parse_cache_param(data.get('cache'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid cache: {e}'}), 400
+
+    try:
+        priority = parse_priority(data.get('priority'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid priority: {e}'}), 400
+
+    try:
+        resources = _parse_resources_param(data.get('resources'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid resources: {e}'}), 400
+
     # 准备任务数据
     job_data = {
         'mode': 'rsync',
         'workspace': workspace,
         'script': data['script'],
-        'user_id': data.get('user_id')
+        'user_id': data.get('user_id'),
+        'cache': cache,
+        'priority': priority,
+        'resources': admission.resolve(resources, workspace.split('/')[-1])
     }
 
-    # 提交任务
-    task = execute_build.delay(job_data)
+    # 合并排队中的相同任务（workspace随时可能变化，不使用构建缓存）
+    build_key, response = _reuse_existing_build(
+        workspace_source_key(workspace_abs), job_data, _is_true(data.get('no_cache')), mutable=True
+    )
+    if response:
+        return response
+    job_data['build_key'] = build_key
 
-    # 记录到数据库
-    job_db.create_job(task.id, {
+    # 记录到数据库，由公平调度器在有空闲槽位时提交给Celery
+    job_id = str(uuid.uuid4())
+    job_db.create_job(job_id, {
         **job_data,
-        'log_file': f"{DATA_DIR}/logs/{task.id}.log"
+        'log_file': f"{DATA_DIR}/logs/{job_id}.log"
     })
+    scheduler.dispatch()
 
     return jsonify({
-        'job_id': task.id,
+        'job_id': job_id,
         'status': 'queued',
         'mode': 'rsync'
     }), 201
@@ -175,11 +400,15 @@ def create_upload_job():
     """
     创建上传模式任务
     multipart/form-data:
-      - code: 代码包文件 (tar.gz)
+      - code: 代码包文件 (tar.gz 或 tar.zst)
       - script: 构建脚本
       - project_name: 项目名称（可选，推荐提供以保持与rsync模式一致）
       - user_id: 可选的用户ID
       - artifact_patterns: 产物路径模式（JSON数组字符串，可选）
+      - cache: 依赖缓存声明（JSON字符串，可选）
+      - priority: 优先级 low | normal | high（可选，默认normal）
+      - resources: 资源需求（JSON字符串，如 {"cpus": 2, "memory": "4G"}，可选）
+      - no_cache: 为true时不复用构建缓存，也不与进行中的相同任务合并（可选）
     """
     # 验证参数
     if 'code' not in request.files:
@@ -201,12 +430,26 @@ def create_upload_job():
         except json.JSONDecodeError:
             return jsonify({'error': 'Invalid artifact_patterns JSON'}), 400
 
+    try:
+        cache = _parse_cache_param(request.form.get('cache'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid cache: {e}'}), 400
+
+    try:
+        priority = parse_priority(request.form.get('priority'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid priority: {e}'}), 400
+
+    try:
+        resources = _parse_resources_param(request.form.get('resources'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid resources: {e}'}), 400
+
     # 验证文件名
     if code_file.filename == '':
         return jsonify({'error': 'Empty filename'}), 400
 
     # 保存上传的文件（使用项目名 + 时间戳 + UUID避免冲突）
-    import uuid
     filename = secure_filename(code_file.filename)
     timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
     unique_id = uuid.uuid4().hex[:8]
@@ -215,6 +458,7 @@ def create_upload_job():
     upload_path = f"{DATA_DIR}/uploads/{saved_filename}"
 
     code_file.save(upload_path)
+    UPLOAD_BYTES.labels('archive').inc(os.path.getsize(upload_path))
 
     # 准备任务数据
     job_data = {
@@ -223,20 +467,315 @@ def create_upload_job():
         'script': script,
         'user_id': user_id,
         'project_name': project_name,
-        'artifact_patterns': artifact_patterns
+        'artifact_patterns': artifact_patterns,
+        'cache': cache,
+        'priority': priority,
+        'resources': admission.resolve(resources, project_name)
     }
 
-    # 提交任务
-    task = execute_build.delay(job_data)
+    # 查找构建缓存和进行中的相同任务
+    build_key, response = _reuse_existing_build(
+        archive_source_key(file_sha256(upload_path)), job_data, _is_true(request.form.get('no_cache')),
+        project_name=project_name
+    )
+    if response:
+        os.remove(upload_path)
+        return response
+    job_data['build_key'] = build_key
+
+    # 记录到数据库，由公平调度器在有空闲槽位时提交给Celery
+    job_id = str(uuid.uuid4())
+    job_db.create_job(job_id, {
+        **job_data,
+        'log_file': f"{DATA_DIR}/logs/{job_id}.log"
+    })
+    scheduler.dispatch()
+
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'mode': 'upload',
+        'project_name': project_name
+    }), 201
+
+
+# 流式上传接受的Content-Type
+STREAM_CONTENT_TYPES = {
+    'application/x-tar', 'application/tar',
+    'application/gzip', 'application/x-gzip', 'application/x-tar+gzip',
+    'application/x-bzip2', 'application/x-xz',
+    'application/zstd', 'application/x-zstd',
+}
+
+
+@app.route('/api/jobs/upload/stream', methods=['POST'])
+@require_auth
+def create_stream_upload_job():
+    """
+    创建上传模式任务（流式上传，边接收边解压）
+    请求体: 原始tar流（可gzip/zstd/bzip2/xz压缩），Content-Type: application/x-tar 等
+    Query参数:
+      - script: 构建脚本
+      - project_name: 项目名称（可选）
+      - user_id: 可选的用户ID
+      - artifact_patterns: 产物路径模式（JSON数组字符串，可选）
+      - cache: 依赖缓存声明（JSON字符串，可选）
+      - priority: 优先级 low | normal | high（可选，默认normal）
+      - resources: 资源需求（JSON字符串，如 {"cpus": 2, "memory": "4G"}，可选）
+      - no_cache: 为true时不复用构建缓存，也不与进行中的相同任务合并（可选）
+
+    示例:
+      tar -cz . | curl -X POST -H "Content-Type: application/gzip" \\
+        --data-binary @- "http://remote-ci:5000/api/jobs/upload/stream?script=make"
+    """
+    content_type = (request.mimetype or '').lower()
+    if content_type not in STREAM_CONTENT_TYPES:
+        return jsonify({'error': f'Unsupported Content-Type: {content_type or "none"}'}), 415
 
-    # 记录到数据库
-    job_db.create_job(task.id, {
+    script = request.args.get('script')
+    if not script:
+        return jsonify({'error': 'Missing script parameter'}), 400
+
+    user_id = request.args.get('user_id')
+    project_name = request.args.get('project_name', 'default')
+
+    artifact_patterns = []
+    if 'artifact_patterns' in request.args:
+        try:
+            artifact_patterns = json.loads(request.args['artifact_patterns'])
+        except json.JSONDecodeError:
+            return jsonify({'error': 'Invalid artifact_patterns JSON'}), 400
+
+    try:
+        cache = _parse_cache_param(request.args.get('cache'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid cache: {e}'}), 400
+
+    try:
+        priority = parse_priority(request.args.get('priority'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid priority: {e}'}), 400
+
+    try:
+        resources = _parse_resources_param(request.args.get('resources'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid resources: {e}'}), 400
+
+    # 解压到暂存目录，成功后重命名为正式目录，worker直接接管
+    import shutil
+    import tarfile
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    unique_id = uuid.uuid4().hex[:8]
+    source_dir = f"{STAGING_DIR}/{secure_filename(project_name)}-{timestamp}-{unique_id}"
+    partial_dir = f"{source_dir}.partial"
+
+    try:
+        extracted = extract_tar_stream(
+            request.stream,
+            partial_dir,
+            max_bytes=MAX_UPLOAD_SIZE,
+            max_extract_bytes=MAX_EXTRACT_SIZE
+        )
+        os.rename(partial_dir, source_dir)
+        UPLOAD_BYTES.labels('stream').inc(extracted['bytes_read'])
+    except ArchiveTooLarge as e:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        return jsonify({'error': str(e)}), 413
+    except (UnsafeArchiveMember, tarfile.TarError) as e:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        return jsonify({'error': f'Invalid archive: {e}'}), 400
+    except Exception:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        raise
+
+    # 准备任务数据
+    job_data = {
+        'mode': 'upload',
+        'source_dir': source_dir,
+        'source_sha256': extracted['sha256'],
+        'script': script,
+        'user_id': user_id,
+        'project_name': project_name,
+        'artifact_patterns': artifact_patterns,
+        'cache': cache,
+        'priority': priority,
+        'resources': admission.resolve(resources, project_name)
+    }
+
+    stream_info = {
+        'project_name': project_name,
+        'sha256': extracted['sha256'],
+        'received_bytes': extracted['bytes_read'],
+        'file_count': extracted['file_count']
+    }
+
+    # 查找构建缓存和进行中的相同任务
+    build_key, response = _reuse_existing_build(
+        archive_source_key(extracted['sha256']), job_data, _is_true(request.args.get('no_cache')),
+        **stream_info
+    )
+    if response:
+        shutil.rmtree(source_dir, ignore_errors=True)
+        return response
+    job_data['build_key'] = build_key
+
+    # 记录到数据库，由公平调度器在有空闲槽位时提交给Celery
+    job_id = str(uuid.uuid4())
+    job_db.create_job(job_id, {
         **job_data,
-        'log_file': f"{DATA_DIR}/logs/{task.id}.log"
+        'log_file': f"{DATA_DIR}/logs/{job_id}.log"
     })
+    scheduler.dispatch()
 
     return jsonify({
-        'job_id': task.id,
+        'job_id': job_id,
+        'status': 'queued',
+        'mode': 'upload',
+        **stream_info
+    }), 201
+
+
+# ============ 增量上传 ============
+
+@app.route('/api/blobs/missing', methods=['POST'])
+@require_auth
+def find_missing_blobs():
+    """
+    查询服务端缺失的源码块
+    请求体: {
+        "digests": ["sha256...", ...]
+    }
+    返回: {
+        "missing": ["sha256...", ...]
+    }
+    """
+    data = request.json
+
+    if not data or not isinstance(data.get('digests'), list):
+        return jsonify({'error': 'Missing required field: digests'}), 400
+
+    try:
+        missing = blob_store.find_missing(data['digests'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'missing': missing})
+
+
+@app.route('/api/blobs', methods=['POST'])
+@require_auth
+def upload_blobs():
+    """
+    上传源码块
+    multipart/form-data:
+      - <sha256>: 块内容（字段名为内容的sha256摘要）
+    """
+    stored = 0
+    stored_bytes = 0
+
+    for digest, blob_file in request.files.items():
+        try:
+            stored_bytes += blob_store.put_blob(digest, blob_file.stream)
+            stored += 1
+        except ValueError as e:
+            return jsonify({'error': str(e), 'stored': stored}), 400
+
+    UPLOAD_BYTES.labels('blob').inc(stored_bytes)
+    return jsonify({
+        'stored': stored,
+        'stored_bytes': stored_bytes
+    }), 201
+
+
+@app.route('/api/jobs/manifest', methods=['POST'])
+@require_auth
+def create_manifest_job():
+    """
+    创建增量上传任务（上传模式）
+    请求体: {
+        "manifest": {"files": [{"path": "src/a.py", "sha256": "...", "mode": 420}, ...]},
+        "script": "npm install && npm test",
+        "project_name": "可选",
+        "user_id": "可选",
+        "artifact_patterns": ["dist/"],
+        "cache": {"paths": ["node_modules"], "key_files": ["package-lock.json"]},
+        "priority": "normal",  // 可选，low | normal | high
+        "resources": {"cpus": 2, "memory": "4G"},  // 可选，未声明时按项目历史用量估算
+        "no_cache": false  // 可选，为true时不复用构建缓存，也不与进行中的相同任务合并
+    }
+    """
+    data = request.json
+
+    if not data or not all(k in data for k in ['manifest', 'script']):
+        return jsonify({'error': 'Missing required fields: manifest, script'}), 400
+
+    manifest = data['manifest']
+    project_name = data.get('project_name') or 'default'
+
+    try:
+        missing = blob_store.check_manifest(manifest)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid manifest: {e}'}), 400
+
+    if missing:
+        return jsonify({'error': 'Missing blobs', 'missing': missing}), 409
+
+    try:
+        cache = _parse_cache_param(data.get('cache'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid cache: {e}'}), 400
+
+    try:
+        priority = parse_priority(data.get('priority'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid priority: {e}'}), 400
+
+    try:
+        resources = _parse_resources_param(data.get('resources'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid resources: {e}'}), 400
+
+    # 准备任务数据
+    job_data = {
+        'mode': 'upload',
+        'script': data['script'],
+        'user_id': data.get('user_id'),
+        'project_name': project_name,
+        'artifact_patterns': data.get('artifact_patterns', []),
+        'cache': cache,
+        'priority': priority,
+        'resources': admission.resolve(resources, project_name)
+    }
+
+    # 查找构建缓存和进行中的相同任务（命中时不需要保存清单）
+    build_key, response = _reuse_existing_build(
+        manifest_source_key(manifest), job_data, _is_true(data.get('no_cache')),
+        project_name=project_name
+    )
+    if response:
+        return response
+
+    # 保存清单（与代码包同目录，任务结束后清理）
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    unique_id = uuid.uuid4().hex[:8]
+    manifest_path = f"{DATA_DIR}/uploads/{secure_filename(project_name)}-{timestamp}-{unique_id}-manifest.json"
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+    job_data['source_manifest'] = manifest_path
+    job_data['build_key'] = build_key
+
+    # 记录到数据库，由公平调度器在有空闲槽位时提交给Celery
+    job_id = str(uuid.uuid4())
+    job_db.create_job(job_id, {
+        **job_data,
+        'log_file': f"{DATA_DIR}/logs/{job_id}.log"
+    })
+    scheduler.dispatch()
+
+    return jsonify({
+        'job_id': job_id,
         'status': 'queued',
         'mode': 'upload',
         'project_name': project_name
@@ -253,8 +792,13 @@ def create_git_job():
         "branch": "main",
         "commit": "optional-commit-hash",
         "script": "npm install && npm test",
-        "user_id": "optional-user-id"
+        "user_id": "optional-user-id",
+        "cache": {"paths": ["node_modules"], "key_files": ["package-lock.json"]},  // 可选
+        "priority": "normal",  // 可选，low | normal | high
+        "resources": {"cpus": 2, "memory": "4G"},  // 可选，未声明时按项目历史用量估算
+        "no_cache": false  // 可选，为true时不复用构建缓存，也不与进行中的相同任务合并
     }
+    commit为完整sha时才能在提交时命中构建缓存（分支会移动），只指定分支时只与排队中的任务合并
     """
     data = request.json
 
@@ -262,6 +806,30 @@ def create_git_job():
     if not all(k in data for k in ['repo', 'branch', 'script']):
         return jsonify({'error': 'Missing required fields: repo, branch, script'}), 400
 
+    # 分支和提交会作为git命令参数，只接受提交hash或安全的引用名
+    try:
+        validate_repo_url(data['repo'])
+        validate_ref(data['branch'], '分支名')
+        if data.get('commit'):
+            validate_ref(data['commit'], '提交')
+    except ValueError as e:
+        return jsonify({'error': f'Invalid git source: {e}'}), 400
+
+    try:
+        cache = _parse_cache_param(data.get('cache'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid cache: {e}'}), 400
+
+    try:
+        priority = parse_priority(data.get('priority'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid priority: {e}'}), 400
+
+    try:
+        resources = _parse_resources_param(data.get('resources'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid resources: {e}'}), 400
+
     # 准备任务数据
     job_data = {
         'mode': 'git',
@@ -269,21 +837,39 @@ def create_git_job():
         'branch': data['branch'],
         'commit': data.get('commit'),
         'script': data['script'],
-        'user_id': data.get('user_id')
+        'user_id': data.get('user_id'),
+        'cache': cache,
+        'priority': priority,
+        'resources': admission.resolve(resources, repo_url=data['repo'])
     }
 
-    # 提交任务
-    task = execute_build.delay(job_data)
+    # 查找构建缓存和进行中的相同任务（只指定分支时源码未确定，只与排队中的任务合并）
+    source_key = git_source_key(data['repo'], data.get('commit'))
+    if source_key:
+        build_key, response = _reuse_existing_build(source_key, job_data, _is_true(data.get('no_cache')))
+    elif data.get('commit'):
+        # 短sha无法与其他提交方式比较，不参与复用
+        build_key, response = None, None
+    else:
+        build_key, response = _reuse_existing_build(
+            git_branch_source_key(data['repo'], data['branch']), job_data,
+            _is_true(data.get('no_cache')), mutable=True
+        )
+    if response:
+        return response
+    job_data['build_key'] = build_key
 
-    # 记录到数据库
-    job_db.create_job(task.id, {
+    # 记录到数据库，由公平调度器在有空闲槽位时提交给Celery
+    job_id = str(uuid.uuid4())
+    job_db.create_job(job_id, {
         **job_data,
         'repo_url': data['repo'],
-        'log_file': f"{DATA_DIR}/logs/{task.id}.log"
+        'log_file': f"{DATA_DIR}/logs/{job_id}.log"
     })
+    scheduler.dispatch()
 
     return jsonify({
-        'job_id': task.id,
+        'job_id': job_id,
         'status': 'queued',
         'mode': 'git'
     }), 201
@@ -297,26 +883,141 @@ def get_job(job_id):
     return jsonify(job_info)
 
 
-@app.route('/api/jobs/<job_id>/logs', methods=['GET'])
+def _job_stages(job):
+    """任务各阶段耗时（跟随任务使用主任务的记录）"""
+    return job_db.get_job_stages(job.get('coalesced_into') or job['job_id'])
+
+
+@app.route('/api/jobs/<job_id>/stages', methods=['GET'])
 @require_auth
-def get_job_logs(job_id):
-    """获取任务日志"""
-    log_file = f"{DATA_DIR}/logs/{job_id}.log"
+def get_job_stages(job_id):
+    """
+    获取任务各阶段耗时
 
-    if not os.path.exists(log_file):
-        # 如果任务还没开始，返回空日志
-        return '', 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    Returns:
+        {'job_id', 'status', 'stages': [{'stage', 'started_at', 'duration'}, ...], 'total'}
+        阶段见 server/stage_timer.py 的 STAGES，任务结束后才有记录
+    """
+    job = job_db.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    stages = _job_stages(job)
+    return jsonify({
+        'job_id': job_id,
+        'status': job['status'],
+        'stages': stages,
+        'total': round(sum(s['duration'] for s in stages), 3)
+    })
+
+
+# 日志长轮询默认/最大等待时间（秒）
+LOG_FOLLOW_WAIT = 25
+LOG_FOLLOW_MAX_WAIT = 60
+
+# SSE日志推送单个连接的最长时间（秒），之后由浏览器自动重连
+LOG_STREAM_MAX_SECONDS = 600
 
-    # 支持tail参数
+
+def _job_status(job_id):
+    """获取任务状态（与任务状态接口一致，未完成时以Celery实时状态为准）"""
+    return get_job_info(job_id).get('status')
+
+
+def _job_log_file(job_id):
+    """任务日志路径（命中构建缓存的任务指向来源任务的日志）"""
+    job = job_db.get_job(job_id)
+    if job and job.get('log_file'):
+        return job['log_file']
+    return f"{DATA_DIR}/logs/{job_id}.log"
+
+
+def _serve_job_log(job_id):
+    """
+    返回任务日志（认证接口与免认证历史接口共用）
+
+    Query参数:
+      - lines: 只返回最后N行
+      - start_line / end_line: 按行号读取（从1开始，包含两端，单次最多返回 MAX_READ_LINES 行），
+        通过行偏移索引定位，不需要读取整个日志
+      - offset: 从该字节偏移开始增量读取，只返回新增内容
+      - limit: 增量读取的最大字节数（默认1MB）
+      - follow: 配合offset使用，没有新内容时阻塞等待（长轮询）
+      - wait: follow模式的最长等待秒数（默认25，最大60）
+
+    响应头:
+      - X-Next-Offset: 下一次增量读取使用的偏移
+      - X-Job-Status: 任务状态
+      - X-Log-Complete: 任务已结束且日志已全部读取时为true
+      - X-Start-Line / X-Total-Lines: 按行读取时返回内容的第一行行号和日志总行数
+    """
+    log_file = _job_log_file(job_id)
+    headers = {'Content-Type': 'text/plain; charset=utf-8'}
+
+    offset = request.args.get('offset', type=int)
     lines = request.args.get('lines', type=int)
+    start_line = request.args.get('start_line', type=int)
+
+    if offset is not None:
+        if request.args.get('follow', 'false').lower() in ['true', '1', 'yes']:
+            wait = min(max(request.args.get('wait', LOG_FOLLOW_WAIT, type=float), 0), LOG_FOLLOW_MAX_WAIT)
+            wait_for_log(log_file, offset, wait, lambda: _job_status(job_id))
+
+        limit = request.args.get('limit', DEFAULT_READ_BYTES, type=int)
+        data, next_offset = read_from_offset(log_file, offset, max(limit, 1))
+        status = _job_status(job_id)
 
-    with open(log_file, 'r', encoding='utf-8', errors='replace') as f:
-        if lines:
-            content = ''.join(f.readlines()[-lines:])
+        headers['X-Next-Offset'] = str(next_offset)
+        headers['X-Job-Status'] = status or 'unknown'
+        headers['X-Log-Complete'] = 'true' if not data and is_log_complete(log_file, next_offset, status) else 'false'
+        return data.decode('utf-8', errors='replace'), 200, headers
+
+    actual_file, fmt = find_log(log_file)
+    if actual_file is None:
+        # 如果任务还没开始，返回空日志
+        headers['X-Next-Offset'] = '0'
+        return '', 200, headers
+
+    if start_line is not None or lines:
+        if start_line is not None:
+            end_line = request.args.get('end_line', start_line + MAX_READ_LINES - 1, type=int)
+            data, first_line, total_lines, next_offset = read_lines(log_file, start_line, end_line)
         else:
-            content = f.read()
+            data, first_line, total_lines, next_offset = read_last_lines(log_file, lines)
+        if total_lines is not None:
+            headers['X-Start-Line'] = str(first_line)
+            headers['X-Total-Lines'] = str(total_lines)
+    elif fmt and accepts_encoding(request.headers.get('Accept-Encoding'), CONTENT_ENCODINGS[fmt]):
+        # 已压缩的完整日志：客户端支持该编码时直接返回压缩内容，由客户端解压
+        try:
+            with open(actual_file, 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            headers['X-Next-Offset'] = '0'
+            return '', 200, headers
+        headers['Content-Encoding'] = CONTENT_ENCODINGS[fmt]
+        headers['Vary'] = 'Accept-Encoding'
+        headers['X-Next-Offset'] = str(log_size(log_file))
+        headers['X-Job-Status'] = _job_status(job_id) or 'unknown'
+        return body, 200, headers
+    else:
+        f, _ = open_log(log_file)
+        data = b''
+        if f is not None:
+            with f:
+                data = f.read()
+        next_offset = len(data)
+
+    headers['X-Next-Offset'] = str(next_offset)
+    headers['X-Job-Status'] = _job_status(job_id) or 'unknown'
+    return data.decode('utf-8', errors='replace'), 200, headers
 
-    return content, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+@app.route('/api/jobs/<job_id>/logs', methods=['GET'])
+@require_auth
+def get_job_logs(job_id):
+    """获取任务日志（支持 lines / offset / follow 参数，见 _serve_job_log）"""
+    return _serve_job_log(job_id)
 
 
 @app.route('/api/jobs/history', methods=['GET'])
@@ -378,27 +1079,116 @@ def get_history_job(job_id):
             return jsonify(job_info)
         return jsonify({'error': 'Job not found'}), 404
 
+    job['stages'] = _job_stages(job)
     return jsonify(job)
 
 
 @app.route('/api/jobs/history/<job_id>/logs', methods=['GET'])
 def get_history_job_logs(job_id):
-    """获取历史任务日志（免Token认证）"""
-    log_file = f"{DATA_DIR}/logs/{job_id}.log"
+    """获取历史任务日志（免Token认证，参数同 /api/jobs/<id>/logs）"""
+    return _serve_job_log(job_id)
 
-    if not os.path.exists(log_file):
-        return '', 200, {'Content-Type': 'text/plain; charset=utf-8'}
 
-    # 支持tail参数
-    lines = request.args.get('lines', type=int)
+@app.route('/api/jobs/history/<job_id>/logs/stream', methods=['GET'])
+def stream_history_job_logs(job_id):
+    """
+    以Server-Sent Events推送任务日志（免Token认证，供Web界面实时查看）
 
-    with open(log_file, 'r', encoding='utf-8', errors='replace') as f:
-        if lines:
-            content = ''.join(f.readlines()[-lines:])
-        else:
-            content = f.read()
+    Query参数:
+      - offset: 起始字节偏移（默认0；断线重连时浏览器通过Last-Event-ID续传）
+
+    事件:
+      - 默认事件: data为新增日志，id为下一次读取的偏移
+      - end: 任务已结束且日志已全部推送，data为任务状态
+    单个连接最长保持 LOG_STREAM_MAX_SECONDS 秒，之后浏览器自动重连续传
+    """
+    log_file = _job_log_file(job_id)
+    offset = request.headers.get('Last-Event-ID', type=int)
+    if offset is None:
+        offset = request.args.get('offset', 0, type=int)
+
+    def generate(offset):
+        deadline = time.monotonic() + LOG_STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            _, complete = wait_for_log(log_file, offset, LOG_FOLLOW_WAIT, lambda: _job_status(job_id))
+            if complete:
+                yield f"event: end\ndata: {_job_status(job_id)}\n\n"
+                return
+
+            data, next_offset = read_from_offset(log_file, offset)
+            if data:
+                offset = next_offset
+                lines = data.decode('utf-8', errors='replace').split('\n')
+                yield f"id: {offset}\n" + ''.join(f"data: {line}\n" for line in lines) + "\n"
+            elif _job_status(job_id) in FINISHED_STATUSES:
+                # 任务已结束，等待收尾日志写完
+                time.sleep(1)
+            else:
+                # 心跳，防止代理断开空闲连接
+                yield ": keep-alive\n\n"
+
+    return Response(generate(offset), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/logs/search', methods=['GET'])
+def search_logs():
+    """
+    全文搜索已结束任务的构建日志（免Token认证）
+
+    Query参数:
+      - q: 搜索内容（每个空白分隔的词按短语匹配，需全部出现）
+      - syntax: 为fts5时q按SQLite FTS5查询语法解释（AND/OR/NOT、前缀*等）
+      - user_id: 按用户ID过滤（支持部分匹配）
+      - project_name: 按项目名过滤（支持部分匹配）
+      - since / until: 按结束时间过滤（ISO格式，如 2026-01-01 或 2026-01-01T08:00:00）
+      - limit: 最多返回的任务数（默认20，最大100）
+      - before: 分页游标（上一页返回的next_before）
+
+    返回:
+      - results: 匹配的任务（从新到旧），每个任务包含最多5个匹配行 matches: [{line, text}]
+      - next_before: 下一页的游标，没有更多结果时为null
+      - index: 索引状态（indexed_jobs, pending_jobs），刚结束的任务需要等待后台索引
+    """
+    if log_search is None:
+        return jsonify({'error': 'Log search is disabled (CI_LOG_SEARCH=false)'}), 503
 
-    return content, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    before = request.args.get('before', type=int)
+
+    filters = {}
+    for key in ('user_id', 'project_name', 'since', 'until'):
+        if request.args.get(key):
+            filters[key] = request.args.get(key)
+    # 只给日期时包含当天
+    if len(filters.get('until', '')) == 10:
+        filters['until'] += 'T23:59:59.999999Z'
+
+    try:
+        results, next_before = log_search.search(
+            request.args.get('q', ''), filters, limit=limit, before=before,
+            raw=request.args.get('syntax', '').lower() == 'fts5'
+        )
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+
+    # 已过期（日志已删除）的任务移出索引
+    expired = []
+    for result in results:
+        job = job_db.get_job(result['job_id'])
+        if not job or job.get('is_expired'):
+            expired.append(result['job_id'])
+    if expired:
+        log_search.delete_jobs(expired)
+        results = [result for result in results if result['job_id'] not in expired]
+
+    return jsonify({
+        'query': request.args.get('q', ''),
+        'results': results,
+        'next_before': next_before,
+        'filters': filters,
+        'index': log_search.get_stats()
+    })
 
 
 @app.route('/api/jobs', methods=['GET'])
@@ -461,6 +1251,45 @@ def get_stats():
     return jsonify(stats)
 
 
+@app.route('/api/stats/stages', methods=['GET'])
+def get_stage_stats():
+    """
+    各阶段耗时分位数（免Token认证）
+
+    Query参数:
+      - days: 统计最近几天创建的任务（默认7）
+      - mode / project_name / user_id / status: 过滤条件（精确匹配）
+
+    Returns:
+        {'days', 'filters', 'stages': [{'stage', 'count', 'avg', 'p50', 'p90', 'p95', 'p99', 'max'}, ...]}
+        （耗时单位为秒，按执行顺序排列）
+    """
+    days = request.args.get('days', 7, type=int)
+    filters = {f: request.args.get(f) for f in ('mode', 'project_name', 'user_id', 'status') if request.args.get(f)}
+
+    durations = job_db.get_stage_durations(days=days, filters=filters)
+    return jsonify({
+        'days': days,
+        'filters': filters,
+        'stages': summarize(durations)
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus指标（无需认证）
+
+    汇总API和所有worker进程的指标（见 server/metrics.py），
+    并在抓取时从数据库读取排队/运行中的任务数和磁盘配额用量
+    """
+    rendered = render_metrics(JobStateCollector(job_db, quota_manager))
+    if rendered is None:
+        return jsonify({'error': 'prometheus_client not installed'}), 501
+    content, content_type = rendered
+    return Response(content, content_type=content_type)
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查（无需认证）"""
@@ -477,6 +1306,17 @@ def health_check():
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 503
 
 
+@app.route('/api/capabilities', methods=['GET'])
+def get_capabilities():
+    """
+    服务端能力（无需认证），客户端据此选择上传格式
+
+    返回:
+      - archive_formats: 支持的代码包/产物压缩格式（按优先级排序）
+    """
+    return jsonify({'archive_formats': available_formats()})
+
+
 @app.route('/api/admin/clear-database', methods=['POST', 'DELETE'])
 @require_auth
 def clear_database():
@@ -492,6 +1332,8 @@ def clear_database():
     """
     # 清空数据库
     deleted_count = job_db.clear_all_jobs()
+    if log_search:
+        log_search.clear()
 
     # 可选：清理日志文件
     clean_logs = request.args.get('clean_logs', 'false').lower() in ['true', '1', 'yes']
@@ -501,11 +1343,13 @@ def clear_database():
         try:
             import glob
             log_pattern = f"{DATA_DIR}/logs/*.log"
-            log_files = glob.glob(log_pattern)
+            log_files = glob.glob(log_pattern) + [
+                path[:-len(suffix)] for suffix in ('.zst', '.gz', '.idx') for path in glob.glob(log_pattern + suffix)
+            ]
 
             for log_file in log_files:
                 try:
-                    os.remove(log_file)
+                    remove_log(log_file)
                     logs_cleaned += 1
                 except Exception as e:
                     print(f"删除日志文件失败 {log_file}: {e}")
@@ -529,8 +1373,11 @@ def download_artifacts(job_id):
     """
     下载任务产物（免Token认证）
 
+    按Accept头协商格式：客户端声明接受 application/zstd 时直接返回zstd产物，
+    否则（旧客户端、浏览器）流式转码为gzip返回
+
     Returns:
-        产物tar.gz文件，如果不存在返回404
+        产物归档文件，如果不存在返回404
     """
     job = job_db.get_job(job_id)
 
@@ -546,14 +1393,25 @@ def download_artifacts(job_id):
     if not artifacts_path or not os.path.exists(artifacts_path):
         return jsonify({'error': 'Artifacts not found', 'message': '产物不存在或未生成'}), 404
 
+    stored_format = format_of_path(artifacts_path)
+    response_format = negotiate_format(request.headers.get('Accept'), stored_format)
+    download_name = f"{job_id}-artifacts{FORMATS[response_format]['suffix']}"
+
     # 返回文件
     try:
-        return send_file(
-            artifacts_path,
-            as_attachment=True,
-            download_name=f"{job_id}-artifacts.tar.gz",
-            mimetype='application/gzip'
-        )
+        if response_format != stored_format:
+            response = Response(iter_transcode_to_gzip(artifacts_path), mimetype=FORMATS['gzip']['mimetype'])
+            response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+        else:
+            response = send_file(
+                artifacts_path,
+                as_attachment=True,
+                download_name=download_name,
+                mimetype=FORMATS[stored_format]['mimetype']
+            )
+        response.headers['Vary'] = 'Accept'
+        ARTIFACT_BYTES.labels('served').inc(os.path.getsize(artifacts_path))
+        return response
     except Exception as e:
         return jsonify({'error': 'Download failed', 'message': str(e)}), 500
 
@@ -575,6 +1433,20 @@ def get_quota():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/admin/scheduler', methods=['GET'])
+def get_scheduler_state():
+    """
+    获取公平调度器状态（免Token认证）
+
+    Returns:
+        槽位数、分组方式、已提交/等待中的任务数，以及各虚拟队列的权重、等待数、虚拟时间等
+    """
+    try:
+        return jsonify(scheduler.get_state())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # ============ 特殊用户管理 ============
 
 @app.route('/api/admin/special-users', methods=['GET'])
@@ -608,7 +1480,8 @@ def add_special_user():
 
     请求体: {
         "user_id": "alice",
-        "quota_gb": 50
+        "quota_gb": 50,
+        "weight": 2  // 可选，公平调度权重（默认1）
     }
     """
     data = request.json
@@ -618,17 +1491,20 @@ def add_special_user():
 
     user_id = data['user_id']
     quota_gb = float(data['quota_gb'])
+    weight = float(data.get('weight', 1))
 
     if quota_gb <= 0:
         return jsonify({'error': 'quota_gb must be positive'}), 400
+    if weight <= 0:
+        return jsonify({'error': 'weight must be positive'}), 400
 
     try:
-        success = job_db.add_special_user(user_id, quota_gb)
+        success = job_db.add_special_user(user_id, quota_gb, weight)
 
         if success:
             return jsonify({
                 'success': True,
-                'message': f'已添加特殊用户 {user_id} (配额: {quota_gb}GB)'
+                'message': f'已添加特殊用户 {user_id} (配额: {quota_gb}GB, 权重: {weight})'
             })
         else:
             return jsonify({'error': 'Failed to add special user'}), 500
@@ -641,29 +1517,40 @@ def add_special_user():
 @require_auth
 def update_special_user(user_id):
     """
-    更新特殊用户配额（需要Token认证）
+    更新特殊用户配额和公平调度权重（需要Token认证）
 
     请求体: {
-        "quota_gb": 100
+        "quota_gb": 100,  // 可选
+        "weight": 2       // 可选
     }
     """
     data = request.json
 
-    if not data or 'quota_gb' not in data:
-        return jsonify({'error': 'Missing required field: quota_gb'}), 400
+    if not data or ('quota_gb' not in data and 'weight' not in data):
+        return jsonify({'error': 'Missing required field: quota_gb or weight'}), 400
 
-    quota_gb = float(data['quota_gb'])
+    quota_gb = float(data['quota_gb']) if 'quota_gb' in data else None
+    weight = float(data['weight']) if 'weight' in data else None
 
-    if quota_gb <= 0:
+    if quota_gb is not None and quota_gb <= 0:
         return jsonify({'error': 'quota_gb must be positive'}), 400
+    if weight is not None and weight <= 0:
+        return jsonify({'error': 'weight must be positive'}), 400
 
     try:
-        success = job_db.update_special_user_quota(user_id, quota_gb)
+        success = True
+        messages = []
+        if quota_gb is not None:
+            success = job_db.update_special_user_quota(user_id, quota_gb)
+            messages.append(f'配额为 {quota_gb}GB')
+        if success and weight is not None:
+            success = job_db.update_special_user_weight(user_id, weight)
+            messages.append(f'权重为 {weight}')
 
         if success:
             return jsonify({
                 'success': True,
-                'message': f'已更新用户 {user_id} 配额为 {quota_gb}GB'
+                'message': f'已更新用户 {user_id} ' + '，'.join(messages)
             })
         else:
             return jsonify({'error': 'User not found or update failed'}), 404
@@ -871,6 +1758,12 @@ WEB_TEMPLATE = '''<!DOCTYPE html>
             overflow-y: auto;
         }
 
+        .log-earlier {
+            display: none;
+            width: 100%;
+            margin-bottom: 10px;
+        }
+
         .empty-state {
             text-align: center;
             padding: 40px;
@@ -959,6 +1852,7 @@ WEB_TEMPLATE = '''<!DOCTYPE html>
                 <button class="close-btn" onclick="closeModal()">&times;</button>
             </div>
             <div class="modal-body">
+                <button class="btn-primary log-earlier" id="log-earlier" onclick="loadEarlierLogs()">加载更早的日志</button>
                 <div class="log-content" id="log-content">加载中...</div>
             </div>
         </div>
@@ -981,11 +1875,26 @@ if __name__ == '__main__':
     print("\nAPI Endpoints:")
     print("  POST /api/jobs/rsync   - 提交rsync模式任务")
     print("  POST /api/jobs/upload  - 提交上传模式任务")
+    print("  POST /api/jobs/manifest - 提交增量上传任务")
+    print("  POST /api/jobs/upload/stream - 流式上传任务（原始tar流）")
     print("  POST /api/jobs/git     - 提交Git模式任务")
     print("  GET  /api/jobs/<id>    - 查询任务状态")
     print("  GET  /api/jobs/<id>/logs - 获取任务日志")
+    print("  GET  /api/logs/search  - 全文搜索构建日志")
+    print("  GET  /api/admin/scheduler - 公平调度器状态")
+    print("  GET  /metrics          - Prometheus指标")
     print("=" * 60)
 
+    # 清理已退出进程留下的指标文件
+    cleanup_dead_processes()
+
+    # 定时调度兜底（worker异常退出、Celery暂时不可用等情况）
+    scheduler.start_background(SCHEDULER_INTERVAL)
+
+    # 后台增量建立日志全文索引（限速，多个API进程通过文件锁只有一个在索引）
+    if log_indexer:
+        log_indexer.start_background(LOG_SEARCH_INTERVAL)
+
     app.run(
         host=API_HOST,
         port=API_PORT,
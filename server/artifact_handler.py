@@ -2,30 +2,270 @@
 """
 构建产物处理器
 负责打包构建产物、清理原始文件
+
+产物模式按glob语义解释（相对工作目录，* 和 ? 不跨目录，** 匹配任意层目录，
+通配符不匹配以.开头的名称，以/结尾只匹配目录，匹配到目录时包含其全部内容），
+以/结尾的模式匹配到指向工作目录内目录的符号链接时，按链接路径包含其指向的目录内容（如 bazel-bin/），
+所有模式编译为一个正则，一次os.scandir遍历得到去重后的产物集合，打包和清理共用；
+不可能包含匹配项的目录不会进入，模式重叠（如 dist/ 和 dist/**/*.js）不会重复打包
 """
 
 import os
-import tarfile
+import re
 import shutil
-import glob
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, Set, Tuple
+
+from server.compression import FORMATS, resolve_format, open_tar_writer
+
+# 一个路径组成部分中的非隐藏名称
+_NAME = r'(?!\.)[^/]+'
+
+
+def _translate_part(part: str) -> str:
+    """把路径的一个组成部分（不含/）转换为正则"""
+    regex = '' if part.startswith('.') else r'(?!\.)'
+    i = 0
+    while i < len(part):
+        c = part[i]
+        i += 1
+        if c == '*':
+            while i < len(part) and part[i] == '*':
+                i += 1
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[':
+            # 与fnmatch相同：紧跟在[或[!之后的]是普通字符
+            j = i + 1 if part[i:i + 1] == '!' else i
+            end = part.find(']', j + 1 if part[j:j + 1] == ']' else j)
+            if end < 0:
+                regex += r'\['
+                continue
+            chars = part[i:end].replace('\\', r'\\')
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            elif chars.startswith('^'):
+                chars = '\\' + chars
+            regex += f'[{chars}]'
+            i = end + 1
+        else:
+            regex += re.escape(c)
+    return regex
+
+
+def _split_pattern(pattern: str) -> Tuple[List[str], bool]:
+    """拆分产物模式为路径组成部分，返回 (组成部分, 是否只匹配目录)"""
+    pattern = pattern.strip()
+    dir_only = pattern.endswith('/')
+    parts = [part for part in pattern.split('/') if part and part != '.']
+    return parts, dir_only
+
+
+def _translate_pattern(parts: List[str]) -> str:
+    """把拆分后的产物模式转换为匹配相对路径（/分隔）的正则"""
+    regex = ''
+    need_sep = False
+    for i, part in enumerate(parts):
+        if part == '**':
+            if i == len(parts) - 1:
+                # 末尾的**匹配该目录本身及其下所有内容
+                regex += f'(?:/{_NAME})*' if need_sep else f'{_NAME}(?:/{_NAME})*'
+            else:
+                regex += ('/' if need_sep else '') + f'(?:{_NAME}/)*'
+                need_sep = False
+            continue
+        regex += ('/' if need_sep else '') + _translate_part(part)
+        need_sep = True
+    return regex
+
+
+def _links_to_dir_within(entry: os.DirEntry, root: str) -> bool:
+    """目录项是否为指向root（真实路径）内某个目录的符号链接（不含root本身及其上级）"""
+    try:
+        if not entry.is_symlink():
+            return False
+        target = os.path.realpath(entry.path)
+    except OSError:
+        return False
+    return target.startswith(root + os.sep) and os.path.isdir(target)
+
+
+class ArtifactMatcher:
+    """编译后的产物模式"""
+
+    def __init__(self, artifact_patterns: List[str]):
+        """
+        Args:
+            artifact_patterns: 产物路径模式列表，如 ['dist/', 'build/**/*.apk']（空模式和超出工作目录的模式忽略）
+        """
+        self.patterns: List[str] = []
+        self._parts: List[List[Optional[re.Pattern]]] = []
+        self._regexes: List[re.Pattern] = []
+        self._dir_only: List[bool] = []
+        self.invalid: List[str] = []
+
+        for pattern in artifact_patterns:
+            parts, dir_only = _split_pattern(pattern)
+            if not parts:
+                continue
+            if pattern.strip().startswith('/') or '..' in parts:
+                self.invalid.append(pattern.strip())
+                continue
+            self.patterns.append(pattern.strip())
+            self._parts.append([None if part == '**' else re.compile(_translate_part(part)) for part in parts])
+            self._regexes.append(re.compile(_translate_pattern(parts)))
+            self._dir_only.append(dir_only)
+
+        # 所有模式合并为一个正则：文件只用不以/结尾的模式，目录用全部模式
+        self._any_path = self._combine([r for r, d in zip(self._regexes, self._dir_only) if not d])
+        self._any_dir = self._combine(self._regexes)
+
+    @staticmethod
+    def _combine(regexes: List[re.Pattern]) -> Optional[re.Pattern]:
+        if not regexes:
+            return None
+        return re.compile('|'.join(f'(?:{r.pattern})' for r in regexes))
+
+    def matches(self, rel_path: str, is_dir: bool) -> bool:
+        """相对路径（/分隔）是否匹配任一模式"""
+        regex = self._any_dir if is_dir else self._any_path
+        return bool(regex and regex.fullmatch(rel_path))
+
+    def matching_patterns(self, rel_path: str, is_dir: bool, candidates: List[int]) -> List[int]:
+        """candidates（模式序号）中匹配该路径的模式"""
+        return [i for i in candidates
+                if (is_dir or not self._dir_only[i]) and self._regexes[i].fullmatch(rel_path)]
+
+    def may_contain(self, rel_parts: List[str]) -> bool:
+        """目录（按组成部分）下是否可能有匹配项，不可能时遍历时跳过该目录"""
+        for compiled in self._parts:
+            for i, name in enumerate(rel_parts):
+                if i >= len(compiled):
+                    break
+                if compiled[i] is None:
+                    return True
+                if not compiled[i].fullmatch(name):
+                    break
+            else:
+                if len(rel_parts) < len(compiled):
+                    return True
+        return False
+
+
+class ArtifactSet:
+    """一次遍历收集到的产物（去重，按遍历顺序，目录在其内容之前）"""
+
+    def __init__(self, work_dir: str):
+        self.work_dir = work_dir
+        # 相对路径 -> 是否为目录
+        self.entries: Dict[str, bool] = {}
+        # 直接匹配模式的路径（不含已匹配目录下的内容），清理时删除这些路径
+        self.roots: List[str] = []
+        # 没有匹配到任何文件的模式
+        self.unmatched: List[str] = []
+        # 以/结尾的模式匹配到的目录符号链接（按目录打包其指向的内容，清理时只删除链接）
+        self.linked_dirs: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def file_count(self) -> int:
+        """文件数（不含目录）"""
+        return sum(1 for is_dir in self.entries.values() if not is_dir)
+
+    def path(self, rel_path: str) -> str:
+        """相对路径对应的绝对路径"""
+        return os.path.join(self.work_dir, *rel_path.split('/'))
 
 
 class ArtifactHandler:
     """构建产物处理器"""
 
-    def __init__(self, artifacts_dir: str):
+    def __init__(self, artifacts_dir: str, archive_format: str = 'gzip',
+                 level: Optional[int] = None, threads: int = -1):
         """
         初始化产物处理器
 
         Args:
             artifacts_dir: 产物存储目录
+            archive_format: 压缩格式 gzip | zstd
+            level: 压缩级别（None使用格式默认值）
+            threads: zstd压缩线程数（-1表示使用全部CPU核心）
         """
         self.artifacts_dir = artifacts_dir
+        self.archive_format = resolve_format(archive_format)
+        self.level = level
+        self.threads = threads
         Path(artifacts_dir).mkdir(parents=True, exist_ok=True)
 
-    def pack_artifacts(self, work_dir: str, artifact_patterns: List[str], job_id: str) -> Optional[str]:
+    def collect_artifacts(self, work_dir: str, artifact_patterns: List[str]) -> ArtifactSet:
+        """
+        一次遍历工作目录，收集匹配任一产物模式的文件和目录
+
+        Args:
+            work_dir: 工作目录（构建代码所在目录）
+            artifact_patterns: 产物路径模式列表
+
+        Returns:
+            去重后的产物集合（符号链接作为链接本身收集，不进入链接指向的目录；
+            以/结尾的模式直接匹配到指向工作目录内目录的链接时除外，按目录收集其内容）
+        """
+        matcher = ArtifactMatcher(artifact_patterns)
+        artifacts = ArtifactSet(work_dir)
+        work_root = os.path.realpath(work_dir)
+        for pattern in matcher.invalid:
+            print(f"⚠ 产物模式超出工作目录，已忽略: {pattern}")
+
+        pending = list(range(len(matcher.patterns)))
+
+        def walk(rel_parts: List[str], included: bool):
+            nonlocal pending
+            try:
+                with os.scandir(os.path.join(work_dir, *rel_parts)) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError as e:
+                print(f"⚠ 读取目录失败 {'/'.join(rel_parts) or '.'}: {e}")
+                return
+
+            for entry in entries:
+                parts = rel_parts + [entry.name]
+                rel_path = '/'.join(parts)
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                linked_dir = not included and not is_dir and _links_to_dir_within(entry, work_root)
+
+                # 只在还有模式没匹配到文件时逐个检查（用于提示）
+                if pending:
+                    matched = matcher.matching_patterns(rel_path, is_dir or linked_dir, pending)
+                    if matched:
+                        pending = [i for i in pending if i not in matched]
+
+                if included or matcher.matches(rel_path, is_dir):
+                    artifacts.entries[rel_path] = is_dir
+                    if not included:
+                        artifacts.roots.append(rel_path)
+                    if is_dir:
+                        walk(parts, True)
+                elif linked_dir and matcher.matches(rel_path, True):
+                    # 链接下的内容按原样收集，其中的符号链接不再展开
+                    artifacts.entries[rel_path] = True
+                    artifacts.roots.append(rel_path)
+                    artifacts.linked_dirs.add(rel_path)
+                    walk(parts, True)
+                elif is_dir and matcher.may_contain(parts):
+                    walk(parts, False)
+
+        if matcher.patterns:
+            walk([], False)
+        artifacts.unmatched = [matcher.patterns[i] for i in pending]
+        return artifacts
+
+    def pack_artifacts(self, work_dir: str, artifact_patterns: List[str], job_id: str,
+                       artifacts: Optional[ArtifactSet] = None) -> Optional[str]:
         """
         打包构建产物
 
@@ -33,53 +273,43 @@ class ArtifactHandler:
             work_dir: 工作目录（构建代码所在目录）
             artifact_patterns: 产物路径模式列表，如 ['dist/', 'build/*.apk']
             job_id: 任务ID
+            artifacts: 已收集的产物集合（为None时按模式收集）
 
         Returns:
-            产物tar.gz路径，如果没有产物返回None
+            产物归档路径（.tar.gz 或 .tar.zst），如果没有产物返回None
         """
         if not artifact_patterns:
             return None
 
-        # 收集所有匹配的文件和目录
-        artifacts_to_pack = []
-
-        for pattern in artifact_patterns:
-            # 去除前后空格
-            pattern = pattern.strip()
-            if not pattern:
-                continue
-
-            # 构建完整路径
-            full_pattern = os.path.join(work_dir, pattern)
-
-            # 使用glob匹配
-            matches = glob.glob(full_pattern, recursive=True)
-
-            if matches:
-                for match in matches:
-                    # 转换为相对路径
-                    rel_path = os.path.relpath(match, work_dir)
-                    artifacts_to_pack.append((match, rel_path))
-            else:
-                print(f"⚠ 产物模式未匹配到文件: {pattern}")
+        if artifacts is None:
+            artifacts = self.collect_artifacts(work_dir, artifact_patterns)
+        for pattern in artifacts.unmatched:
+            print(f"⚠ 产物模式未匹配到文件: {pattern}")
 
-        if not artifacts_to_pack:
+        if not artifacts.entries:
             print("⚠ 没有找到构建产物")
             return None
 
-        # 创建tar.gz文件
-        archive_path = os.path.join(self.artifacts_dir, f"{job_id}-artifacts.tar.gz")
+        # 创建压缩归档
+        suffix = FORMATS[self.archive_format]['suffix']
+        archive_path = os.path.join(self.artifacts_dir, f"{job_id}-artifacts{suffix}")
 
         try:
-            with tarfile.open(archive_path, 'w:gz') as tar:
-                for abs_path, rel_path in artifacts_to_pack:
-                    tar.add(abs_path, arcname=rel_path)
-                    print(f"  打包: {rel_path}")
+            with open_tar_writer(archive_path, self.archive_format, self.level, self.threads) as tar:
+                # 集合中已包含目录下的全部内容，逐项添加（不递归），每个路径只打包一次
+                for rel_path in artifacts.entries:
+                    path = artifacts.path(rel_path)
+                    # 末尾加分隔符时按链接指向的目录打包
+                    if rel_path in artifacts.linked_dirs:
+                        path += os.sep
+                    tar.add(path, arcname=rel_path, recursive=False)
+            for rel_path in artifacts.roots:
+                print(f"  打包: {rel_path}")
 
             # 获取文件大小
             size = os.path.getsize(archive_path)
             size_mb = size / (1024 * 1024)
-            print(f"✓ 产物打包完成: {archive_path} ({size_mb:.2f}MB)")
+            print(f"✓ 产物打包完成: {archive_path} ({artifacts.file_count} 个文件, {size_mb:.2f}MB)")
 
             return archive_path
 
@@ -87,35 +317,38 @@ class ArtifactHandler:
             print(f"✗ 打包产物失败: {e}")
             return None
 
-    def cleanup_source_artifacts(self, work_dir: str, artifact_patterns: List[str]):
+    def cleanup_source_artifacts(self, work_dir: str, artifact_patterns: List[str],
+                                 artifacts: Optional[ArtifactSet] = None):
         """
-        清理原始构建产物（保留tar.gz）
+        清理原始构建产物（保留打包后的归档）
 
         Args:
             work_dir: 工作目录
             artifact_patterns: 产物路径模式列表
+            artifacts: 打包时使用的产物集合（为None时按模式重新收集）
         """
         if not artifact_patterns:
             return
 
-        for pattern in artifact_patterns:
-            pattern = pattern.strip()
-            if not pattern:
-                continue
-
-            full_pattern = os.path.join(work_dir, pattern)
-            matches = glob.glob(full_pattern, recursive=True)
-
-            for match in matches:
-                try:
-                    if os.path.isfile(match):
-                        os.remove(match)
-                        print(f"  删除文件: {match}")
-                    elif os.path.isdir(match):
-                        shutil.rmtree(match)
-                        print(f"  删除目录: {match}")
-                except Exception as e:
-                    print(f"⚠ 清理失败 {match}: {e}")
+        if artifacts is None:
+            artifacts = self.collect_artifacts(work_dir, artifact_patterns)
+
+        for rel_path in artifacts.roots:
+            path = artifacts.path(rel_path)
+            try:
+                if rel_path in artifacts.linked_dirs:
+                    os.remove(path)
+                    print(f"  删除链接: {path}")
+                elif artifacts.entries[rel_path]:
+                    shutil.rmtree(path)
+                    print(f"  删除目录: {path}")
+                else:
+                    os.remove(path)
+                    print(f"  删除文件: {path}")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"⚠ 清理失败 {path}: {e}")
 
     def get_artifact_size(self, archive_path: str) -> int:
         """
@@ -154,7 +387,9 @@ class ArtifactHandler:
 
 # 测试代码
 if __name__ == '__main__':
+    import tarfile
     import tempfile
+    import time
 
     # 创建测试目录
     with tempfile.TemporaryDirectory() as temp_dir:
@@ -162,27 +397,86 @@ if __name__ == '__main__':
         artifacts_dir = os.path.join(temp_dir, 'artifacts')
 
         os.makedirs(work_dir)
-        os.makedirs(os.path.join(work_dir, 'dist'))
+        os.makedirs(os.path.join(work_dir, 'dist', 'js'))
         os.makedirs(os.path.join(work_dir, 'build'))
+        os.makedirs(os.path.join(work_dir, 'node_modules', 'dep'))
 
         # 创建测试文件
         with open(os.path.join(work_dir, 'dist', 'app.js'), 'w') as f:
             f.write('console.log("test")')
+        with open(os.path.join(work_dir, 'dist', 'js', 'vendor.js'), 'w') as f:
+            f.write('console.log("vendor")')
+        with open(os.path.join(work_dir, 'dist', '.env'), 'w') as f:
+            f.write('HIDDEN=1')
         with open(os.path.join(work_dir, 'build', 'app.apk'), 'w') as f:
             f.write('fake apk')
+        with open(os.path.join(work_dir, 'build', '.hidden.apk'), 'w') as f:
+            f.write('hidden apk')
+        with open(os.path.join(work_dir, 'node_modules', 'dep', 'index.js'), 'w') as f:
+            f.write('module.exports = 1')
 
-        # 测试打包
         handler = ArtifactHandler(artifacts_dir)
-        archive = handler.pack_artifacts(work_dir, ['dist/', 'build/*.apk'], 'test-job-001')
-
-        if archive:
-            print(f"产物大小: {handler.get_artifact_size(archive)} 字节")
-            print(f"产物文件: {archive}")
-
-            # 测试清理
-            handler.cleanup_source_artifacts(work_dir, ['dist/', 'build/*.apk'])
 
-            # 测试删除
-            handler.delete_artifact(archive)
+        # 模式匹配（与glob语义一致）
+        def collected(patterns):
+            return sorted(handler.collect_artifacts(work_dir, patterns).entries)
+
+        assert collected(['dist/']) == ['dist', 'dist/.env', 'dist/app.js', 'dist/js', 'dist/js/vendor.js']
+        assert collected(['build/*.apk']) == ['build/app.apk'], "通配符不匹配隐藏文件"
+        assert collected(['**/*.js']) == ['dist/app.js', 'dist/js/vendor.js', 'node_modules/dep/index.js']
+        assert collected(['dist/**/*.js']) == ['dist/app.js', 'dist/js/vendor.js']
+        assert collected(['build/app.apk/']) == [], "以/结尾只匹配目录"
+        assert collected(['../work', '/etc/passwd']) == [], "不能超出工作目录"
+        artifacts = handler.collect_artifacts(work_dir, ['dist/**/*.js', 'missing/*'])
+        assert artifacts.unmatched == ['missing/*'] and artifacts.roots == ['dist/app.js', 'dist/js/vendor.js']
+
+        # 以/结尾的模式匹配到目录链接时收集链接指向的内容，链接本身匹配时按链接收集
+        os.symlink('dist', os.path.join(work_dir, 'distlink'))
+        os.symlink(os.path.dirname(work_dir), os.path.join(work_dir, 'parent'))
+        artifacts = handler.collect_artifacts(work_dir, ['distlink/', 'parent/'])
+        assert sorted(artifacts.entries) == ['distlink', 'distlink/.env', 'distlink/app.js',
+                                             'distlink/js', 'distlink/js/vendor.js']
+        assert artifacts.unmatched == ['parent/'], "不展开指向工作目录外的链接"
+        assert collected(['distlink']) == ['distlink']
+        archive = handler.pack_artifacts(work_dir, ['distlink/'], 'test-job-link', artifacts)
+        with tarfile.open(archive) as tar:
+            assert tar.getmember('distlink').isdir() and 'distlink/js/vendor.js' in tar.getnames()
+        handler.cleanup_source_artifacts(work_dir, ['distlink/'], artifacts)
+        assert not os.path.lexists(os.path.join(work_dir, 'distlink'))
+        assert os.path.exists(os.path.join(work_dir, 'dist', 'app.js'))
+        os.remove(os.path.join(work_dir, 'parent'))
+        handler.delete_artifact(archive)
+
+        # 模式重叠时每个文件只打包一次
+        patterns = ['dist/', 'dist/**/*.js', 'dist/*', 'build/*.apk']
+        artifacts = handler.collect_artifacts(work_dir, patterns)
+        assert artifacts.roots == ['build/app.apk', 'dist']
+        archive = handler.pack_artifacts(work_dir, patterns, 'test-job-001', artifacts)
+        with tarfile.open(archive) as tar:
+            names = tar.getnames()
+        print(f"归档内容: {names}")
+        assert len(names) == len(set(names)) == 6 and 'dist/js/vendor.js' in names
+
+        print(f"产物大小: {handler.get_artifact_size(archive)} 字节")
+        print(f"产物文件: {archive}")
+
+        # 测试清理（与打包共用同一集合）
+        handler.cleanup_source_artifacts(work_dir, patterns, artifacts)
+        assert not os.path.exists(os.path.join(work_dir, 'dist'))
+        assert sorted(os.listdir(os.path.join(work_dir, 'build'))) == ['.hidden.apk']
+
+        # 测试删除
+        handler.delete_artifact(archive)
+
+        # 大目录：只遍历可能包含匹配项的目录
+        for i in range(200):
+            os.makedirs(os.path.join(work_dir, 'node_modules', f'pkg{i}'))
+            for j in range(50):
+                open(os.path.join(work_dir, 'node_modules', f'pkg{i}', f'{j}.js'), 'w').close()
+        os.makedirs(os.path.join(work_dir, 'out'))
+        open(os.path.join(work_dir, 'out', 'app.bin'), 'w').close()
+        start = time.perf_counter()
+        assert collected(['out/', 'out/**/*.bin']) == ['out', 'out/app.bin']
+        print(f"跳过10000个文件的目录收集产物: {(time.perf_counter() - start) * 1000:.1f} 毫秒")
 
         print("\n✓ 所有测试通过")
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+内容寻址源码存储
+按文件内容的sha256保存源码块，供upload模式增量上传复用
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Tuple, Any, BinaryIO
+
+# sha256十六进制摘要
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# 读写块大小
+CHUNK_SIZE = 1024 * 1024
+
+
+def validate_relpath(path: str) -> str:
+    """
+    校验清单/归档中的相对路径，拒绝绝对路径和目录穿越
+
+    Args:
+        path: 相对路径
+
+    Returns:
+        规范化后的相对路径
+
+    Raises:
+        ValueError: 路径不安全
+    """
+    if not path or '\x00' in path:
+        raise ValueError(f"非法路径: {path!r}")
+
+    normalized = os.path.normpath(path.replace('\\', '/'))
+    if normalized.startswith('/') or normalized == '..' or normalized.startswith('../'):
+        raise ValueError(f"路径越界: {path}")
+    if normalized == '.':
+        raise ValueError(f"非法路径: {path}")
+
+    return normalized
+
+
+def validate_symlink(path: str, link_target: str) -> str:
+    """
+    校验清单中的符号链接，拒绝指向绝对路径或源码树之外的链接
+
+    Args:
+        path: 链接的相对路径（已校验）
+        link_target: 链接指向的路径
+
+    Returns:
+        链接指向的路径
+
+    Raises:
+        ValueError: 链接不安全
+    """
+    if not isinstance(link_target, str) or not link_target or '\x00' in link_target:
+        raise ValueError(f"非法符号链接: {path} -> {link_target!r}")
+    if os.path.isabs(link_target):
+        raise ValueError(f"符号链接指向绝对路径: {path} -> {link_target}")
+
+    resolved = os.path.normpath(os.path.join(os.path.dirname(path), link_target))
+    if resolved == '..' or resolved.startswith('../'):
+        raise ValueError(f"符号链接越界: {path} -> {link_target}")
+    return link_target
+
+
+def _check_no_symlink_parents(dest_root: str, path: str):
+    """
+    确认路径的各级父目录（以及目标本身）都不是符号链接，避免通过链接写到目标目录之外
+
+    Raises:
+        ValueError: 路径经过符号链接
+    """
+    current = dest_root
+    for part in path.split('/'):
+        current = os.path.join(current, part)
+        if os.path.islink(current):
+            raise ValueError(f"路径经过符号链接: {path}")
+
+
+class BlobStore:
+    """内容寻址的源码块存储"""
+
+    def __init__(self, blobs_dir: str):
+        """
+        初始化存储
+
+        Args:
+            blobs_dir: 存储目录，按摘要前两位分片
+        """
+        self.blobs_dir = blobs_dir
+        Path(blobs_dir).mkdir(parents=True, exist_ok=True)
+
+    def blob_path(self, digest: str) -> str:
+        """
+        获取摘要对应的存储路径
+
+        Raises:
+            ValueError: 摘要格式非法
+        """
+        if not DIGEST_RE.match(digest or ''):
+            raise ValueError(f"非法摘要: {digest!r}")
+        return os.path.join(self.blobs_dir, digest[:2], digest[2:])
+
+    def has_blob(self, digest: str) -> bool:
+        """检查块是否存在"""
+        return os.path.exists(self.blob_path(digest))
+
+    def find_missing(self, digests: List[str]) -> List[str]:
+        """
+        找出存储中缺失的块
+
+        已存在的块会刷新访问时间，避免在提交任务前被清理
+
+        Args:
+            digests: 摘要列表
+
+        Returns:
+            缺失的摘要列表（去重、保持顺序）
+        """
+        missing = []
+        seen = set()
+
+        for digest in digests:
+            if digest in seen:
+                continue
+            seen.add(digest)
+
+            path = self.blob_path(digest)
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                missing.append(digest)
+
+        return missing
+
+    def put_blob(self, digest: str, stream: BinaryIO) -> int:
+        """
+        写入一个块（流式写入临时文件，校验摘要后原子替换）
+
+        Args:
+            digest: 期望的sha256摘要
+            stream: 可读的二进制流
+
+        Returns:
+            写入的字节数
+
+        Raises:
+            ValueError: 内容与摘要不一致
+        """
+        target = self.blob_path(digest)
+        Path(target).parent.mkdir(parents=True, exist_ok=True)
+
+        hasher = hashlib.sha256()
+        size = 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            if hasher.hexdigest() != digest:
+                raise ValueError(f"块内容与摘要不一致: {digest}")
+
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, target)
+            return size
+
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def load_manifest(self, manifest_file: str) -> Dict[str, Any]:
+        """读取清单文件"""
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def check_manifest(self, manifest: Dict[str, Any]) -> List[str]:
+        """
+        校验清单格式并返回缺失的块
+
+        Args:
+            manifest: {'files': [{'path', 'sha256', 'mode'} | {'path', 'symlink'}], 'dirs': [...]}
+
+        Returns:
+            缺失的摘要列表
+
+        Raises:
+            ValueError: 清单格式非法
+        """
+        files = manifest.get('files')
+        if not isinstance(files, list):
+            raise ValueError("清单缺少files列表")
+
+        digests = []
+        for entry in files:
+            if not isinstance(entry, dict) or 'path' not in entry:
+                raise ValueError(f"非法清单条目: {entry!r}")
+            path = validate_relpath(entry['path'])
+            if 'symlink' in entry:
+                validate_symlink(path, entry['symlink'])
+                continue
+            digests.append(entry.get('sha256', ''))
+
+        for dir_path in manifest.get('dirs', []):
+            validate_relpath(dir_path)
+
+        return self.find_missing(digests)
+
+    def materialize(self, manifest: Dict[str, Any], dest_dir: str) -> Tuple[int, int]:
+        """
+        按清单在目标目录还原源码树
+
+        块以复制方式还原，构建对文件的修改不会影响存储
+
+        Args:
+            manifest: 清单
+            dest_dir: 目标目录
+
+        Returns:
+            (文件数, 总字节数)
+        """
+        Path(dest_dir).mkdir(parents=True, exist_ok=True)
+        dest_root = os.path.realpath(dest_dir)
+
+        for dir_path in manifest.get('dirs', []):
+            path = validate_relpath(dir_path)
+            _check_no_symlink_parents(dest_root, path)
+            Path(dest_root, path).mkdir(parents=True, exist_ok=True)
+
+        file_count = 0
+        total_bytes = 0
+
+        for entry in manifest['files']:
+            path = validate_relpath(entry['path'])
+            # 之前的条目可能创建了符号链接，不能经由链接写到目标目录之外（与tar_stream相同）
+            _check_no_symlink_parents(dest_root, path)
+            target = os.path.join(dest_root, path)
+            Path(target).parent.mkdir(parents=True, exist_ok=True)
+
+            if 'symlink' in entry:
+                link_target = validate_symlink(path, entry['symlink'])
+                # 按已还原的文件系统状态解析（经过其他链接时可能越界）
+                resolved = os.path.realpath(os.path.join(os.path.dirname(target), link_target))
+                if resolved != dest_root and not resolved.startswith(dest_root + os.sep):
+                    raise ValueError(f"符号链接越界: {path} -> {link_target}")
+                os.symlink(link_target, target)
+                continue
+
+            blob = self.blob_path(entry['sha256'])
+            shutil.copyfile(blob, target)
+            os.chmod(target, entry.get('mode', 0o644) & 0o777)
+
+            file_count += 1
+            total_bytes += os.path.getsize(target)
+
+        return file_count, total_bytes
+
+    def prune(self, max_age_days: int) -> Tuple[int, int]:
+        """
+        清理长时间未被引用的块
+
+        Args:
+            max_age_days: 超过该天数未访问的块将被删除
+
+        Returns:
+            (删除的块数, 释放的字节数)
+        """
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        freed = 0
+
+        for shard in os.scandir(self.blobs_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                    if stat.st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                        freed += stat.st_size
+                except FileNotFoundError:
+                    continue
+
+        return removed, freed
+
+
+# 测试代码
+if __name__ == '__main__':
+    import io
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = BlobStore(os.path.join(temp_dir, 'blobs'))
+
+        content = b'print("hello")\n'
+        digest = hashlib.sha256(content).hexdigest()
+
+        assert store.find_missing([digest]) == [digest]
+        store.put_blob(digest, io.BytesIO(content))
+        assert store.find_missing([digest]) == []
+
+        manifest = {
+            'files': [
+                {'path': 'src/main.py', 'sha256': digest, 'mode': 0o755},
+                {'path': 'src/link.py', 'symlink': 'main.py'},
+            ],
+            'dirs': ['empty'],
+        }
+        assert store.check_manifest(manifest) == []
+
+        dest = os.path.join(temp_dir, 'repo')
+        count, size = store.materialize(manifest, dest)
+        print(f"还原: {count} 个文件, {size} 字节")
+
+        try:
+            validate_relpath('../etc/passwd')
+            raise AssertionError('应拒绝目录穿越')
+        except ValueError:
+            pass
+
+        # 符号链接不能指向源码树之外，也不能经由链接写到目标目录之外
+        for link_target in ('/tmp/outside', '../../outside', 'sub/../../../outside'):
+            try:
+                store.check_manifest({'files': [{'path': 'src/a', 'symlink': link_target}]})
+                raise AssertionError(f'应拒绝越界符号链接: {link_target}')
+            except ValueError as e:
+                print(f"拒绝: {e}")
+        assert store.check_manifest({'files': [{'path': 'src/a', 'symlink': '../README'}]}) == []
+
+        outside = os.path.join(temp_dir, 'outside')
+        os.makedirs(outside)
+        os.symlink(outside, os.path.join(dest, 'escape'))
+        try:
+            store.materialize({'files': [{'path': 'escape/x', 'sha256': digest}]}, dest)
+            raise AssertionError('应拒绝经由符号链接写入')
+        except ValueError as e:
+            print(f"拒绝: {e}")
+        try:
+            store.materialize({'files': [{'path': 'src/link.py', 'sha256': digest}]}, dest)
+            raise AssertionError('应拒绝覆盖符号链接')
+        except ValueError as e:
+            print(f"拒绝: {e}")
+        try:
+            store.materialize({'files': [{'path': 'up', 'symlink': '.'}, {'path': 'chain/up', 'symlink': '..'},
+                                         {'path': 'chain/a', 'symlink': 'up/../outside'}]},
+                              os.path.join(temp_dir, 'repo2'))
+            raise AssertionError('应拒绝经由其他链接越界的符号链接')
+        except ValueError as e:
+            print(f"拒绝: {e}")
+        assert os.listdir(outside) == []
+
+        print("\n✓ 所有测试通过")
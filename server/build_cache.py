@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+构建结果缓存与重复任务合并
+源码内容、构建脚本和产物配置都相同的任务结果相同：
+- 命中最近一次成功构建时新任务直接完成，复用其日志和产物，不再执行构建
+- 相同任务正在排队或运行时新任务跟随该任务，共享其日志、状态和产物
+
+内容确定的源码标识（可用于缓存和合并）：
+- 增量上传：规范化后的源码清单
+- 代码包上传/流式上传：代码包的sha256
+- git模式：仓库URL + commit sha（分支名会移动，worker检出后才能确定）
+
+内容可变的源码标识（rsync的workspace、git分支）只能与尚未开始的任务合并：
+排队中的任务开始时才读取源码，一定能看到后提交任务的代码
+"""
+
+import re
+import json
+import hashlib
+from typing import Any, Dict, List, Optional
+
+# 完整的commit sha（短sha和分支名不能作为源码标识）
+_COMMIT_SHA_RE = re.compile(r'^[0-9a-f]{40}$')
+
+
+def manifest_source_key(manifest: Dict[str, Any]) -> str:
+    """
+    增量上传清单的源码标识（与清单中文件的顺序无关）
+
+    Args:
+        manifest: {'files': [{'path', 'sha256', 'mode', ...}, ...]}
+    """
+    files = sorted(manifest.get('files', []), key=lambda f: f.get('path', ''))
+    canonical = json.dumps(files, sort_keys=True, separators=(',', ':'))
+    return 'manifest:' + hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def archive_source_key(sha256: str) -> str:
+    """代码包的源码标识（gzip和zstd打包同一份代码得到不同的标识，只会少命中）"""
+    return f'archive:{sha256}'
+
+
+def git_source_key(repo: str, commit: Optional[str]) -> Optional[str]:
+    """git仓库的源码标识，commit不是完整sha时返回None"""
+    if not commit or not _COMMIT_SHA_RE.match(commit.lower()):
+        return None
+    return f'git:{repo}@{commit.lower()}'
+
+
+def git_branch_source_key(repo: str, branch: str) -> str:
+    """git分支的源码标识（内容可变）"""
+    return f'git-branch:{repo}#{branch}'
+
+
+def workspace_source_key(workspace: str) -> str:
+    """rsync workspace的源码标识（内容可变）"""
+    return f'workspace:{workspace}'
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件的sha256"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def compute_build_key(source_key: str, script: str, artifact_patterns: Optional[List[str]]) -> str:
+    """
+    计算构建键
+
+    Args:
+        source_key: 源码标识（见 *_source_key）
+        script: 构建脚本
+        artifact_patterns: 产物路径模式
+    """
+    payload = json.dumps([source_key, script, list(artifact_patterns or [])], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# 测试代码
+if __name__ == '__main__':
+    manifest = {'files': [
+        {'path': 'b.py', 'sha256': 'b' * 64, 'mode': 420},
+        {'path': 'a.py', 'sha256': 'a' * 64, 'mode': 420},
+    ]}
+    reordered = {'files': list(reversed(manifest['files']))}
+    source = manifest_source_key(manifest)
+    print(f"清单标识: {source}")
+    assert source == manifest_source_key(reordered)
+
+    key = compute_build_key(source, 'make test', ['dist/'])
+    assert key == compute_build_key(source, 'make test', ['dist/'])
+    assert key != compute_build_key(source, 'make test', [])
+    assert key != compute_build_key(source, 'make', ['dist/'])
+    print(f"构建键: {key}")
+
+    assert git_source_key('https://example.com/r.git', 'main') is None
+    assert git_source_key('https://example.com/r.git', 'abc123') is None
+    assert git_source_key('https://example.com/r.git', 'A' * 40) == f"git:https://example.com/r.git@{'a' * 40}"
+    assert git_branch_source_key('https://example.com/r.git', 'main') != git_source_key('https://example.com/r.git', 'a' * 40)
+
+    print("\n✓ 所有测试通过")
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+构建进程执行器
+边运行边把输出按块写入日志文件，内存占用与输出量无关；
+构建脚本在独立进程组中运行，超时或异常时整组终止（包括后台子进程）；
+整组可以被暂停（SIGSTOP）和恢复（SIGCONT），暂停时间不计入超时；
+结束后通过wait4记录脚本进程树的CPU时间和峰值内存
+"""
+
+import os
+import time
+import signal
+import select
+import resource
+import subprocess
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+# 每次读取的最大字节数
+CHUNK_SIZE = 64 * 1024
+
+# 无输出时检查进程状态的间隔（秒）
+POLL_INTERVAL = 1.0
+
+# SIGTERM后等待进程组退出的时间（秒），超过后SIGKILL
+KILL_GRACE = 5.0
+
+
+class BuildRunner:
+    """在独立进程组中执行构建脚本，流式写日志并强制超时"""
+
+    def __init__(self, script: str, cwd: str, log_file: str, timeout: float,
+                 env: Optional[Dict[str, str]] = None, on_poll: Optional[Callable[[], None]] = None,
+                 cgroup_procs: Optional[str] = None):
+        """
+        初始化执行器
+
+        Args:
+            script: 构建脚本（shell命令）
+            cwd: 工作目录
+            log_file: 日志文件路径（追加写入）
+            timeout: 超时时间（秒）
+            env: 构建环境变量（None表示继承worker环境）
+            on_poll: 运行期间约每 POLL_INTERVAL 秒调用一次的回调（检查抢占请求等）
+            cgroup_procs: 构建进程要加入的cgroup的cgroup.procs文件（None表示不加入）
+        """
+        self.script = script
+        self.cwd = cwd
+        self.log_file = log_file
+        self.timeout = timeout
+        self.env = env
+        self.on_poll = on_poll
+        self.cgroup_procs = cgroup_procs
+        self.process: Optional[subprocess.Popen] = None
+        self.output_bytes = 0
+        self.paused_seconds = 0.0
+        self.run_seconds = 0.0
+        self.rusage: Optional[resource.struct_rusage] = None
+
+    @property
+    def pid(self) -> Optional[int]:
+        """构建进程PID（同时也是进程组ID）"""
+        return self.process.pid if self.process else None
+
+    def run(self) -> int:
+        """
+        执行构建脚本直到结束
+
+        Returns:
+            退出码
+
+        Raises:
+            subprocess.TimeoutExpired: 超时（进程组已被终止）
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        if self.cgroup_procs:
+            # 由shell把自身加入cgroup后再exec构建脚本（worker有多个线程，preexec_fn可能在exec前死锁）
+            args = ['/bin/sh', '-c', 'echo $$ > "$1" && exec /bin/sh -c "$0"', self.script, self.cgroup_procs]
+        else:
+            args = ['/bin/sh', '-c', self.script]
+        self.process = subprocess.Popen(
+            args,
+            cwd=self.cwd,
+            env=self.env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+        fd = self.process.stdout.fileno()
+        last_byte = b'\n'
+        next_poll = time.monotonic()
+
+        try:
+            with open(self.log_file, 'ab', buffering=0) as log:
+                while True:
+                    if self.on_poll and time.monotonic() >= next_poll:
+                        self.on_poll()
+                        next_poll = time.monotonic() + POLL_INTERVAL
+
+                    remaining = deadline + self.paused_seconds - time.monotonic()
+                    if remaining <= 0:
+                        self._terminate_group()
+                        raise subprocess.TimeoutExpired(self.script, self.timeout)
+
+                    ready, _, _ = select.select([fd], [], [], min(remaining, POLL_INTERVAL))
+                    if ready:
+                        chunk = os.read(fd, CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        log.write(chunk)
+                        self.output_bytes += len(chunk)
+                        last_byte = chunk[-1:]
+                    elif self._reap(blocking=False):
+                        # 脚本已退出但后台子进程仍持有输出管道，终止它们以结束读取
+                        self._kill_group(signal.SIGKILL)
+
+                if last_byte != b'\n':
+                    log.write(b'\n')
+
+            self._reap(blocking=True)
+            returncode = self.process.returncode
+            self.run_seconds = time.monotonic() - started - self.paused_seconds
+            return returncode
+
+        finally:
+            if self.process.poll() is None:
+                self._terminate_group()
+            self.process.stdout.close()
+
+    def _reap(self, blocking: bool) -> bool:
+        """
+        回收构建进程，同时取得其进程树（已回收的子孙进程）的资源用量
+
+        Returns:
+            进程是否已退出
+        """
+        if self.process.returncode is not None:
+            return True
+        pid, status, rusage = os.wait4(self.process.pid, 0 if blocking else os.WNOHANG)
+        if pid == 0:
+            return False
+        self.rusage = rusage
+        if os.WIFEXITED(status):
+            self.process.returncode = os.WEXITSTATUS(status)
+        else:
+            self.process.returncode = -os.WTERMSIG(status)
+        return True
+
+    @contextmanager
+    def suspended(self) -> Iterator[None]:
+        """暂停整个进程组，退出时恢复；暂停时长累计到 paused_seconds，不计入超时"""
+        self._kill_group(signal.SIGSTOP)
+        paused_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self._kill_group(signal.SIGCONT)
+            self.paused_seconds += time.monotonic() - paused_at
+
+    def _terminate_group(self):
+        """先SIGTERM整个进程组，超过宽限期仍未退出则SIGKILL"""
+        self._kill_group(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=KILL_GRACE)
+        except subprocess.TimeoutExpired:
+            pass
+        self._kill_group(signal.SIGKILL)
+        self.process.wait()
+
+    def _kill_group(self, sig: int):
+        """向构建进程组发送信号（进程组已全部退出时忽略）"""
+        try:
+            os.killpg(self.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+
+# 测试代码
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_path = os.path.join(temp_dir, 'build.log')
+
+        # 大量输出：内存占用保持平稳
+        runner = BuildRunner('head -c 50000000 /dev/zero | tr "\\0" "x"; echo; exit 3', temp_dir, log_path, 60)
+        code = runner.run()
+        print(f"退出码: {code}, 输出: {runner.output_bytes} 字节, 日志: {os.path.getsize(log_path)} 字节")
+        assert code == 3
+
+        # 资源用量包含子进程
+        runner = BuildRunner('python3 -c "x = bytearray(64 * 1024 * 1024); sum(range(3000000))"', temp_dir, log_path, 60)
+        assert runner.run() == 0
+        print(f"CPU: {runner.rusage.ru_utime:.2f}s 用户态, {runner.rusage.ru_stime:.2f}s 内核态, "
+              f"峰值内存: {runner.rusage.ru_maxrss // 1024} MB, 运行: {runner.run_seconds:.2f}s")
+        assert runner.rusage.ru_maxrss >= 64 * 1024
+
+        # 后台子进程持有管道不会阻塞
+        start = time.monotonic()
+        assert BuildRunner('sleep 300 & echo started', temp_dir, log_path, 60).run() == 0
+        print(f"✓ 后台进程已终止 ({time.monotonic() - start:.1f} 秒)")
+
+        # 超时后终止整个进程组
+        pid_file = os.path.join(temp_dir, 'child.pid')
+        runner = BuildRunner(f'sh -c "echo $$ > {pid_file}; sleep 300"; echo never', temp_dir, log_path, 2)
+        try:
+            runner.run()
+            raise AssertionError("应超时")
+        except subprocess.TimeoutExpired:
+            with open(pid_file) as f:
+                child = int(f.read())
+            try:
+                os.kill(child, 0)
+                raise AssertionError("子进程仍在运行")
+            except ProcessLookupError:
+                print("✓ 超时后进程组已终止")
+
+        # 暂停期间不输出，暂停时间不计入超时
+        def pause_once():
+            if not runner.paused_seconds:
+                with runner.suspended():
+                    time.sleep(2)
+
+        runner = BuildRunner('for i in 1 2 3; do date +%s; sleep 0.5; done', temp_dir, log_path, 2.5,
+                             on_poll=pause_once)
+        assert runner.run() == 0
+        print(f"✓ 暂停 {runner.paused_seconds:.1f} 秒后恢复，未超时")
+
+        # 加入cgroup：构建进程在exec脚本前写入自己的PID，脚本参数原样传递
+        procs = os.path.join(temp_dir, 'cgroup.procs')
+        runner = BuildRunner('echo "$0 \'quoted\' $$"', temp_dir, log_path, 10, cgroup_procs=procs)
+        assert runner.run() == 0
+        with open(procs) as f:
+            assert int(f.read()) == runner.pid
+        with open(log_path, 'rb') as f:
+            assert f.read().endswith(f"/bin/sh 'quoted' {runner.pid}\n".encode())
+        print("✓ 构建进程已加入cgroup")
+
+        print("\n✓ 所有测试通过")
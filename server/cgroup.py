@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+构建进程的cgroup v2统计与限制
+每个构建在父cgroup下创建独立的子cgroup：
+- 统计整个进程树（包括脱离进程组的后台进程）的CPU时间、内存峰值和磁盘IO
+- 按需设置CPU上限（cpu.max）和内存上限（memory.max，超出时整组OOM终止）
+- 构建结束后通过cgroup.kill清理残留进程
+
+父cgroup需要worker有写权限（root，或systemd的Delegate=yes），
+没有权限或系统不是cgroup v2时不可用，调用方退回getrusage统计
+"""
+
+import os
+import time
+import signal
+from typing import Any, Dict, Optional
+
+# CPU配额周期（微秒）
+CPU_PERIOD_US = 100000
+
+# 需要在子cgroup中启用的控制器
+CONTROLLERS = ('cpu', 'memory', 'io')
+
+# 删除cgroup时等待进程退出的时间（秒）
+DESTROY_TIMEOUT = 5.0
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _write(path: str, value: str) -> bool:
+    try:
+        with open(path, 'w') as f:
+            f.write(value)
+        return True
+    except OSError:
+        return False
+
+
+def _parse_flat_keyed(text: Optional[str]) -> Dict[str, int]:
+    """解析 cpu.stat / memory.events 这类 "key value" 格式"""
+    result = {}
+    for line in (text or '').splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].isdigit():
+            result[parts[0]] = int(parts[1])
+    return result
+
+
+class BuildCgroup:
+    """单个构建的cgroup"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.cpu_limit: Optional[float] = None
+        self.memory_limit_mb: Optional[int] = None
+
+    def set_limits(self, cpus: Optional[float] = None, memory_mb: Optional[int] = None):
+        """
+        设置CPU和内存上限（对应控制器未启用时忽略，实际生效的上限记录在cpu_limit/memory_limit_mb）
+
+        Args:
+            cpus: CPU核数上限
+            memory_mb: 内存上限（MB）
+        """
+        if cpus and _write(f"{self.path}/cpu.max", f"{int(cpus * CPU_PERIOD_US)} {CPU_PERIOD_US}"):
+            self.cpu_limit = cpus
+        if memory_mb and _write(f"{self.path}/memory.max", str(memory_mb * 1024 * 1024)):
+            self.memory_limit_mb = memory_mb
+            # 超出内存上限时终止整个构建，而不是只杀掉其中一个进程
+            _write(f"{self.path}/memory.oom.group", '1')
+
+    @property
+    def procs_file(self) -> str:
+        """写入PID即可把进程加入该cgroup的文件（由构建进程在exec脚本前自己写入，见BuildRunner）"""
+        return f"{self.path}/cgroup.procs"
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        读取统计信息（只包含可用的项）
+
+        Returns:
+            {'cpu_user_seconds', 'cpu_system_seconds', 'memory_peak_kb',
+             'io_read_bytes', 'io_write_bytes', 'oom_killed'}
+        """
+        result: Dict[str, Any] = {}
+
+        cpu = _parse_flat_keyed(_read(f"{self.path}/cpu.stat"))
+        if 'user_usec' in cpu:
+            result['cpu_user_seconds'] = cpu['user_usec'] / 1e6
+            result['cpu_system_seconds'] = cpu['system_usec'] / 1e6
+
+        peak = _read(f"{self.path}/memory.peak")
+        if peak and peak.strip().isdigit():
+            result['memory_peak_kb'] = int(peak) // 1024
+
+        io = _read(f"{self.path}/io.stat")
+        if io is not None:
+            read_bytes = write_bytes = 0
+            for line in io.splitlines():
+                for field in line.split()[1:]:
+                    key, _, value = field.partition('=')
+                    if key == 'rbytes':
+                        read_bytes += int(value)
+                    elif key == 'wbytes':
+                        write_bytes += int(value)
+            result['io_read_bytes'] = read_bytes
+            result['io_write_bytes'] = write_bytes
+
+        events = _read(f"{self.path}/memory.events")
+        if events is not None:
+            result['oom_killed'] = 1 if _parse_flat_keyed(events).get('oom_kill') else 0
+
+        return result
+
+    def destroy(self):
+        """终止cgroup中残留的进程并删除cgroup"""
+        if not _write(f"{self.path}/cgroup.kill", '1'):
+            # 内核不支持cgroup.kill（5.14之前）
+            for pid in (_read(f"{self.path}/cgroup.procs") or '').split():
+                try:
+                    os.kill(int(pid), signal.SIGKILL)
+                except (ProcessLookupError, ValueError):
+                    pass
+
+        deadline = time.monotonic() + DESTROY_TIMEOUT
+        while True:
+            try:
+                os.rmdir(self.path)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                # 进程尚未完全退出
+                if time.monotonic() >= deadline:
+                    print(f"⚠ 删除cgroup失败: {self.path}")
+                    return
+                time.sleep(0.1)
+
+
+class CgroupManager:
+    """在父cgroup下为每个构建创建子cgroup"""
+
+    def __init__(self, parent: str):
+        """
+        初始化cgroup管理器
+
+        Args:
+            parent: 父cgroup路径（如 /sys/fs/cgroup/remote-ci），不存在时自动创建
+        """
+        self.parent = parent
+        self.available = self._setup()
+
+    def _setup(self) -> bool:
+        """创建父cgroup并为子cgroup启用控制器"""
+        try:
+            os.makedirs(self.parent, exist_ok=True)
+        except OSError as e:
+            print(f"⚠ cgroup不可用（{e}），资源统计退回getrusage")
+            return False
+
+        if not os.path.exists(f"{self.parent}/cgroup.procs") or \
+                not os.path.exists(f"{self.parent}/cgroup.subtree_control"):
+            print(f"⚠ {self.parent} 不是cgroup v2目录，资源统计退回getrusage")
+            return False
+
+        available = (_read(f"{self.parent}/cgroup.controllers") or '').split()
+        for controller in CONTROLLERS:
+            if controller in available:
+                _write(f"{self.parent}/cgroup.subtree_control", f"+{controller}")
+        return True
+
+    @property
+    def controllers(self) -> list:
+        """子cgroup中已启用的控制器"""
+        return (_read(f"{self.parent}/cgroup.subtree_control") or '').split()
+
+    def create(self, job_id: str) -> Optional[BuildCgroup]:
+        """
+        为构建创建cgroup
+
+        Returns:
+            BuildCgroup，不可用或创建失败返回None
+        """
+        if not self.available:
+            return None
+        path = f"{self.parent}/job-{job_id}"
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as e:
+            print(f"⚠ 创建cgroup失败: {e}")
+            return None
+        return BuildCgroup(path)
+
+
+# 测试代码
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    from server.build_runner import BuildRunner
+
+    parent = sys.argv[1] if len(sys.argv) > 1 else '/sys/fs/cgroup/remote-ci-test'
+    manager = CgroupManager(parent)
+    print(f"cgroup可用: {manager.available}, 控制器: {manager.controllers if manager.available else []}")
+
+    if manager.available:
+        cgroup = manager.create('demo')
+        cgroup.set_limits(cpus=1, memory_mb=256)
+        print(f"生效的上限: CPU {cgroup.cpu_limit}, 内存 {cgroup.memory_limit_mb} MB")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # 脱离进程组的后台进程也会被统计并在结束后清理
+            runner = BuildRunner('setsid sleep 300 >/dev/null 2>&1 & python3 -c "sum(range(5000000))"', temp_dir,
+                                 os.path.join(temp_dir, 'build.log'), 60, cgroup_procs=cgroup.procs_file)
+            assert runner.run() == 0
+            stats = cgroup.stats()
+            print(f"统计: {stats}")
+            assert stats['cpu_user_seconds'] > 0
+            cgroup.destroy()
+            assert not os.path.exists(cgroup.path)
+
+        os.rmdir(parent)
+
+    print("\n✓ 所有测试通过")
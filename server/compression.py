@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+归档压缩格式
+统一处理代码包和产物的gzip/zstd压缩、格式识别和内容协商
+
+zstd依赖可选的 zstandard 包，未安装时自动回退到gzip
+"""
+
+import io
+import zlib
+import tarfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 格式定义：文件后缀、MIME类型
+FORMATS = {
+    'gzip': {'suffix': '.tar.gz', 'mimetype': 'application/gzip'},
+    'zstd': {'suffix': '.tar.zst', 'mimetype': 'application/zstd'},
+}
+
+# MIME类型 -> 格式
+MIMETYPE_FORMATS = {
+    'application/gzip': 'gzip',
+    'application/x-gzip': 'gzip',
+    'application/zstd': 'zstd',
+    'application/x-zstd': 'zstd',
+}
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def available_formats() -> List[str]:
+    """当前环境支持的压缩格式"""
+    return ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+
+
+def resolve_format(fmt: str) -> str:
+    """校验格式名，zstd不可用时回退为gzip"""
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的压缩格式: {fmt}")
+    if fmt == 'zstd' and zstandard is None:
+        print("⚠ 未安装zstandard，回退为gzip压缩")
+        return 'gzip'
+    return fmt
+
+
+def detect_format(head: bytes) -> Optional[str]:
+    """根据文件头识别压缩格式，未压缩或无法识别返回None"""
+    if head.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    return None
+
+
+def format_of_path(path: str) -> str:
+    """根据文件后缀判断格式"""
+    return 'zstd' if path.endswith(FORMATS['zstd']['suffix']) else 'gzip'
+
+
+def negotiate_format(accept_header: Optional[str], stored_format: str) -> str:
+    """
+    根据Accept头决定返回格式
+
+    只有客户端显式声明接受 application/zstd 时才返回zstd，
+    旧客户端（Accept: */* 或不带Accept）始终得到gzip
+
+    Args:
+        accept_header: 请求的Accept头
+        stored_format: 文件的存储格式
+
+    Returns:
+        响应使用的格式
+    """
+    if stored_format != 'zstd':
+        return stored_format
+
+    for part in (accept_header or '').split(','):
+        fields = part.strip().split(';')
+        if MIMETYPE_FORMATS.get(fields[0].strip().lower()) != 'zstd':
+            continue
+        quality = 1.0
+        for param in fields[1:]:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            return 'zstd'
+
+    return 'gzip'
+
+
+def accepts_encoding(accept_encoding: Optional[str], encoding: str) -> bool:
+    """
+    客户端是否接受指定的Content-Encoding
+
+    Args:
+        accept_encoding: 请求的Accept-Encoding头
+        encoding: 编码名（gzip, zstd）
+
+    Returns:
+        显式列出该编码（或 *）且q值大于0时为True
+    """
+    accepted = False
+    for part in (accept_encoding or '').split(','):
+        fields = part.strip().split(';')
+        name = fields[0].strip().lower()
+        if name not in (encoding, '*'):
+            continue
+        quality = 1.0
+        for param in fields[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name == encoding:
+            # 显式列出的编码优先于 *
+            return quality > 0
+        accepted = quality > 0
+    return accepted
+
+
+@contextmanager
+def open_tar_writer(path: str, fmt: str, level: Optional[int] = None, threads: int = -1) -> Iterator[tarfile.TarFile]:
+    """
+    打开压缩tar写入器
+
+    Args:
+        path: 输出文件路径
+        fmt: gzip | zstd
+        level: 压缩级别（gzip默认9，zstd默认3）
+        threads: zstd压缩线程数（-1表示使用全部CPU核心，0表示单线程）
+    """
+    if fmt == 'zstd':
+        cctx = zstandard.ZstdCompressor(level=level if level is not None else 3, threads=threads)
+        with open(path, 'wb') as f:
+            with cctx.stream_writer(f, closefd=False) as writer:
+                with tarfile.open(fileobj=writer, mode='w|') as tar:
+                    yield tar
+    else:
+        with tarfile.open(path, 'w:gz', compresslevel=level if level is not None else 9) as tar:
+            yield tar
+
+
+class _PrefixedReader:
+    """把已读取的文件头拼回输入流"""
+
+    def __init__(self, prefix: bytes, stream: BinaryIO):
+        self._prefix = prefix
+        self._stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if self._prefix:
+            if size is None or size < 0:
+                data = self._prefix + self._stream.read()
+                self._prefix = b''
+                return data
+            data = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            if len(data) < size:
+                data += self._stream.read(size - len(data))
+            return data
+        return self._stream.read(size)
+
+
+def open_decompressed_stream(stream: BinaryIO) -> BinaryIO:
+    """
+    识别输入流格式，zstd流返回解压后的流，其余原样返回（交给tarfile自动识别）
+
+    Args:
+        stream: 只读的二进制流（不要求可seek）
+    """
+    head = stream.read(len(ZSTD_MAGIC))
+    reader = _PrefixedReader(head, stream)
+
+    if detect_format(head) == 'zstd':
+        if zstandard is None:
+            raise tarfile.CompressionError("zstd归档需要安装zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(reader, read_across_frames=True)
+
+    return reader
+
+
+def iter_transcode_to_gzip(path: str, level: int = 6) -> Iterator[bytes]:
+    """
+    将zstd文件流式转码为gzip（供不支持zstd的客户端下载）
+
+    Args:
+        path: zstd文件路径
+        level: gzip压缩级别
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    with open(path, 'rb') as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        while True:
+            chunk = reader.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.flush()
+
+
+# 测试代码
+if __name__ == '__main__':
+    import os
+    import gzip
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        src = os.path.join(temp_dir, 'hello.txt')
+        with open(src, 'w') as f:
+            f.write('hello\n' * 1000)
+
+        for fmt in available_formats():
+            archive = os.path.join(temp_dir, 'out' + FORMATS[fmt]['suffix'])
+            with open_tar_writer(archive, fmt) as tar:
+                tar.add(src, arcname='hello.txt')
+
+            with open(archive, 'rb') as f:
+                assert detect_format(f.read(4)) == fmt
+                f.seek(0)
+                with tarfile.open(fileobj=open_decompressed_stream(f), mode='r|*') as tar:
+                    names = [m.name for m in tar]
+            print(f"{fmt}: {os.path.getsize(archive)} 字节, 成员 {names}")
+
+            if fmt == 'zstd':
+                data = gzip.decompress(b''.join(iter_transcode_to_gzip(archive)))
+                with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+                    assert tar.getnames() == ['hello.txt']
+                print("✓ zstd -> gzip 转码")
+
+        assert negotiate_format('*/*', 'zstd') == 'gzip'
+        assert negotiate_format('application/zstd, application/gzip;q=0.5', 'zstd') == 'zstd'
+        assert negotiate_format('application/zstd;q=0', 'zstd') == 'gzip'
+        assert accepts_encoding('gzip, deflate, br', 'gzip')
+        assert not accepts_encoding('gzip, deflate', 'zstd')
+        assert not accepts_encoding('*, zstd;q=0', 'zstd')
+        assert accepts_encoding('*', 'zstd') and not accepts_encoding(None, 'gzip')
+
+        print("\n✓ 所有测试通过")
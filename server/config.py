@@ -16,6 +16,8 @@ BASE_DIR = Path(__file__).parent.parent
 DATA_DIR = os.getenv('CI_DATA_DIR', str(BASE_DIR / 'data'))
 WORK_DIR = os.getenv('CI_WORK_DIR', '/tmp/remote-ci')
 WORKSPACE_DIR = os.getenv('CI_WORKSPACE_DIR', '/var/ci-workspace')
+# 流式上传的解压暂存目录（需对worker可见，与WORK_DIR同一文件系统时任务可直接重命名）
+STAGING_DIR = os.getenv('CI_STAGING_DIR', f"{WORK_DIR}/staging")
 
 # API配置
 API_HOST = os.getenv('CI_API_HOST', '0.0.0.0')
@@ -27,13 +29,105 @@ CELERY_BROKER_URL = os.getenv('CI_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CI_RESULT_BACKEND', 'redis://localhost:6379/0')
 
 # 任务配置
-MAX_CONCURRENT_JOBS = int(os.getenv('CI_MAX_CONCURRENT', '2'))
+# 资源准入控制：任务声明（或按项目历史用量估算）CPU和内存需求，节点剩余容量足够时才开始执行，
+# 并发数由资源决定
+ADMISSION_ENABLED = os.getenv('CI_ADMISSION', 'true').lower() in ['true', '1', 'yes']
+# 每个worker的并发进程数（Celery worker_concurrency）；启用资源准入时默认为CPU核数（至少2），只作为上限
+MAX_CONCURRENT_JOBS = int(os.getenv('CI_MAX_CONCURRENT', str(max(os.cpu_count() or 1, 2)) if ADMISSION_ENABLED else '2'))
 JOB_TIMEOUT = int(os.getenv('CI_JOB_TIMEOUT', '3600'))  # 1小时
 LOG_RETENTION_DAYS = int(os.getenv('CI_LOG_RETENTION_DAYS', '7'))
+# 构建日志缓冲：超过该字节数或距上次写入超过该秒数时写入文件（实时查看日志的最大延迟）
+LOG_FLUSH_BYTES = int(os.getenv('CI_LOG_FLUSH_KB', '64')) * 1024
+LOG_FLUSH_INTERVAL = float(os.getenv('CI_LOG_FLUSH_INTERVAL', '1'))
+# 任务结束后在后台压缩日志: zstd | gzip | none（zstd需要安装zstandard，未安装时回退为gzip）
+# 数据库中的日志大小和配额按压缩后的大小计算，读取时透明解压
+LOG_COMPRESSION = os.getenv('CI_LOG_COMPRESSION', 'zstd').lower()
+# 构建日志全文搜索：API进程在后台把已结束任务的日志增量写入 log_search.db（SQLite FTS5）
+LOG_SEARCH_ENABLED = os.getenv('CI_LOG_SEARCH', 'true').lower() in ['true', '1', 'yes']
+# 只索引最近N天结束的任务，更早的自动移出索引
+LOG_SEARCH_DAYS = int(os.getenv('CI_LOG_SEARCH_DAYS', str(LOG_RETENTION_DAYS)))
+# 建立索引时读取日志的速率上限（MB/秒）和每轮之间的间隔（秒），避免与构建争抢磁盘I/O
+LOG_SEARCH_RATE = float(os.getenv('CI_LOG_SEARCH_RATE_MB', '2')) * 1024 * 1024
+LOG_SEARCH_INTERVAL = float(os.getenv('CI_LOG_SEARCH_INTERVAL', '30'))
+
+# 公平调度：任务先进入按用户（或项目）划分的虚拟队列，有空闲执行槽位时按权重轮流提交给Celery
+# 槽位数应等于所有worker的并发数之和；0表示不限制（提交即入队，先到先得）
+# 启用资源准入时默认不限制，由节点剩余CPU和内存决定同时运行的任务数
+SCHEDULER_SLOTS = int(os.getenv('CI_SCHEDULER_SLOTS', '0' if ADMISSION_ENABLED else str(MAX_CONCURRENT_JOBS)))
+# 虚拟队列划分方式: user | project（权重取自特殊用户表中同名的记录）
+SCHEDULER_KEY = os.getenv('CI_SCHEDULER_KEY', 'user')
+# API进程定期调度的间隔（秒），兜底worker异常退出等未触发调度的情况
+SCHEDULER_INTERVAL = float(os.getenv('CI_SCHEDULER_INTERVAL', '5'))
+# 运行中的任务每隔N秒刷新心跳；超过超时时间没有心跳的任务视为worker已退出，不再占用槽位和资源
+HEARTBEAT_INTERVAL = float(os.getenv('CI_HEARTBEAT_INTERVAL', '15'))
+HEARTBEAT_TIMEOUT = float(os.getenv('CI_HEARTBEAT_TIMEOUT', '90'))
+
+# 任务优先级（数值越大越优先），调度器和指标导出共用
+PRIORITY_CLASSES = {'low': 0, 'normal': 1, 'high': 2}
+
+# 抢占式优先级：high优先级任务到达而没有空闲槽位时，暂停（SIGSTOP）一个优先级更低的运行中构建，
+# 在其worker中先执行high任务，结束后恢复（SIGCONT）；暂停时间不计入被暂停任务的超时
+PREEMPTION_ENABLED = os.getenv('CI_PREEMPTION', 'true').lower() in ['true', '1', 'yes']
+# 单个任务最多被暂停的次数（每次暂停最多让该任务多占用一个任务超时的时间）
+MAX_PREEMPTIONS = int(os.getenv('CI_MAX_PREEMPTIONS', '1'))
+# Celery任务的硬超时：包含被暂停期间执行的抢占任务
+TASK_TIME_LIMIT = JOB_TIMEOUT * (1 + (MAX_PREEMPTIONS if PREEMPTION_ENABLED else 0))
+
+# 节点可分配给构建的CPU核数和内存（MB），0表示自动检测
+NODE_CPUS = float(os.getenv('CI_NODE_CPUS', '0'))
+NODE_MEMORY_MB = int(os.getenv('CI_NODE_MEMORY_MB', '0'))
+# 没有声明且没有历史记录时任务的需求
+DEFAULT_JOB_CPUS = float(os.getenv('CI_DEFAULT_JOB_CPUS', '1'))
+DEFAULT_JOB_MEMORY_MB = int(os.getenv('CI_DEFAULT_JOB_MEMORY_MB', '1024'))
+
+# cgroup v2资源统计与限制：每个构建在父cgroup下建立子cgroup，统计整个进程树的CPU、内存峰值和磁盘IO，
+# 结束后清理残留进程；worker没有写权限（需root或systemd Delegate=yes）或不是cgroup v2时退回getrusage统计
+CGROUP_ENABLED = os.getenv('CI_CGROUP', 'true').lower() in ['true', '1', 'yes']
+CGROUP_PARENT = os.getenv('CI_CGROUP_PARENT', '/sys/fs/cgroup/remote-ci')
+# 对声明了resources的任务按声明值强制CPU和内存上限（超出内存上限时整个构建被终止）
+CGROUP_LIMITS = os.getenv('CI_CGROUP_LIMITS', 'true').lower() in ['true', '1', 'yes']
+
+# rsync模式工作副本的快照策略: auto | reflink | hardlink | copy
+# auto按 reflink -> copy 顺序选择文件系统支持的策略；hardlink不隔离构建对文件的原地修改
+# （会改动workspace和其他任务的快照），只在显式指定时使用
+SNAPSHOT_STRATEGY = os.getenv('CI_SNAPSHOT_STRATEGY', 'auto')
+
+# git模式镜像缓存大小上限（超出后按LRU淘汰）
+GIT_CACHE_MAX_BYTES = int(float(os.getenv('CI_GIT_CACHE_MAX_GB', '20')) * 1024 * 1024 * 1024)
+
+# 依赖缓存目录（与WORK_DIR位于同一文件系统时可用reflink恢复）和大小上限
+DEP_CACHE_DIR = os.getenv('CI_DEP_CACHE_DIR', f'{DATA_DIR}/dep-cache')
+DEP_CACHE_MAX_BYTES = int(float(os.getenv('CI_DEP_CACHE_MAX_GB', '20')) * 1024 * 1024 * 1024)
+# 依赖缓存恢复策略: auto | reflink | hardlink | copy
+# auto按 reflink -> copy 顺序选择；hardlink最快，但构建原地修改缓存文件时会改坏缓存
+DEP_CACHE_STRATEGY = os.getenv('CI_DEP_CACHE_STRATEGY', 'auto')
+
+# 构建结果缓存：源码、脚本和产物配置相同时直接复用最近一次成功构建的日志和产物
+# 单个任务可通过 no_cache 参数跳过；TTL之前的构建不再复用
+BUILD_CACHE_ENABLED = os.getenv('CI_BUILD_CACHE', 'true').lower() in ['true', '1', 'yes']
+BUILD_CACHE_TTL_HOURS = float(os.getenv('CI_BUILD_CACHE_TTL_HOURS', '24'))
+# 合并重复提交：与排队中/运行中的任务完全相同时不再入队，新任务跟随已有任务（共享日志、状态和产物）
+COALESCE_JOBS = os.getenv('CI_COALESCE_JOBS', 'true').lower() in ['true', '1', 'yes']
+
+# 产物压缩格式: zstd | gzip（未安装zstandard时自动回退gzip）
+ARTIFACT_FORMAT = os.getenv('CI_ARTIFACT_FORMAT', 'zstd')
+# zstd压缩级别（1-19）和线程数（-1表示使用全部CPU核心）
+ZSTD_LEVEL = int(os.getenv('CI_ZSTD_LEVEL', '3'))
+ZSTD_THREADS = int(os.getenv('CI_ZSTD_THREADS', '-1'))
 
 # 上传文件大小限制（500MB）
 MAX_UPLOAD_SIZE = 500 * 1024 * 1024
 
+# 流式上传解压后的大小限制（防止压缩炸弹）
+MAX_EXTRACT_SIZE = int(os.getenv('CI_MAX_EXTRACT_SIZE_MB', '5120')) * 1024 * 1024
+
+# 增量上传：源码块保留天数（超过该天数未被引用的块会被清理）
+BLOB_RETENTION_DAYS = int(os.getenv('CI_BLOB_RETENTION_DAYS', '14'))
+
+# Prometheus指标：API和各worker进程把指标写入该目录下的共享文件，由API的/metrics接口汇总
+# （目录需对API和worker都可写）
+METRICS_DIR = os.getenv('CI_METRICS_DIR', f'{DATA_DIR}/metrics')
+
 # Celery任务配置
 CELERY_CONFIG = {
     'broker_url': CELERY_BROKER_URL,
@@ -44,8 +138,9 @@ CELERY_CONFIG = {
     'timezone': 'Asia/Shanghai',
     'enable_utc': True,
     'task_track_started': True,
-    'task_time_limit': JOB_TIMEOUT,
-    'task_soft_time_limit': JOB_TIMEOUT - 60,
+    'task_time_limit': TASK_TIME_LIMIT,
+    'task_soft_time_limit': TASK_TIME_LIMIT - 60,
+    'worker_concurrency': MAX_CONCURRENT_JOBS,
     'worker_prefetch_multiplier': 1,  # 每次只取一个任务，确保并发控制
     'worker_max_tasks_per_child': 10,  # 每10个任务重启worker，防止内存泄漏
     'result_expires': 86400 * LOG_RETENTION_DAYS,  # 结果保留时间
@@ -55,5 +150,10 @@ CELERY_CONFIG = {
 Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
 Path(f"{DATA_DIR}/logs").mkdir(parents=True, exist_ok=True)
 Path(f"{DATA_DIR}/uploads").mkdir(parents=True, exist_ok=True)
+Path(f"{DATA_DIR}/blobs").mkdir(parents=True, exist_ok=True)
+Path(f"{DATA_DIR}/git-mirrors").mkdir(parents=True, exist_ok=True)
+Path(DEP_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+Path(METRICS_DIR).mkdir(parents=True, exist_ok=True)
 Path(WORK_DIR).mkdir(parents=True, exist_ok=True)
+Path(STAGING_DIR).mkdir(parents=True, exist_ok=True)
 Path(WORKSPACE_DIR).mkdir(parents=True, exist_ok=True)
@@ -5,15 +5,49 @@ SQLite数据库模块 - 任务历史记录
 
 import sqlite3
 import json
+import time
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Optional, Dict, List, Any
 import threading
 
+from server.metrics import observe_query
+
 # 定义时区
 UTC = timezone.utc
 UTC8 = timezone(timedelta(hours=8))
 
+# 可记录的资源用量字段（ci_jobs中的列）
+RESOURCE_USAGE_FIELDS = (
+    'cpu_user_seconds', 'cpu_system_seconds', 'max_rss_kb', 'build_seconds',
+    'memory_peak_kb', 'io_read_bytes', 'io_write_bytes', 'cpu_limit', 'memory_limit_mb', 'oom_killed',
+)
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """记录每条语句执行延迟的游标（导出为 ci_sqlite_query_duration_seconds）"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observe_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            observe_query(sql, time.perf_counter() - start)
+
+
+class _TimedConnection(sqlite3.Connection):
+    """cursor()默认返回_TimedCursor的连接"""
+
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
 
 class JobDatabase:
     """任务数据库管理类"""
@@ -28,7 +62,7 @@ class JobDatabase:
     def _get_conn(self):
         """获取线程本地的数据库连接"""
         if not hasattr(self._local, 'conn'):
-            self._local.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._local.conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=_TimedConnection)
             self._local.conn.row_factory = sqlite3.Row
         return self._local.conn
 
@@ -85,6 +119,29 @@ class JobDatabase:
             )
         ''')
 
+        # 创建公平调度队列表（每个用户/项目一个虚拟队列）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scheduler_queues (
+                queue_key TEXT PRIMARY KEY,
+                virtual_time REAL NOT NULL DEFAULT 0,
+                last_start REAL NOT NULL DEFAULT 0,
+                dispatched_count INTEGER NOT NULL DEFAULT 0,
+                last_dispatched_at TEXT
+            )
+        ''')
+
+        # 创建任务阶段耗时表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS job_stages (
+                job_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                started_at TEXT,
+                duration REAL NOT NULL,
+                PRIMARY KEY (job_id, stage)
+            )
+        ''')
+
         # 数据库迁移：添加新字段
         migrations = [
             ('user_id', 'ALTER TABLE ci_jobs ADD COLUMN user_id TEXT'),
@@ -94,6 +151,27 @@ class JobDatabase:
             ('code_archive_path', 'ALTER TABLE ci_jobs ADD COLUMN code_archive_path TEXT'),
             ('code_archive_size', 'ALTER TABLE ci_jobs ADD COLUMN code_archive_size INTEGER DEFAULT 0'),
             ('is_expired', 'ALTER TABLE ci_jobs ADD COLUMN is_expired INTEGER DEFAULT 0'),
+            ('build_key', 'ALTER TABLE ci_jobs ADD COLUMN build_key TEXT'),
+            ('cached_from', 'ALTER TABLE ci_jobs ADD COLUMN cached_from TEXT'),
+            ('coalesced_into', 'ALTER TABLE ci_jobs ADD COLUMN coalesced_into TEXT'),
+            ('dispatched_at', 'ALTER TABLE ci_jobs ADD COLUMN dispatched_at TEXT'),
+            ('priority', 'ALTER TABLE ci_jobs ADD COLUMN priority INTEGER DEFAULT 1'),
+            ('preempted_by', 'ALTER TABLE ci_jobs ADD COLUMN preempted_by TEXT'),
+            ('preempt_count', 'ALTER TABLE ci_jobs ADD COLUMN preempt_count INTEGER DEFAULT 0'),
+            ('paused_seconds', 'ALTER TABLE ci_jobs ADD COLUMN paused_seconds REAL DEFAULT 0'),
+            ('cpu_request', 'ALTER TABLE ci_jobs ADD COLUMN cpu_request REAL'),
+            ('memory_request_mb', 'ALTER TABLE ci_jobs ADD COLUMN memory_request_mb INTEGER'),
+            ('cpu_user_seconds', 'ALTER TABLE ci_jobs ADD COLUMN cpu_user_seconds REAL'),
+            ('cpu_system_seconds', 'ALTER TABLE ci_jobs ADD COLUMN cpu_system_seconds REAL'),
+            ('max_rss_kb', 'ALTER TABLE ci_jobs ADD COLUMN max_rss_kb INTEGER'),
+            ('build_seconds', 'ALTER TABLE ci_jobs ADD COLUMN build_seconds REAL'),
+            ('memory_peak_kb', 'ALTER TABLE ci_jobs ADD COLUMN memory_peak_kb INTEGER'),
+            ('io_read_bytes', 'ALTER TABLE ci_jobs ADD COLUMN io_read_bytes INTEGER'),
+            ('io_write_bytes', 'ALTER TABLE ci_jobs ADD COLUMN io_write_bytes INTEGER'),
+            ('cpu_limit', 'ALTER TABLE ci_jobs ADD COLUMN cpu_limit REAL'),
+            ('memory_limit_mb', 'ALTER TABLE ci_jobs ADD COLUMN memory_limit_mb INTEGER'),
+            ('oom_killed', 'ALTER TABLE ci_jobs ADD COLUMN oom_killed INTEGER DEFAULT 0'),
+            ('heartbeat_at', 'ALTER TABLE ci_jobs ADD COLUMN heartbeat_at TEXT'),
         ]
 
         for field_name, migration_sql in migrations:
@@ -102,6 +180,15 @@ class JobDatabase:
             except sqlite3.OperationalError:
                 cursor.execute(migration_sql)
                 print(f"✓ 数据库迁移: 添加{field_name}字段")
+                if field_name == 'dispatched_at':
+                    # 升级前的任务都已直接提交给Celery，不能再被调度器重复提交
+                    cursor.execute('UPDATE ci_jobs SET dispatched_at = created_at')
+
+        try:
+            cursor.execute("SELECT weight FROM special_users LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute('ALTER TABLE special_users ADD COLUMN weight REAL NOT NULL DEFAULT 1')
+            print("✓ 数据库迁移: 添加weight字段")
 
         # 创建索引
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON ci_jobs(status)')
@@ -111,6 +198,12 @@ class JobDatabase:
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON ci_jobs(finished_at DESC)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_project_name ON ci_jobs(project_name)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_is_expired ON ci_jobs(is_expired)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_build_key ON ci_jobs(build_key)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_cached_from ON ci_jobs(cached_from)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_coalesced_into ON ci_jobs(coalesced_into)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_dispatched_at ON ci_jobs(dispatched_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_preempted_by ON ci_jobs(preempted_by)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_stages_stage ON job_stages(stage)')
 
         conn.commit()
         conn.close()
@@ -133,8 +226,9 @@ class JobDatabase:
             cursor.execute('''
                 INSERT INTO ci_jobs (
                     job_id, mode, status, script, user_id, project_name,
-                    created_at, log_file, workspace, repo_url, branch, metadata
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    created_at, log_file, workspace, repo_url, branch, build_key, priority,
+                    cpu_request, memory_request_mb, metadata
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
                 job_id,
                 job_data.get('mode', 'unknown'),
@@ -147,6 +241,10 @@ class JobDatabase:
                 job_data.get('workspace'),
                 job_data.get('repo'),
                 job_data.get('branch'),
+                job_data.get('build_key'),
+                job_data.get('priority', 1),
+                (job_data.get('resources') or {}).get('cpus'),
+                (job_data.get('resources') or {}).get('memory_mb'),
                 json.dumps(job_data)
             ))
 
@@ -157,6 +255,196 @@ class JobDatabase:
             print(f"✗ 创建任务记录失败: {e}")
             return False
 
+    def create_cached_job(self, job_id: str, job_data: Dict[str, Any], source_job: Dict[str, Any]) -> bool:
+        """
+        创建命中构建缓存的任务记录（直接完成，引用来源任务的日志和产物）
+
+        文件归来源任务所有，本记录的文件大小记为0，不重复计入配额
+
+        Args:
+            job_id: 任务ID
+            job_data: 任务数据
+            source_job: 被复用的成功任务
+
+        Returns:
+            bool: 是否创建成功
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            now = datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z'
+            cursor.execute('''
+                INSERT INTO ci_jobs (
+                    job_id, mode, status, script, user_id, project_name,
+                    created_at, started_at, finished_at, duration, exit_code,
+                    workspace, repo_url, branch, commit_hash,
+                    log_file, artifacts_path, build_key, cached_from, metadata
+                ) VALUES (?, ?, 'success', ?, ?, ?, ?, ?, ?, 0, 0, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                job_id,
+                job_data.get('mode', 'unknown'),
+                job_data.get('script', ''),
+                job_data.get('user_id'),
+                job_data.get('project_name'),
+                now, now, now,
+                job_data.get('workspace'),
+                job_data.get('repo'),
+                job_data.get('branch'),
+                source_job.get('commit_hash'),
+                source_job.get('log_file'),
+                source_job.get('artifacts_path'),
+                source_job['build_key'],
+                source_job['job_id'],
+                json.dumps(job_data)
+            ))
+
+            conn.commit()
+            return True
+
+        except Exception as e:
+            print(f"✗ 创建缓存任务记录失败: {e}")
+            return False
+
+    def create_follower_job(self, job_id: str, job_data: Dict[str, Any], leader_job: Dict[str, Any]) -> bool:
+        """
+        创建跟随任务记录（与排队中/运行中的相同任务合并，不再单独执行）
+
+        跟随任务共享主任务的日志和产物，状态随主任务更新；文件大小记为0，不重复计入配额
+
+        Args:
+            job_id: 任务ID
+            job_data: 任务数据
+            leader_job: 被跟随的主任务
+
+        Returns:
+            bool: 是否创建成功
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                INSERT INTO ci_jobs (
+                    job_id, mode, status, script, user_id, project_name,
+                    created_at, started_at, workspace, repo_url, branch,
+                    log_file, build_key, coalesced_into, metadata
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                job_id,
+                job_data.get('mode', 'unknown'),
+                leader_job['status'],
+                job_data.get('script', ''),
+                job_data.get('user_id'),
+                job_data.get('project_name', job_data.get('workspace', '').split('/')[-1] if job_data.get('workspace') else None),
+                datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z',
+                leader_job.get('started_at'),
+                job_data.get('workspace'),
+                job_data.get('repo'),
+                job_data.get('branch'),
+                leader_job.get('log_file'),
+                leader_job['build_key'],
+                leader_job['job_id'],
+                json.dumps(job_data)
+            ))
+
+            conn.commit()
+            return True
+
+        except Exception as e:
+            print(f"✗ 创建跟随任务记录失败: {e}")
+            return False
+
+    def find_inflight_job(self, build_key: str, statuses: tuple = ('queued', 'running')) -> Optional[Dict[str, Any]]:
+        """
+        查找构建键相同、尚未结束的主任务（最早提交的一个）
+
+        Args:
+            build_key: 构建键
+            statuses: 可合并的任务状态
+
+        Returns:
+            任务信息字典，没有返回None
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            placeholders = ', '.join('?' * len(statuses))
+            cursor.execute(f'''
+                SELECT * FROM ci_jobs
+                WHERE build_key = ? AND status IN ({placeholders})
+                  AND coalesced_into IS NULL AND cached_from IS NULL
+                ORDER BY created_at ASC
+                LIMIT 1
+            ''', (build_key, *statuses))
+            row = cursor.fetchone()
+
+            return dict(row) if row else None
+
+        except Exception as e:
+            print(f"✗ 查找进行中的任务失败: {e}")
+            return None
+
+    def find_cached_build(self, build_key: str, max_age_hours: float) -> Optional[Dict[str, Any]]:
+        """
+        查找可复用的最近一次成功构建（本身不是缓存命中或跟随任务、文件未被清理）
+
+        Args:
+            build_key: 构建键
+            max_age_hours: 只查找该时间内完成的构建
+
+        Returns:
+            任务信息字典，没有返回None
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cutoff = (datetime.now(UTC) - timedelta(hours=max_age_hours)).replace(tzinfo=None).isoformat() + 'Z'
+            cursor.execute('''
+                SELECT * FROM ci_jobs
+                WHERE build_key = ? AND status = 'success' AND is_expired = 0
+                  AND cached_from IS NULL AND coalesced_into IS NULL AND finished_at >= ?
+                ORDER BY finished_at DESC
+                LIMIT 1
+            ''', (build_key, cutoff))
+            row = cursor.fetchone()
+
+            return dict(row) if row else None
+
+        except Exception as e:
+            print(f"✗ 查找构建缓存失败: {e}")
+            return None
+
+    def update_job_build_key(self, job_id: str, build_key: str, commit_hash: Optional[str] = None) -> bool:
+        """
+        记录任务的构建键（git模式在worker检出后才能确定）
+
+        Args:
+            job_id: 任务ID
+            build_key: 构建键
+            commit_hash: 检出的commit sha
+
+        Returns:
+            bool: 是否更新成功
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                UPDATE ci_jobs SET build_key = ?, commit_hash = COALESCE(?, commit_hash)
+                WHERE job_id = ?
+            ''', (build_key, commit_hash, job_id))
+
+            conn.commit()
+            return True
+
+        except Exception as e:
+            print(f"✗ 更新构建键失败: {e}")
+            return False
+
     def update_job_started(self, job_id: str) -> bool:
         """
         更新任务为已开始状态
@@ -171,11 +459,13 @@ class JobDatabase:
             conn = self._get_conn()
             cursor = conn.cursor()
 
+            # 跟随任务的状态随主任务更新
+            now = datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z'
             cursor.execute('''
                 UPDATE ci_jobs
-                SET status = 'running', started_at = ?
-                WHERE job_id = ?
-            ''', (datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z', job_id))
+                SET status = 'running', started_at = ?, heartbeat_at = ?
+                WHERE job_id = ? OR coalesced_into = ?
+            ''', (now, now, job_id, job_id))
 
             conn.commit()
             return True
@@ -184,6 +474,31 @@ class JobDatabase:
             print(f"✗ 更新任务开始状态失败: {e}")
             return False
 
+    def touch_job_heartbeat(self, job_id: str) -> bool:
+        """
+        刷新运行中任务的心跳（调度器据此判断执行任务的worker是否存活）
+
+        Args:
+            job_id: 任务ID
+
+        Returns:
+            bool: 是否更新成功（任务已结束时返回False）
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                UPDATE ci_jobs SET heartbeat_at = ? WHERE job_id = ? AND status = 'running'
+            ''', (datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z', job_id))
+
+            conn.commit()
+            return cursor.rowcount == 1
+
+        except Exception as e:
+            print(f"✗ 刷新任务心跳失败: {e}")
+            return False
+
     def update_job_finished(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None) -> bool:
         """
         更新任务为完成状态
@@ -209,13 +524,14 @@ class JobDatabase:
                     duration = ?,
                     exit_code = ?,
                     error_message = ?
-                WHERE job_id = ?
+                WHERE job_id = ? OR coalesced_into = ?
             ''', (
                 status,
                 datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z',
                 result.get('duration'),
                 result.get('exit_code'),
                 result.get('error'),
+                job_id,
                 job_id
             ))
 
@@ -354,6 +670,33 @@ class JobDatabase:
             traceback.print_exc()
             return 0
 
+    def get_active_job_counts(self) -> Dict[str, Dict[int, int]]:
+        """
+        按优先级统计排队中和运行中的任务数（不含跟随任务）
+
+        Returns:
+            {'queued': {优先级: 任务数}, 'running': {优先级: 任务数}}
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT status, COALESCE(priority, 1) AS priority, COUNT(*) AS count
+                FROM ci_jobs
+                WHERE status IN ('queued', 'running') AND coalesced_into IS NULL
+                GROUP BY status, COALESCE(priority, 1)
+            ''')
+
+            counts: Dict[str, Dict[int, int]] = {'queued': {}, 'running': {}}
+            for row in cursor.fetchall():
+                counts[row['status']][row['priority']] = row['count']
+            return counts
+
+        except Exception as e:
+            print(f"✗ 统计活跃任务数失败: {e}")
+            return {'queued': {}, 'running': {}}
+
     def get_stats(self, days: int = 7) -> Dict[str, Any]:
         """
         获取统计数据
@@ -457,6 +800,7 @@ class JobDatabase:
 
             cursor.execute('DELETE FROM ci_jobs WHERE created_at < ?', (cutoff,))
             deleted_count = cursor.rowcount
+            cursor.execute('DELETE FROM job_stages WHERE job_id NOT IN (SELECT job_id FROM ci_jobs)')
 
             conn.commit()
 
@@ -484,6 +828,7 @@ class JobDatabase:
 
             # 清空所有记录
             cursor.execute('DELETE FROM ci_jobs')
+            cursor.execute('DELETE FROM job_stages')
 
             conn.commit()
 
@@ -546,6 +891,11 @@ class JobDatabase:
             query = f"UPDATE ci_jobs SET {', '.join(updates)} WHERE job_id = ?"
             cursor.execute(query, params)
 
+            # 跟随任务共享主任务的产物（大小不重复计入配额）
+            if artifacts_path is not None:
+                cursor.execute('UPDATE ci_jobs SET artifacts_path = ? WHERE coalesced_into = ?',
+                               (artifacts_path, job_id))
+
             conn.commit()
             return True
 
@@ -567,7 +917,11 @@ class JobDatabase:
             conn = self._get_conn()
             cursor = conn.cursor()
 
-            cursor.execute('UPDATE ci_jobs SET is_expired = 1 WHERE job_id = ?', (job_id,))
+            # 共享该任务日志和产物的缓存命中、跟随任务一并过期
+            cursor.execute('''
+                UPDATE ci_jobs SET is_expired = 1
+                WHERE job_id = ? OR cached_from = ? OR coalesced_into = ?
+            ''', (job_id, job_id, job_id))
             conn.commit()
             return True
 
@@ -652,90 +1006,97 @@ class JobDatabase:
             print(f"✗ 获取最老任务失败: {e}")
             return []
 
-    # ========== 特殊用户管理方法 ==========
+    # ========== 公平调度相关方法 ==========
 
-    def add_special_user(self, user_id: str, quota_gb: float) -> bool:
+    def get_pending_jobs(self) -> List[Dict[str, Any]]:
         """
-        添加特殊用户
-
-        Args:
-            user_id: 用户ID
-            quota_gb: 配额（GB）
+        获取等待调度（尚未提交给Celery）的任务，按优先级、提交时间排序
 
         Returns:
-            bool: 是否添加成功
+            任务列表（job_id, user_id, project_name, priority, cpu_request, memory_request_mb, created_at, metadata）
         """
         try:
             conn = self._get_conn()
             cursor = conn.cursor()
 
-            quota_bytes = int(quota_gb * 1024 * 1024 * 1024)
-            now = datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z'
-
             cursor.execute('''
-                INSERT OR REPLACE INTO special_users (user_id, quota_bytes, created_at, updated_at)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, quota_bytes, now, now))
-
-            conn.commit()
-            return True
+                SELECT job_id, user_id, project_name, priority, cpu_request, memory_request_mb,
+                       created_at, metadata FROM ci_jobs
+                WHERE status = 'queued' AND dispatched_at IS NULL
+                  AND coalesced_into IS NULL AND cached_from IS NULL
+                ORDER BY priority DESC, created_at ASC
+            ''')
+            return [dict(row) for row in cursor.fetchall()]
 
         except Exception as e:
-            print(f"✗ 添加特殊用户失败: {e}")
-            return False
+            print(f"✗ 获取待调度任务失败: {e}")
+            return []
 
-    def get_special_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+    def get_dispatched_jobs(self, since: str, alive_since: str) -> List[Dict[str, Any]]:
         """
-        获取特殊用户信息
+        获取已提交给Celery但尚未结束的任务
 
         Args:
-            user_id: 用户ID
+            since: 尚未开始的任务只统计该时间之后提交的（更早的视为丢失的Celery消息）
+            alive_since: 运行中的任务只统计该时间之后有心跳的（没有心跳的视为worker已退出）
 
         Returns:
-            用户信息字典，如果不存在返回None
+            任务列表（job_id, user_id, project_name, status, cpu_request, memory_request_mb）
         """
         try:
             conn = self._get_conn()
             cursor = conn.cursor()
 
-            cursor.execute('SELECT * FROM special_users WHERE user_id = ?', (user_id,))
-            row = cursor.fetchone()
-
-            if row:
-                return dict(row)
-            return None
+            cursor.execute('''
+                SELECT job_id, user_id, project_name, status, cpu_request, memory_request_mb FROM ci_jobs
+                WHERE ((status = 'queued' AND dispatched_at >= ?)
+                       OR (status = 'running' AND heartbeat_at >= ?))
+                  AND coalesced_into IS NULL AND cached_from IS NULL
+            ''', (since, alive_since))
+            return [dict(row) for row in cursor.fetchall()]
 
         except Exception as e:
-            print(f"✗ 获取特殊用户信息失败: {e}")
-            return None
+            print(f"✗ 获取执行中任务失败: {e}")
+            return []
 
-    def get_all_special_users(self) -> List[Dict[str, Any]]:
+    def get_finished_jobs(self, after: str, after_id: str, before: str, limit: int = 500) -> List[Dict[str, Any]]:
         """
-        获取所有特殊用户
+        按结束时间顺序获取已结束且有独立日志的任务（不含缓存命中、合并的任务），用于增量建立日志索引
+
+        Args:
+            after: 游标：上一批最后一个任务的结束时间（为空表示从头开始）
+            after_id: 游标：上一批最后一个任务的ID（结束时间相同时按ID排序）
+            before: 只返回该时间及之前结束的任务
+            limit: 返回数量限制
 
         Returns:
-            特殊用户列表
+            任务列表（job_id, user_id, project_name, status, finished_at, log_file）
         """
         try:
             conn = self._get_conn()
             cursor = conn.cursor()
 
-            cursor.execute('SELECT * FROM special_users ORDER BY created_at DESC')
-            rows = cursor.fetchall()
-
-            return [dict(row) for row in rows]
+            # 其余条件加一元+，只走结束时间索引（否则会选择选择性很差的status等索引再排序）
+            cursor.execute('''
+                SELECT job_id, user_id, project_name, status, finished_at, log_file FROM ci_jobs
+                WHERE finished_at >= ? AND finished_at <= ? AND (finished_at > ? OR job_id > ?)
+                  AND +status IN ('success', 'failed', 'timeout', 'error') AND +is_expired = 0
+                  AND +coalesced_into IS NULL AND +cached_from IS NULL
+                ORDER BY finished_at, job_id LIMIT ?
+            ''', (after, before, after, after_id, limit))
+            return [dict(row) for row in cursor.fetchall()]
 
         except Exception as e:
-            print(f"✗ 获取特殊用户列表失败: {e}")
+            print(f"✗ 获取已结束任务失败: {e}")
             return []
 
-    def update_special_user_quota(self, user_id: str, quota_gb: float) -> bool:
+    def set_job_dispatched(self, job_id: str, dispatched: bool = True) -> bool:
         """
-        更新特殊用户配额
+        标记任务已提交给Celery（提交失败时撤销标记）
 
         Args:
-            user_id: 用户ID
-            quota_gb: 新配额（GB）
+            job_id: 任务ID
+            dispatched: True标记，False撤销
 
         Returns:
             bool: 是否更新成功
@@ -744,22 +1105,578 @@ class JobDatabase:
             conn = self._get_conn()
             cursor = conn.cursor()
 
-            quota_bytes = int(quota_gb * 1024 * 1024 * 1024)
-            now = datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z'
-
-            cursor.execute('''
-                UPDATE special_users
-                SET quota_bytes = ?, updated_at = ?
-                WHERE user_id = ?
-            ''', (quota_bytes, now, user_id))
+            dispatched_at = datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z' if dispatched else None
+            cursor.execute('UPDATE ci_jobs SET dispatched_at = ? WHERE job_id = ?', (dispatched_at, job_id))
 
             conn.commit()
-            return cursor.rowcount > 0
+            return True
 
         except Exception as e:
-            print(f"✗ 更新特殊用户配额失败: {e}")
+            print(f"✗ 更新任务调度状态失败: {e}")
             return False
 
+    def get_scheduler_queues(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取各虚拟队列的调度状态
+
+        Returns:
+            {queue_key: {'virtual_time', 'last_start', 'dispatched_count', 'last_dispatched_at'}}
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('SELECT * FROM scheduler_queues')
+            return {row['queue_key']: dict(row) for row in cursor.fetchall()}
+
+        except Exception as e:
+            print(f"✗ 获取调度队列失败: {e}")
+            return {}
+
+    def save_scheduler_queue(self, queue_key: str, virtual_time: float, last_start: float,
+                             dispatched: int = 0) -> bool:
+        """
+        保存虚拟队列的调度状态
+
+        Args:
+            queue_key: 队列标识（用户ID或项目名）
+            virtual_time: 队列的虚拟时间
+            last_start: 最近一次调度时的虚拟时间
+            dispatched: 本次新调度的任务数
+
+        Returns:
+            bool: 是否保存成功
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            now = datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z'
+            cursor.execute('''
+                INSERT INTO scheduler_queues (queue_key, virtual_time, last_start, dispatched_count, last_dispatched_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(queue_key) DO UPDATE SET
+                    virtual_time = excluded.virtual_time,
+                    last_start = excluded.last_start,
+                    dispatched_count = dispatched_count + excluded.dispatched_count,
+                    last_dispatched_at = CASE WHEN excluded.dispatched_count > 0
+                        THEN excluded.last_dispatched_at ELSE last_dispatched_at END
+            ''', (queue_key, virtual_time, last_start, dispatched, now if dispatched else None))
+
+            conn.commit()
+            return True
+
+        except Exception as e:
+            print(f"✗ 保存调度队列失败: {e}")
+            return False
+
+    # ========== 资源准入相关方法 ==========
+
+    def update_job_resource_usage(self, job_id: str, **usage) -> bool:
+        """
+        记录构建脚本（整个进程树）的资源用量和生效的资源上限
+
+        Args:
+            job_id: 任务ID
+            usage: RESOURCE_USAGE_FIELDS 中的字段，例如
+                cpu_user_seconds / cpu_system_seconds: 用户态/内核态CPU时间（秒）
+                max_rss_kb: 单个进程的峰值内存（KB，getrusage）
+                memory_peak_kb: 整个cgroup的峰值内存（KB）
+                io_read_bytes / io_write_bytes: 磁盘读写字节数
+                build_seconds: 构建脚本运行时间（秒，不含被抢占暂停的时间）
+                cpu_limit / memory_limit_mb: 通过cgroup强制的上限
+                oom_killed: 是否因超出内存上限被终止
+
+        Returns:
+            bool: 是否更新成功
+        """
+        fields = [f for f in RESOURCE_USAGE_FIELDS if f in usage]
+        if not fields:
+            return True
+
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            assignments = ', '.join(f"{f} = ?" for f in fields)
+            cursor.execute(f'UPDATE ci_jobs SET {assignments} WHERE job_id = ?',
+                           (*[usage[f] for f in fields], job_id))
+
+            conn.commit()
+            return True
+
+        except Exception as e:
+            print(f"✗ 记录资源用量失败: {e}")
+            return False
+
+    def get_recent_resource_usage(self, project_name: Optional[str] = None, repo_url: Optional[str] = None,
+                                  limit: int = 10) -> Optional[Dict[str, Any]]:
+        """
+        获取项目最近构建的资源用量（取峰值，用于估算新任务的需求）
+
+        Args:
+            project_name: 项目名
+            repo_url: git仓库URL（没有项目名时使用）
+            limit: 参考的最近构建数
+
+        Returns:
+            {'cpus': 平均占用核数的峰值, 'memory_mb': 峰值内存, 'samples': 构建数}，没有记录返回None
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            column, value = ('project_name', project_name) if project_name else ('repo_url', repo_url)
+            cursor.execute(f'''
+                SELECT cpu_user_seconds, cpu_system_seconds, build_seconds,
+                       COALESCE(memory_peak_kb, max_rss_kb) AS memory_kb FROM ci_jobs
+                WHERE {column} = ? AND build_seconds > 0 AND status IN ('success', 'failed')
+                ORDER BY finished_at DESC
+                LIMIT ?
+            ''', (value, limit))
+            rows = cursor.fetchall()
+            if not rows:
+                return None
+
+            return {
+                'cpus': max((r['cpu_user_seconds'] + r['cpu_system_seconds']) / r['build_seconds'] for r in rows),
+                'memory_mb': max(r['memory_kb'] or 0 for r in rows) / 1024,
+                'samples': len(rows),
+            }
+
+        except Exception as e:
+            print(f"✗ 获取历史资源用量失败: {e}")
+            return None
+
+    # ========== 优先级抢占相关方法 ==========
+
+    def raise_job_priority(self, job_id: str, priority: int) -> bool:
+        """
+        提高任务优先级（不会降低）
+
+        Args:
+            job_id: 任务ID
+            priority: 优先级
+
+        Returns:
+            bool: 是否更新成功
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('UPDATE ci_jobs SET priority = MAX(priority, ?) WHERE job_id = ?', (priority, job_id))
+
+            conn.commit()
+            return True
+
+        except Exception as e:
+            print(f"✗ 更新任务优先级失败: {e}")
+            return False
+
+    def find_preemptible_job(self, priority: int, max_preemptions: int, alive_since: str) -> Optional[Dict[str, Any]]:
+        """
+        查找可被暂停的运行中任务：优先级低于指定优先级中最低的，相同时选最晚开始的
+
+        Args:
+            priority: 抢占任务的优先级
+            max_preemptions: 单个任务最多被暂停的次数
+            alive_since: 只查找该时间之后有心跳的任务（没有心跳的worker已退出，无法执行抢占任务）
+
+        Returns:
+            任务信息字典，没有返回None
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT job_id, user_id, project_name, priority, started_at FROM ci_jobs
+                WHERE status = 'running' AND heartbeat_at >= ? AND priority < ?
+                  AND preempted_by IS NULL AND preempt_count < ?
+                  AND coalesced_into IS NULL AND cached_from IS NULL
+                ORDER BY priority ASC, started_at DESC
+                LIMIT 1
+            ''', (alive_since, priority, max_preemptions))
+            row = cursor.fetchone()
+
+            return dict(row) if row else None
+
+        except Exception as e:
+            print(f"✗ 查找可暂停的任务失败: {e}")
+            return None
+
+    def request_preemption(self, victim_id: str, job_id: str) -> bool:
+        """
+        请求暂停运行中的任务，在其worker中执行指定任务（该任务同时标记为已调度）
+
+        Args:
+            victim_id: 被暂停的任务ID
+            job_id: 抢占的任务ID
+
+        Returns:
+            bool: 是否请求成功（被暂停的任务已结束或已有抢占请求时失败）
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                UPDATE ci_jobs SET preempted_by = ?, preempt_count = preempt_count + 1
+                WHERE job_id = ? AND status = 'running' AND preempted_by IS NULL
+            ''', (job_id, victim_id))
+            if cursor.rowcount != 1:
+                conn.rollback()
+                return False
+
+            now = datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z'
+            cursor.execute('UPDATE ci_jobs SET dispatched_at = ? WHERE job_id = ?', (now, job_id))
+
+            conn.commit()
+            return True
+
+        except Exception as e:
+            print(f"✗ 请求抢占失败: {e}")
+            return False
+
+    def get_preempting_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取请求暂停该任务、尚未开始执行的抢占任务
+
+        Args:
+            job_id: 运行中的任务ID
+
+        Returns:
+            抢占任务信息（job_id, priority, metadata），没有返回None
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT j.job_id, j.priority, j.metadata FROM ci_jobs v
+                JOIN ci_jobs j ON j.job_id = v.preempted_by
+                WHERE v.job_id = ? AND j.status = 'queued'
+            ''', (job_id,))
+            row = cursor.fetchone()
+
+            return dict(row) if row else None
+
+        except Exception as e:
+            print(f"✗ 获取抢占任务失败: {e}")
+            return None
+
+    def finish_preemption(self, job_id: str, paused_seconds: float) -> bool:
+        """
+        抢占任务执行完毕，被暂停的任务恢复运行
+
+        Args:
+            job_id: 被暂停的任务ID
+            paused_seconds: 本次暂停的时长（秒）
+
+        Returns:
+            bool: 是否更新成功
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                UPDATE ci_jobs SET preempted_by = NULL, paused_seconds = COALESCE(paused_seconds, 0) + ?
+                WHERE job_id = ?
+            ''', (paused_seconds, job_id))
+
+            conn.commit()
+            return True
+
+        except Exception as e:
+            print(f"✗ 更新暂停时长失败: {e}")
+            return False
+
+    def release_preemption(self, job_id: str) -> Optional[str]:
+        """
+        撤销未执行的抢占请求（被暂停的任务在执行抢占任务前已结束），抢占任务重新等待调度
+
+        Args:
+            job_id: 被请求暂停的任务ID
+
+        Returns:
+            重新等待调度的任务ID，没有返回None
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('SELECT preempted_by FROM ci_jobs WHERE job_id = ?', (job_id,))
+            row = cursor.fetchone()
+            if not row or not row['preempted_by']:
+                return None
+
+            cursor.execute('UPDATE ci_jobs SET preempted_by = NULL WHERE job_id = ?', (job_id,))
+            cursor.execute('''
+                UPDATE ci_jobs SET dispatched_at = NULL WHERE job_id = ? AND status = 'queued'
+            ''', (row['preempted_by'],))
+            released = cursor.rowcount == 1
+
+            conn.commit()
+            return row['preempted_by'] if released else None
+
+        except Exception as e:
+            print(f"✗ 撤销抢占请求失败: {e}")
+            return None
+
+    # ========== 阶段耗时相关方法 ==========
+
+    def save_job_stages(self, job_id: str, stages: List[Dict[str, Any]]) -> bool:
+        """
+        保存任务各阶段耗时（覆盖该任务已有的记录）
+
+        Args:
+            job_id: 任务ID
+            stages: [{'stage', 'started_at', 'duration'}, ...]（按执行顺序）
+
+        Returns:
+            bool: 是否保存成功
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('DELETE FROM job_stages WHERE job_id = ?', (job_id,))
+            cursor.executemany('''
+                INSERT INTO job_stages (job_id, stage, seq, started_at, duration)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(job_id, s['stage'], i, s.get('started_at'), s['duration']) for i, s in enumerate(stages)])
+
+            conn.commit()
+            return True
+
+        except Exception as e:
+            print(f"✗ 保存阶段耗时失败: {e}")
+            return False
+
+    def get_job_stages(self, job_id: str) -> List[Dict[str, Any]]:
+        """
+        获取任务各阶段耗时
+
+        Args:
+            job_id: 任务ID
+
+        Returns:
+            [{'stage', 'started_at', 'duration'}, ...]（按执行顺序）
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT stage, started_at, duration FROM job_stages
+                WHERE job_id = ?
+                ORDER BY seq
+            ''', (job_id,))
+
+            return [dict(row) for row in cursor.fetchall()]
+
+        except Exception as e:
+            print(f"✗ 获取阶段耗时失败: {e}")
+            return []
+
+    def get_stage_durations(self, days: int = 7, filters: Optional[Dict[str, str]] = None) -> Dict[str, List[float]]:
+        """
+        获取最近任务各阶段的耗时（用于计算分位数）
+
+        Args:
+            days: 统计最近几天创建的任务
+            filters: 过滤条件，支持 mode, project_name, user_id, status（精确匹配）
+
+        Returns:
+            {阶段名: [耗时(秒), ...]}（升序）
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cutoff = (datetime.now(UTC) - timedelta(days=days)).replace(tzinfo=None).isoformat()
+            conditions = ['j.created_at > ?']
+            params: List[Any] = [cutoff]
+            for field in ('mode', 'project_name', 'user_id', 'status'):
+                if filters and filters.get(field):
+                    conditions.append(f'j.{field} = ?')
+                    params.append(filters[field])
+
+            cursor.execute(f'''
+                SELECT s.stage, s.duration FROM job_stages s
+                JOIN ci_jobs j ON j.job_id = s.job_id
+                WHERE {' AND '.join(conditions)}
+                ORDER BY s.stage, s.duration
+            ''', params)
+
+            durations: Dict[str, List[float]] = {}
+            for row in cursor.fetchall():
+                durations.setdefault(row['stage'], []).append(row['duration'])
+            return durations
+
+        except Exception as e:
+            print(f"✗ 获取阶段耗时统计失败: {e}")
+            return {}
+
+    # ========== 特殊用户管理方法 ==========
+
+    def add_special_user(self, user_id: str, quota_gb: float, weight: float = 1.0) -> bool:
+        """
+        添加特殊用户
+
+        Args:
+            user_id: 用户ID
+            quota_gb: 配额（GB）
+            weight: 公平调度权重（默认1，权重2的用户获得两倍的执行机会）
+
+        Returns:
+            bool: 是否添加成功
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            quota_bytes = int(quota_gb * 1024 * 1024 * 1024)
+            now = datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z'
+
+            cursor.execute('''
+                INSERT OR REPLACE INTO special_users (user_id, quota_bytes, weight, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, quota_bytes, weight, now, now))
+
+            conn.commit()
+            return True
+
+        except Exception as e:
+            print(f"✗ 添加特殊用户失败: {e}")
+            return False
+
+    def get_special_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取特殊用户信息
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            用户信息字典，如果不存在返回None
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('SELECT * FROM special_users WHERE user_id = ?', (user_id,))
+            row = cursor.fetchone()
+
+            if row:
+                return dict(row)
+            return None
+
+        except Exception as e:
+            print(f"✗ 获取特殊用户信息失败: {e}")
+            return None
+
+    def get_all_special_users(self) -> List[Dict[str, Any]]:
+        """
+        获取所有特殊用户
+
+        Returns:
+            特殊用户列表
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('SELECT * FROM special_users ORDER BY created_at DESC')
+            rows = cursor.fetchall()
+
+            return [dict(row) for row in rows]
+
+        except Exception as e:
+            print(f"✗ 获取特殊用户列表失败: {e}")
+            return []
+
+    def update_special_user_quota(self, user_id: str, quota_gb: float) -> bool:
+        """
+        更新特殊用户配额
+
+        Args:
+            user_id: 用户ID
+            quota_gb: 新配额（GB）
+
+        Returns:
+            bool: 是否更新成功
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            quota_bytes = int(quota_gb * 1024 * 1024 * 1024)
+            now = datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z'
+
+            cursor.execute('''
+                UPDATE special_users
+                SET quota_bytes = ?, updated_at = ?
+                WHERE user_id = ?
+            ''', (quota_bytes, now, user_id))
+
+            conn.commit()
+            return cursor.rowcount > 0
+
+        except Exception as e:
+            print(f"✗ 更新特殊用户配额失败: {e}")
+            return False
+
+    def update_special_user_weight(self, user_id: str, weight: float) -> bool:
+        """
+        更新特殊用户的公平调度权重
+
+        Args:
+            user_id: 用户ID
+            weight: 新权重
+
+        Returns:
+            bool: 是否更新成功
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            now = datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z'
+
+            cursor.execute('''
+                UPDATE special_users
+                SET weight = ?, updated_at = ?
+                WHERE user_id = ?
+            ''', (weight, now, user_id))
+
+            conn.commit()
+            return cursor.rowcount > 0
+
+        except Exception as e:
+            print(f"✗ 更新特殊用户权重失败: {e}")
+            return False
+
+    def get_user_weights(self) -> Dict[str, float]:
+        """
+        获取特殊用户的公平调度权重
+
+        Returns:
+            {user_id: weight}
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+
+            cursor.execute('SELECT user_id, weight FROM special_users')
+            return {row['user_id']: row['weight'] for row in cursor.fetchall()}
+
+        except Exception as e:
+            print(f"✗ 获取调度权重失败: {e}")
+            return {}
+
     def delete_special_user(self, user_id: str) -> bool:
         """
         删除特殊用户
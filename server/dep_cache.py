@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+依赖缓存
+任务声明要缓存的目录（node_modules、~/.cache/pip、~/.m2等）和锁文件，
+缓存键由项目、目录和锁文件内容决定；构建前从缓存恢复，构建成功后保存
+
+目录结构（均位于缓存目录下）：
+- <key>/：缓存内容
+- <key>.json：元数据（大小、来源），修改时间作为最近使用时间
+- <key>.lock：恢复时持有共享锁，保存/淘汰时持有排他锁
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from server.blob_store import validate_relpath
+from server.file_lock import FileLock
+from server.snapshot import SnapshotEngine
+
+# 单个任务最多声明的缓存目录数
+MAX_CACHE_PATHS = 16
+
+# 家目录前缀（构建时HOME指向任务私有目录）
+HOME_PREFIX = '~/'
+
+
+def parse_cache_spec(spec: Any) -> Optional[Dict[str, List[str]]]:
+    """
+    校验任务的缓存声明
+
+    支持两种写法：
+      ["node_modules", "~/.cache/pip"]
+      {"paths": ["node_modules"], "key_files": ["package-lock.json"]}
+
+    Returns:
+        {'paths': [...], 'key_files': [...]}，未声明返回None
+
+    Raises:
+        ValueError: 格式错误或路径不安全
+    """
+    if not spec:
+        return None
+    if isinstance(spec, list):
+        spec = {'paths': spec}
+    if not isinstance(spec, dict):
+        raise ValueError("cache必须是路径列表或包含paths的对象")
+
+    paths = spec.get('paths') or []
+    key_files = spec.get('key_files') or []
+    if not isinstance(paths, list) or not isinstance(key_files, list):
+        raise ValueError("paths和key_files必须是列表")
+    if len(paths) > MAX_CACHE_PATHS:
+        raise ValueError(f"最多声明 {MAX_CACHE_PATHS} 个缓存目录")
+
+    normalized = []
+    for path in paths:
+        if not isinstance(path, str):
+            raise ValueError(f"无效的缓存路径: {path!r}")
+        if path.startswith(HOME_PREFIX):
+            normalized.append(HOME_PREFIX + validate_relpath(path[len(HOME_PREFIX):]))
+        else:
+            normalized.append(validate_relpath(path))
+
+    if not normalized:
+        return None
+
+    return {
+        'paths': normalized,
+        'key_files': [validate_relpath(f) for f in key_files if isinstance(f, str)],
+    }
+
+
+def uses_home(spec: Optional[Dict[str, List[str]]]) -> bool:
+    """缓存声明中是否包含家目录路径"""
+    return bool(spec) and any(p.startswith(HOME_PREFIX) for p in spec['paths'])
+
+
+class DependencyCache:
+    """按锁文件内容分键的依赖缓存，按大小做LRU淘汰"""
+
+    def __init__(self, cache_dir: str, max_bytes: int, strategy: str = 'auto'):
+        """
+        初始化依赖缓存
+
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节）
+            strategy: 恢复缓存的快照策略；auto不使用hardlink（见snapshot），
+                      构建会原地修改恢复出的文件，硬链接会连带改坏缓存
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._restore_engine = SnapshotEngine(strategy)
+        # 保存时源目录随后即被删除，可以放心使用hardlink
+        self._save_engine = SnapshotEngine(allow_hardlink=True)
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def resolve_path(path: str, repo_dir: str, home_dir: str) -> str:
+        """缓存声明中的路径 -> 任务中的实际路径"""
+        if path.startswith(HOME_PREFIX):
+            return os.path.join(home_dir, path[len(HOME_PREFIX):])
+        return os.path.join(repo_dir, path)
+
+    def cache_key(self, scope: str, path: str, key_files: List[str], repo_dir: str) -> str:
+        """
+        计算缓存键
+
+        Args:
+            scope: 缓存隔离范围（项目名、仓库URL等）
+            path: 缓存声明中的路径
+            key_files: 锁文件列表（相对代码目录）
+            repo_dir: 代码目录
+        """
+        hasher = hashlib.sha256()
+        hasher.update(json.dumps([scope, path]).encode('utf-8'))
+
+        for name in sorted(key_files):
+            hasher.update(b'\0' + name.encode('utf-8') + b'\0')
+            try:
+                with open(os.path.join(repo_dir, name), 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        hasher.update(chunk)
+            except (FileNotFoundError, IsADirectoryError):
+                hasher.update(b'<missing>')
+
+        return hasher.hexdigest()
+
+    def _entry(self, key: str) -> Tuple[str, str, str]:
+        """(内容目录, 元数据文件, 锁文件)"""
+        base = os.path.join(self.cache_dir, key)
+        return base, f"{base}.json", f"{base}.lock"
+
+    def restore(self, key: str, dest: str) -> Optional[str]:
+        """
+        恢复缓存到dest（dest已存在时不覆盖）
+
+        Returns:
+            使用的快照策略，未命中返回None
+        """
+        entry, meta, lock_path = self._entry(key)
+        if os.path.lexists(dest):
+            return None
+
+        with FileLock(lock_path, shared=True):
+            if not os.path.exists(meta):
+                return None
+            os.utime(meta)
+            return self._restore_engine.snapshot(entry, dest)
+
+    def save(self, key: str, src: str, info: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        """
+        保存src为缓存（已存在或正在被其他任务保存时跳过）
+
+        Args:
+            key: 缓存键
+            src: 构建后的目录
+            info: 附加元数据（项目、路径等）
+
+        Returns:
+            保存的字节数，跳过返回None
+        """
+        entry, meta, lock_path = self._entry(key)
+        if os.path.exists(meta) or not os.path.isdir(src) or os.path.islink(src):
+            return None
+
+        lock = FileLock(lock_path)
+        if not lock.acquire(blocking=False):
+            return None
+
+        try:
+            if os.path.exists(meta):
+                return None
+
+            # 先快照到临时目录，完成后再发布，避免其他任务看到不完整的缓存
+            tmp = f"{entry}.tmp-{os.getpid()}"
+            shutil.rmtree(tmp, ignore_errors=True)
+            shutil.rmtree(entry, ignore_errors=True)
+            self._save_engine.snapshot(src, tmp)
+            size = self._tree_size(tmp)
+            os.rename(tmp, entry)
+
+            with open(f"{meta}.tmp", 'w', encoding='utf-8') as f:
+                json.dump({**(info or {}), 'size': size, 'created_at': time.time()}, f)
+            os.replace(f"{meta}.tmp", meta)
+            return size
+        finally:
+            lock.release()
+
+    @staticmethod
+    def _tree_size(path: str) -> int:
+        """目录树中文件的总大小"""
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except FileNotFoundError:
+                    continue
+        return total
+
+    def get_cache_usage(self) -> List[Tuple[str, int, float]]:
+        """
+        获取各缓存的大小和最近使用时间
+
+        Returns:
+            [(缓存键, 字节数, 最近使用时间戳), ...]
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.json') or not entry.is_file():
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    size = json.load(f).get('size', 0)
+                entries.append((entry.name[:-5], size, entry.stat().st_mtime))
+            except (OSError, ValueError):
+                continue
+        return entries
+
+    def get_total_size(self) -> int:
+        """缓存总大小（字节）"""
+        return sum(size for _, size, _ in self.get_cache_usage())
+
+    def evict(self) -> Tuple[int, int]:
+        """
+        按LRU淘汰缓存直到总大小不超过上限，跳过正在恢复或保存的缓存
+
+        Returns:
+            (淘汰的缓存数, 释放的字节数)
+        """
+        entries = self.get_cache_usage()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        freed = 0
+
+        for key, size, _ in sorted(entries, key=lambda e: e[2]):
+            if total <= self.max_bytes:
+                break
+
+            entry, meta, lock_path = self._entry(key)
+            lock = FileLock(lock_path)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                # 先删元数据，缓存立即对其他任务不可见
+                os.remove(meta)
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+                freed += size
+                evicted += 1
+            except FileNotFoundError:
+                continue
+            finally:
+                lock.release()
+
+        return evicted, freed
+
+
+# 测试代码
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        repo = os.path.join(temp_dir, 'repo')
+        os.makedirs(os.path.join(repo, 'node_modules', 'left-pad'))
+        with open(os.path.join(repo, 'package-lock.json'), 'w') as f:
+            f.write('{"lockfileVersion": 3}')
+        with open(os.path.join(repo, 'node_modules', 'left-pad', 'index.js'), 'w') as f:
+            f.write('module.exports = 1\n')
+
+        spec = parse_cache_spec({'paths': ['node_modules', '~/.cache/pip'], 'key_files': ['package-lock.json']})
+        print(f"缓存声明: {spec}, 使用家目录: {uses_home(spec)}")
+
+        for bad in [['../etc'], ['/abs'], {'paths': 'node_modules'}]:
+            try:
+                parse_cache_spec(bad)
+                raise AssertionError(f"应拒绝: {bad}")
+            except ValueError as e:
+                print(f"✓ 已拒绝 {bad}: {e}")
+
+        cache = DependencyCache(os.path.join(temp_dir, 'cache'), max_bytes=1024 * 1024)
+        key = cache.cache_key('demo', 'node_modules', spec['key_files'], repo)
+
+        # 首次未命中，构建成功后保存
+        assert cache.restore(key, os.path.join(repo, 'node_modules')) is None
+        saved = cache.save(key, os.path.join(repo, 'node_modules'), {'path': 'node_modules'})
+        print(f"保存缓存: {saved} 字节")
+        assert cache.save(key, os.path.join(repo, 'node_modules')) is None
+
+        # 另一个任务命中缓存
+        dest = os.path.join(temp_dir, 'job-2', 'node_modules')
+        strategy = cache.restore(key, dest)
+        print(f"恢复缓存: 策略 {strategy}")
+        assert os.path.exists(os.path.join(dest, 'left-pad', 'index.js'))
+
+        # 锁文件变化后缓存键随之变化
+        with open(os.path.join(repo, 'package-lock.json'), 'a') as f:
+            f.write('\n')
+        assert cache.cache_key('demo', 'node_modules', spec['key_files'], repo) != key
+
+        # 超过上限时淘汰
+        cache.max_bytes = 0
+        print(f"淘汰: {cache.evict()}, 剩余: {cache.get_total_size()} 字节")
+
+        print("\n✓ 所有测试通过")
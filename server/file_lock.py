@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+跨进程文件锁
+基于fcntl.flock，供多个worker进程协调共享缓存目录
+"""
+
+import os
+import fcntl
+from pathlib import Path
+
+
+class FileLock:
+    """基于flock的文件锁，支持共享锁和排他锁"""
+
+    def __init__(self, path: str, shared: bool = False):
+        """
+        初始化文件锁
+
+        Args:
+            path: 锁文件路径（不存在时自动创建）
+            shared: True为共享锁（多个持有者），False为排他锁
+        """
+        self.path = path
+        self.shared = shared
+        self._fd = None
+
+    @property
+    def locked(self) -> bool:
+        """当前是否持有锁"""
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        获取锁
+
+        Args:
+            blocking: 是否阻塞等待
+
+        Returns:
+            是否获取成功（blocking=True时总是True）
+        """
+        if self._fd is not None:
+            return True
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        flags = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+
+        try:
+            fcntl.flock(fd, flags)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+
+        self._fd = fd
+        return True
+
+    def release(self):
+        """释放锁"""
+        if self._fd is None:
+            return
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+# 测试代码
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        lock_path = os.path.join(temp_dir, 'test.lock')
+
+        reader_a = FileLock(lock_path, shared=True)
+        reader_b = FileLock(lock_path, shared=True)
+        writer = FileLock(lock_path)
+
+        assert reader_a.acquire()
+        assert reader_b.acquire(blocking=False)
+        assert not writer.acquire(blocking=False)
+
+        reader_a.release()
+        reader_b.release()
+
+        with writer:
+            assert writer.locked
+        assert not writer.locked
+
+        print("\n✓ 所有测试通过")
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Git镜像缓存
+为git模式维护每个仓库的裸镜像，任务只增量拉取缺失的提交，
+工作目录通过 git clone --shared 从镜像创建（共享对象库，不复制对象）
+
+锁约定（均位于缓存目录下）：
+- <key>.lock：排他锁，拉取/创建/删除镜像时持有
+- <key>.use：共享锁，任务使用镜像期间持有；淘汰镜像前需获取其排他锁
+"""
+
+import os
+import re
+import shutil
+import hashlib
+import subprocess
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from server.file_lock import FileLock
+
+# git命令超时（秒）
+GIT_TIMEOUT = 300
+
+
+# 提交hash（可缩写）和安全的引用名（不以-开头，不含..、@{、空白和git引用名中的特殊字符）
+_COMMIT_SHA = re.compile(r'^[0-9a-fA-F]{4,64}$')
+_SAFE_REF = re.compile(r'^[A-Za-z0-9_][A-Za-z0-9._/+-]*$')
+
+
+def validate_ref(value: str, what: str = '引用') -> str:
+    """
+    校验用户提交的分支名/提交，避免被git当作命令行选项解释
+
+    Args:
+        value: 提交hash或引用名
+        what: 错误信息中的名称
+
+    Returns:
+        原值
+
+    Raises:
+        ValueError: 不是提交hash或安全的引用名
+    """
+    if not isinstance(value, str) or len(value) > 255:
+        raise ValueError(f"非法{what}: {value!r}")
+    if _COMMIT_SHA.match(value):
+        return value
+    if (not _SAFE_REF.match(value) or '..' in value or '//' in value
+            or value.endswith(('/', '.', '.lock')) or '/.' in value):
+        raise ValueError(f"非法{what}: {value!r}")
+    return value
+
+
+def validate_repo_url(repo_url: str) -> str:
+    """
+    校验仓库URL（拒绝以-开头的值和执行本地命令的ext::/fd::传输）
+
+    Raises:
+        ValueError: URL不安全
+    """
+    if (not isinstance(repo_url, str) or not repo_url or repo_url.startswith('-')
+            or any(c.isspace() or ord(c) < 32 for c in repo_url)
+            or repo_url.lower().startswith(('ext::', 'fd::'))):
+        raise ValueError(f"非法仓库地址: {repo_url!r}")
+    return repo_url
+
+
+class GitCacheError(Exception):
+    """Git镜像操作失败"""
+
+    def __init__(self, message: str, output: str = '', returncode: int = 1):
+        super().__init__(message)
+        self.output = output
+        self.returncode = returncode
+
+
+class GitMirrorCache:
+    """按仓库URL管理的裸镜像缓存，按大小做LRU淘汰"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        初始化镜像缓存
+
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节），超出后淘汰最久未使用的镜像
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+    def mirror_key(self, repo_url: str) -> str:
+        """仓库URL对应的缓存键（可读前缀 + URL摘要）"""
+        name = re.sub(r'[^A-Za-z0-9._-]', '_', repo_url.rstrip('/').split('/')[-1])
+        name = name[:-4] if name.endswith('.git') else name
+        digest = hashlib.sha256(repo_url.encode('utf-8')).hexdigest()[:16]
+        return f"{name[:40]}-{digest}"
+
+    def mirror_path(self, repo_url: str) -> str:
+        """仓库镜像路径"""
+        return os.path.join(self.cache_dir, f"{self.mirror_key(repo_url)}.git")
+
+    def checkout(self, repo_url: str, branch: str, commit: Optional[str], dest: str) -> Tuple[str, FileLock, str]:
+        """
+        确保镜像包含目标提交，并在dest创建工作目录
+
+        Args:
+            repo_url: 仓库URL
+            branch: 分支名
+            commit: 可选的提交（为空时使用分支最新提交）
+            dest: 工作目录路径（不能已存在）
+
+        Returns:
+            (提交hash, 镜像使用锁, git输出)；任务结束后需调用 lock.release()
+
+        Raises:
+            GitCacheError: 拉取或检出失败
+        """
+        try:
+            validate_repo_url(repo_url)
+            validate_ref(branch, '分支名')
+            if commit:
+                validate_ref(commit, '提交')
+        except ValueError as e:
+            raise GitCacheError(str(e))
+
+        key = self.mirror_key(repo_url)
+        mirror = self.mirror_path(repo_url)
+        output = []
+
+        use_lock = FileLock(os.path.join(self.cache_dir, f"{key}.use"), shared=True)
+
+        with FileLock(os.path.join(self.cache_dir, f"{key}.lock")):
+            if not os.path.exists(os.path.join(mirror, 'HEAD')):
+                shutil.rmtree(mirror, ignore_errors=True)
+                output.append(self._git(['init', '--bare', '--quiet', mirror]))
+                output.append(self._git(['remote', 'add', 'origin', '--', repo_url], cwd=mirror))
+                output.append(f"创建镜像: {mirror}")
+
+            sha = self._ensure_commit(mirror, branch, commit, output)
+
+            # 在释放拉取锁前持有使用锁，避免镜像在创建工作目录前被淘汰
+            use_lock.acquire()
+            os.utime(mirror)
+
+        try:
+            output.append(self._git(['clone', '--quiet', '--shared', '--no-checkout', mirror, dest]))
+            output.append(self._git(['checkout', '--quiet', '-B', branch, sha], cwd=dest))
+            output.append(self._git(['remote', 'set-url', 'origin', '--', repo_url], cwd=dest))
+        except GitCacheError:
+            use_lock.release()
+            raise
+
+        return sha, use_lock, '\n'.join(o for o in output if o)
+
+    def _ensure_commit(self, mirror: str, branch: str, commit: Optional[str], output: List[str]) -> str:
+        """增量拉取目标提交到镜像，返回完整的提交hash"""
+        branch_ref = f"+refs/heads/{branch}:refs/heads/{branch}"
+
+        if not commit:
+            output.append(self._git(['fetch', '--quiet', '--end-of-options', 'origin', branch_ref], cwd=mirror))
+            return self._rev_parse(mirror, f"refs/heads/{branch}")
+
+        # 镜像中已有该提交，无需访问网络
+        sha = self._rev_parse(mirror, commit, required=False)
+        if sha:
+            output.append(f"镜像已包含提交 {sha}，跳过拉取")
+            return sha
+
+        # 优先直接拉取该提交（服务端需允许按hash拉取），失败则拉取整个分支
+        try:
+            output.append(self._git(['fetch', '--quiet', '--end-of-options', 'origin', commit], cwd=mirror))
+        except GitCacheError as e:
+            output.append(e.output)
+            output.append(self._git(['fetch', '--quiet', '--end-of-options', 'origin', branch_ref], cwd=mirror))
+
+        sha = self._rev_parse(mirror, commit, required=False)
+        if not sha:
+            raise GitCacheError(f"提交不存在: {commit}", '\n'.join(o for o in output if o))
+        return sha
+
+    def _rev_parse(self, repo: str, rev: str, required: bool = True) -> Optional[str]:
+        """解析提交hash"""
+        result = subprocess.run(
+            ['git', 'rev-parse', '--verify', '--quiet', f"{rev}^{{commit}}"],
+            cwd=repo,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=GIT_TIMEOUT,
+            text=True
+        )
+        if result.returncode == 0:
+            return result.stdout.strip()
+        if required:
+            raise GitCacheError(f"无法解析: {rev}", result.stdout, result.returncode)
+        return None
+
+    def _git(self, args: List[str], cwd: Optional[str] = None) -> str:
+        """执行git命令，失败时抛出GitCacheError"""
+        result = subprocess.run(
+            ['git'] + args,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=GIT_TIMEOUT,
+            text=True
+        )
+        if result.returncode != 0:
+            raise GitCacheError(f"git {args[0]} 失败", result.stdout, result.returncode)
+        return result.stdout.strip()
+
+    def get_cache_usage(self) -> List[Tuple[str, int, float]]:
+        """
+        获取各镜像的大小和最近使用时间
+
+        Returns:
+            [(镜像路径, 字节数, 最近使用时间戳), ...]
+        """
+        mirrors = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.git') or not entry.is_dir():
+                continue
+            size = 0
+            for root, _, files in os.walk(entry.path):
+                for name in files:
+                    try:
+                        size += os.lstat(os.path.join(root, name)).st_size
+                    except FileNotFoundError:
+                        continue
+            mirrors.append((entry.path, size, entry.stat().st_mtime))
+        return mirrors
+
+    def evict(self) -> Tuple[int, int]:
+        """
+        按LRU淘汰镜像直到总大小不超过上限，跳过正在使用的镜像
+
+        Returns:
+            (淘汰的镜像数, 释放的字节数)
+        """
+        mirrors = self.get_cache_usage()
+        total = sum(size for _, size, _ in mirrors)
+        evicted = 0
+        freed = 0
+
+        for path, size, _ in sorted(mirrors, key=lambda m: m[2]):
+            if total <= self.max_bytes:
+                break
+
+            key = os.path.basename(path)[:-4]
+            fetch_lock = FileLock(os.path.join(self.cache_dir, f"{key}.lock"))
+            use_lock = FileLock(os.path.join(self.cache_dir, f"{key}.use"))
+
+            if not fetch_lock.acquire(blocking=False):
+                continue
+            try:
+                if not use_lock.acquire(blocking=False):
+                    continue
+                try:
+                    shutil.rmtree(path, ignore_errors=True)
+                    total -= size
+                    freed += size
+                    evicted += 1
+                finally:
+                    use_lock.release()
+            finally:
+                fetch_lock.release()
+
+        return evicted, freed
+
+
+# 测试代码
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # 创建一个本地上游仓库
+        upstream = os.path.join(temp_dir, 'upstream')
+        os.makedirs(upstream)
+        subprocess.run(['git', 'init', '-q', '-b', 'main', upstream], check=True)
+        for i in range(2):
+            with open(os.path.join(upstream, 'file.txt'), 'w') as f:
+                f.write(f'version {i}\n')
+            subprocess.run(['git', '-C', upstream, 'add', '.'], check=True)
+            subprocess.run(['git', '-C', upstream, '-c', 'user.name=ci', '-c', 'user.email=ci@local',
+                            'commit', '-q', '-m', f'commit {i}'], check=True)
+
+        first = subprocess.run(['git', '-C', upstream, 'rev-parse', 'HEAD~1'],
+                               stdout=subprocess.PIPE, text=True, check=True).stdout.strip()
+
+        cache = GitMirrorCache(os.path.join(temp_dir, 'mirrors'), max_bytes=0)
+
+        # 分支最新提交
+        sha, lock, _ = cache.checkout(upstream, 'main', None, os.path.join(temp_dir, 'job-1'))
+        print(f"检出: {sha}")
+        lock.release()
+
+        # 非分支最新的提交，镜像中已存在
+        sha, lock, output = cache.checkout(upstream, 'main', first, os.path.join(temp_dir, 'job-2'))
+        print(f"检出: {sha} ({output})")
+        with open(os.path.join(temp_dir, 'job-2', 'file.txt')) as f:
+            assert f.read() == 'version 0\n'
+
+        # 以-开头的提交/分支不能被当作git选项
+        for branch, commit in (('main', '--upload-pack=touch /tmp/pwned'), ('--help', None), ('main', 'a..b')):
+            try:
+                cache.checkout(upstream, branch, commit, os.path.join(temp_dir, 'job-x'))
+                raise AssertionError(f'应拒绝: {branch} {commit}')
+            except GitCacheError as e:
+                print(f"拒绝: {e}")
+        assert validate_ref('release/v1.2') and validate_ref(first[:12])
+
+        # 使用中的镜像不会被淘汰
+        assert cache.evict() == (0, 0)
+        lock.release()
+        evicted, freed = cache.evict()
+        print(f"淘汰: {evicted} 个镜像, {freed} 字节")
+
+        print("\n✓ 所有测试通过")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+任务日志写入器
+每个任务保持一个打开的日志文件描述符，消息先写入内存缓冲，
+缓冲超过大小阈值、距上次写入超过时间间隔（后台线程定期检查）或到达步骤边界时才写入文件，
+避免每条消息都打开、追加、关闭一次文件；实时查看日志最多延迟一个时间间隔
+后台线程同时增量更新日志的行偏移索引（见 log_index），构建脚本直接追加到文件的输出也会被索引
+"""
+
+import os
+import time
+import threading
+from datetime import datetime, timezone, timedelta
+from typing import List, Optional
+
+from server.log_index import LineIndexWriter
+
+# 日志时间戳使用的时区
+UTC8 = timezone(timedelta(hours=8))
+
+# 默认缓冲大小阈值（字节）和写入间隔（秒）
+DEFAULT_FLUSH_BYTES = 64 * 1024
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+
+class JobLogWriter:
+    """带时间戳和步骤标记的缓冲日志写入器（线程安全）"""
+
+    def __init__(self, path: str, flush_bytes: int = DEFAULT_FLUSH_BYTES,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, index: Optional[LineIndexWriter] = None):
+        """
+        初始化日志写入器（第一次写入时才打开文件）
+
+        Args:
+            path: 日志文件路径（追加写入）
+            flush_bytes: 缓冲超过该字节数时立即写入
+            flush_interval: 缓冲中的内容最多保留的时间（秒），0表示每条消息立即写入
+            index: 行偏移索引（为None时不建立索引）
+        """
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.index = index
+        self._fd: Optional[int] = None
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._timestamp_second = -1
+        self._timestamp = ''
+
+    def _now(self) -> str:
+        """当前时间戳（同一秒内复用格式化结果）"""
+        second = int(time.time())
+        if second != self._timestamp_second:
+            self._timestamp_second = second
+            self._timestamp = datetime.fromtimestamp(second, UTC8).strftime('%Y-%m-%d %H:%M:%S')
+        return self._timestamp
+
+    def write(self, text: str):
+        """追加原始文本（不加时间戳）"""
+        data = text.encode('utf-8')
+        with self._lock:
+            if self._closed.is_set():
+                # 已关闭（如任务结束后的异常回调），直接写入
+                self._write_unlocked([data])
+                self._close_fd_unlocked()
+                return
+            self._buffer.append(data)
+            self._buffered += len(data)
+            if self._buffered >= self.flush_bytes or self.flush_interval <= 0:
+                self._flush_unlocked()
+            elif self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+                self._flusher.start()
+
+    def log(self, message: str):
+        """写一行带时间戳的日志"""
+        self.write(f"[{self._now()}] {message}\n")
+
+    def step(self, title: str, blank_line: bool = False):
+        """
+        写步骤标记（">>> 标题"）并立即写入文件，实时查看日志时能看到当前步骤
+
+        Args:
+            title: 步骤标题
+            blank_line: 是否在标记前空一行
+        """
+        prefix = '\n' if blank_line else ''
+        self.log(f"{prefix}>>> {title}")
+        self.flush()
+
+    def flush(self):
+        """把缓冲的内容写入文件（外部进程写同一文件前必须调用）"""
+        with self._lock:
+            self._flush_unlocked()
+
+    def close(self):
+        """写入剩余内容并关闭文件"""
+        self._closed.set()
+        with self._lock:
+            self._flush_unlocked()
+            self._close_fd_unlocked()
+        if self._flusher and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        if self.index:
+            self.index.update()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _flush_periodically(self):
+        """后台线程：每隔flush_interval把缓冲写入文件并更新索引"""
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+            if self.index:
+                self.index.update()
+
+    def _flush_unlocked(self):
+        if self._buffer:
+            chunks, self._buffer, self._buffered = self._buffer, [], 0
+            self._write_unlocked(chunks)
+
+    def _close_fd_unlocked(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _write_unlocked(self, chunks: List[bytes]):
+        try:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            data = b''.join(chunks)
+            while data:
+                written = os.write(self._fd, data)
+                data = data[written:]
+        except OSError as e:
+            print(f"✗ 写入日志失败 {self.path}: {e}")
+
+
+# 测试代码
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'job.log')
+
+        writer = JobLogWriter(path, flush_bytes=1024, flush_interval=0.2,
+                              index=LineIndexWriter(path, lines_per_entry=10))
+        writer.log("=" * 70)
+        writer.log("任务ID: demo")
+        assert not os.path.exists(path), "未到阈值时不应写入"
+
+        writer.step("步骤 1/3: 准备代码", blank_line=True)
+        content = open(path, encoding='utf-8').read()
+        print(content)
+        assert content.endswith(">>> 步骤 1/3: 准备代码\n") and "\n[" in content
+
+        # 时间阈值：后台线程写入
+        writer.log("源目录: /tmp/demo")
+        time.sleep(0.5)
+        assert "源目录" in open(path, encoding='utf-8').read()
+
+        # 大小阈值
+        before = os.path.getsize(path)
+        for i in range(100):
+            writer.log(f"line {i}")
+        assert os.path.getsize(path) > before
+
+        writer.close()
+        assert open(path, encoding='utf-8').read().endswith("line 99\n")
+        from server.log_index import load_index
+        assert len(load_index(path).offsets) == 11, "105行应有11个检查点"
+
+        # 关闭后仍可写入（异常回调）
+        writer.write("\n===== 任务异常终止 =====\n")
+        assert open(path, encoding='utf-8').read().endswith("===== 任务异常终止 =====\n")
+
+        # 耗时：缓冲写入 vs 逐行打开文件
+        many = os.path.join(temp_dir, 'many.log')
+        start = time.perf_counter()
+        with JobLogWriter(many) as w:
+            for i in range(20000):
+                w.log(f"message {i}")
+        buffered = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(20000):
+            with open(many, 'a') as f:
+                f.write(f"[{datetime.now(UTC8).strftime('%Y-%m-%d %H:%M:%S')}] message {i}\n")
+        unbuffered = time.perf_counter() - start
+        print(f"20000行: 缓冲写入 {buffered:.3f} 秒, 逐行打开 {unbuffered:.3f} 秒")
+
+    print("\n✓ 所有测试通过")
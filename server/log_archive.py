@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+已结束任务日志的压缩存储
+任务结束后把 <job_id>.log 压缩为 <job_id>.log.zst（未安装zstandard时为 <job_id>.log.gz），
+数据库中记录的日志路径不变，读取时按该路径查找实际存在的文件；
+偏移和大小始终按解压后的内容计算，压缩前后客户端的增量读取可以无缝衔接；
+压缩文件由独立压缩的帧组成，帧表记录在行偏移索引中（见 log_index），可以从任意帧开始解压
+"""
+
+import io
+import os
+import gzip
+import zlib
+import fcntl
+import struct
+from array import array
+from functools import lru_cache
+from typing import BinaryIO, Optional, Tuple
+
+from server.compression import resolve_format, zstandard
+from server.log_index import LogIndex, LineCounter, load_index, write_index, index_path
+
+# 压缩格式 -> 压缩日志的文件后缀
+LOG_SUFFIXES = {'zstd': '.zst', 'gzip': '.gz'}
+
+# 压缩格式 -> HTTP Content-Encoding
+CONTENT_ENCODINGS = {'zstd': 'zstd', 'gzip': 'gzip'}
+
+# 默认压缩级别（构建日志重复度高，较高的级别压缩率提升明显，解压速度不受影响）
+DEFAULT_LEVELS = {'zstd': 9, 'gzip': 6}
+
+# 每帧压缩前的大小：帧越小按偏移读取时需要解压的内容越少，压缩率越低
+FRAME_SIZE = 1024 * 1024
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def find_log(path: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    查找日志实际存储的文件
+
+    压缩文件和原文件同时存在时以压缩文件为准：压缩后追加的内容（如任务异常回调）写入新的原文件，
+    只包含追加的部分，下次压缩时才合并到压缩文件中。
+    压缩时先生成压缩文件再删除原文件，按 压缩文件 -> 原文件 -> 压缩文件 的顺序查找总能找到其中之一
+
+    Args:
+        path: 数据库中记录的日志路径（未压缩的路径）
+
+    Returns:
+        (实际文件路径, 压缩格式)，未压缩时格式为None，都不存在时返回 (None, None)
+    """
+    for check_plain in (True, False):
+        for fmt, suffix in LOG_SUFFIXES.items():
+            if os.path.exists(path + suffix):
+                return path + suffix, fmt
+        if check_plain and os.path.exists(path):
+            return path, None
+    return None, None
+
+
+def log_exists(path: str) -> bool:
+    """日志是否存在（未压缩或已压缩）"""
+    return find_log(path)[0] is not None
+
+
+def disk_size(path: str) -> int:
+    """日志和索引占用的磁盘空间（已压缩时为压缩后的大小），不存在返回0"""
+    total = 0
+    for candidate in (find_log(path)[0], index_path(path)):
+        try:
+            total += os.path.getsize(candidate) if candidate else 0
+        except FileNotFoundError:
+            continue
+    return total
+
+
+def remove_log(path: str) -> int:
+    """
+    删除日志的所有存储形式和索引
+
+    Returns:
+        释放的字节数
+    """
+    freed = 0
+    for candidate in [path, index_path(path)] + [path + suffix for suffix in LOG_SUFFIXES.values()]:
+        try:
+            size = os.path.getsize(candidate)
+            os.remove(candidate)
+            freed += size
+        except FileNotFoundError:
+            continue
+    return freed
+
+
+class _GzipReader(gzip.GzipFile):
+    """从压缩文件的任意成员开始读取，关闭时一并关闭底层文件"""
+
+    def close(self):
+        raw = self.fileobj
+        try:
+            super().close()
+        finally:
+            if raw is not None:
+                raw.close()
+
+
+class _DeflateReader(io.RawIOBase):
+    """从gzip文件中的全刷新点（帧的起始处）开始解压deflate数据，关闭时一并关闭底层文件"""
+
+    def __init__(self, raw: BinaryIO):
+        self._raw = raw
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while True:
+            if self._decompressor.eof:
+                return 0
+            if self._decompressor.unconsumed_tail:
+                data = self._decompressor.decompress(self._decompressor.unconsumed_tail, len(buffer))
+            else:
+                chunk = self._raw.read(64 * 1024)
+                if not chunk:
+                    return 0
+                data = self._decompressor.decompress(chunk, len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                return len(data)
+
+    def close(self):
+        try:
+            self._raw.close()
+        finally:
+            super().close()
+
+
+def _open_decompressed(raw: BinaryIO, fmt: str, at_frame: bool = False) -> BinaryIO:
+    """
+    从raw的当前位置开始解压，关闭时一并关闭raw
+
+    Args:
+        raw: 压缩文件
+        fmt: zstd | gzip
+        at_frame: raw位于帧表中某一帧的起始处（gzip为全刷新点，不在文件开头）
+    """
+    if fmt == 'zstd':
+        if zstandard is None:
+            raw.close()
+            raise OSError("读取zstd压缩的日志需要安装zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+    if at_frame:
+        return io.BufferedReader(_DeflateReader(raw), CHUNK_SIZE)
+    return _GzipReader(fileobj=raw, mode='rb')
+
+
+def _skip(f: BinaryIO, count: int):
+    """在解压流中向前跳过指定字节数"""
+    while count > 0:
+        data = f.read(min(count, CHUNK_SIZE))
+        if not data:
+            return
+        count -= len(data)
+
+
+@lru_cache(maxsize=1024)
+def _content_size(actual: str, fmt: str, size: int, mtime_ns: int) -> int:
+    """没有索引时解压统计大小（按文件大小和修改时间缓存，文件变化后重新计算）"""
+    total = 0
+    with _open_decompressed(open(actual, 'rb'), fmt) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return total
+            total += len(chunk)
+
+
+def _check_index(index: Optional[LogIndex], fmt: Optional[str], stored_size: int) -> Optional[LogIndex]:
+    """
+    确认索引与当前文件一致：检查点只会随内容增长而追加，始终有效；
+    总行数、大小和帧表只在索引对应的正是当前文件时有效，否则按未完成的索引处理
+    """
+    if index and index.complete:
+        matches = index.stored_size == stored_size if fmt else index.content_size == stored_size
+        if not matches or (fmt and not index.frames):
+            index.complete = False
+            index.frames = []
+    elif index:
+        index.frames = []
+    return index
+
+
+def load_log_index(path: str) -> Optional[LogIndex]:
+    """
+    读取日志的行偏移索引（已确认与当前文件一致，见 _check_index）
+
+    Args:
+        path: 数据库中记录的日志路径
+
+    Returns:
+        索引，日志或索引不存在时返回None
+    """
+    actual, fmt = find_log(path)
+    if actual is None:
+        return None
+    try:
+        return _check_index(load_index(path), fmt, os.path.getsize(actual))
+    except FileNotFoundError:
+        return None
+
+
+def open_log(path: str, offset: int = 0) -> Tuple[Optional[BinaryIO], int]:
+    """
+    打开日志用于读取，返回的流位于指定偏移处
+
+    已压缩时返回解压流（只支持向前读取）：有帧表时从包含该偏移的帧开始解压，否则从头解压
+
+    Args:
+        path: 数据库中记录的日志路径
+        offset: 解压后的起始偏移（超出大小时按末尾处理）
+
+    Returns:
+        (只读流, 解压后的大小)，日志不存在时返回 (None, 0)
+    """
+    for _ in range(2):
+        actual, fmt = find_log(path)
+        if actual is None:
+            return None, 0
+        try:
+            raw = open(actual, 'rb')
+        except FileNotFoundError:
+            # 查找后文件恰好被压缩（原文件已删除），重新查找
+            continue
+
+        stat = os.fstat(raw.fileno())
+        if fmt is None:
+            raw.seek(min(max(offset, 0), stat.st_size))
+            return raw, stat.st_size
+
+        index = _check_index(load_index(path), fmt, stat.st_size)
+        if index and index.complete:
+            size = index.content_size
+            target = min(max(offset, 0), size)
+            frame_offset, frame_start = index.frame_for(target)
+            raw.seek(frame_offset)
+            f = _open_decompressed(raw, fmt, at_frame=True)
+        else:
+            size = _content_size(actual, fmt, stat.st_size, stat.st_mtime_ns)
+            target, frame_start = min(max(offset, 0), size), 0
+            f = _open_decompressed(raw, fmt)
+
+        _skip(f, target - frame_start)
+        return f, size
+    return None, 0
+
+
+def content_size(path: str) -> int:
+    """日志解压后的大小，不存在返回0"""
+    f, size = open_log(path)
+    if f is not None:
+        f.close()
+    return size
+
+
+class _FrameWriter:
+    """
+    把日志按帧写入压缩文件
+
+    zstd: 每帧是一个独立的zstd帧；gzip: 整个文件是一个gzip成员，每帧结束时全刷新（Z_FULL_FLUSH），
+    可以从任意帧的起始处开始解压deflate数据，不支持多成员gzip的客户端也能直接解压
+    """
+
+    def __init__(self, out: BinaryIO, fmt: str, level: int):
+        self.out = out
+        self.fmt = fmt
+        if fmt == 'zstd':
+            self._cctx = zstandard.ZstdCompressor(level=level)
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            self._crc = 0
+            self._size = 0
+            # gzip头: magic, deflate, 无标志, mtime=0, 无额外标志, 操作系统未知
+            out.write(b'\x1f\x8b\x08\x00' + b'\x00' * 4 + b'\x00\xff')
+
+    def write_frame(self, data: bytes):
+        if self.fmt == 'zstd':
+            self.out.write(self._cctx.compress(data))
+            return
+        self.out.write(self._compressor.compress(data))
+        self.out.write(self._compressor.flush(zlib.Z_FULL_FLUSH))
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+
+    def finish(self):
+        if self.fmt == 'gzip':
+            self.out.write(self._compressor.flush())
+            self.out.write(struct.pack('<II', self._crc, self._size & 0xFFFFFFFF))
+
+
+def compress_log(path: str, fmt: str = 'zstd', level: Optional[int] = None) -> Optional[int]:
+    """
+    压缩日志并删除原文件（只应在任务结束、日志不再写入后调用）
+
+    每 FRAME_SIZE 字节独立压缩为一帧（见 _FrameWriter，标准工具可直接解压整个文件），
+    帧表、总行数和完整的行偏移写入索引，按偏移或行号读取时只需从对应的帧开始解压。
+    先写入临时文件再重命名，读取方任何时候都能看到完整的原文件或压缩文件；
+    已有压缩文件时（压缩后又追加了内容，如任务异常回调）与新内容合并后重新压缩。
+    多个进程同时压缩同一日志时通过文件锁只有一个执行
+
+    Args:
+        path: 日志路径
+        fmt: zstd | gzip（zstd不可用时回退为gzip）
+        level: 压缩级别，默认见 DEFAULT_LEVELS
+
+    Returns:
+        压缩文件与索引的总大小，日志不存在或正在被其他进程压缩时返回None
+    """
+    fmt = resolve_format(fmt)
+    level = level if level is not None else DEFAULT_LEVELS[fmt]
+    dest = path + LOG_SUFFIXES[fmt]
+    temp = f"{dest}.{os.getpid()}.tmp"
+
+    try:
+        source = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+
+    with source:
+        try:
+            fcntl.flock(source.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        # 拿到锁时其他进程可能已压缩完并删除了原文件
+        if os.fstat(source.fileno()).st_nlink == 0:
+            return None
+
+        previous = [(path + suffix, previous_fmt) for previous_fmt, suffix in LOG_SUFFIXES.items()
+                    if os.path.exists(path + suffix)]
+        counter = LineCounter()
+        offsets = array('Q', [0])
+        frames = []
+
+        try:
+            with open(temp, 'wb') as out:
+                writer = _FrameWriter(out, fmt, level)
+                inputs = [_open_decompressed(open(p, 'rb'), f) for p, f in previous] + [source]
+                for stream in inputs:
+                    while True:
+                        data = stream.read(FRAME_SIZE)
+                        if not data:
+                            break
+                        frames.append((out.tell(), counter.position))
+                        offsets.extend(counter.feed(data))
+                        writer.write_frame(data)
+                    if stream is not source:
+                        stream.close()
+                writer.finish()
+            # 保留原文件的修改时间（判断日志是否写完依赖修改时间）
+            stat = os.fstat(source.fileno())
+            os.utime(temp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            os.replace(temp, dest)
+        except Exception:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+        write_index(path, LogIndex(counter.lines_per_entry, offsets, frames, counter.line_count(),
+                                   counter.position, os.path.getsize(dest), complete=True))
+        for previous_path, _ in previous:
+            if previous_path != dest:
+                os.remove(previous_path)
+        os.remove(path)
+        return os.path.getsize(dest) + os.path.getsize(index_path(path))
+
+
+def cleanup_temp_files(log_dir: str) -> int:
+    """
+    删除中断的压缩留下的临时文件（进程启动时调用）
+
+    Returns:
+        删除的文件数
+    """
+    removed = 0
+    try:
+        entries = list(os.scandir(log_dir))
+    except FileNotFoundError:
+        return 0
+
+    for entry in entries:
+        # 文件名格式: <job_id>.log.<后缀>.<pid>.tmp
+        parts = entry.name.rsplit('.', 2)
+        if len(parts) != 3 or parts[2] != 'tmp' or not parts[1].isdigit():
+            continue
+        if int(parts[1]) == os.getpid():
+            continue
+        try:
+            os.kill(int(parts[1]), 0)
+        except ProcessLookupError:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        except PermissionError:
+            continue
+    return removed
+
+
+# 测试代码
+if __name__ == '__main__':
+    import tempfile
+    import time
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for fmt in ['zstd', 'gzip'] if zstandard is not None else ['gzip']:
+            path = os.path.join(temp_dir, f'{fmt}.log')
+            with open(path, 'w', encoding='utf-8') as f:
+                for i in range(50000):
+                    f.write(f"[2026-01-01 00:00:00] 编译 src/module_{i % 200}.c ... ok\n")
+            original = open(path, 'rb').read()
+
+            start = time.perf_counter()
+            compressed = compress_log(path, fmt)
+            elapsed = time.perf_counter() - start
+            print(f"{fmt}: {len(original)} -> {compressed} 字节 "
+                  f"({len(original) / compressed:.1f}x, {elapsed * 1000:.0f} ms)")
+
+            assert not os.path.exists(path) and find_log(path) == (path + LOG_SUFFIXES[fmt], fmt)
+            assert disk_size(path) == compressed
+            assert content_size(path) == len(original)
+            f, size = open_log(path, 1000)
+            with f:
+                assert f.read(500) == original[1000:1500]
+            index = load_log_index(path)
+            assert index.complete and len(index.frames) == 3 and index.line_count == 50000
+            f, size = open_log(path, len(original) - 100)
+            with f:
+                assert f.read() == original[-100:]
+
+            # 压缩后追加的内容与已压缩的内容合并；合并前读取的仍是完整的压缩文件
+            with open(path, 'ab') as f:
+                f.write("===== 任务异常终止 =====\n".encode('utf-8'))
+            assert find_log(path) == (path + LOG_SUFFIXES[fmt], fmt) and content_size(path) == len(original)
+            compress_log(path, fmt)
+            f, size = open_log(path)
+            with f:
+                assert f.read() == original + "===== 任务异常终止 =====\n".encode('utf-8')
+
+            assert remove_log(path) > 0 and not log_exists(path)
+
+        assert compress_log(os.path.join(temp_dir, 'missing.log')) is None
+        open(os.path.join(temp_dir, 'x.log.zst.999999999.tmp'), 'w').close()
+        assert cleanup_temp_files(temp_dir) == 1
+
+    print("\n✓ 所有测试通过")
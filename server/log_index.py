@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+日志行偏移索引
+与日志放在一起的 <日志路径>.idx 文件，每K行记录一个uint64偏移（第 i*K 行的起始字节），
+日志写入过程中增量建立；按行号读取时先定位到最近的检查点，最多再顺序扫描K行
+
+日志压缩后索引中还记录压缩文件的帧表（每帧独立压缩，见 log_archive），
+可以从任意帧开始解压，按行号或偏移读取压缩日志时只需解压一帧左右的内容
+
+文件格式（小端）:
+  头部: magic(4) 版本(2) 标志(2) 每个检查点的行数K(4) 帧数(4) 总行数(8) 解压后大小(8) 压缩文件大小(8)
+  帧表: 帧数 x (压缩文件中的偏移(8), 解压后的偏移(8))
+  检查点: uint64数组，第i项为第 i*K 行的起始偏移（第0项为0），写入过程中不断追加
+"""
+
+import os
+import sys
+import struct
+import bisect
+from array import array
+from typing import List, Optional, Tuple
+
+INDEX_SUFFIX = '.idx'
+
+MAGIC = b'CILI'
+VERSION = 1
+
+# 头部和帧表项
+HEADER = struct.Struct('<4sHHIIQQQ')
+FRAME = struct.Struct('<QQ')
+
+# 标志：索引已覆盖整个日志（压缩时写入），总行数和大小可直接使用
+FLAG_COMPLETE = 1
+
+# 默认每个检查点的行数
+DEFAULT_LINES_PER_ENTRY = 1024
+
+# 建立索引时每次读取的字节数
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def index_path(log_path: str) -> str:
+    """日志对应的索引文件路径"""
+    return log_path + INDEX_SUFFIX
+
+
+def _to_bytes(offsets: array) -> bytes:
+    if sys.byteorder != 'little':
+        offsets = array('Q', offsets)
+        offsets.byteswap()
+    return offsets.tobytes()
+
+
+class LogIndex:
+    """已加载的行偏移索引"""
+
+    def __init__(self, lines_per_entry: int, offsets: array, frames: List[Tuple[int, int]] = None,
+                 line_count: int = 0, content_size: int = 0, stored_size: int = 0, complete: bool = False):
+        """
+        Args:
+            lines_per_entry: 每个检查点的行数K
+            offsets: 检查点偏移（第i项为第 i*K 行的起始偏移）
+            frames: 压缩帧表 [(压缩文件中的偏移, 解压后的偏移)]，未压缩时为空
+            line_count: 总行数（complete为True时有效）
+            content_size: 解压后的大小（complete为True时有效）
+            stored_size: 帧表对应的压缩文件大小（用于确认帧表与压缩文件一致）
+            complete: 索引是否已覆盖整个日志
+        """
+        self.lines_per_entry = lines_per_entry
+        self.offsets = offsets
+        self.frames = frames or []
+        self.line_count = line_count
+        self.content_size = content_size
+        self.stored_size = stored_size
+        self.complete = complete
+
+    def checkpoint(self, line: int) -> Tuple[int, int]:
+        """
+        不超过指定行的最近检查点
+
+        Args:
+            line: 行号（从0开始）
+
+        Returns:
+            (检查点的行号, 检查点的偏移)
+        """
+        entry = min(max(line, 0) // self.lines_per_entry, len(self.offsets) - 1)
+        return entry * self.lines_per_entry, self.offsets[entry]
+
+    def last_checkpoint(self) -> Tuple[int, int]:
+        """最后一个检查点 (行号, 偏移)"""
+        return (len(self.offsets) - 1) * self.lines_per_entry, self.offsets[-1]
+
+    def frame_for(self, offset: int) -> Tuple[int, int]:
+        """
+        包含指定解压后偏移的帧
+
+        Returns:
+            (帧在压缩文件中的偏移, 帧起始的解压后偏移)
+        """
+        position = bisect.bisect_right([start for _, start in self.frames], offset) - 1
+        return self.frames[max(position, 0)]
+
+
+def load_index(log_path: str) -> Optional[LogIndex]:
+    """
+    读取日志的行偏移索引
+
+    Returns:
+        索引，不存在或格式不正确时返回None
+    """
+    try:
+        with open(index_path(log_path), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    if len(data) < HEADER.size:
+        return None
+    magic, version, flags, lines_per_entry, frame_count, line_count, content_size, stored_size = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or lines_per_entry <= 0:
+        return None
+
+    position = HEADER.size
+    frames = [FRAME.unpack_from(data, position + i * FRAME.size) for i in range(frame_count)]
+    position += frame_count * FRAME.size
+
+    # 写入过程中最后一项可能不完整
+    body = data[position:]
+    offsets = array('Q')
+    offsets.frombytes(body[:len(body) - len(body) % 8])
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+    if not offsets:
+        return None
+
+    return LogIndex(lines_per_entry, offsets, frames, line_count, content_size, stored_size,
+                    bool(flags & FLAG_COMPLETE))
+
+
+def write_index(log_path: str, index: LogIndex):
+    """写入完整的索引（先写临时文件再替换）"""
+    path = index_path(log_path)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, FLAG_COMPLETE if index.complete else 0, index.lines_per_entry,
+                            len(index.frames), index.line_count, index.content_size, index.stored_size))
+        for frame in index.frames:
+            f.write(FRAME.pack(*frame))
+        f.write(_to_bytes(index.offsets))
+    os.replace(temp, path)
+
+
+class LineCounter:
+    """顺序扫描日志内容，统计行数并每K行记录一个检查点"""
+
+    def __init__(self, lines_per_entry: int = DEFAULT_LINES_PER_ENTRY,
+                 lines: int = 0, position: int = 0):
+        """
+        Args:
+            lines_per_entry: 每个检查点的行数K
+            lines: 已扫描的行数（从检查点继续时为检查点的行号）
+            position: 已扫描的字节数（从检查点继续时为检查点的偏移）
+        """
+        self.lines_per_entry = lines_per_entry
+        self.lines = lines
+        self.position = position
+        self.last_byte = b''
+
+    def feed(self, data: bytes) -> List[int]:
+        """
+        扫描一块内容
+
+        Returns:
+            本块中新增的检查点偏移
+        """
+        checkpoints = []
+        start = 0
+        newlines = data.count(b'\n')
+        needed = self.lines_per_entry - self.lines % self.lines_per_entry
+
+        # 只在跨过检查点时逐个查找换行符，其余直接计数
+        while newlines >= needed:
+            for _ in range(needed):
+                start = data.index(b'\n', start) + 1
+            checkpoints.append(self.position + start)
+            newlines -= needed
+            self.lines += needed
+            needed = self.lines_per_entry
+        self.lines += newlines
+
+        self.position += len(data)
+        if data:
+            self.last_byte = data[-1:]
+        return checkpoints
+
+    def line_count(self) -> int:
+        """总行数（最后一行没有换行符时也算一行）"""
+        return self.lines + (1 if self.last_byte and self.last_byte != b'\n' else 0)
+
+
+class LineIndexWriter:
+    """
+    日志写入过程中增量建立索引（每个日志只能有一个写入者）
+
+    每次update从上次扫描到的位置读取新增内容，只追加新的检查点；
+    其他进程直接追加到日志的内容（构建脚本输出）也会被索引
+    """
+
+    def __init__(self, log_path: str, lines_per_entry: int = DEFAULT_LINES_PER_ENTRY):
+        """
+        Args:
+            log_path: 日志文件路径
+            lines_per_entry: 每个检查点的行数K（已有索引时沿用其K）
+        """
+        self.log_path = log_path
+        self.path = index_path(log_path)
+        self.lines_per_entry = lines_per_entry
+        self._counter: Optional[LineCounter] = None
+
+    def _open_counter(self) -> LineCounter:
+        existing = load_index(self.log_path)
+        if existing and not existing.frames:
+            # 从已有索引的最后一个检查点继续（如worker重启后重新执行）
+            self.lines_per_entry = existing.lines_per_entry
+            lines, position = existing.last_checkpoint()
+            return LineCounter(self.lines_per_entry, lines, position)
+
+        with open(self.path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, self.lines_per_entry, 0, 0, 0, 0))
+            f.write(_to_bytes(array('Q', [0])))
+        return LineCounter(self.lines_per_entry)
+
+    def update(self) -> int:
+        """
+        索引日志中新增的内容
+
+        Returns:
+            新增的检查点数
+        """
+        try:
+            with open(self.log_path, 'rb') as log:
+                if self._counter is None:
+                    self._counter = self._open_counter()
+                log.seek(self._counter.position)
+                checkpoints = []
+                while True:
+                    data = log.read(READ_BLOCK_SIZE)
+                    if not data:
+                        break
+                    checkpoints.extend(self._counter.feed(data))
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            print(f"✗ 更新日志索引失败 {self.path}: {e}")
+            return 0
+
+        if checkpoints:
+            try:
+                with open(self.path, 'ab') as f:
+                    f.write(_to_bytes(array('Q', checkpoints)))
+            except OSError as e:
+                print(f"✗ 更新日志索引失败 {self.path}: {e}")
+        return len(checkpoints)
+
+
+# 测试代码
+if __name__ == '__main__':
+    import tempfile
+    import time
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'job.log')
+        writer = LineIndexWriter(path, lines_per_entry=100)
+        assert writer.update() == 0
+
+        with open(path, 'w', encoding='utf-8') as f:
+            for i in range(250):
+                f.write(f"第 {i} 行\n")
+        assert writer.update() == 2
+        with open(path, 'a', encoding='utf-8') as f:
+            for i in range(250, 1000):
+                f.write(f"第 {i} 行\n")
+            f.write("没有换行的最后一行")
+        assert writer.update() == 8
+
+        index = load_index(path)
+        content = open(path, 'rb').read()
+        lines = content.split(b'\n')
+        assert len(index.offsets) == 11 and not index.complete
+        for i, offset in enumerate(index.offsets):
+            assert content[offset:].startswith(lines[i * 100])
+        assert index.checkpoint(555) == (500, index.offsets[5])
+        print(f"检查点: {list(index.offsets)}")
+
+        # 从已有索引继续
+        resumed = LineIndexWriter(path, lines_per_entry=100)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write("\n" + "x\n" * 200)
+        assert resumed.update() == 2 and len(load_index(path).offsets) == 13
+
+        counter = LineCounter(100)
+        counter.feed(open(path, 'rb').read())
+        assert counter.line_count() == 1201
+
+        # 写入完整索引
+        write_index(path, LogIndex(100, load_index(path).offsets, [(0, 0), (500, 4096)], 1201, 123, 999, True))
+        index = load_index(path)
+        assert index.complete and index.line_count == 1201 and index.frame_for(5000) == (500, 4096)
+
+        # 建立索引的耗时
+        big = os.path.join(temp_dir, 'big.log')
+        with open(big, 'w') as f:
+            for i in range(1000000):
+                f.write(f"[2026-01-01 00:00:00] compile unit {i}\n")
+        start = time.perf_counter()
+        LineIndexWriter(big).update()
+        print(f"100万行建立索引: {time.perf_counter() - start:.2f} 秒, "
+              f"索引 {os.path.getsize(index_path(big))} 字节")
+
+    print("\n✓ 所有测试通过")
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+任务日志读取
+按字节偏移增量读取、按行号读取、读取最后N行、等待日志增长（长轮询），
+读取开销只与读取的内容成正比，不随日志总大小增长
+
+按行号读取通过行偏移索引（见 log_index）定位到最近的检查点，最多再顺序扫描K行；
+已结束任务的日志可能已被压缩（见 log_archive），读取时从包含目标偏移的帧开始透明解压，
+偏移按解压后的内容计算
+"""
+
+import io
+import os
+import time
+from typing import Callable, Optional, Tuple
+
+from server.log_archive import find_log, open_log, content_size, load_log_index
+from server.log_index import LogIndex, LineCounter, DEFAULT_LINES_PER_ENTRY
+
+# 单次增量读取的默认/最大字节数
+DEFAULT_READ_BYTES = 1024 * 1024
+MAX_READ_BYTES = 8 * 1024 * 1024
+
+# 反向查找时每次读取的块大小
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# 按行号读取时单次最多返回的行数
+MAX_READ_LINES = 10000
+
+# 等待日志增长时的检查间隔（秒）
+WAIT_INTERVAL = 0.5
+
+# 任务结束后日志无变化多久视为写完（任务结束后还会写入清理信息）
+LOG_SETTLE_SECONDS = 2.0
+
+# 任务结束状态
+FINISHED_STATUSES = {'success', 'failed', 'timeout', 'error'}
+
+
+def log_size(path: str) -> int:
+    """日志大小（已压缩时为解压后的大小），不存在返回0"""
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return content_size(path)
+
+
+def _trim_partial_utf8(data: bytes) -> bytes:
+    """去掉末尾不完整的UTF-8字符，留给下一次读取"""
+    # 从末尾最多回看3个字节，找到最后一个字符的起始字节
+    for i in range(1, min(4, len(data)) + 1):
+        byte = data[-i]
+        if byte & 0xC0 == 0x80:
+            continue
+        if byte & 0x80 == 0:
+            return data
+        needed = 2 if byte & 0xE0 == 0xC0 else 3 if byte & 0xF0 == 0xE0 else 4
+        return data if i >= needed else data[:-i]
+    return data
+
+
+def read_from_offset(path: str, offset: int, max_bytes: int = DEFAULT_READ_BYTES) -> Tuple[bytes, int]:
+    """
+    从指定字节偏移读取日志
+
+    Args:
+        path: 日志文件路径
+        offset: 起始偏移（超出文件大小时按文件末尾处理）
+        max_bytes: 最多读取的字节数
+
+    Returns:
+        (读取的内容, 下一次读取的偏移)
+    """
+    f, size = open_log(path, offset)
+    if f is None:
+        return b'', 0
+
+    want = min(max(max_bytes, 1), MAX_READ_BYTES)
+    with f:
+        offset = min(max(offset, 0), size)
+        data = f.read(want)
+
+    # 读满时末尾可能截断了多字节字符
+    if len(data) == want:
+        data = _trim_partial_utf8(data)
+
+    return data, offset + len(data)
+
+
+def count_lines(path: str, index: Optional[LogIndex] = None) -> int:
+    """
+    日志总行数（最后一行没有换行符时也算一行）
+
+    索引完整时直接读取，否则从最后一个检查点开始扫描（没有索引时扫描整个日志）
+
+    Args:
+        path: 日志文件路径
+        index: 已加载的索引（为None时自动加载）
+    """
+    index = index or load_log_index(path)
+    if index and index.complete:
+        return index.line_count
+
+    line, offset = index.last_checkpoint() if index else (0, 0)
+    f, _ = open_log(path, offset)
+    if f is None:
+        return 0
+
+    counter = LineCounter(index.lines_per_entry if index else DEFAULT_LINES_PER_ENTRY, line, offset)
+    with f:
+        while True:
+            data = f.read(TAIL_BLOCK_SIZE)
+            if not data:
+                break
+            counter.feed(data)
+    return counter.line_count()
+
+
+def read_lines(path: str, start: int, end: int,
+               limit: int = MAX_READ_LINES) -> Tuple[bytes, int, int, int]:
+    """
+    按行号读取日志（行号从1开始，包含两端）
+
+    Args:
+        path: 日志文件路径
+        start: 起始行号（小于1时从第1行开始）
+        end: 结束行号（超出总行数时到最后一行为止）
+        limit: 最多返回的行数
+
+    Returns:
+        (内容, 第一行的行号, 总行数, 内容之后的偏移)
+    """
+    index = load_log_index(path)
+    total = count_lines(path, index)
+    start = max(start, 1)
+    end = min(end, total, start + max(limit, 1) - 1)
+    if end < start:
+        return b'', start, total, log_size(path)
+
+    line, offset = index.checkpoint(start - 1) if index else (0, 0)
+    f, _ = open_log(path, offset)
+    if f is None:
+        return b'', start, 0, 0
+
+    with f:
+        reader = f if isinstance(f, io.BufferedReader) else io.BufferedReader(f)
+        for _ in range(start - 1 - line):
+            offset += len(reader.readline())
+        data = b''.join(reader.readline() for _ in range(end - start + 1))
+
+    return data, start, total, offset + len(data)
+
+
+def read_last_lines(path: str, lines: int) -> Tuple[bytes, Optional[int], Optional[int], int]:
+    """
+    读取日志最后N行
+
+    有索引时按行号读取；没有索引的未压缩日志从文件末尾反向按块查找换行符，不统计行号
+
+    Args:
+        path: 日志文件路径
+        lines: 行数
+
+    Returns:
+        (最后N行内容, 第一行的行号, 总行数, 内容之后的偏移)，不统计行号时行号和总行数为None
+    """
+    index = load_log_index(path)
+    if index is None and find_log(path)[1] is None:
+        data, end = _tail_plain(path, lines)
+        return data, None, None, end
+
+    total = count_lines(path, index)
+    return read_lines(path, total - lines + 1, total, limit=lines)
+
+
+def tail_lines(path: str, lines: int) -> Tuple[bytes, int]:
+    """
+    读取日志最后N行
+
+    Args:
+        path: 日志文件路径
+        lines: 行数
+
+    Returns:
+        (最后N行内容, 文件末尾偏移)
+    """
+    data, _, _, end = read_last_lines(path, lines)
+    return data, end
+
+
+def _tail_plain(path: str, lines: int) -> Tuple[bytes, int]:
+    """从未压缩日志的末尾反向按块查找换行符，读取最后N行"""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return b'', 0
+
+    with f:
+        end = os.fstat(f.fileno()).st_size
+        position = end
+        blocks = []
+        newlines = 0
+
+        # 末尾的换行不算作一行的分隔
+        f.seek(max(end - 1, 0))
+        if end and f.read(1) == b'\n':
+            newlines -= 1
+
+        while position > 0 and newlines < lines:
+            read_size = min(TAIL_BLOCK_SIZE, position)
+            position -= read_size
+            f.seek(position)
+            block = f.read(read_size)
+            blocks.append(block)
+            newlines += block.count(b'\n')
+
+        data = b''.join(reversed(blocks))
+
+    if newlines >= lines:
+        # 去掉多读的部分，只保留最后N行
+        cut = len(data)
+        for _ in range(lines + (1 if data.endswith(b'\n') else 0)):
+            cut = data.rfind(b'\n', 0, cut)
+        data = data[cut + 1:]
+
+    return data, end
+
+
+def wait_for_log(path: str, offset: int, timeout: float,
+                 get_status: Callable[[], Optional[str]]) -> Tuple[int, bool]:
+    """
+    等待日志超过指定偏移或任务结束（任务结束时立即返回，不等待日志写完）
+
+    Args:
+        path: 日志文件路径
+        offset: 客户端已读取到的偏移
+        timeout: 最长等待时间（秒）
+        get_status: 返回当前任务状态的回调
+
+    Returns:
+        (当前日志大小, 日志是否已完整)
+    """
+    deadline = time.monotonic() + timeout
+
+    while True:
+        size = log_size(path)
+        if size > offset:
+            return size, False
+
+        status = get_status()
+        if status in FINISHED_STATUSES:
+            return size, is_log_complete(path, offset, status)
+
+        if time.monotonic() >= deadline:
+            return size, False
+
+        time.sleep(WAIT_INTERVAL)
+
+
+def is_log_complete(path: str, offset: int, status: Optional[str]) -> bool:
+    """
+    判断日志是否已读完：任务已结束、偏移到达末尾且日志在一段时间内没有变化
+
+    Args:
+        path: 日志文件路径
+        offset: 客户端已读取到的偏移
+        status: 任务状态
+    """
+    if status not in FINISHED_STATUSES:
+        return False
+    actual, _ = find_log(path)
+    try:
+        stat = os.stat(actual) if actual else None
+    except FileNotFoundError:
+        stat = None
+    if stat is None:
+        return True
+    return offset >= log_size(path) and time.time() - stat.st_mtime >= LOG_SETTLE_SECONDS
+
+
+# 测试代码
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'job.log')
+        with open(path, 'w', encoding='utf-8') as f:
+            for i in range(100000):
+                f.write(f"第 {i} 行\n")
+
+        data, end = tail_lines(path, 3)
+        print(f"最后3行: {data.decode()!r} (偏移 {end})")
+        assert data.decode() == "第 99997 行\n第 99998 行\n第 99999 行\n"
+        assert tail_lines(path, 1)[0].decode() == "第 99999 行\n"
+
+        # 按偏移分块读取，拼接结果与原文件一致，且不截断多字节字符
+        offset, chunks = 0, []
+        while True:
+            data, offset = read_from_offset(path, offset, max_bytes=1000)
+            if not data:
+                break
+            data.decode('utf-8')
+            chunks.append(data)
+        with open(path, 'rb') as f:
+            assert b''.join(chunks) == f.read()
+        print(f"✓ 增量读取 {len(chunks)} 块")
+
+        # 请求量超过单次读取上限时，按上限截断也不截断多字节字符
+        wide = os.path.join(temp_dir, 'wide.log')
+        with open(wide, 'w', encoding='utf-8') as f:
+            f.write("中" * (MAX_READ_BYTES // 3 + 10))
+        data, next_offset = read_from_offset(wide, 0, MAX_READ_BYTES * 2)
+        assert len(data) == next_offset < MAX_READ_BYTES and next_offset % 3 == 0
+        data.decode('utf-8')
+
+        # 等待新内容
+        size, complete = wait_for_log(path, offset, 1, lambda: 'running')
+        assert (size, complete) == (offset, False)
+        os.utime(path, (time.time() - 10, time.time() - 10))
+        size, complete = wait_for_log(path, offset, 1, lambda: 'success')
+        assert complete
+
+        # 按行号读取（有索引时从最近的检查点开始）
+        from server.log_index import LineIndexWriter
+        from server.log_archive import compress_log
+        window = "第 50000 行\n第 50001 行\n第 50002 行\n".encode()
+        assert read_lines(path, 50001, 50003)[:3] == (window, 50001, 100000)
+        LineIndexWriter(path).update()
+        assert count_lines(path) == 100000
+        data, first, total, next_offset = read_lines(path, 50001, 50003)
+        assert (data, first, total) == (window, 50001, 100000)
+        assert b''.join(chunks)[:next_offset].endswith(window)
+        assert read_last_lines(path, 3)[1:3] == (99998, 100000)
+        assert read_lines(path, 100001, 100010)[:3] == (b'', 100001, 100000)
+
+        # 压缩后透明读取，偏移和行号与压缩前一致
+        compress_log(path)
+        assert tail_lines(path, 3) == (b"".join(f"第 {i} 行\n".encode() for i in range(99997, 100000)), end)
+        data, next_offset = read_from_offset(path, 1000, 20)
+        assert data == b''.join(chunks)[1000:next_offset] and next_offset > 1000
+        assert log_size(path) == offset and is_log_complete(path, offset, 'success')
+        assert read_lines(path, 50001, 50003)[:3] == (window, 50001, 100000)
+        start = time.perf_counter()
+        for i in range(100):
+            read_lines(path, i * 1000 + 1, i * 1000 + 50)
+        print(f"✓ 压缩日志读取（按行号读取平均 {(time.perf_counter() - start) * 10:.2f} ms）")
+
+        print("\n✓ 所有测试通过")
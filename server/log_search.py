@@ -0,0 +1,619 @@
+#!/usr/bin/env python3
+"""
+构建日志全文搜索
+已结束任务的日志由API进程中的后台线程增量写入独立的 log_search.db（SQLite FTS5），
+不占用 jobs.db 的写锁，删除或重建索引也不影响任务记录
+
+每个日志按 CHUNK_LINES 行切成块，每块是FTS表中的一行，rowid = (文档ID << CHUNK_BITS) | 块号，
+块号即可换算出块的起始行号；删除一个任务的索引只需按rowid范围删除。
+文档ID按发现顺序递增，按rowid倒序遍历即大致按任务结束时间从新到旧
+
+索引进度（已索引到的偏移和行数）与块在同一事务中提交，进程重启后从中断处继续；
+读取日志按速率限制（字节/秒），每轮之间休眠，避免与构建争抢磁盘I/O；
+多个API进程通过文件锁保证同时只有一个在建立索引
+"""
+
+import time
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from server.database import JobDatabase
+from server.file_lock import FileLock
+from server.log_archive import open_log
+from server.log_reader import is_log_complete
+
+UTC = timezone.utc
+
+# 每块的行数和块号占用的位数（单个日志最多 2^20 块）
+CHUNK_LINES = 100
+CHUNK_BITS = 20
+
+# 建立索引时每次读取的字节数（每批在一个事务中提交）
+BATCH_BYTES = 256 * 1024
+
+# 任务结束后等待日志写完（异常回调、压缩）的时间（秒）
+SETTLE_SECONDS = 60
+
+# 每轮最多发现的新任务数和最多处理的日志数
+DISCOVER_BATCH = 500
+INDEX_BATCH = 20
+
+# 每个任务最多返回的匹配行数，匹配行最多返回的字符数
+MAX_MATCHES_PER_JOB = 5
+MAX_LINE_CHARS = 500
+
+# highlight()标记匹配词的控制字符
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+
+def build_match_query(text: str, raw: bool = False) -> str:
+    """
+    把用户输入转换为FTS5查询
+
+    默认每个空白分隔的词作为一个短语（需全部出现），不解释FTS5语法，
+    如 test_login_flow 匹配连续的 test login flow；raw为True时原样使用FTS5语法（AND/OR/NOT/前缀*等）
+
+    Args:
+        text: 搜索内容
+        raw: 是否使用FTS5查询语法
+
+    Returns:
+        FTS5 MATCH表达式
+
+    Raises:
+        ValueError: 搜索内容为空或FTS5语法错误
+    """
+    text = (text or '').strip()
+    if not text:
+        raise ValueError('搜索内容不能为空')
+    if raw:
+        # 在空的内存表上检查语法，与数据库本身的错误（如锁超时）区分开
+        conn = sqlite3.connect(':memory:')
+        try:
+            conn.execute('CREATE VIRTUAL TABLE t USING fts5(content)')
+            conn.execute('SELECT rowid FROM t WHERE t MATCH ?', (text,)).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f'查询语法错误: {e}')
+        finally:
+            conn.close()
+        return text
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in text.split())
+
+
+def _matched_lines(text: str, start_line: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    从highlight()的结果中取出含匹配词的行（行号从1开始）
+
+    多个词的查询只要求块中出现所有词，只返回块中匹配词最多的行
+    """
+    candidates = [(line.count(_MARK_START), i, line) for i, line in enumerate(text.split('\n'))]
+    most = max(count for count, _, _ in candidates)
+
+    matches = []
+    for count, i, line in candidates:
+        if count < most or not count:
+            continue
+        if len(matches) >= limit:
+            break
+        first = line.index(_MARK_START)
+        line = line.replace(_MARK_START, '').replace(_MARK_END, '')
+        if len(line) > MAX_LINE_CHARS:
+            # 截取第一个匹配附近的内容
+            begin = max(0, min(first - MAX_LINE_CHARS // 4, len(line) - MAX_LINE_CHARS))
+            line = line[begin:begin + MAX_LINE_CHARS]
+        matches.append({'line': start_line + i, 'text': line})
+    return matches
+
+
+class LogSearchIndex:
+    """日志全文索引（log_search.db）"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._init_db()
+
+    def _get_conn(self):
+        """获取线程本地的数据库连接"""
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._local.conn.row_factory = sqlite3.Row
+        return self._local.conn
+
+    def _init_db(self):
+        """初始化表结构（WAL模式，建立索引时不阻塞搜索）"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+
+        # 已发现的日志（文档）及索引进度
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS log_docs (
+                doc_id INTEGER PRIMARY KEY,
+                job_id TEXT NOT NULL UNIQUE,
+                user_id TEXT,
+                project_name TEXT,
+                status TEXT,
+                finished_at TEXT,
+                log_file TEXT,
+                indexed_offset INTEGER DEFAULT 0,
+                indexed_lines INTEGER DEFAULT 0,
+                complete INTEGER DEFAULT 0
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_log_docs_finished_at ON log_docs(finished_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_log_docs_complete ON log_docs(complete)')
+
+        # 日志内容（每行一块）
+        cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS log_fts USING fts5(content)')
+
+        # 发现新任务的游标等状态
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS log_search_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def get_state(self, key: str, default: str = '') -> str:
+        """读取状态值"""
+        try:
+            conn = self._get_conn()
+            row = conn.execute('SELECT value FROM log_search_state WHERE key = ?', (key,)).fetchone()
+            return row['value'] if row else default
+        except Exception as e:
+            print(f"✗ 读取日志索引状态失败: {e}")
+            return default
+
+    def set_state(self, key: str, value: str) -> bool:
+        """保存状态值"""
+        try:
+            conn = self._get_conn()
+            conn.execute('INSERT OR REPLACE INTO log_search_state (key, value) VALUES (?, ?)', (key, value))
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"✗ 保存日志索引状态失败: {e}")
+            return False
+
+    def add_jobs(self, jobs: List[Dict[str, Any]]) -> int:
+        """
+        登记待索引的日志（已登记的任务忽略）
+
+        Args:
+            jobs: 任务列表（job_id, user_id, project_name, status, finished_at, log_file）
+
+        Returns:
+            新登记的数量
+        """
+        try:
+            conn = self._get_conn()
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT OR IGNORE INTO log_docs (job_id, user_id, project_name, status, finished_at, log_file)
+                VALUES (:job_id, :user_id, :project_name, :status, :finished_at, :log_file)
+            ''', jobs)
+            conn.commit()
+            return cursor.rowcount
+        except Exception as e:
+            print(f"✗ 登记待索引日志失败: {e}")
+            return 0
+
+    def get_pending_docs(self, limit: int = INDEX_BATCH) -> List[Dict[str, Any]]:
+        """获取尚未索引完成的日志（按登记顺序）"""
+        try:
+            conn = self._get_conn()
+            cursor = conn.execute('''
+                SELECT doc_id, job_id, log_file, indexed_offset, indexed_lines FROM log_docs
+                WHERE complete = 0 ORDER BY doc_id LIMIT ?
+            ''', (limit,))
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"✗ 获取待索引日志失败: {e}")
+            return []
+
+    def add_chunks(self, doc_id: int, chunks: List[Tuple[int, str]],
+                   indexed_offset: int, indexed_lines: int, complete: bool) -> bool:
+        """
+        写入一批块并更新索引进度（同一事务）
+
+        Args:
+            doc_id: 文档ID
+            chunks: [(块号, 内容)]
+            indexed_offset: 已索引到的日志偏移
+            indexed_lines: 已索引的行数
+            complete: 日志是否已全部索引
+        """
+        try:
+            conn = self._get_conn()
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO log_fts (rowid, content) VALUES (?, ?)',
+                                 [((doc_id << CHUNK_BITS) | chunk_no, content) for chunk_no, content in chunks])
+                conn.execute('''
+                    UPDATE log_docs SET indexed_offset = ?, indexed_lines = ?, complete = ?
+                    WHERE doc_id = ?
+                ''', (indexed_offset, indexed_lines, 1 if complete else 0, doc_id))
+            return True
+        except Exception as e:
+            print(f"✗ 写入日志索引失败: {e}")
+            return False
+
+    def _delete_docs(self, conn, doc_ids: List[int]):
+        for doc_id in doc_ids:
+            conn.execute('DELETE FROM log_fts WHERE rowid >= ? AND rowid < ?',
+                         (doc_id << CHUNK_BITS, (doc_id + 1) << CHUNK_BITS))
+            conn.execute('DELETE FROM log_docs WHERE doc_id = ?', (doc_id,))
+
+    def delete_jobs(self, job_ids: List[str]) -> int:
+        """
+        删除任务的索引（日志已删除、任务已过期）
+
+        Returns:
+            删除的文档数
+        """
+        try:
+            conn = self._get_conn()
+            placeholders = ','.join('?' * len(job_ids))
+            doc_ids = [row['doc_id'] for row in conn.execute(
+                f'SELECT doc_id FROM log_docs WHERE job_id IN ({placeholders})', job_ids)]
+            with conn:
+                self._delete_docs(conn, doc_ids)
+            return len(doc_ids)
+        except Exception as e:
+            print(f"✗ 删除日志索引失败: {e}")
+            return 0
+
+    def purge_before(self, finished_before: str) -> int:
+        """
+        删除指定时间之前结束的任务的索引
+
+        Returns:
+            删除的文档数
+        """
+        try:
+            conn = self._get_conn()
+            doc_ids = [row['doc_id'] for row in conn.execute(
+                'SELECT doc_id FROM log_docs WHERE finished_at < ?', (finished_before,))]
+            with conn:
+                self._delete_docs(conn, doc_ids)
+            if doc_ids:
+                print(f"✓ 移出日志索引: {len(doc_ids)} 个任务")
+            return len(doc_ids)
+        except Exception as e:
+            print(f"✗ 清理日志索引失败: {e}")
+            return 0
+
+    def clear(self) -> bool:
+        """清空索引（包括发现新任务的游标）"""
+        try:
+            conn = self._get_conn()
+            with conn:
+                conn.execute('DELETE FROM log_fts')
+                conn.execute('DELETE FROM log_docs')
+                conn.execute('DELETE FROM log_search_state')
+            return True
+        except Exception as e:
+            print(f"✗ 清空日志索引失败: {e}")
+            return False
+
+    def get_stats(self) -> Dict[str, int]:
+        """索引状态（已索引和待索引的任务数）"""
+        try:
+            conn = self._get_conn()
+            row = conn.execute('''
+                SELECT COALESCE(SUM(complete), 0) AS indexed_jobs,
+                       COALESCE(SUM(1 - complete), 0) AS pending_jobs FROM log_docs
+            ''').fetchone()
+            return dict(row)
+        except Exception as e:
+            print(f"✗ 获取日志索引状态失败: {e}")
+            return {'indexed_jobs': 0, 'pending_jobs': 0}
+
+    def search(self, query: str, filters: Optional[Dict[str, str]] = None, limit: int = 20,
+               before: Optional[int] = None, raw: bool = False) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        搜索日志，按任务分组返回（从新到旧）
+
+        每个任务返回最多 MAX_MATCHES_PER_JOB 个匹配行，然后跳到下一个任务，
+        匹配很多的任务不会占满结果
+
+        Args:
+            query: 搜索内容（见 build_match_query）
+            filters: 过滤条件，支持 user_id, project_name（部分匹配）, since, until（结束时间）
+            limit: 最多返回的任务数
+            before: 分页游标（上一页返回的next_before）
+            raw: 是否使用FTS5查询语法
+
+        Returns:
+            (结果列表, 下一页的游标)，没有更多结果时游标为None
+
+        Raises:
+            ValueError: 搜索内容为空或查询语法错误
+        """
+        match = build_match_query(query, raw)
+        filters = filters or {}
+
+        conditions = ['log_fts MATCH ?', 'f.rowid < ?']
+        params: List[Any] = [match]
+        if filters.get('user_id'):
+            conditions.append('d.user_id LIKE ? COLLATE NOCASE')
+            params.append(f"%{filters['user_id']}%")
+        if filters.get('project_name'):
+            conditions.append('d.project_name LIKE ? COLLATE NOCASE')
+            params.append(f"%{filters['project_name']}%")
+        if filters.get('since'):
+            conditions.append('d.finished_at >= ?')
+            params.append(filters['since'])
+        if filters.get('until'):
+            conditions.append('d.finished_at <= ?')
+            params.append(filters['until'])
+
+        sql = f'''
+            SELECT f.rowid AS chunk_id, d.doc_id, d.job_id, d.user_id, d.project_name, d.status, d.finished_at,
+                   highlight(log_fts, 0, char(2), char(3)) AS text
+            FROM log_fts f JOIN log_docs d ON d.doc_id = f.rowid >> {CHUNK_BITS}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY f.rowid DESC LIMIT ?
+        '''
+
+        results = []
+        cursor_rowid = before if before is not None else 1 << 62
+        try:
+            conn = self._get_conn()
+            while len(results) < limit:
+                # 取当前任务的若干匹配块（可能跨到下一个任务）
+                rows = conn.execute(sql, params[:1] + [cursor_rowid] + params[1:] + [MAX_MATCHES_PER_JOB]).fetchall()
+                if not rows:
+                    return results, None
+
+                doc_id = rows[0]['doc_id']
+                job = {key: rows[0][key] for key in ('job_id', 'user_id', 'project_name', 'status', 'finished_at')}
+                matches = []
+                for row in rows:
+                    if row['doc_id'] != doc_id or len(matches) >= MAX_MATCHES_PER_JOB:
+                        break
+                    start_line = (row['chunk_id'] & ((1 << CHUNK_BITS) - 1)) * CHUNK_LINES + 1
+                    matches.extend(_matched_lines(row['text'], start_line, MAX_MATCHES_PER_JOB - len(matches)))
+                job['matches'] = sorted(matches, key=lambda m: m['line'])
+                results.append(job)
+
+                # 跳过该任务剩余的块
+                cursor_rowid = doc_id << CHUNK_BITS
+
+            more = conn.execute(sql, params[:1] + [cursor_rowid] + params[1:] + [1]).fetchone()
+            return results, cursor_rowid if more else None
+
+        except Exception as e:
+            print(f"✗ 搜索日志失败: {e}")
+            return [], None
+
+
+class LogSearchIndexer:
+    """后台增量建立日志索引"""
+
+    def __init__(self, job_db: JobDatabase, index: LogSearchIndex, lock_path: str,
+                 days: int, rate_bytes: int):
+        """
+        Args:
+            job_db: 任务数据库
+            index: 日志全文索引
+            lock_path: 跨进程索引锁文件
+            days: 只索引最近N天结束的任务，更早的移出索引
+            rate_bytes: 读取日志的速率上限（字节/秒），0表示不限制
+        """
+        self.job_db = job_db
+        self.index = index
+        self.lock_path = lock_path
+        self.days = days
+        self.rate_bytes = rate_bytes
+
+    def run_once(self) -> int:
+        """
+        执行一轮：移出过期索引、发现新结束的任务、索引一批日志（其他进程正在索引时直接返回）
+
+        Returns:
+            本轮索引的日志字节数
+        """
+        lock = FileLock(self.lock_path)
+        if not lock.acquire(blocking=False):
+            return 0
+        try:
+            now = datetime.now(UTC).replace(tzinfo=None)
+            cutoff = (now - timedelta(days=self.days)).isoformat() + 'Z'
+            self.index.purge_before(cutoff)
+            self._discover(cutoff, (now - timedelta(seconds=SETTLE_SECONDS)).isoformat() + 'Z')
+
+            indexed = 0
+            for doc in self.index.get_pending_docs():
+                indexed += self._index_doc(doc)
+            return indexed
+        finally:
+            lock.release()
+
+    def _discover(self, cutoff: str, settled_before: str):
+        """登记游标之后结束、且日志已写完的任务"""
+        after = max(self.index.get_state('cursor_finished_at'), cutoff)
+        after_id = self.index.get_state('cursor_job_id') if after != cutoff else ''
+
+        while True:
+            jobs = self.job_db.get_finished_jobs(after, after_id, settled_before, DISCOVER_BATCH)
+            if not jobs:
+                return
+            self.index.add_jobs(jobs)
+            after, after_id = jobs[-1]['finished_at'], jobs[-1]['job_id']
+            self.index.set_state('cursor_finished_at', after)
+            self.index.set_state('cursor_job_id', after_id)
+            if len(jobs) < DISCOVER_BATCH:
+                return
+
+    def _throttle(self, size: int, started: float):
+        """按速率上限休眠"""
+        if self.rate_bytes > 0:
+            delay = size / self.rate_bytes - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+    def _index_doc(self, doc: Dict[str, Any]) -> int:
+        """从上次的进度继续索引一个日志，返回读取的字节数"""
+        offset, lines_done = doc['indexed_offset'], doc['indexed_lines']
+        stream, size = open_log(doc['log_file'], offset) if doc['log_file'] else (None, 0)
+        if stream is None:
+            # 日志已删除
+            self.index.add_chunks(doc['doc_id'], [], offset, lines_done, complete=True)
+            return 0
+        if not is_log_complete(doc['log_file'], size, 'success'):
+            # 日志仍在变化（如异常回调追加），下一轮再处理
+            stream.close()
+            return 0
+
+        total = 0
+        chunk_no = lines_done // CHUNK_LINES
+        pending = b''
+        lines: List[bytes] = []
+        with stream:
+            while True:
+                started = time.monotonic()
+                data = stream.read(BATCH_BYTES)
+                eof = not data
+                parts = (pending + data).split(b'\n')
+                pending = parts.pop()
+                if eof and pending:
+                    parts.append(pending)
+                lines.extend(parts)
+
+                chunks = []
+                while len(lines) >= CHUNK_LINES or (eof and lines):
+                    group, lines = lines[:CHUNK_LINES], lines[CHUNK_LINES:]
+                    content = b'\n'.join(group)
+                    chunks.append((chunk_no, content.decode('utf-8', errors='replace')))
+                    chunk_no += 1
+                    offset += len(content) + 1
+                    lines_done += len(group)
+
+                if not self.index.add_chunks(doc['doc_id'], chunks, offset, lines_done, complete=eof):
+                    return total
+                total += len(data)
+                if eof:
+                    return total
+                self._throttle(len(data), started)
+
+    def start_background(self, interval: float) -> threading.Thread:
+        """启动后台索引线程（每轮之间休眠interval秒）"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"✗ 建立日志索引失败: {e}")
+
+        thread = threading.Thread(target=loop, name='log-search-indexer', daemon=True)
+        thread.start()
+        return thread
+
+
+# 测试代码
+if __name__ == '__main__':
+    import os
+    import tempfile
+    from server.log_archive import compress_log
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = JobDatabase(os.path.join(temp_dir, 'jobs.db'))
+        index = LogSearchIndex(os.path.join(temp_dir, 'log_search.db'))
+        indexer = LogSearchIndexer(db, index, os.path.join(temp_dir, 'log_search.lock'), days=14, rate_bytes=0)
+
+        def finished_job(job_id, user_id, project_name, lines, compress=False, minutes_ago=5):
+            log_file = os.path.join(temp_dir, f'{job_id}.log')
+            with open(log_file, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.utime(log_file, (time.time() - 600, time.time() - 600))
+            if compress:
+                compress_log(log_file)
+            db.create_job(job_id, {'mode': 'upload', 'script': 'make', 'user_id': user_id,
+                                   'project_name': project_name, 'log_file': log_file})
+            db.update_job_finished(job_id, 'failed')
+            finished_at = (datetime.now(UTC).replace(tzinfo=None) - timedelta(minutes=minutes_ago)).isoformat() + 'Z'
+            db._get_conn().execute('UPDATE ci_jobs SET finished_at = ? WHERE job_id = ?', (finished_at, job_id))
+            db._get_conn().commit()
+
+        build_lines = [f'[2026-01-01 00:00:00] compile unit {i}' for i in range(350)]
+        build_lines[123] = 'tests/test_login.py::test_login_flow FAILED'
+        build_lines[300] = 'java.lang.OutOfMemoryError: Java heap space'
+        finished_job('job-a', 'alice', 'web', build_lines, minutes_ago=10)
+        finished_job('job-b', 'bob', 'api', ['编译开始', 'OutOfMemoryError 内存不足', 'done'],
+                     compress=True, minutes_ago=8)
+        finished_job('job-c', 'alice', 'web', ['still running'], minutes_ago=0)
+
+        indexed = indexer.run_once()
+        print(f"索引了 {indexed} 字节: {index.get_stats()}")
+        assert index.get_stats() == {'indexed_jobs': 2, 'pending_jobs': 0}, "刚结束的任务应等待日志写完"
+
+        results, next_before = index.search('test_login_flow')
+        assert [r['job_id'] for r in results] == ['job-a'] and next_before is None
+        assert results[0]['matches'] == [{'line': 124, 'text': build_lines[123]}]
+
+        results, _ = index.search('OutOfMemoryError')
+        assert [r['job_id'] for r in results] == ['job-b', 'job-a'], "应从新到旧"
+        assert results[1]['matches'][0]['line'] == 301 and results[0]['matches'][0]['line'] == 2
+        print(f"搜索结果: {results}")
+
+        # 分页与过滤
+        page, next_before = index.search('OutOfMemoryError', limit=1)
+        assert page[0]['job_id'] == 'job-b' and next_before is not None
+        page, next_before = index.search('OutOfMemoryError', limit=1, before=next_before)
+        assert page[0]['job_id'] == 'job-a' and next_before is None
+        assert [r['job_id'] for r in index.search('OutOfMemoryError', {'user_id': 'ALI'})[0]] == ['job-a']
+        assert index.search('OutOfMemoryError', {'since': '2099-01-01'})[0] == []
+
+        # 每个任务最多返回的匹配行数
+        results, _ = index.search('compile unit')
+        assert len(results) == 1 and len(results[0]['matches']) == MAX_MATCHES_PER_JOB
+
+        # FTS5语法
+        assert [r['job_id'] for r in index.search('OutOf*', raw=True)[0]] == ['job-b', 'job-a']
+        try:
+            index.search('"unterminated', raw=True)
+            assert False, "语法错误应抛出ValueError"
+        except ValueError as e:
+            print(f"语法错误: {e}")
+
+        # 中断后从进度继续：模拟只索引了第一批
+        index.delete_jobs(['job-a'])
+        index.set_state('cursor_finished_at', '')
+        index.add_jobs([{'job_id': 'job-a', 'user_id': 'alice', 'project_name': 'web', 'status': 'failed',
+                         'finished_at': db.get_job('job-a')['finished_at'], 'log_file': db.get_job('job-a')['log_file']}])
+        doc = index.get_pending_docs()[0]
+        content = open(doc['log_file'], 'rb').read()
+        head = b'\n'.join(content.split(b'\n')[:CHUNK_LINES])
+        index.add_chunks(doc['doc_id'], [(0, head.decode())], len(head) + 1, CHUNK_LINES, complete=False)
+        indexer.run_once()
+        results, _ = index.search('test_login_flow')
+        assert results[0]['job_id'] == 'job-a' and results[0]['matches'][0]['line'] == 124
+        assert len(index.search('compile unit')[0]) == 1
+
+        # 移出过期索引
+        indexer.days = 0
+        indexer.run_once()
+        assert index.get_stats()['indexed_jobs'] == 0 and index.search('OutOfMemoryError')[0] == []
+
+        # 速率限制
+        big = [f'line {i} ' + 'x' * 100 for i in range(5000)]
+        finished_job('job-big', 'carol', 'big', big)
+        indexer.days, indexer.rate_bytes = 14, 2 * 1024 * 1024
+        start = time.perf_counter()
+        indexed = indexer.run_once()
+        elapsed = time.perf_counter() - start
+        print(f"限速索引 {indexed} 字节: {elapsed:.2f} 秒")
+        assert elapsed >= indexed / indexer.rate_bytes * 0.5
+        assert index.search('line 4999')[0][0]['matches'][0]['line'] == 5000
+
+    print("\n✓ 所有测试通过")
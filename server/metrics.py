@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Prometheus指标
+- API进程：请求延迟、上传/下载字节数、SQLite查询延迟
+- worker进程：任务耗时、排队时间、产物字节数、SQLite查询延迟
+- 抓取时从数据库读取：排队/运行中的任务数、磁盘配额用量
+
+Celery worker是多进程（prefork），各进程通过prometheus_client的多进程模式
+把指标写入 METRICS_DIR 下的共享文件，由API的 /metrics 接口汇总；
+未安装prometheus_client时指标记录为空操作，/metrics 不可用
+"""
+
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from server.config import METRICS_DIR, PRIORITY_CLASSES
+
+# 多进程模式必须在导入prometheus_client之前设置
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', METRICS_DIR)
+
+try:
+    from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+    from prometheus_client import CONTENT_TYPE_LATEST
+    from prometheus_client.core import GaugeMetricFamily
+    METRICS_AVAILABLE = True
+except ImportError:
+    METRICS_AVAILABLE = False
+
+# 任务耗时分桶（秒）
+JOB_DURATION_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+# 排队时间分桶（秒）
+QUEUE_WAIT_BUCKETS = (0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+# API请求延迟分桶（秒）
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# SQLite查询延迟分桶（秒）
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+# SQL语句的表名（作为查询延迟的标签）
+_SQL_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+(\w+)', re.IGNORECASE)
+
+
+class _NoopMetric:
+    """未安装prometheus_client时的占位指标"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, amount):
+        pass
+
+
+if METRICS_AVAILABLE:
+    JOB_DURATION = Histogram('ci_job_duration_seconds', '任务执行耗时（开始到结束）',
+                             ['mode', 'status'], buckets=JOB_DURATION_BUCKETS)
+    JOB_QUEUE_WAIT = Histogram('ci_job_queue_wait_seconds', '任务排队时间（创建到开始执行）',
+                               ['mode', 'status'], buckets=QUEUE_WAIT_BUCKETS)
+    UPLOAD_BYTES = Counter('ci_upload_bytes', '接收的上传字节数', ['kind'])
+    ARTIFACT_BYTES = Counter('ci_artifact_bytes', '产物字节数（packed: 打包保存, served: 下载）', ['direction'])
+    REQUEST_LATENCY = Histogram('ci_api_request_duration_seconds', 'API请求延迟（到返回响应头为止）',
+                                ['method', 'route', 'status'], buckets=REQUEST_BUCKETS)
+    QUERY_LATENCY = Histogram('ci_sqlite_query_duration_seconds', 'SQLite语句执行延迟',
+                              ['statement', 'table'], buckets=QUERY_BUCKETS)
+else:
+    JOB_DURATION = JOB_QUEUE_WAIT = UPLOAD_BYTES = ARTIFACT_BYTES = REQUEST_LATENCY = QUERY_LATENCY = _NoopMetric()
+
+
+def observe_query(sql: str, seconds: float):
+    """记录一条SQL语句的执行延迟（按语句类型和表名分组）"""
+    statement = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'UNKNOWN'
+    match = _SQL_TABLE_RE.search(sql)
+    QUERY_LATENCY.labels(statement, match.group(1) if match else '').observe(seconds)
+
+
+def _parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.rstrip('Z'))
+
+
+def observe_job(job: Dict[str, Any]):
+    """
+    记录已结束任务的耗时和排队时间
+
+    Args:
+        job: 数据库中的任务记录（mode, status, duration, created_at, started_at）
+    """
+    mode = job.get('mode') or 'unknown'
+    status = job.get('status') or 'unknown'
+    if job.get('duration') is not None:
+        JOB_DURATION.labels(mode, status).observe(job['duration'])
+    if job.get('created_at') and job.get('started_at'):
+        wait = (_parse_time(job['started_at']) - _parse_time(job['created_at'])).total_seconds()
+        JOB_QUEUE_WAIT.labels(mode, status).observe(max(wait, 0.0))
+
+
+def cleanup_dead_processes(directory: str = METRICS_DIR) -> int:
+    """
+    删除已退出进程的指标文件（进程启动时调用，防止目录随进程重启无限增长）
+    删除后计数器会回落，Prometheus的rate()/increase()会按计数器重置处理
+
+    Returns:
+        删除的文件数
+    """
+    removed = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+
+    for entry in entries:
+        # 文件名格式: <类型>_<pid>.db，如 counter_1234.db、histogram_1234.db
+        pid = entry.name[:-3].rsplit('_', 1)[-1] if entry.name.endswith('.db') else ''
+        if not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        except PermissionError:
+            # 进程存在但属于其他用户
+            continue
+    return removed
+
+
+class JobStateCollector:
+    """抓取时从数据库读取排队/运行中的任务数和磁盘配额用量"""
+
+    def __init__(self, db, quota_manager=None):
+        """
+        Args:
+            db: 任务数据库
+            quota_manager: 配额管理器（为None时不导出配额指标）
+        """
+        self.db = db
+        self.quota_manager = quota_manager
+
+    def collect(self):
+        priority_names = {value: name for name, value in PRIORITY_CLASSES.items()}
+
+        counts = self.db.get_active_job_counts()
+        for status, name, documentation in (('queued', 'ci_queue_depth', '排队中的任务数'),
+                                            ('running', 'ci_running_jobs', '运行中的任务数')):
+            by_priority = {priority_name: 0 for priority_name in PRIORITY_CLASSES}
+            for priority, count in counts.get(status, {}).items():
+                by_priority[priority_names.get(priority, str(priority))] = count
+
+            family = GaugeMetricFamily(name, documentation, labels=['priority'])
+            for priority_name, count in by_priority.items():
+                family.add_metric([priority_name], count)
+            yield family
+
+        if self.quota_manager:
+            info = self.quota_manager.get_quota_info()
+            limit = GaugeMetricFamily('ci_quota_limit_bytes', '磁盘配额', labels=['scope'])
+            used = GaugeMetricFamily('ci_quota_used_bytes', '磁盘配额已使用', labels=['scope'])
+            limit.add_metric(['total'], info['total_bytes'])
+            used.add_metric(['total'], info['used_bytes'])
+            limit.add_metric(['normal_users'], info['normal_users_quota'])
+            used.add_metric(['normal_users'], info['normal_users_used'])
+            limit.add_metric(['dep_cache'], info['dep_cache_quota'])
+            used.add_metric(['dep_cache'], info['dep_cache_used'])
+            for user in info['special_users']:
+                limit.add_metric([f"user:{user['user_id']}"], user['quota_bytes'])
+                used.add_metric([f"user:{user['user_id']}"], user['used_bytes'])
+            yield limit
+            yield used
+
+
+def render_metrics(*collectors) -> Optional[Tuple[bytes, str]]:
+    """
+    汇总所有进程的指标，以Prometheus文本格式输出
+
+    Args:
+        collectors: 额外的抓取时采集器（如 JobStateCollector）
+
+    Returns:
+        (内容, Content-Type)，未安装prometheus_client时返回None
+    """
+    if not METRICS_AVAILABLE:
+        return None
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in collectors:
+        registry.register(collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# 测试代码
+if __name__ == '__main__':
+    import tempfile
+
+    print(f"prometheus_client可用: {METRICS_AVAILABLE}, 指标目录: {os.environ['PROMETHEUS_MULTIPROC_DIR']}")
+    # 其他已退出进程（如其他模块的测试）留下的指标会合并到输出中
+    cleanup_dead_processes()
+
+    observe_query("SELECT * FROM ci_jobs WHERE job_id = ?", 0.0003)
+    observe_query("  update ci_jobs SET status = 'running'", 0.002)
+    observe_job({'mode': 'git', 'status': 'success', 'duration': 42.0,
+                 'created_at': '2026-01-01T00:00:00Z', 'started_at': '2026-01-01T00:00:07.5Z'})
+    UPLOAD_BYTES.labels('stream').inc(1024)
+
+    class _FakeDB:
+        def get_active_job_counts(self):
+            return {'queued': {1: 3, 2: 1}, 'running': {1: 2}}
+
+    if METRICS_AVAILABLE:
+        content, content_type = render_metrics(JobStateCollector(_FakeDB()))
+        text = content.decode('utf-8')
+        print(text[:1500])
+        assert 'ci_queue_depth{priority="normal"} 3.0' in text
+        assert 'ci_running_jobs{priority="high"} 0.0' in text
+        assert 'ci_sqlite_query_duration_seconds_count{statement="UPDATE",table="ci_jobs"} 1.0' in text
+        assert 'ci_job_queue_wait_seconds_sum{mode="git",status="success"} 7.5' in text
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        open(os.path.join(temp_dir, 'counter_999999999.db'), 'w').close()
+        open(os.path.join(temp_dir, f'counter_{os.getpid()}.db'), 'w').close()
+        assert cleanup_dead_processes(temp_dir) == 1
+
+    print("\n✓ 所有测试通过")
@@ -10,6 +10,7 @@ from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 from server.database import JobDatabase
 from server.config import DATA_DIR
+from server.log_archive import remove_log
 
 
 class QuotaManager:
@@ -18,15 +19,17 @@ class QuotaManager:
     # 总配额（字节）
     TOTAL_QUOTA_BYTES = 200 * 1024 * 1024 * 1024  # 200GB
 
-    def __init__(self, db: JobDatabase, special_users_config: str = None):
+    def __init__(self, db: JobDatabase, special_users_config: str = None, dep_cache=None):
         """
         初始化配额管理器
 
         Args:
             db: 数据库实例
             special_users_config: 特殊用户配置文件路径
+            dep_cache: 依赖缓存（DependencyCache），其大小上限从普通用户共享配额中划出
         """
         self.db = db
+        self.dep_cache = dep_cache
         self.special_users_config = special_users_config or f"{DATA_DIR}/special_users.yml"
 
         # 启动时从配置文件加载特殊用户
@@ -53,10 +56,11 @@ class QuotaManager:
             for user_config in special_users:
                 user_id = user_config.get('user_id')
                 quota_gb = user_config.get('quota_gb', 50)
+                weight = user_config.get('weight', 1)
 
                 if user_id:
-                    self.db.add_special_user(user_id, quota_gb)
-                    print(f"✓ 加载特殊用户: {user_id} (配额: {quota_gb}GB)")
+                    self.db.add_special_user(user_id, quota_gb, weight)
+                    print(f"✓ 加载特殊用户: {user_id} (配额: {quota_gb}GB, 调度权重: {weight})")
 
         except Exception as e:
             print(f"✗ 加载特殊用户配置失败: {e}")
@@ -88,7 +92,9 @@ class QuotaManager:
                 'available_bytes': 可用,
                 'special_users': [{user_id, quota_bytes, used_bytes}, ...],
                 'normal_users_quota': 普通用户共享配额,
-                'normal_users_used': 普通用户已使用
+                'normal_users_used': 普通用户已使用,
+                'dep_cache_quota': 依赖缓存上限,
+                'dep_cache_used': 依赖缓存已使用
             }
         """
         # 获取所有特殊用户
@@ -98,8 +104,12 @@ class QuotaManager:
         # 计算特殊用户配额总和
         special_quota_total = sum(u['quota_bytes'] for u in special_users)
 
+        # 依赖缓存（独立按LRU淘汰，不参与任务清理）
+        dep_cache_quota = self.dep_cache.max_bytes if self.dep_cache else 0
+        dep_cache_used = self.dep_cache.get_total_size() if self.dep_cache else 0
+
         # 普通用户共享配额
-        normal_quota = self.TOTAL_QUOTA_BYTES - special_quota_total
+        normal_quota = self.TOTAL_QUOTA_BYTES - special_quota_total - dep_cache_quota
 
         # 计算特殊用户使用量
         special_users_info = []
@@ -117,8 +127,8 @@ class QuotaManager:
             special_used_total += used
 
         # 计算普通用户使用量
-        total_used = self.db.calculate_disk_usage()
-        normal_used = total_used - special_used_total
+        total_used = self.db.calculate_disk_usage() + dep_cache_used
+        normal_used = total_used - special_used_total - dep_cache_used
 
         # 获取所有普通用户的使用情况
         normal_users_info = []
@@ -162,7 +172,9 @@ class QuotaManager:
             'normal_users_quota': normal_quota,
             'normal_users_used': normal_used,
             'normal_users_usage_percent': round(normal_used / normal_quota * 100, 2) if normal_quota > 0 else 0,
-            'normal_users': normal_users_info
+            'normal_users': normal_users_info,
+            'dep_cache_quota': dep_cache_quota,
+            'dep_cache_used': dep_cache_used
         }
 
     def check_and_cleanup(self, user_id: str = None) -> Tuple[bool, int]:
@@ -236,9 +248,10 @@ class QuotaManager:
             # 删除任务的所有文件
             freed = self._delete_job_files(job)
 
-            if freed > 0:
-                # 标记为过期
+            # 标记为过期（共享文件的任务没有自己的文件，同样标记，否则会被反复选中）
+            if freed > 0 or self._shares_files(job):
                 self.db.mark_job_expired(job_id)
+            if freed > 0:
                 freed_bytes += freed
                 cleaned_count += 1
                 print(f"✓ 清理任务 {job_id} (释放 {freed} 字节)")
@@ -284,8 +297,9 @@ class QuotaManager:
 
             freed = self._delete_job_files(job)
 
-            if freed > 0:
+            if freed > 0 or self._shares_files(job):
                 self.db.mark_job_expired(job_id)
+            if freed > 0:
                 freed_bytes += freed
                 cleaned_count += 1
                 print(f"✓ 清理任务 {job_id} (释放 {freed} 字节)")
@@ -293,6 +307,11 @@ class QuotaManager:
         print(f"✓ 共清理 {cleaned_count} 个任务，释放 {freed_bytes} 字节")
         return cleaned_count
 
+    @staticmethod
+    def _shares_files(job: Dict) -> bool:
+        """任务是否引用其他任务的日志和产物（构建缓存命中、跟随任务）"""
+        return bool(job.get('cached_from') or job.get('coalesced_into'))
+
     def _delete_job_files(self, job: Dict) -> int:
         """
         删除任务的所有文件
@@ -303,15 +322,17 @@ class QuotaManager:
         Returns:
             释放的字节数
         """
+        # 共享其他任务文件的任务不删除文件，由文件所属任务负责清理
+        if self._shares_files(job):
+            return 0
+
         freed_bytes = 0
 
-        # 删除日志文件
+        # 删除日志文件（未压缩或已压缩）
         log_file = job.get('log_file')
-        if log_file and os.path.exists(log_file):
+        if log_file:
             try:
-                size = os.path.getsize(log_file)
-                os.remove(log_file)
-                freed_bytes += size
+                freed_bytes += remove_log(log_file)
             except Exception as e:
                 print(f"✗ 删除日志文件失败 {log_file}: {e}")
 
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+公平调度器
+提交的任务先进入按用户（或项目）划分的虚拟队列，只有在有空闲执行槽位、
+且节点剩余CPU和内存足够（见admission.py）时才提交给Celery，
+Celery队列中始终只有少量任务，一个用户批量提交不会让其他用户排在其后
+
+调度算法为加权公平队列（start-time fair queuing）：
+- 每个虚拟队列有一个虚拟时间，调度一个任务后增加 1/权重
+- 每次选择虚拟时间最小的非空队列（相同时选最早提交的任务）
+- 空闲后重新有任务的队列，虚拟时间追平到当前系统虚拟时间，不能用空闲期间"攒下"的份额插队
+权重2的用户在竞争时获得两倍的执行机会；没有竞争时任何用户都能用满所有槽位
+
+优先级先于公平性：总是先调度优先级最高的任务，同一优先级内按上述规则轮流。
+启用抢占时，高优先级任务到达而没有空闲槽位，会请求暂停一个优先级更低的运行中构建，
+由该构建所在的worker暂停其进程组、执行高优先级任务、再恢复（见tasks.py）
+
+调度在API进程（提交任务后、定时兜底）和worker（任务结束后）中触发，
+多个进程之间通过文件锁串行化
+"""
+
+import json
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from server.config import PRIORITY_CLASSES
+from server.database import JobDatabase
+from server.admission import AdmissionController
+from server.file_lock import FileLock
+
+UTC = timezone.utc
+
+DEFAULT_PRIORITY = PRIORITY_CLASSES['normal']
+
+# 可以抢占（暂停）其他任务的最低优先级
+PREEMPT_PRIORITY = PRIORITY_CLASSES['high']
+
+
+def parse_priority(value: Any) -> int:
+    """
+    解析提交参数中的优先级
+
+    Args:
+        value: 优先级名称（low/normal/high）或数值，为空时使用默认优先级
+
+    Returns:
+        优先级数值
+
+    Raises:
+        ValueError: 无效的优先级
+    """
+    if value is None or value == '':
+        return DEFAULT_PRIORITY
+    if isinstance(value, str) and value.lower() in PRIORITY_CLASSES:
+        return PRIORITY_CLASSES[value.lower()]
+    try:
+        priority = int(value)
+    except (TypeError, ValueError):
+        priority = None
+    if isinstance(value, bool) or priority not in PRIORITY_CLASSES.values():
+        raise ValueError(f"优先级必须是 {', '.join(PRIORITY_CLASSES)} 之一")
+    return priority
+
+
+class FairShareScheduler:
+    """按用户/项目加权轮流把任务提交给Celery"""
+
+    def __init__(self, db: JobDatabase, send: Callable[[str, Dict[str, Any]], Any],
+                 slots: int, key_by: str, lock_path: str, stale_seconds: float,
+                 heartbeat_timeout: float, preemption: bool = False, max_preemptions: int = 1,
+                 admission: Optional[AdmissionController] = None):
+        """
+        初始化调度器
+
+        Args:
+            db: 任务数据库
+            send: 把任务提交给Celery的函数 send(job_id, job_data)
+            slots: 执行槽位数（0表示不限制）
+            key_by: 虚拟队列划分方式 user | project
+            lock_path: 跨进程调度锁文件
+            stale_seconds: 提交超过该时间仍未开始的任务不再占用槽位（丢失的Celery消息）
+            heartbeat_timeout: 运行中的任务超过该时间没有心跳时不再占用槽位（worker异常退出遗留）
+            preemption: 没有空闲槽位时高优先级任务是否暂停低优先级任务
+            max_preemptions: 单个任务最多被暂停的次数
+            admission: 资源准入控制（None表示只按槽位数限制）
+        """
+        if key_by not in ('user', 'project'):
+            raise ValueError(f"不支持的调度分组方式: {key_by}")
+        self.db = db
+        self.send = send
+        self.slots = slots
+        self.key_by = key_by
+        self.lock_path = lock_path
+        self.stale_seconds = stale_seconds
+        self.heartbeat_timeout = heartbeat_timeout
+        self.preemption = preemption
+        self.max_preemptions = max_preemptions
+        self.admission = admission
+
+    def queue_key(self, job: Dict[str, Any]) -> str:
+        """任务所属的虚拟队列"""
+        if self.key_by == 'project':
+            return job.get('project_name') or 'default'
+        return job.get('user_id') or 'anonymous'
+
+    @staticmethod
+    def _cutoff(seconds: float) -> str:
+        return (datetime.now(UTC) - timedelta(seconds=seconds)).replace(tzinfo=None).isoformat() + 'Z'
+
+    def _inflight(self) -> List[Dict[str, Any]]:
+        """占用槽位的任务：已提交尚未开始的，以及worker仍有心跳的运行中任务"""
+        return self.db.get_dispatched_jobs(self._cutoff(self.stale_seconds), self._cutoff(self.heartbeat_timeout))
+
+    def dispatch(self, blocking: bool = True) -> List[str]:
+        """
+        把等待中的任务按公平顺序提交给Celery，直到槽位用满
+
+        Args:
+            blocking: 其他进程正在调度时是否等待（worker中不等待，由正在调度的进程处理）
+
+        Returns:
+            本次提交给Celery的任务ID列表
+        """
+        lock = FileLock(self.lock_path)
+        if not lock.acquire(blocking=blocking):
+            return []
+        try:
+            return self._dispatch_locked()
+        finally:
+            lock.release()
+
+    def _dispatch_locked(self) -> List[str]:
+        pending = self.db.get_pending_jobs()
+        if not pending:
+            return []
+
+        inflight = self._inflight()
+        used = AdmissionController.usage(inflight)
+        free = len(pending)
+        if self.slots > 0:
+            free = min(free, self.slots - len(inflight))
+        if free <= 0 and not (self.preemption and pending[0]['priority'] >= PREEMPT_PRIORITY):
+            return []
+
+        # 按虚拟队列分组（组内保持提交顺序）
+        queues: Dict[str, List[Dict[str, Any]]] = {}
+        for job in pending:
+            queues.setdefault(self.queue_key(job), []).append(job)
+
+        weights = self.db.get_user_weights()
+        state = self.db.get_scheduler_queues()
+        system_time = max((q['last_start'] for q in state.values()), default=0.0)
+
+        # 空闲后重新有任务的队列追平到系统虚拟时间
+        # （一直有任务等待的队列虚拟时间不会低于系统虚拟时间，不受影响）
+        virtual_time = {
+            key: max(state.get(key, {}).get('virtual_time', 0.0), system_time)
+            for key in queues
+        }
+        last_start = {key: state.get(key, {}).get('last_start', 0.0) for key in queues}
+        dispatched_count = {key: 0 for key in queues}
+
+        dispatched = []
+        while any(queues.values()):
+            # 先比较队首任务的优先级，相同时按虚拟时间轮流
+            key = min((k for k in queues if queues[k]),
+                      key=lambda k: (-queues[k][0]['priority'], virtual_time[k], queues[k][0]['created_at']))
+            job = queues[key][0]
+
+            # 资源不足时不跳过该任务去调度更小的任务，等待资源释放，避免大任务一直等待
+            if free > 0 and (self.admission is None or self.admission.fits(used, job)):
+                if not self._send(job):
+                    # Celery不可用，下次调度重试
+                    break
+                free -= 1
+                inflight.append(job)
+                used = AdmissionController.usage(inflight)
+            elif not self._preempt(job):
+                break
+            queues[key].pop(0)
+
+            last_start[key] = virtual_time[key]
+            virtual_time[key] += 1.0 / max(weights.get(key, 1.0), 0.01)
+            dispatched_count[key] += 1
+            dispatched.append(job['job_id'])
+
+        for key in queues:
+            self.db.save_scheduler_queue(key, virtual_time[key], last_start[key], dispatched_count[key])
+
+        return dispatched
+
+    def _send(self, job: Dict[str, Any]) -> bool:
+        """提交单个任务给Celery（先标记再提交，提交失败时撤销标记）"""
+        job_data = json.loads(job['metadata'] or '{}')
+        self.db.set_job_dispatched(job['job_id'])
+        try:
+            self.send(job['job_id'], job_data)
+            return True
+        except Exception as e:
+            self.db.set_job_dispatched(job['job_id'], False)
+            print(f"✗ 提交任务 {job['job_id']} 失败: {e}")
+            return False
+
+    def _preempt(self, job: Dict[str, Any]) -> bool:
+        """没有空闲槽位时请求暂停一个优先级更低的运行中任务，由其worker执行该任务"""
+        if not self.preemption or job['priority'] < PREEMPT_PRIORITY:
+            return False
+        victim = self.db.find_preemptible_job(job['priority'], self.max_preemptions,
+                                              self._cutoff(self.heartbeat_timeout))
+        if not victim or not self.db.request_preemption(victim['job_id'], job['job_id']):
+            return False
+        print(f"✓ 任务 {job['job_id']} 抢占任务 {victim['job_id']}（优先级 {victim['priority']}）")
+        return True
+
+    def get_state(self) -> Dict[str, Any]:
+        """
+        调度器状态（供管理接口展示）
+
+        Returns:
+            {'slots', 'key_by', 'preemption', 'resources', 'dispatched', 'pending', 'queues': [...]}
+        """
+        pending = self.db.get_pending_jobs()
+        inflight = self._inflight()
+        weights = self.db.get_user_weights()
+        state = self.db.get_scheduler_queues()
+
+        queues: Dict[str, Dict[str, Any]] = {}
+
+        def queue(key):
+            if key not in queues:
+                saved = state.get(key, {})
+                queues[key] = {
+                    'queue_key': key,
+                    'weight': weights.get(key, 1.0),
+                    'pending': 0,
+                    'dispatched': 0,
+                    'oldest_pending_at': None,
+                    'virtual_time': saved.get('virtual_time', 0.0),
+                    'dispatched_total': saved.get('dispatched_count', 0),
+                    'last_dispatched_at': saved.get('last_dispatched_at'),
+                }
+            return queues[key]
+
+        for job in pending:
+            q = queue(self.queue_key(job))
+            q['pending'] += 1
+            q['oldest_pending_at'] = q['oldest_pending_at'] or job['created_at']
+        for job in inflight:
+            queue(self.queue_key(job))['dispatched'] += 1
+
+        return {
+            'slots': self.slots,
+            'key_by': self.key_by,
+            'preemption': self.preemption,
+            'resources': self.admission.get_state(AdmissionController.usage(inflight)) if self.admission else None,
+            'dispatched': len(inflight),
+            'pending': len(pending),
+            'queues': sorted(queues.values(), key=lambda q: (-q['pending'], q['queue_key'])),
+        }
+
+    def start_background(self, interval: float) -> threading.Thread:
+        """启动定时调度线程（兜底worker异常退出等未触发调度的情况）"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dispatch()
+                except Exception as e:
+                    print(f"✗ 定时调度失败: {e}")
+
+        thread = threading.Thread(target=loop, name='fair-share-scheduler', daemon=True)
+        thread.start()
+        return thread
+
+
+# 测试代码
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = JobDatabase(os.path.join(temp_dir, 'jobs.db'))
+        db.add_special_user('carol', 1, weight=2)
+        sent = []
+
+        def fake_send(job_id, job_data):
+            sent.append(job_data['user_id'])
+
+        scheduler = FairShareScheduler(db, fake_send, slots=2, key_by='user',
+                                       lock_path=os.path.join(temp_dir, 'scheduler.lock'), stale_seconds=3600,
+                                       heartbeat_timeout=60)
+
+        # alice一次提交10个任务，之后bob和carol各提交4个
+        for i in range(10):
+            db.create_job(f'alice-{i}', {'mode': 'upload', 'script': 'make', 'user_id': 'alice'})
+        scheduler.dispatch()
+        for user in ('bob', 'carol'):
+            for i in range(4):
+                db.create_job(f'{user}-{i}', {'mode': 'upload', 'script': 'make', 'user_id': user})
+        print(f"槽位已满: {scheduler.dispatch()}")
+
+        # 模拟任务逐个完成，观察调度顺序
+        while True:
+            running = db.get_dispatched_jobs('', '')
+            if not running:
+                break
+            db.update_job_finished(running[0]['job_id'], 'success')
+            scheduler.dispatch()
+
+        print(f"调度顺序: {sent}")
+        assert sent[:2] == ['alice', 'alice']
+        # 竞争期间carol（权重2）得到的机会约为bob的两倍，alice没有插队
+        contested = sent[2:11]
+        assert contested.count('carol') >= contested.count('bob') and contested.count('alice') <= 3
+        print(f"状态: {scheduler.get_state()}")
+
+        # 槽位被低优先级任务占满时，高优先级任务请求暂停其中一个
+        scheduler.preemption = True
+        for i in range(2):
+            db.create_job(f'nightly-{i}', {'mode': 'upload', 'script': 'make', 'user_id': 'alice',
+                                           'priority': parse_priority('low')})
+        scheduler.dispatch()
+        for i in range(2):
+            db.update_job_started(f'nightly-{i}')
+        db.create_job('hotfix', {'mode': 'upload', 'script': 'make', 'user_id': 'bob', 'priority': parse_priority('high')})
+        assert scheduler.dispatch() == ['hotfix'] and sent[-1] == 'alice'
+        assert db.get_preempting_job('nightly-1')['job_id'] == 'hotfix'
+        print("✓ 高优先级任务已抢占 nightly-1")
+
+        # 被暂停的任务提前结束时，抢占任务重新等待调度
+        assert db.release_preemption('nightly-1') == 'hotfix'
+        db.update_job_finished('nightly-1', 'success')
+        assert scheduler.dispatch() == ['hotfix'] and sent[-1] == 'bob'
+        db.update_job_finished('nightly-0', 'success')
+        db.update_job_finished('hotfix', 'success')
+
+        # 资源准入：不限槽位，按CPU容量同时运行多个轻量任务，重量级任务等待资源释放
+        scheduler.slots = 0
+        scheduler.admission = AdmissionController(db, cpus=4, memory_mb=8192, default_cpus=1, default_memory_mb=512)
+        for i in range(6):
+            db.create_job(f'lint-{i}', {'mode': 'upload', 'script': 'lint', 'user_id': 'dave',
+                                        'resources': {'cpus': 0.5, 'memory_mb': 256}})
+        started = scheduler.dispatch()
+        print(f"准入: {started}, 资源: {scheduler.get_state()['resources']}")
+        assert len(started) == 6
+
+        db.create_job('cpp', {'mode': 'upload', 'script': 'make -j4', 'user_id': 'erin',
+                              'resources': {'cpus': 4, 'memory_mb': 4096}})
+        assert scheduler.dispatch() == []
+        for job_id in started:
+            db.update_job_finished(job_id, 'success')
+        assert scheduler.dispatch() == ['cpp']
+        db.create_job('lint-6', {'mode': 'upload', 'script': 'lint', 'user_id': 'dave',
+                                 'resources': {'cpus': 0.5, 'memory_mb': 256}})
+        assert scheduler.dispatch() == []
+        print("✓ 重量级任务独占节点")
+
+        # 执行任务的worker异常退出：心跳超时后释放其占用的资源，不必等到任务超时
+        db.update_job_started('cpp')
+        assert scheduler.dispatch() == []
+        time.sleep(0.01)
+        scheduler.heartbeat_timeout = 0
+        assert scheduler.dispatch() == ['lint-6']
+        print("✓ 心跳超时的任务不再占用资源")
+
+        print("\n✓ 所有测试通过")
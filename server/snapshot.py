@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+目录快照引擎
+为rsync模式的workspace生成任务工作副本，避免每个任务完整复制代码
+
+策略：
+- reflink：写时复制克隆（btrfs、xfs等支持FICLONE的文件系统），不复制数据
+- copy：完整复制（与shutil.copytree相同）
+- hardlink：硬链接农场，目录结构独立，文件共享inode；构建原地修改文件
+  （追加写入、chmod、touch等）会同时改动源目录和其他快照，不能隔离构建，
+  只在显式指定时使用（如源目录随后即被删除）
+
+auto模式按 reflink -> copy 顺序尝试，保证快照中文件的修改不影响源目录
+"""
+
+import os
+import errno
+import shutil
+import fcntl
+from pathlib import Path
+from typing import Dict, Tuple
+
+# linux/fs.h: FICLONE = _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+STRATEGIES = ('reflink', 'hardlink', 'copy')
+
+# auto模式尝试的策略（hardlink不隔离原地修改，需要allow_hardlink=True）
+AUTO_STRATEGIES = ('reflink', 'copy')
+
+# 表示文件系统不支持当前策略的错误码
+_UNSUPPORTED_ERRNOS = {
+    errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL,
+    errno.ENOSYS, errno.EPERM, errno.EMLINK,
+}
+
+
+class SnapshotUnsupported(Exception):
+    """当前文件系统不支持该快照策略"""
+
+
+class SnapshotEngine:
+    """目录快照引擎"""
+
+    def __init__(self, strategy: str = 'auto', allow_hardlink: bool = False):
+        """
+        初始化快照引擎
+
+        Args:
+            strategy: auto | reflink | hardlink | copy
+            allow_hardlink: auto模式是否在reflink之后尝试hardlink（只有快照不会被原地修改、
+                            或源目录随后即被删除时才能开启）
+        """
+        if strategy != 'auto' and strategy not in STRATEGIES:
+            raise ValueError(f"不支持的快照策略: {strategy}")
+        self.strategy = strategy
+        self.candidates = ['reflink', 'hardlink', 'copy'] if allow_hardlink else list(AUTO_STRATEGIES)
+        # (源设备号, 目标设备号) -> 可用策略，避免每个任务重复探测
+        self._probed: Dict[Tuple[int, int], str] = {}
+
+    def snapshot(self, src: str, dst: str) -> str:
+        """
+        生成src的快照到dst（dst不能已存在）
+
+        hardlink策略下文件与源目录共享inode，原地修改会同步到源目录，
+        因此auto模式默认不使用（见allow_hardlink）。
+
+        Args:
+            src: 源目录
+            dst: 目标目录
+
+        Returns:
+            实际使用的策略名
+        """
+        Path(dst).parent.mkdir(parents=True, exist_ok=True)
+
+        if self.strategy != 'auto':
+            self._snapshot_with(self.strategy, src, dst)
+            return self.strategy
+
+        key = (os.stat(src).st_dev, os.stat(os.path.dirname(dst)).st_dev)
+        candidates = [self._probed[key]] if key in self._probed else self.candidates
+
+        for strategy in candidates:
+            try:
+                self._snapshot_with(strategy, src, dst)
+                self._probed[key] = strategy
+                return strategy
+            except SnapshotUnsupported:
+                shutil.rmtree(dst, ignore_errors=True)
+
+        # 缓存的策略失效（例如目录被移动到其他文件系统），重新探测
+        self._probed.pop(key, None)
+        self._snapshot_with('copy', src, dst)
+        return 'copy'
+
+    def _snapshot_with(self, strategy: str, src: str, dst: str):
+        """使用指定策略复制目录树"""
+        if strategy == 'copy':
+            shutil.copytree(src, dst, symlinks=True)
+            return
+
+        link_file = self._reflink_file if strategy == 'reflink' else self._hardlink_file
+
+        os.mkdir(dst)
+        # (源目录, 目标目录)，目录元数据在内容处理完后复制
+        stack = [(src, dst)]
+        finished_dirs = []
+
+        while stack:
+            src_dir, dst_dir = stack.pop()
+            finished_dirs.append((src_dir, dst_dir))
+
+            with os.scandir(src_dir) as entries:
+                for entry in entries:
+                    target = os.path.join(dst_dir, entry.name)
+
+                    if entry.is_symlink():
+                        os.symlink(os.readlink(entry.path), target)
+                    elif entry.is_dir():
+                        os.mkdir(target)
+                        stack.append((entry.path, target))
+                    elif entry.is_file():
+                        link_file(entry.path, target)
+
+        for src_dir, dst_dir in reversed(finished_dirs):
+            shutil.copystat(src_dir, dst_dir)
+
+    @staticmethod
+    def _reflink_file(src: str, dst: str):
+        """以FICLONE克隆单个文件"""
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except OSError as e:
+                if e.errno in _UNSUPPORTED_ERRNOS:
+                    raise SnapshotUnsupported(str(e))
+                raise
+        shutil.copystat(src, dst)
+
+    @staticmethod
+    def _hardlink_file(src: str, dst: str):
+        """硬链接单个文件"""
+        try:
+            os.link(src, dst)
+        except OSError as e:
+            if e.errno in _UNSUPPORTED_ERRNOS:
+                raise SnapshotUnsupported(str(e))
+            raise
+
+
+# 测试代码
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        src = os.path.join(temp_dir, 'workspace')
+        os.makedirs(os.path.join(src, 'src', 'empty'))
+        with open(os.path.join(src, 'src', 'main.py'), 'w') as f:
+            f.write('print("hello")\n')
+        os.symlink('main.py', os.path.join(src, 'src', 'link.py'))
+
+        engine = SnapshotEngine()
+        for i in range(2):
+            dst = os.path.join(temp_dir, f'job-{i}', 'repo')
+            strategy = engine.snapshot(src, dst)
+            print(f"快照策略: {strategy}")
+            assert strategy != 'hardlink', "auto模式不应使用hardlink"
+            assert os.path.islink(os.path.join(dst, 'src', 'link.py'))
+            assert os.path.isdir(os.path.join(dst, 'src', 'empty'))
+
+            # 构建原地修改快照中的文件不影响源目录
+            with open(os.path.join(dst, 'src', 'main.py'), 'a') as f:
+                f.write('# modified\n')
+            os.chmod(os.path.join(dst, 'src', 'main.py'), 0o600)
+            with open(os.path.join(src, 'src', 'main.py')) as f:
+                assert f.read() == 'print("hello")\n'
+
+        # 显式开启时可以使用hardlink
+        dst = os.path.join(temp_dir, 'saved')
+        print(f"显式允许hardlink: {SnapshotEngine(allow_hardlink=True).snapshot(src, dst)}")
+
+        print("\n✓ 所有测试通过")
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+构建阶段计时
+记录任务各阶段（排队、准备代码、构建、打包产物、清理等）的开始时间和耗时，
+任务结束后写入job_stages表，用于查看单个任务的时间分布和各阶段的耗时分位数
+"""
+
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+UTC = timezone.utc
+
+# 阶段名（按执行顺序）
+STAGES = (
+    'queue_wait',         # 创建到开始执行
+    'prepare_source',     # 复制/解压/还原/克隆代码
+    'restore_cache',      # 恢复依赖缓存
+    'build',              # 执行构建脚本（不含被抢占暂停的时间）
+    'preempted',          # 被高优先级任务抢占暂停
+    'save_cache',         # 保存依赖缓存
+    'pack_artifacts',     # 打包构建产物
+    'cleanup_artifacts',  # 清理原始产物文件
+    'quota_cleanup',      # 检查磁盘配额并清理
+    'cleanup_workdir',    # 删除工作目录
+)
+
+# 统计的分位数
+PERCENTILES = (50, 90, 95, 99)
+
+
+def _utc_now() -> str:
+    return datetime.now(UTC).replace(tzinfo=None).isoformat() + 'Z'
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """
+    线性插值分位数
+
+    Args:
+        sorted_values: 升序排列的数值
+        q: 分位（0-100）
+    """
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(durations: Dict[str, List[float]]) -> List[Dict[str, Any]]:
+    """
+    按阶段汇总耗时
+
+    Args:
+        durations: {阶段名: [耗时(秒), ...]}（升序）
+
+    Returns:
+        [{'stage', 'count', 'avg', 'p50', 'p90', 'p95', 'p99', 'max'}, ...]，按STAGES顺序
+    """
+    order = {name: i for i, name in enumerate(STAGES)}
+    result = []
+    for stage in sorted(durations, key=lambda s: order.get(s, len(order))):
+        values = durations[stage]
+        if not values:
+            continue
+        summary = {'stage': stage, 'count': len(values), 'avg': round(sum(values) / len(values), 3)}
+        for q in PERCENTILES:
+            summary[f'p{q}'] = round(percentile(values, q), 3)
+        summary['max'] = round(values[-1], 3)
+        result.append(summary)
+    return result
+
+
+class StageTimer:
+    """
+    记录一个任务的各阶段耗时
+
+    连续的阶段用 start() 切换（开始新阶段时结束上一个阶段），单个操作用 stage() 上下文管理器；
+    任务异常结束时调用 stop() 记录进行中阶段已用的时间
+    """
+
+    def __init__(self):
+        self.stages: List[Dict[str, Any]] = []
+        self._current: Optional[tuple] = None
+
+    def add(self, stage: str, duration: float, started_at: Optional[str] = None):
+        """
+        记录一个阶段（同名阶段多次出现时耗时累加）
+
+        Args:
+            stage: 阶段名
+            duration: 耗时（秒）
+            started_at: 开始时间（UTC ISO格式），默认为当前时间减去耗时
+        """
+        for entry in self.stages:
+            if entry['stage'] == stage:
+                entry['duration'] += duration
+                return
+        if started_at is None:
+            started_at = datetime.fromtimestamp(time.time() - duration, UTC).replace(tzinfo=None).isoformat() + 'Z'
+        self.stages.append({'stage': stage, 'started_at': started_at, 'duration': duration})
+
+    def add_span(self, stage: str, started_at: str, finished_at: str):
+        """按两个时间点（数据库中的UTC ISO格式）记录阶段，例如排队时间"""
+        start = datetime.fromisoformat(started_at.rstrip('Z'))
+        end = datetime.fromisoformat(finished_at.rstrip('Z'))
+        self.add(stage, max((end - start).total_seconds(), 0.0), started_at)
+
+    def move(self, stage: str, to_stage: str, seconds: float):
+        """把阶段中的一部分时间划到另一个阶段（例如构建中被抢占暂停的时间）"""
+        for entry in self.stages:
+            if entry['stage'] == stage:
+                seconds = min(seconds, entry['duration'])
+                entry['duration'] -= seconds
+                self.add(to_stage, seconds)
+                return
+
+    def start(self, stage: str):
+        """结束进行中的阶段并开始新阶段"""
+        self.stop()
+        self._current = (stage, _utc_now(), time.monotonic())
+
+    def stop(self):
+        """结束进行中的阶段"""
+        if self._current:
+            stage, started_at, start = self._current
+            self._current = None
+            self.add(stage, time.monotonic() - start, started_at)
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """计时一个阶段（阶段内抛出异常时同样记录已用时间）"""
+        self.start(stage)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def total(self) -> float:
+        """各阶段耗时合计（秒）"""
+        return sum(entry['duration'] for entry in self.stages)
+
+
+# 测试代码
+if __name__ == '__main__':
+    timer = StageTimer()
+    timer.add_span('queue_wait', '2026-01-01T00:00:00Z', '2026-01-01T00:00:01.500000Z')
+    timer.start('prepare_source')
+    time.sleep(0.05)
+    timer.start('build')
+    time.sleep(0.03)
+    timer.stop()
+    timer.move('build', 'preempted', 0.02)
+    try:
+        with timer.stage('cleanup_workdir'):
+            raise OSError('删除失败')
+    except OSError:
+        pass
+
+    for entry in timer.stages:
+        print(f"{entry['stage']:<16} {entry['duration']:.3f} 秒 (开始: {entry['started_at']})")
+    assert [e['stage'] for e in timer.stages] == ['queue_wait', 'prepare_source', 'build', 'preempted', 'cleanup_workdir']
+    assert timer.stages[0]['duration'] == 1.5 and timer.stages[1]['duration'] >= 0.05
+    assert timer.stages[3]['duration'] == 0.02
+
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([5], 99) == 5
+    summary = summarize({'build': [float(i) for i in range(1, 101)], 'queue_wait': [0.1, 0.2]})
+    print(f"汇总: {summary}")
+    assert [s['stage'] for s in summary] == ['queue_wait', 'build']
+    assert summary[1]['p50'] == 50.5 and summary[1]['max'] == 100
+
+    print("\n✓ 所有测试通过")
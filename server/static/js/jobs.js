@@ -83,21 +83,112 @@ function clearFilter() {
     loadData();
 }
 
+// 实时日志推送连接（运行中的任务）
+let logStream = null;
+
+function stopLogStream() {
+    if (logStream) {
+        logStream.close();
+        logStream = null;
+    }
+}
+
+// 日志分页：先加载最后一页，滚动到顶部或点击按钮时按行号加载更早的日志
+const LOG_PAGE_LINES = 2000;
+let logJobId = null;
+let logFirstLine = 1;
+let logLoadingEarlier = false;
+
+function updateEarlierButton() {
+    const button = document.getElementById('log-earlier');
+    button.style.display = logFirstLine > 1 ? 'block' : 'none';
+    button.textContent = `加载更早的日志（还有 ${logFirstLine - 1} 行）`;
+}
+
 async function showLogs(jobId) {
+    stopLogStream();
     document.getElementById('log-modal').style.display = 'block';
     document.getElementById('modal-title').textContent = `任务日志 - ${jobId}`;
-    document.getElementById('log-content').textContent = '加载中...';
+    const logContent = document.getElementById('log-content');
+    logContent.textContent = '加载中...';
+    logJobId = jobId;
+    logFirstLine = 1;
+    updateEarlierButton();
 
     try {
-        // 使用免Token的历史接口
-        const response = await fetch(`/api/jobs/history/${jobId}/logs`);
+        // 使用免Token的历史接口，只加载最后一页
+        let response = await fetch(`/api/jobs/history/${jobId}/logs?lines=${LOG_PAGE_LINES}`);
+        if (!response.headers.get('X-Total-Lines')) {
+            // 没有行索引的旧日志：加载完整日志
+            response = await fetch(`/api/jobs/history/${jobId}/logs`);
+        }
         const logs = await response.text();
-        document.getElementById('log-content').textContent = logs || '暂无日志';
+        if (logJobId !== jobId) return;
+        logContent.textContent = logs || '暂无日志';
+        logFirstLine = parseInt(response.headers.get('X-Start-Line') || '1', 10);
+        updateEarlierButton();
+        logContent.scrollTop = logContent.scrollHeight;
+
+        // 任务未结束：从当前偏移开始接收新增日志
+        const status = response.headers.get('X-Job-Status');
+        if (status === 'queued' || status === 'running') {
+            followLogs(jobId, response.headers.get('X-Next-Offset') || 0);
+        }
     } catch (e) {
-        document.getElementById('log-content').textContent = '加载日志失败: ' + e.message;
+        logContent.textContent = '加载日志失败: ' + e.message;
     }
 }
 
+async function loadEarlierLogs() {
+    if (logLoadingEarlier || logFirstLine <= 1) return;
+    const jobId = logJobId;
+    const logContent = document.getElementById('log-content');
+    const start = Math.max(1, logFirstLine - LOG_PAGE_LINES);
+
+    logLoadingEarlier = true;
+    try {
+        const response = await fetch(`/api/jobs/history/${jobId}/logs?start_line=${start}&end_line=${logFirstLine - 1}`);
+        const logs = await response.text();
+        if (logJobId !== jobId) return;
+
+        // 在顶部插入，保持当前查看的位置
+        const previousHeight = logContent.scrollHeight;
+        logContent.textContent = logs + logContent.textContent;
+        logContent.scrollTop += logContent.scrollHeight - previousHeight;
+        logFirstLine = start;
+        updateEarlierButton();
+    } catch (e) {
+        console.error('加载更早的日志失败:', e);
+    } finally {
+        logLoadingEarlier = false;
+    }
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const logContent = document.getElementById('log-content');
+    logContent.addEventListener('scroll', () => {
+        if (logContent.scrollTop < 50) loadEarlierLogs();
+    });
+});
+
+function followLogs(jobId, offset) {
+    const logContent = document.getElementById('log-content');
+    logStream = new EventSource(`/api/jobs/history/${jobId}/logs/stream?offset=${offset}`);
+
+    logStream.onmessage = (event) => {
+        // 停留在底部时自动滚动
+        const atBottom = logContent.scrollTop + logContent.clientHeight >= logContent.scrollHeight - 20;
+        if (logContent.textContent === '暂无日志') logContent.textContent = '';
+        logContent.textContent += event.data;
+        if (atBottom) logContent.scrollTop = logContent.scrollHeight;
+    };
+
+    logStream.addEventListener('end', () => {
+        stopLogStream();
+        loadData();
+    });
+}
+
 async function loadData() {
     await Promise.all([loadStats(), loadJobs()]);
 }
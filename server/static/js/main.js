@@ -17,6 +17,7 @@ async function apiCall(url) {
 
 function closeModal() {
     document.getElementById('log-modal').style.display = 'none';
+    if (typeof stopLogStream === 'function') stopLogStream();
 }
 
 function getStatusText(status) {
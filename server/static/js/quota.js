@@ -36,6 +36,10 @@ async function loadQuotaInfo() {
         document.getElementById('normal-used').textContent = formatGB(data.normal_users_used);
         document.getElementById('normal-percent').textContent = data.normal_users_usage_percent + '%';
 
+        // 更新依赖缓存
+        document.getElementById('dep-cache-quota').textContent = formatGB(data.dep_cache_quota || 0);
+        document.getElementById('dep-cache-used').textContent = formatGB(data.dep_cache_used || 0);
+
     } catch (e) {
         console.error('加载配额信息失败:', e);
     }
@@ -60,14 +64,15 @@ async function loadSpecialUsers() {
                     <div class="user-quota">
                         配额: ${user.quota_gb.toFixed(2)} GB /
                         已用: ${user.used_gb.toFixed(2)} GB
-                        (${user.usage_percent}%)
+                        (${user.usage_percent}%) /
+                        调度权重: ${user.weight}
                     </div>
                     <div class="user-progress">
                         <div class="user-progress-fill" style="width: ${user.usage_percent}%"></div>
                     </div>
                 </div>
                 <div class="user-actions">
-                    <button class="btn-primary" onclick="editUser('${user.user_id}', ${user.quota_gb})">编辑</button>
+                    <button class="btn-primary" onclick="editUser('${user.user_id}', ${user.quota_gb}, ${user.weight})">编辑</button>
                     <button class="btn-danger" onclick="deleteUser('${user.user_id}')">删除</button>
                 </div>
             </div>
@@ -85,15 +90,17 @@ function showAddUserModal() {
     document.getElementById('user-id-input').value = '';
     document.getElementById('user-id-input').disabled = false;
     document.getElementById('quota-input').value = '';
+    document.getElementById('weight-input').value = '';
     document.getElementById('user-modal').style.display = 'block';
 }
 
-function editUser(userId, quotaGb) {
+function editUser(userId, quotaGb, weight) {
     editingUserId = userId;
     document.getElementById('user-modal-title').textContent = '编辑特殊用户';
     document.getElementById('user-id-input').value = userId;
     document.getElementById('user-id-input').disabled = true;
     document.getElementById('quota-input').value = quotaGb;
+    document.getElementById('weight-input').value = weight;
     document.getElementById('user-modal').style.display = 'block';
 }
 
@@ -105,11 +112,16 @@ function closeUserModal() {
 async function saveUser() {
     const userId = document.getElementById('user-id-input').value.trim();
     const quotaGb = parseFloat(document.getElementById('quota-input').value);
+    const weight = parseFloat(document.getElementById('weight-input').value || '1');
 
     if (!userId || !quotaGb || quotaGb <= 0) {
         alert('请填写正确的用户ID和配额');
         return;
     }
+    if (!weight || weight <= 0) {
+        alert('调度权重必须大于0');
+        return;
+    }
 
     try {
         const url = editingUserId
@@ -126,7 +138,8 @@ async function saveUser() {
             },
             body: JSON.stringify({
                 user_id: userId,
-                quota_gb: quotaGb
+                quota_gb: quotaGb,
+                weight: weight
             })
         });
 
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+流式tar解包
+边接收边校验、边计算摘要边解压，不在磁盘上保留归档文件
+"""
+
+import os
+import hashlib
+import tarfile
+from pathlib import Path
+from typing import BinaryIO, Dict, Any, Optional
+
+from server.blob_store import validate_relpath
+from server.compression import open_decompressed_stream
+
+# 读取块大小
+CHUNK_SIZE = 1024 * 1024
+
+# Python 3.12+（及部分3.8-3.11补丁版本）的解压过滤器异常
+_FilterError = getattr(tarfile, 'FilterError', ())
+
+
+class ArchiveTooLarge(Exception):
+    """归档超过大小限制"""
+
+
+class UnsafeArchiveMember(Exception):
+    """归档成员路径不安全（绝对路径、目录穿越、经过链接写到目录外等）"""
+
+
+class HashingReader:
+    """包装输入流：累计sha256并限制读取字节数"""
+
+    def __init__(self, stream: BinaryIO, max_bytes: Optional[int] = None):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self._hasher = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size if size is not None and size >= 0 else CHUNK_SIZE)
+        if data:
+            self.bytes_read += len(data)
+            if self.max_bytes is not None and self.bytes_read > self.max_bytes:
+                raise ArchiveTooLarge(f"归档超过大小限制: {self.max_bytes} 字节")
+            self._hasher.update(data)
+        return data
+
+    def drain(self):
+        """读完剩余数据（tar结束块之后的填充），保证摘要覆盖整个流"""
+        while self.read(CHUNK_SIZE):
+            pass
+
+    def hexdigest(self) -> str:
+        return self._hasher.hexdigest()
+
+
+def _is_within(path: str, root: str) -> bool:
+    """判断真实路径是否位于root之内"""
+    return path == root or path.startswith(root + os.sep)
+
+
+def _check_member(member: tarfile.TarInfo, dest_root: str) -> str:
+    """
+    校验单个成员，按当前已解压的文件系统状态解析路径
+
+    符号链接按原样保留（项目中常见指向系统路径的链接，如 env -> /usr/bin/env），
+    危险的是经过链接写入，因此只要求成员的上级目录解析后仍在目标目录内
+
+    Returns:
+        成员解压后的路径
+
+    Raises:
+        UnsafeArchiveMember: 路径不安全
+    """
+    try:
+        name = validate_relpath(member.name)
+    except ValueError as e:
+        raise UnsafeArchiveMember(str(e))
+
+    target = os.path.join(dest_root, name)
+    parent = os.path.realpath(os.path.dirname(target))
+    if not _is_within(parent, dest_root):
+        raise UnsafeArchiveMember(f"路径越界: {member.name}")
+
+    if member.islnk():
+        try:
+            link_name = validate_relpath(member.linkname)
+        except ValueError as e:
+            raise UnsafeArchiveMember(str(e))
+        link_target = os.path.realpath(os.path.join(dest_root, link_name))
+        if not _is_within(link_target, dest_root):
+            raise UnsafeArchiveMember(f"硬链接越界: {member.name} -> {member.linkname}")
+
+    return target
+
+
+def extract_tar_stream(stream: BinaryIO, dest_dir: str,
+                       max_bytes: Optional[int] = None,
+                       max_extract_bytes: Optional[int] = None) -> Dict[str, Any]:
+    """
+    流式解压tar（自动识别gzip/zstd/bzip2/xz压缩）到目标目录
+
+    Args:
+        stream: 输入流（如 request.stream）
+        dest_dir: 目标目录
+        max_bytes: 输入流字节数上限
+        max_extract_bytes: 解压后文件总大小上限（防止压缩炸弹）
+
+    Returns:
+        {'sha256': 输入流摘要, 'bytes_read': 输入字节数,
+         'file_count': 文件数, 'extracted_bytes': 解压字节数}
+
+    Raises:
+        ArchiveTooLarge: 超过大小限制
+        UnsafeArchiveMember: 成员路径不安全
+        tarfile.TarError: 归档格式错误
+    """
+    Path(dest_dir).mkdir(parents=True, exist_ok=True)
+    dest_root = os.path.realpath(dest_dir)
+
+    reader = HashingReader(stream, max_bytes)
+    file_count = 0
+    extracted_bytes = 0
+
+    # Python 3.12+ 提供解压过滤器，作为额外一层防护
+    extract_kwargs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+
+    with tarfile.open(fileobj=open_decompressed_stream(reader), mode='r|*') as tar:
+        for member in tar:
+            # 设备文件、FIFO等不解压；根目录成员（tar -C dir .）直接跳过
+            if not (member.isfile() or member.isdir() or member.issym() or member.islnk()):
+                continue
+            if member.isdir() and os.path.normpath(member.name) == '.':
+                continue
+
+            target = _check_member(member, dest_root)
+
+            if member.isfile():
+                file_count += 1
+                extracted_bytes += member.size
+                if max_extract_bytes is not None and extracted_bytes > max_extract_bytes:
+                    raise ArchiveTooLarge(f"解压后超过大小限制: {max_extract_bytes} 字节")
+
+            # 同名的符号链接先删除，不经过链接写入或修改权限
+            if os.path.islink(target):
+                os.unlink(target)
+
+            if member.issym():
+                # 解压过滤器会拒绝指向目录外的链接，由这里直接创建
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if os.path.lexists(target) and not os.path.isdir(target):
+                    os.unlink(target)
+                try:
+                    os.symlink(member.linkname, target)
+                except FileExistsError:
+                    raise UnsafeArchiveMember(f"符号链接与已有目录同名: {member.name}")
+                continue
+
+            try:
+                tar.extract(member, dest_root, **extract_kwargs)
+            except _FilterError as e:
+                raise UnsafeArchiveMember(str(e))
+
+    reader.drain()
+
+    return {
+        'sha256': reader.hexdigest(),
+        'bytes_read': reader.bytes_read,
+        'file_count': file_count,
+        'extracted_bytes': extracted_bytes,
+    }
+
+
+# 测试代码
+if __name__ == '__main__':
+    import io
+    import tempfile
+
+    def build_tar(members, mode='w:gz'):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode=mode) as tar:
+            for info, data in members:
+                tar.addfile(info, io.BytesIO(data) if data is not None else None)
+        buf.seek(0)
+        return buf
+
+    def file_info(name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        return info, data
+
+    def link_info(name, target):
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.SYMTYPE
+        info.linkname = target
+        return info, None
+
+    def hardlink_info(name, target):
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.LNKTYPE
+        info.linkname = target
+        return info, None
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # 正常归档
+        archive = build_tar([file_info('src/main.py', b'print(1)\n'), link_info('src/link.py', 'main.py')])
+        result = extract_tar_stream(archive, os.path.join(temp_dir, 'ok'), max_bytes=1024 * 1024)
+        print(f"解压: {result}")
+
+        # 指向目录外的符号链接原样保留，同名成员替换链接本身而不写入链接目标
+        outside = os.path.join(temp_dir, 'outside')
+        open(outside, 'w').close()
+        extract_tar_stream(build_tar([link_info('bin/env', '/usr/bin/env'), link_info('up', '..'),
+                                      link_info('victim', outside), file_info('victim', b'x')]),
+                           os.path.join(temp_dir, 'links'))
+        assert os.readlink(os.path.join(temp_dir, 'links', 'bin', 'env')) == '/usr/bin/env'
+        assert os.path.getsize(outside) == 0 and not os.path.islink(os.path.join(temp_dir, 'links', 'victim'))
+        print("✓ 保留指向目录外的符号链接")
+
+        # 目录穿越与经过链接写到目录外
+        for name, members in [
+            ('traversal', [file_info('../evil', b'x')]),
+            ('abs-link', [link_info('etc', '/etc'), file_info('etc/evil', b'x')]),
+            ('link-escape', [link_info('here', '.'), link_info('here/up', '..'), file_info('here/up/evil', b'x')]),
+            ('hardlink', [link_info('env', '/usr/bin/env'), hardlink_info('copy', 'env')]),
+        ]:
+            try:
+                extract_tar_stream(build_tar(members), os.path.join(temp_dir, name))
+                raise AssertionError(f"应拒绝: {name}")
+            except UnsafeArchiveMember as e:
+                print(f"✓ 已拒绝 {name}: {e}")
+
+        # 大小限制
+        try:
+            extract_tar_stream(build_tar([file_info('big', os.urandom(4096))]),
+                               os.path.join(temp_dir, 'big'), max_bytes=1024)
+            raise AssertionError("应拒绝超大归档")
+        except ArchiveTooLarge as e:
+            print(f"✓ 已拒绝超大归档: {e}")
+
+        print("\n✓ 所有测试通过")
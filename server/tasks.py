@@ -7,16 +7,44 @@ Celery任务定义
 """
 
 import os
+import json
+import time
 import subprocess
 import shutil
+import threading
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 from celery import Task
+from celery.signals import worker_init, worker_ready
 from server.celery_app import celery_app
-from server.config import WORK_DIR, DATA_DIR, JOB_TIMEOUT
+from server.config import (
+    WORK_DIR, DATA_DIR, JOB_TIMEOUT, BLOB_RETENTION_DAYS, SNAPSHOT_STRATEGY,
+    GIT_CACHE_MAX_BYTES, ARTIFACT_FORMAT, ZSTD_LEVEL, ZSTD_THREADS,
+    DEP_CACHE_DIR, DEP_CACHE_MAX_BYTES, DEP_CACHE_STRATEGY, BUILD_CACHE_ENABLED,
+    SCHEDULER_SLOTS, SCHEDULER_KEY, PREEMPTION_ENABLED, MAX_PREEMPTIONS, TASK_TIME_LIMIT,
+    ADMISSION_ENABLED, NODE_CPUS, NODE_MEMORY_MB, DEFAULT_JOB_CPUS, DEFAULT_JOB_MEMORY_MB,
+    CGROUP_ENABLED, CGROUP_PARENT, CGROUP_LIMITS, LOG_FLUSH_BYTES, LOG_FLUSH_INTERVAL,
+    LOG_COMPRESSION, HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT
+)
 from server.database import JobDatabase
 from server.artifact_handler import ArtifactHandler
 from server.quota_manager import QuotaManager
+from server.blob_store import BlobStore
+from server.snapshot import SnapshotEngine
+from server.git_cache import GitMirrorCache, GitCacheError
+from server.tar_stream import extract_tar_stream
+from server.build_runner import BuildRunner
+from server.job_log import JobLogWriter
+from server.log_archive import compress_log, cleanup_temp_files, disk_size
+from server.log_index import LineIndexWriter
+from server.log_reader import FINISHED_STATUSES
+from server.cgroup import CgroupManager
+from server.stage_timer import StageTimer
+from server.metrics import ARTIFACT_BYTES, observe_job, cleanup_dead_processes
+from server.dep_cache import DependencyCache, uses_home
+from server.build_cache import compute_build_key, git_source_key
+from server.admission import AdmissionController, node_cpus, node_memory_mb
+from server.scheduler import FairShareScheduler
 
 # 定义时区
 UTC = timezone.utc
@@ -26,10 +54,156 @@ UTC8 = timezone(timedelta(hours=8))
 job_db = JobDatabase(f"{DATA_DIR}/jobs.db")
 
 # 初始化产物处理器
-artifact_handler = ArtifactHandler(f"{DATA_DIR}/artifacts")
+artifact_handler = ArtifactHandler(f"{DATA_DIR}/artifacts", ARTIFACT_FORMAT, ZSTD_LEVEL, ZSTD_THREADS)
+
+# 初始化依赖缓存
+dep_cache = DependencyCache(DEP_CACHE_DIR, DEP_CACHE_MAX_BYTES, DEP_CACHE_STRATEGY)
 
 # 初始化配额管理器
-quota_manager = QuotaManager(job_db)
+quota_manager = QuotaManager(job_db, dep_cache=dep_cache)
+
+# 初始化源码块存储（增量上传）
+blob_store = BlobStore(f"{DATA_DIR}/blobs")
+
+# 初始化快照引擎（rsync模式工作副本）
+snapshot_engine = SnapshotEngine(SNAPSHOT_STRATEGY)
+
+# 初始化Git镜像缓存（git模式）
+git_cache = GitMirrorCache(f"{DATA_DIR}/git-mirrors", GIT_CACHE_MAX_BYTES)
+
+# 初始化cgroup管理器（构建资源统计与限制）
+cgroup_manager = CgroupManager(CGROUP_PARENT) if CGROUP_ENABLED else None
+
+# 初始化资源准入控制（按节点CPU和内存容量决定任务能否开始）
+admission = AdmissionController(
+    job_db,
+    cpus=NODE_CPUS or node_cpus(),
+    memory_mb=NODE_MEMORY_MB or node_memory_mb(),
+    default_cpus=DEFAULT_JOB_CPUS,
+    default_memory_mb=DEFAULT_JOB_MEMORY_MB
+)
+
+# 初始化公平调度器（任务结束后把等待中的任务提交给Celery）
+scheduler = FairShareScheduler(
+    job_db,
+    send=lambda job_id, job_data: execute_build.apply_async(args=[job_data], task_id=job_id),
+    slots=SCHEDULER_SLOTS,
+    key_by=SCHEDULER_KEY,
+    lock_path=f"{DATA_DIR}/scheduler.lock",
+    stale_seconds=TASK_TIME_LIMIT + 600,
+    heartbeat_timeout=HEARTBEAT_TIMEOUT,
+    preemption=PREEMPTION_ENABLED,
+    max_preemptions=MAX_PREEMPTIONS,
+    admission=admission if ADMISSION_ENABLED else None
+)
+
+
+
+@worker_init.connect
+def cleanup_metrics_files(**kwargs):
+    """worker启动时清理已退出进程留下的指标文件"""
+    removed = cleanup_dead_processes()
+    if removed:
+        print(f"✓ 清理已退出进程的指标文件 {removed} 个")
+
+
+@worker_ready.connect
+def compress_pending_logs(**kwargs):
+    """worker启动完成后清理中断的压缩留下的临时文件，并在后台压缩之前未压缩的已结束任务日志"""
+    removed = cleanup_temp_files(f"{DATA_DIR}/logs")
+    if removed:
+        print(f"✓ 清理未完成的日志压缩临时文件 {removed} 个")
+    if LOG_COMPRESSION != 'none':
+        threading.Thread(target=compress_finished_logs, name='compress-logs', daemon=True).start()
+
+
+def compress_job_log(job_id: str, log_file: str):
+    """
+    压缩已结束任务的日志，并把数据库中的日志大小更新为压缩后的大小
+
+    Args:
+        job_id: 日志所属的任务ID
+        log_file: 日志路径
+    """
+    try:
+        size = compress_log(log_file, LOG_COMPRESSION)
+    except Exception as e:
+        print(f"✗ 压缩日志失败 {log_file}: {e}")
+        return
+    if size is not None:
+        job_db.update_job_file_sizes(job_id=job_id, log_size=size)
+
+
+def compress_finished_logs() -> int:
+    """
+    压缩日志目录中所有已结束任务的未压缩日志（启用压缩前的历史日志、压缩被中断的日志）
+
+    Returns:
+        压缩的日志数
+    """
+    compressed = 0
+    try:
+        entries = list(os.scandir(f"{DATA_DIR}/logs"))
+    except FileNotFoundError:
+        return 0
+
+    for entry in entries:
+        if not entry.name.endswith('.log'):
+            continue
+        job = job_db.get_job(entry.name[:-len('.log')])
+        if not job or job.get('status') not in FINISHED_STATUSES or job.get('log_file') != entry.path:
+            continue
+        compress_job_log(job['job_id'], entry.path)
+        compressed += 1
+
+    if compressed:
+        print(f"✓ 压缩已结束任务的日志 {compressed} 个")
+    return compressed
+
+
+# 源码块清理间隔（秒）
+BLOB_PRUNE_INTERVAL = 3600
+
+
+def prune_blob_store():
+    """
+    定期清理长时间未引用的源码块
+
+    通过标记文件的修改时间节流，多个worker之间最多每小时执行一次
+
+    Returns:
+        (删除的块数, 释放的字节数)，未到清理时间返回None
+    """
+    marker = f"{DATA_DIR}/blobs/.last-prune"
+    try:
+        if time.time() - os.path.getmtime(marker) < BLOB_PRUNE_INTERVAL:
+            return None
+    except FileNotFoundError:
+        pass
+
+    Path(marker).touch()
+    return blob_store.prune(BLOB_RETENTION_DAYS)
+
+
+def start_heartbeat(job_id: str) -> threading.Event:
+    """
+    任务运行期间在后台定期刷新心跳，worker进程异常退出后心跳停止，
+    调度器在心跳超时后释放其占用的槽位和资源
+
+    Args:
+        job_id: 任务ID
+
+    Returns:
+        停止信号，任务结束时set()
+    """
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            job_db.touch_job_heartbeat(job_id)
+
+    threading.Thread(target=loop, name=f'heartbeat-{job_id}', daemon=True).start()
+    return stop
 
 
 class BuildTask(Task):
@@ -37,12 +211,18 @@ class BuildTask(Task):
 
     def on_failure(self, exc, task_id, args, kwargs, einfo):
         """任务失败回调"""
-        log_file = f"{DATA_DIR}/logs/{task_id}.log"
-        with open(log_file, 'a') as f:
-            f.write(f"\n\n===== 任务异常终止 =====\n")
-            f.write(f"时间: {datetime.now(UTC8).isoformat()}\n")
-            f.write(f"错误: {str(exc)}\n")
-            f.write(f"详情:\n{einfo}\n")
+        # 等待本任务的后台日志压缩结束，避免追加的内容写入即将被删除的原文件
+        for thread in threading.enumerate():
+            if thread.name == f'compress-log-{task_id}':
+                thread.join()
+        with JobLogWriter(f"{DATA_DIR}/logs/{task_id}.log") as build_log:
+            build_log.write(f"\n\n===== 任务异常终止 =====\n")
+            build_log.write(f"时间: {datetime.now(UTC8).isoformat()}\n")
+            build_log.write(f"错误: {str(exc)}\n")
+            build_log.write(f"详情:\n{einfo}\n")
+        # 日志可能已在任务结束时压缩，追加的内容合并到压缩文件中
+        if LOG_COMPRESSION != 'none':
+            compress_job_log(task_id, f"{DATA_DIR}/logs/{task_id}.log")
 
 
 @celery_app.task(base=BuildTask, bind=True, name='remote_ci.build')
@@ -61,11 +241,19 @@ def execute_build(self, job_data):
 
             # upload模式
             'code_archive': '/path/to/code.tar.gz',
+            'source_manifest': '/path/to/manifest.json',  # 增量上传，与code_archive二选一
+            'source_dir': '/path/to/staging/dir',  # 流式上传，API已解压的目录
 
             # git模式
             'repo': 'git仓库URL',
             'branch': '分支名',
-            'commit': '可选的commit hash'
+            'commit': '可选的commit hash',
+
+            # 依赖缓存（可选）
+            'cache': {'paths': ['node_modules', '~/.cache/pip'], 'key_files': ['package-lock.json']},
+
+            # 优先级（0=low, 1=normal, 2=high）
+            'priority': 1
         }
 
     Returns:
@@ -80,21 +268,48 @@ def execute_build(self, job_data):
     work_dir = f"{WORK_DIR}/{task_id}"
 
     start_time = datetime.now(UTC8)
+    git_mirror_lock = None
+    heartbeat = None
+    runner = None
+    build_cgroup = None
+    timer = StageTimer()
 
-    def log(message):
-        """写日志"""
-        timestamp = datetime.now(UTC8).strftime('%Y-%m-%d %H:%M:%S')
-        with open(log_file, 'a') as f:
-            f.write(f"[{timestamp}] {message}\n")
-            f.flush()
+    # 日志保持一个打开的文件描述符并缓冲写入，构建脚本写同一文件前先flush
+    build_log = JobLogWriter(log_file, LOG_FLUSH_BYTES, LOG_FLUSH_INTERVAL, index=LineIndexWriter(log_file))
+    log = build_log.log
 
     def update_progress(state, meta):
         """更新任务进度"""
         self.update_state(state=state, meta=meta)
 
+    def run_preempting_job():
+        """构建期间检查抢占请求：暂停构建进程组，在当前worker中执行高优先级任务，结束后恢复"""
+        urgent = job_db.get_preempting_job(task_id)
+        if not urgent:
+            return
+
+        log(f"\n⏸ 高优先级任务 {urgent['job_id']} 抢占执行槽位，暂停构建")
+        build_log.flush()
+        paused_before = runner.paused_seconds
+        with runner.suspended():
+            try:
+                execute_build.apply(args=[json.loads(urgent['metadata'])], task_id=urgent['job_id'])
+            except Exception as e:
+                print(f"✗ 执行抢占任务 {urgent['job_id']} 失败: {e}")
+        paused = runner.paused_seconds - paused_before
+        job_db.finish_preemption(task_id, paused)
+        # 抢占任务执行期间同时更新了进度，恢复本任务的进度
+        update_progress('PROGRESS', {'step': 'building', 'percent': 30})
+        log(f"▶ 恢复构建（暂停 {paused:.1f} 秒，不计入超时）\n")
+        build_log.flush()
+
     try:
         # 更新数据库状态为运行中
         job_db.update_job_started(task_id)
+        heartbeat = start_heartbeat(task_id)
+        db_job = job_db.get_job(task_id)
+        if db_job and db_job.get('started_at'):
+            timer.add_span('queue_wait', db_job['created_at'], db_job['started_at'])
 
         # 初始化日志
         log("=" * 70)
@@ -112,27 +327,62 @@ def execute_build(self, job_data):
 
         # 步骤1: 准备代码
         update_progress('PROGRESS', {'step': 'preparing', 'percent': 10})
+        timer.start('prepare_source')
 
         mode = job_data.get('mode', 'git')
 
         if mode == 'rsync':
             # rsync模式：复制workspace中的代码
             workspace = job_data['workspace']
-            log(f">>> 步骤 1/3: 复制代码（rsync模式）")
+            build_log.step("步骤 1/3: 复制代码（rsync模式）")
             log(f"源目录: {workspace}")
 
             if not os.path.exists(workspace):
                 raise Exception(f"Workspace不存在: {workspace}")
 
-            # 复制到工作目录
+            # 快照到工作目录
+            repo_dir = f"{work_dir}/repo"
+            snapshot_start = time.monotonic()
+            strategy = snapshot_engine.snapshot(workspace, repo_dir)
+            log(f"✓ 代码复制完成 (策略: {strategy}, 耗时: {time.monotonic() - snapshot_start:.2f} 秒)\n")
+
+        elif mode == 'upload' and job_data.get('source_dir'):
+            # upload模式（流式上传）：API已解压到暂存目录，直接接管
+            source_dir = job_data['source_dir']
+            build_log.step("步骤 1/3: 接管代码（流式上传模式）")
+            log(f"暂存目录: {source_dir}")
+
+            if not os.path.isdir(source_dir):
+                raise Exception(f"暂存目录不存在: {source_dir}")
+
+            repo_dir = f"{work_dir}/repo"
+            try:
+                os.rename(source_dir, repo_dir)
+                log(f"✓ 代码接管完成 (重命名)\n")
+            except OSError:
+                # 暂存目录与工作目录不在同一文件系统
+                strategy = snapshot_engine.snapshot(source_dir, repo_dir)
+                shutil.rmtree(source_dir, ignore_errors=True)
+                log(f"✓ 代码接管完成 (策略: {strategy})\n")
+
+        elif mode == 'upload' and job_data.get('source_manifest'):
+            # upload模式（增量上传）：按清单从源码块存储还原代码
+            source_manifest = job_data['source_manifest']
+            build_log.step("步骤 1/3: 还原代码（增量上传模式）")
+            log(f"清单: {source_manifest}")
+
+            if not os.path.exists(source_manifest):
+                raise Exception(f"源码清单不存在: {source_manifest}")
+
             repo_dir = f"{work_dir}/repo"
-            shutil.copytree(workspace, repo_dir, symlinks=True)
-            log(f"✓ 代码复制完成\n")
+            manifest = blob_store.load_manifest(source_manifest)
+            file_count, total_bytes = blob_store.materialize(manifest, repo_dir)
+            log(f"✓ 代码还原完成 ({file_count} 个文件, {total_bytes} 字节)\n")
 
         elif mode == 'upload':
             # upload模式：解压上传的代码包
             code_archive = job_data['code_archive']
-            log(f">>> 步骤 1/3: 解压代码（上传模式）")
+            build_log.step("步骤 1/3: 解压代码（上传模式）")
             log(f"代码包: {code_archive}")
 
             if not os.path.exists(code_archive):
@@ -141,110 +391,197 @@ def execute_build(self, job_data):
             repo_dir = f"{work_dir}/repo"
             Path(repo_dir).mkdir(parents=True, exist_ok=True)
 
-            # 解压
-            subprocess.run(
-                ['tar', '-xzf', code_archive, '-C', repo_dir],
-                check=True,
-                timeout=300
-            )
-            log(f"✓ 代码解压完成\n")
+            # 解压（自动识别gzip/zstd，拒绝越界路径）
+            with open(code_archive, 'rb') as f:
+                extracted = extract_tar_stream(f, repo_dir)
+            log(f"✓ 代码解压完成 ({extracted['file_count']} 个文件)\n")
 
         elif mode == 'git':
-            # git模式：克隆代码
-            log(f">>> 步骤 1/3: 克隆代码（Git模式）")
+            # git模式：从镜像缓存增量拉取并创建工作目录
+            build_log.step("步骤 1/3: 克隆代码（Git模式）")
             log(f"仓库: {job_data['repo']}")
             log(f"分支: {job_data['branch']}")
+            if job_data.get('commit'):
+                log(f"提交: {job_data['commit']}")
 
-            clone_cmd = ['git', 'clone', '-b', job_data['branch'], '--depth', '1',
-                        job_data['repo'], 'repo']
-
-            clone_result = subprocess.run(
-                clone_cmd,
-                cwd=work_dir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                timeout=300,
-                text=True
-            )
-
-            log(clone_result.stdout)
+            repo_dir = f"{work_dir}/repo"
 
-            if clone_result.returncode != 0:
-                log(f"\n错误: Git克隆失败 (退出码: {clone_result.returncode})")
-                return {
+            try:
+                commit_sha, git_mirror_lock, git_output = git_cache.checkout(
+                    job_data['repo'], job_data['branch'], job_data.get('commit'), repo_dir
+                )
+            except GitCacheError as e:
+                log(e.output)
+                log(f"\n错误: {e} (退出码: {e.returncode})")
+                build_log.flush()
+                result = {
                     'status': 'failed',
-                    'exit_code': clone_result.returncode,
-                    'duration': (datetime.now() - start_time).total_seconds(),
+                    'exit_code': e.returncode,
+                    'duration': (datetime.now(UTC8) - start_time).total_seconds(),
                     'error': 'Git clone failed'
                 }
+                job_db.update_job_finished(task_id, 'failed', result)
+                return result
 
-            repo_dir = f"{work_dir}/repo"
+            if git_output:
+                log(git_output)
+            log(f"当前提交: {commit_sha}")
 
-            # 如果指定了commit，切换到该commit
-            if 'commit' in job_data and job_data['commit']:
-                log(f"切换到commit: {job_data['commit']}")
-                subprocess.run(
-                    ['git', 'checkout', job_data['commit']],
-                    cwd=repo_dir,
-                    check=True
-                )
+            # 检出后才能确定源码，记录构建键供后续指定该commit的任务复用
+            source_key = git_source_key(job_data['repo'], commit_sha)
+            if BUILD_CACHE_ENABLED and source_key:
+                build_key = compute_build_key(source_key, job_data['script'], job_data.get('artifact_patterns'))
+                job_db.update_job_build_key(task_id, build_key, commit_sha)
+
+            evicted, freed = git_cache.evict()
+            if evicted:
+                log(f"淘汰Git镜像 {evicted} 个，释放 {freed} 字节")
 
             log(f"✓ 代码准备完成\n")
 
         else:
             raise Exception(f"不支持的模式: {mode}")
 
+        # 恢复依赖缓存
+        caches = job_data.get('cache')
+        cache_entries = []
+        build_env = None
+
+        if caches:
+            timer.start('restore_cache')
+            build_log.step("恢复依赖缓存")
+            home_dir = f"{work_dir}/home"
+            if uses_home(caches):
+                # 家目录下的缓存（~/.cache/pip、~/.m2等）使用任务私有HOME
+                Path(home_dir).mkdir(parents=True, exist_ok=True)
+                build_env = {**os.environ, 'HOME': home_dir}
+                log(f"HOME: {home_dir}")
+
+            cache_scope = job_data.get('project_name') or job_data.get('repo') or os.path.basename(
+                job_data.get('workspace', '').rstrip('/'))
+            for cache_path in caches['paths']:
+                target = dep_cache.resolve_path(cache_path, repo_dir, home_dir)
+                key = dep_cache.cache_key(cache_scope, cache_path, caches.get('key_files', []), repo_dir)
+                restore_start = time.monotonic()
+                strategy = dep_cache.restore(key, target)
+                if strategy:
+                    log(f"✓ 命中缓存 {cache_path} (策略: {strategy}, 耗时: {time.monotonic() - restore_start:.2f} 秒)")
+                else:
+                    log(f"  未命中缓存 {cache_path} (键: {key[:12]})")
+                cache_entries.append((cache_path, key, target, bool(strategy)))
+            log("")
+
         # 步骤2: 执行构建
         update_progress('PROGRESS', {'step': 'building', 'percent': 30})
 
-        log(">>> 步骤 2/3: 执行构建脚本")
+        build_log.step("步骤 2/3: 执行构建脚本")
         log(f"工作目录: {repo_dir}")
         log(f"命令: {job_data['script']}")
         log("-" * 70)
         log("")
 
-        build_result = subprocess.run(
+        # 构建进程树放入独立cgroup：统计资源用量，声明了资源需求时强制上限
+        build_cgroup = cgroup_manager.create(task_id) if cgroup_manager else None
+        resources = job_data.get('resources') or {}
+        if build_cgroup and CGROUP_LIMITS and resources.get('source') == 'declared':
+            build_cgroup.set_limits(resources.get('cpus'), resources.get('memory_mb'))
+            if build_cgroup.cpu_limit or build_cgroup.memory_limit_mb:
+                log(f"资源上限: CPU {build_cgroup.cpu_limit or '不限'}, "
+                    f"内存 {build_cgroup.memory_limit_mb or '不限'} MB")
+
+        # 输出边运行边写入日志，超时时终止整个进程组；运行期间检查抢占请求
+        timer.start('build')
+        build_log.flush()
+        runner = BuildRunner(
             job_data['script'],
-            shell=True,
             cwd=repo_dir,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
+            log_file=log_file,
             timeout=JOB_TIMEOUT - 400,  # 留点时间给清理工作
-            text=True
+            env=build_env,
+            on_poll=run_preempting_job if PREEMPTION_ENABLED else None,
+            cgroup_procs=build_cgroup.procs_file if build_cgroup else None
         )
+        returncode = runner.run()
+        timer.stop()
 
-        log(build_result.stdout)
         log("")
         log("-" * 70)
 
+        # 记录构建进程树的资源用量（cgroup统计优先，包含脱离进程组的后台进程），
+        # 供后续同一项目的任务估算资源需求
+        usage = {'build_seconds': runner.run_seconds}
+        if runner.rusage:
+            usage.update(
+                cpu_user_seconds=runner.rusage.ru_utime,
+                cpu_system_seconds=runner.rusage.ru_stime,
+                max_rss_kb=runner.rusage.ru_maxrss,
+                io_read_bytes=runner.rusage.ru_inblock * 512,
+                io_write_bytes=runner.rusage.ru_oublock * 512
+            )
+        if build_cgroup:
+            usage.update(build_cgroup.stats(), cpu_limit=build_cgroup.cpu_limit,
+                         memory_limit_mb=build_cgroup.memory_limit_mb)
+        job_db.update_job_resource_usage(task_id, **usage)
+
+        if 'cpu_user_seconds' in usage:
+            memory_kb = usage.get('memory_peak_kb', usage.get('max_rss_kb', 0))
+            log(f"资源用量: CPU {usage['cpu_user_seconds']:.1f} 秒用户态 / {usage['cpu_system_seconds']:.1f} 秒内核态, "
+                f"峰值内存 {memory_kb / 1024:.0f} MB, "
+                f"磁盘读写 {usage.get('io_read_bytes', 0) / 1048576:.1f} / {usage.get('io_write_bytes', 0) / 1048576:.1f} MB")
+        if usage.get('oom_killed'):
+            log(f"✗ 构建超出内存上限 ({build_cgroup.memory_limit_mb} MB)，已被终止")
+
+        # 构建成功后保存未命中的依赖缓存
+        cache_misses = [e for e in cache_entries if not e[3]]
+        if returncode == 0 and cache_misses:
+            timer.start('save_cache')
+            build_log.step("保存依赖缓存", blank_line=True)
+            for cache_path, key, target, _ in cache_misses:
+                saved = dep_cache.save(key, target, {'scope': cache_scope, 'path': cache_path, 'job_id': task_id})
+                if saved is not None:
+                    log(f"✓ 已保存 {cache_path} ({saved} 字节)")
+                else:
+                    log(f"  跳过 {cache_path}（目录不存在或已由其他任务保存）")
+
+            evicted, freed = dep_cache.evict()
+            if evicted:
+                log(f"淘汰依赖缓存 {evicted} 个，释放 {freed} 字节")
+            timer.stop()
+
         # 步骤3: 打包产物（如果构建成功）
         update_progress('PROGRESS', {'step': 'packing_artifacts', 'percent': 80})
 
         artifacts_path = None
         artifacts_size = 0
 
-        if build_result.returncode == 0:
+        if returncode == 0:
             # 获取产物配置
             artifact_patterns = job_data.get('artifact_patterns', [])
 
             if artifact_patterns:
-                log(f"\n>>> 步骤 3/4: 打包构建产物")
+                build_log.step("步骤 3/4: 打包构建产物", blank_line=True)
                 log(f"产物模式: {artifact_patterns}")
                 log("-" * 70)
 
-                artifacts_path = artifact_handler.pack_artifacts(
-                    work_dir=repo_dir,
-                    artifact_patterns=artifact_patterns,
-                    job_id=task_id
-                )
+                # 一次遍历收集产物，打包和清理共用
+                with timer.stage('pack_artifacts'):
+                    artifacts = artifact_handler.collect_artifacts(repo_dir, artifact_patterns)
+                    artifacts_path = artifact_handler.pack_artifacts(
+                        work_dir=repo_dir,
+                        artifact_patterns=artifact_patterns,
+                        job_id=task_id,
+                        artifacts=artifacts
+                    )
 
                 if artifacts_path:
                     artifacts_size = artifact_handler.get_artifact_size(artifacts_path)
+                    ARTIFACT_BYTES.labels('packed').inc(artifacts_size)
                     log(f"✓ 产物已保存: {artifacts_path} ({artifacts_size} 字节)\n")
 
                     # 清理原始产物文件
                     log("清理原始产物文件...")
-                    artifact_handler.cleanup_source_artifacts(repo_dir, artifact_patterns)
+                    with timer.stage('cleanup_artifacts'):
+                        artifact_handler.cleanup_source_artifacts(repo_dir, artifact_patterns, artifacts)
                     log("✓ 原始产物文件已清理\n")
 
         # 步骤4: 保存结果
@@ -253,12 +590,15 @@ def execute_build(self, job_data):
         end_time = datetime.now(UTC8)
         duration = (end_time - start_time).total_seconds()
 
-        log(f"\n>>> 步骤 {'4' if build_result.returncode == 0 and artifacts_path else '3'}/{'4' if build_result.returncode == 0 and artifacts_path else '3'}: 完成")
+        build_log.step(f"步骤 {'4' if returncode == 0 and artifacts_path else '3'}/{'4' if returncode == 0 and artifacts_path else '3'}: 完成",
+                       blank_line=True)
         log(f"结束时间: {end_time.isoformat()}")
         log(f"总耗时: {duration:.2f} 秒")
-        log(f"退出码: {build_result.returncode}")
+        if runner.paused_seconds:
+            log(f"被抢占暂停: {runner.paused_seconds:.2f} 秒")
+        log(f"退出码: {returncode}")
 
-        if build_result.returncode == 0:
+        if returncode == 0:
             log("\n" + "=" * 70)
             log("✓ 构建成功")
             log("=" * 70)
@@ -271,17 +611,16 @@ def execute_build(self, job_data):
 
         result = {
             'status': status,
-            'exit_code': build_result.returncode,
+            'exit_code': returncode,
             'duration': duration
         }
 
-        # 更新数据库状态为完成
+        # 更新数据库状态为完成（先写入日志，结束状态可见时日志已完整）
+        build_log.flush()
         job_db.update_job_finished(task_id, status, result)
 
         # 更新文件大小信息
-        log_size = 0
-        if os.path.exists(log_file):
-            log_size = os.path.getsize(log_file)
+        log_size = disk_size(log_file)
 
         code_archive_size = 0
         code_archive_path = None
@@ -302,12 +641,17 @@ def execute_build(self, job_data):
         # 检查配额并清理
         user_id = job_data.get('user_id')
         log("\n检查磁盘配额...")
-        need_cleanup, cleaned_count = quota_manager.check_and_cleanup(user_id)
+        with timer.stage('quota_cleanup'):
+            need_cleanup, cleaned_count = quota_manager.check_and_cleanup(user_id)
         if need_cleanup:
             log(f"✓ 配额清理完成，清理了 {cleaned_count} 个任务")
         else:
             log("✓ 配额正常")
 
+        pruned = prune_blob_store()
+        if pruned and pruned[0]:
+            log(f"✓ 清理过期源码块 {pruned[0]} 个，释放 {pruned[1]} 字节")
+
         return result
 
     except subprocess.TimeoutExpired:
@@ -324,6 +668,7 @@ def execute_build(self, job_data):
         }
 
         # 更新数据库状态
+        build_log.flush()
         job_db.update_job_finished(task_id, 'timeout', result)
 
         return result
@@ -341,18 +686,39 @@ def execute_build(self, job_data):
         }
 
         # 更新数据库状态
+        build_log.flush()
         job_db.update_job_finished(task_id, 'error', result)
 
         return result
 
     finally:
+        # 任务异常结束时记录进行中阶段已用的时间
+        timer.stop()
+        if runner and runner.paused_seconds:
+            timer.move('build', 'preempted', runner.paused_seconds)
+
         # 清理工作目录
         try:
-            shutil.rmtree(work_dir)
+            with timer.stage('cleanup_workdir'):
+                shutil.rmtree(work_dir)
             log(f"\n清理工作目录: {work_dir}")
         except Exception as e:
             log(f"\n警告: 清理工作目录失败: {e}")
 
+        # 保存各阶段耗时，导出任务耗时和排队时间指标
+        job_db.save_job_stages(task_id, timer.stages)
+        finished_job = job_db.get_job(task_id)
+        if finished_job and finished_job.get('finished_at'):
+            observe_job(finished_job)
+
+        # 清理cgroup中残留的进程（脱离进程组的后台进程）
+        if build_cgroup:
+            build_cgroup.destroy()
+
+        # 释放Git镜像使用锁（工作目录通过alternates引用镜像对象）
+        if git_mirror_lock:
+            git_mirror_lock.release()
+
         # 清理上传的文件（upload模式）
         if mode == 'upload' and 'code_archive' in job_data:
             try:
@@ -360,3 +726,35 @@ def execute_build(self, job_data):
                 log(f"清理上传文件: {job_data['code_archive']}")
             except Exception as e:
                 log(f"警告: 清理上传文件失败: {e}")
+
+        # 清理未被接管的暂存目录（流式上传）
+        if mode == 'upload' and job_data.get('source_dir') and os.path.exists(job_data['source_dir']):
+            shutil.rmtree(job_data['source_dir'], ignore_errors=True)
+            log(f"清理暂存目录: {job_data['source_dir']}")
+
+        # 清理源码清单（增量上传）
+        if mode == 'upload' and job_data.get('source_manifest'):
+            try:
+                os.remove(job_data['source_manifest'])
+                log(f"清理源码清单: {job_data['source_manifest']}")
+            except Exception as e:
+                log(f"警告: 清理源码清单失败: {e}")
+
+        # 构建结束前未来得及执行的抢占任务重新等待调度
+        released = job_db.release_preemption(task_id)
+        if released:
+            log(f"抢占任务 {released} 未在本任务中执行，重新等待调度")
+        build_log.close()
+        if heartbeat:
+            heartbeat.set()
+
+        # 释放执行槽位，调度等待中的任务（其他进程正在调度时由其处理）
+        try:
+            scheduler.dispatch(blocking=False)
+        except Exception as e:
+            print(f"✗ 调度等待中的任务失败: {e}")
+
+        # 后台压缩日志，不占用执行槽位（进程退出前等待压缩完成）
+        if LOG_COMPRESSION != 'none':
+            threading.Thread(target=compress_job_log, args=(task_id, log_file),
+                             name=f'compress-log-{task_id}').start()
@@ -43,14 +43,13 @@ fi
 
 # 使用测试默认值
 CI_API_TOKEN=${CI_API_TOKEN:-test-token-only}
-CI_MAX_CONCURRENT=${CI_MAX_CONCURRENT:-2}
 CI_JOB_TIMEOUT=${CI_JOB_TIMEOUT:-3600}
 
 echo "========================================="
 echo "测试环境配置:"
 echo "========================================="
 echo "API Token: ${CI_API_TOKEN}"
-echo "最大并发: $CI_MAX_CONCURRENT"
+echo "最大并发: ${CI_MAX_CONCURRENT:-CPU核数（资源准入）}"
 echo "任务超时: $CI_JOB_TIMEOUT 秒"
 echo "========================================="
 echo ""